@@ -27,7 +27,16 @@ __version__ = '0.1.0'
 from .exceptions import *
 from .apparmor import AppArmor
 from .selinux import SELinux
+from .events import Event, EventParser
+from .flows import FlowAggregator
+from .follow import Follower
+from .hashlimit import Hashlimit
+from .ipset import IPSet
 from .iptables import IPTablesSinkhole
+from .nflog import NFLog
+from .nftables import NFTablesSinkhole
+from .pcapindex import FlowIndex
+from .pcapmerge import PcapMerger
 from .tcpdump import TCPDump
 from .service import SystemService
 from .rsyslog import RSyslog
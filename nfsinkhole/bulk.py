@@ -0,0 +1,482 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import glob
+import gzip
+import heapq
+import logging
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+from .events import Event, EventParser
+
+try:  # pragma: no cover
+
+    import cPickle as pickle
+
+except ImportError:  # pragma: no cover
+
+    import pickle
+
+log = logging.getLogger(__name__)
+
+# The default byte range size per task. Large enough to amortize the task
+# overhead, small enough to balance the work across processes.
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# The size of the line blocks a byte range is read in.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# The default maximum number of events per sorted run (held in memory by a
+# worker, then written to a temporary file).
+RUN_SIZE = 262144
+
+# The number of events per pickled batch in a run file.
+RUN_BATCH_SIZE = 1024
+
+# The maximum number of run files merged at once (open files); more runs
+# are merged in passes.
+MERGE_FILES = 256
+
+
+def get_paths(pattern='/var/log/nfsinkhole-events.log*'):
+    """
+    The function for listing the events logs, oldest (most rotated) first.
+
+    Args:
+        pattern: The glob pattern.
+
+    Returns:
+        List: File paths, by modification time.
+    """
+
+    paths = [p for p in glob.glob(pattern) if os.path.isfile(p)]
+    paths.sort(key=lambda p: os.stat(p).st_mtime)
+
+    return paths
+
+
+def get_ranges(path=None, chunk_size=CHUNK_SIZE):
+    """
+    The function for splitting a file into byte ranges on newline
+    boundaries, using mmap (no data is read into Python).
+
+    Args:
+        path: The file path.
+        chunk_size: The approximate range size in bytes.
+
+    Returns:
+        List: (start, end) byte offsets; end is exclusive.
+    """
+
+    size = os.path.getsize(path)
+    if not size:
+
+        return []
+
+    ranges = []
+    with open(path, 'rb') as f:
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+
+            start = 0
+            while start < size:
+
+                end = start + chunk_size
+                if end >= size:
+
+                    end = size
+
+                else:
+
+                    newline = mm.find(b'\n', end - 1)
+                    end = size if newline < 0 else newline + 1
+
+                ranges.append((start, end))
+                start = end
+
+        finally:
+
+            mm.close()
+
+    return ranges
+
+
+def sort_events(events=None):
+    """
+    The function for sorting event tuples by timestamp (missing timestamps
+    first). The sort is stable, and fast for the mostly ordered logs.
+
+    Args:
+        events: The list of event tuples (Event.to_tuple()).
+    """
+
+    events.sort(key=lambda e: e[0] or 0.0)
+
+
+def iter_range(path=None, start=None, end=None, prefix='[nfsinkhole] ',
+               year=None):
+    """
+    The generator for parsing a byte range of an events log.
+
+    Args:
+        path: The file path.
+        start: The range start offset, or None for a gzip file, which is
+            decompressed as a stream.
+        end: The range end offset (exclusive).
+        prefix: The iptables log prefix. See events.EventParser.
+        year: The year for traditional syslog timestamps. See
+            events.EventParser. Defaults to the year of the file mtime.
+
+    Yields:
+        Tuple: Event tuples (Event.to_tuple()), in file order.
+    """
+
+    parse_line = EventParser(prefix=prefix, year=year,
+                             reference=os.path.getmtime(path)).parse_line
+
+    if start is None:
+
+        f = gzip.open(path, 'rb')
+        try:
+
+            for line in f:
+
+                event = parse_line(line)
+                if event is not None:
+
+                    yield event.to_tuple()
+
+        finally:
+
+            f.close()
+
+    else:
+
+        with open(path, 'rb') as f:
+
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+
+                # Read in blocks of lines, so memory is bounded by the block
+                # size, not the range size.
+                offset = start
+                while offset < end:
+
+                    block_end = min(offset + BLOCK_SIZE, end)
+                    if block_end < end:
+
+                        newline = mm.find(b'\n', block_end - 1, end)
+                        block_end = end if newline < 0 else newline + 1
+
+                    for line in mm[offset:block_end].splitlines():
+
+                        event = parse_line(line)
+                        if event is not None:
+
+                            yield event.to_tuple()
+
+                    offset = block_end
+
+            finally:
+
+                mm.close()
+
+
+def write_run(path=None, events=None):
+    """
+    The function for writing a run (a list of event tuples) to a temporary
+    file, pickled in batches.
+
+    Args:
+        path: The run file path.
+        events: The list of event tuples.
+
+    Returns:
+        String: The run file path.
+    """
+
+    with open(path, 'wb') as f:
+
+        for i in range(0, len(events), RUN_BATCH_SIZE):
+
+            pickle.dump(events[i:i + RUN_BATCH_SIZE], f,
+                        pickle.HIGHEST_PROTOCOL)
+
+    return path
+
+
+def iter_run(path=None):
+    """
+    The generator for reading a run file written by write_run().
+
+    Args:
+        path: The run file path.
+
+    Yields:
+        Tuple: Event tuples.
+    """
+
+    with open(path, 'rb') as f:
+
+        while True:
+
+            try:
+
+                events = pickle.load(f)
+
+            except EOFError:
+
+                break
+
+            for event in events:
+
+                yield event
+
+
+def sort_range(task=None):
+    """
+    The function for parsing a byte range of an events log into sorted runs
+    (a process pool task). At most run_size events are held in memory; each
+    run is sorted by timestamp and written to a temporary file.
+
+    Args:
+        task: Tuple (path, start, end, prefix, year, run_dir, run_size).
+            start/end are None for a gzip file, which is decompressed as a
+            stream.
+
+    Returns:
+        List: The run file paths, in order.
+    """
+
+    path, start, end, prefix, year, run_dir, run_size = task
+    runs = []
+    events = []
+
+    def _write():
+
+        sort_events(events)
+        fd, run_path = tempfile.mkstemp(suffix='.run', dir=run_dir)
+        os.close(fd)
+        runs.append(write_run(run_path, events))
+        del events[:]
+
+    for event in iter_range(path, start, end, prefix, year):
+
+        events.append(event)
+        if len(events) >= run_size:
+
+            _write()
+
+    if events:
+
+        _write()
+
+    return runs
+
+
+def get_tasks(paths=None, prefix='[nfsinkhole] ', year=None,
+              chunk_size=CHUNK_SIZE):
+    """
+    The function for generating the parse_range() tasks for files; byte
+    ranges for plain files, one task per gzip (.gz) file.
+
+    Args:
+        paths: The list of file paths.
+        prefix: The iptables log prefix. See events.EventParser.
+        year: The year for traditional syslog timestamps. See
+            events.EventParser.
+        chunk_size: The approximate range size in bytes.
+
+    Returns:
+        List: Tuples (path, start, end, prefix, year).
+    """
+
+    tasks = []
+    for path in paths:
+
+        if path.endswith('.gz'):
+
+            tasks.append((path, None, None, prefix, year))
+
+        else:
+
+            for start, end in get_ranges(path, chunk_size):
+
+                tasks.append((path, start, end, prefix, year))
+
+    return tasks
+
+
+def merge_events(results=None):
+    """
+    The generator for merging lists of event tuples, each sorted by
+    timestamp, into one timestamp ordered stream (heapq k-way merge).
+
+    Args:
+        results: The list of sorted event tuple iterables (lists, or
+            iter_run() generators).
+
+    Yields:
+        Tuple: Event tuples, by timestamp; ties keep the input order.
+    """
+
+    def _decorate(n, events):
+
+        for i, event in enumerate(events):
+
+            yield (event[0] or 0.0, n, i, event)
+
+    for item in heapq.merge(*[_decorate(n, events)
+                              for n, events in enumerate(results)]):
+
+        yield item[3]
+
+
+def merge_runs(runs=None, run_dir=None, merge_files=MERGE_FILES):
+    """
+    The function for merging run files in passes until at most merge_files
+    are left, so the final merge does not exceed the open file limit.
+    Consecutive runs are merged, so ties keep the input order.
+
+    Args:
+        runs: The list of run file paths, in order.
+        run_dir: The directory for the merged run files.
+        merge_files: The maximum number of run files merged at once.
+
+    Returns:
+        List: The run file paths, in order.
+    """
+
+    while len(runs) > merge_files:
+
+        merged = []
+        for i in range(0, len(runs), merge_files):
+
+            group = runs[i:i + merge_files]
+            if len(group) == 1:
+
+                merged += group
+                continue
+
+            fd, path = tempfile.mkstemp(suffix='.run', dir=run_dir)
+            with os.fdopen(fd, 'wb') as f:
+
+                batch = []
+                for event in merge_events([iter_run(r) for r in group]):
+
+                    batch.append(event)
+                    if len(batch) >= RUN_BATCH_SIZE:
+
+                        pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+                        batch = []
+
+                if batch:
+
+                    pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+
+            for run in group:
+
+                os.remove(run)
+
+            merged.append(path)
+
+        runs = merged
+
+    return runs
+
+
+def iter_events(paths=None, prefix='[nfsinkhole] ', year=None,
+                processes=None, chunk_size=CHUNK_SIZE, as_tuples=False,
+                run_size=RUN_SIZE, tmp_dir=None):
+    """
+    The generator for parsing events logs in parallel. Plain files are
+    memory-mapped and split into byte ranges on newline boundaries, gzip
+    files are decompressed as a stream (one task per file). The tasks are
+    parsed across a process pool into sorted runs in temporary files,
+    which are merged in timestamp order. Memory is bounded by run_size
+    events per process, and one batch per run while merging.
+
+    Args:
+        paths: The list of file paths. Defaults to the current and rotated
+            events logs (get_paths()).
+        prefix: The iptables log prefix. See events.EventParser.
+        year: The year for traditional syslog timestamps. See
+            events.EventParser.
+        processes: The number of worker processes. Defaults to the number of
+            CPUs. 1 parses in this process.
+        chunk_size: The approximate range size in bytes.
+        as_tuples: If True, yield Event.to_tuple() tuples instead of Event
+            objects.
+        run_size: The maximum number of events per sorted run.
+        tmp_dir: The directory for the run files. Defaults to the system
+            temporary directory.
+
+    Yields:
+        Event: The parsed events, by timestamp.
+    """
+
+    if paths is None:
+
+        paths = get_paths()
+
+    run_dir = tempfile.mkdtemp(prefix='nfsinkhole-bulk-', dir=tmp_dir)
+    try:
+
+        tasks = [task + (run_dir, run_size) for task in get_tasks(
+            paths, prefix, year, chunk_size)]
+
+        log.info('Parsing {0} files ({1} tasks)'.format(
+            len(paths), len(tasks)))
+
+        processes = processes or multiprocessing.cpu_count()
+        if processes == 1 or len(tasks) < 2:
+
+            results = [sort_range(task) for task in tasks]
+
+        else:
+
+            pool = multiprocessing.Pool(processes)
+            try:
+
+                results = pool.map(sort_range, tasks, chunksize=1)
+
+            finally:
+
+                pool.close()
+                pool.join()
+
+        runs = merge_runs(sum(results, []), run_dir)
+
+        for event in merge_events([iter_run(r) for r in runs]):
+
+            yield event if as_tuples else Event(*event)
+
+    finally:
+
+        shutil.rmtree(run_dir, ignore_errors=True)
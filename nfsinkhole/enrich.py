@@ -0,0 +1,502 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from array import array
+import bisect
+import csv
+import json
+import logging
+import mmap
+import socket
+import struct
+import sys
+from .events import Event
+from .utils import get_cidr_range, ip_to_int
+
+try:  # pragma: no cover
+
+    from collections import OrderedDict
+
+except ImportError:  # pragma: no cover
+
+    OrderedDict = None
+
+try:  # pragma: no cover
+
+    # memoryview.cast() (Python 3) for the load_range_table() mmap path.
+    MEMORYVIEW_CAST = hasattr(memoryview, 'cast')
+
+except NameError:  # pragma: no cover
+
+    # Python 2.6; no memoryview.
+    MEMORYVIEW_CAST = False
+
+log = logging.getLogger(__name__)
+
+# Range table file header; magic, number of ranges, JSON values length.
+TABLE_MAGIC = b'NFSKRNG1'
+TABLE_HEADER = struct.Struct('<8sII')
+
+
+def read_csv(path=None):
+    """
+    The generator for reading IPv4 ranges from a CSV file with a header
+    row (e.g., a GeoLite2/ASN style CSV export). Ranges are either a network
+    column (CIDR), or start and end columns (IPv4 addresses or integers).
+    Every other column is a field.
+
+    Args:
+        path: The CSV file path.
+
+    Yields:
+        Tuple: (start, end, fields); integer addresses (inclusive), and a
+            tuple of (column, value) pairs.
+    """
+
+    with open(path, 'r') as f:
+
+        for row in csv.DictReader(f):
+
+            try:
+
+                if row.get('network'):
+
+                    if ':' in row['network']:
+
+                        # IPv6; not logged by the IPv4 sinkhole.
+                        continue
+
+                    network, netmask = get_cidr_range(row.pop('network'))
+                    start, end = network, network | (~netmask & 0xFFFFFFFF)
+
+                else:
+
+                    start, end = [int(v) if v.isdigit() else ip_to_int(v)
+                                  for v in (row.pop('start'),
+                                            row.pop('end'))]
+
+            # socket.error (inet_aton) is an IOError on Python 2.
+            except (KeyError, ValueError, OSError, socket.error) as e:
+
+                log.debug('Skipping CSV row {0}: {1}'.format(row, e))
+                continue
+
+            yield start, end, tuple(sorted(row.items()))
+
+
+def flatten_ranges(ranges=None):
+    """
+    The function for flattening (possibly nested) ranges into sorted,
+    non-overlapping ranges, where the most specific range wins (longest
+    prefix match). Adjacent ranges with the same value are joined. A range
+    that partially overlaps an enclosing range (not possible with CIDRs) is
+    clipped to it.
+
+    Args:
+        ranges: An iterable of (start, end, value) tuples.
+
+    Returns:
+        List: Sorted, non-overlapping (start, end, value) tuples.
+    """
+
+    out = []
+
+    def _emit(start, end, value):
+
+        if start > end:
+
+            return
+
+        if out and out[-1][2] == value and out[-1][1] + 1 == start:
+
+            out[-1] = (out[-1][0], end, value)
+
+        else:
+
+            out.append((start, end, value))
+
+    # Enclosing (larger) ranges first for the same start.
+    stack = []
+    pos = 0
+    for start, end, value in sorted(ranges, key=lambda r: (r[0], -r[1])):
+
+        # Close the enclosing ranges that end before this one.
+        while stack and stack[-1][0] < start:
+
+            stack_end, stack_value = stack.pop()
+            _emit(pos, stack_end, stack_value)
+            pos = max(pos, stack_end + 1)
+
+        if stack:
+
+            _emit(pos, start - 1, stack[-1][1])
+            end = min(end, stack[-1][0])
+
+        pos = max(pos, start)
+        stack.append((end, value))
+
+    while stack:
+
+        stack_end, stack_value = stack.pop()
+        _emit(pos, stack_end, stack_value)
+        pos = max(pos, stack_end + 1)
+
+    return out
+
+
+class RangeTable:
+    """
+    The class for looking up IPv4 addresses in sorted, non-overlapping
+    ranges (binary search). The arrays can be array.array objects or
+    memoryviews of a memory-mapped file (load_range_table()).
+
+    Args:
+        starts: The range starts (uint32, sorted).
+        ends: The range ends (uint32, inclusive).
+        indexes: The values index of each range.
+        values: The list of unique values.
+    """
+
+    def __init__(self, starts=None, ends=None, indexes=None, values=None):
+
+        self.starts = starts
+        self.ends = ends
+        self.indexes = indexes
+        self.values = values
+
+    def __len__(self):
+
+        return len(self.starts)
+
+    def lookup(self, addr=0):
+        """
+        The function for looking up an address.
+
+        Args:
+            addr: The IPv4 address (int).
+
+        Returns:
+            Object: The value, or None if the address is not in a range.
+        """
+
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr <= self.ends[i]:
+
+            return self.values[self.indexes[i]]
+
+        return None
+
+    def save(self, path=None):
+        """
+        The function for saving the table in a memory-mappable binary
+        format; a header, the uint32 starts, ends and indexes arrays
+        (little-endian), and the JSON values.
+
+        Args:
+            path: The file path.
+        """
+
+        values = json.dumps(self.values).encode('utf-8')
+        with open(path, 'wb') as f:
+
+            f.write(TABLE_HEADER.pack(TABLE_MAGIC, len(self.starts),
+                                      len(values)))
+
+            for column in (self.starts, self.ends, self.indexes):
+
+                column = array('I', column)
+                if sys.byteorder != 'little':  # pragma: no cover
+
+                    column.byteswap()
+
+                column.tofile(f)
+
+            f.write(values)
+
+        log.info('Saved {0} ranges to {1}'.format(len(self.starts), path))
+
+
+def build_range_table(ranges=None):
+    """
+    The function for building a RangeTable from (possibly nested) ranges,
+    e.g., read_csv() output.
+
+    Args:
+        ranges: An iterable of (start, end, value) tuples. Values must be
+            hashable (e.g., tuples).
+
+    Returns:
+        RangeTable: The table.
+    """
+
+    starts = array('I')
+    ends = array('I')
+    indexes = array('I')
+    values = []
+    value_indexes = {}
+
+    for start, end, value in flatten_ranges(ranges):
+
+        if value not in value_indexes:
+
+            value_indexes[value] = len(values)
+            values.append(value)
+
+        starts.append(start)
+        ends.append(end)
+        indexes.append(value_indexes[value])
+
+    # JSON (save()) turns tuples into lists; build the same for lookups.
+    values = [dict(v) if isinstance(v, tuple) else v for v in values]
+
+    return RangeTable(starts, ends, indexes, values)
+
+
+def load_range_table(path=None, use_mmap=True):
+    """
+    The function for loading a table saved by RangeTable.save(). With mmap,
+    the arrays are not read into memory; the OS pages them in as they are
+    searched, and shares them between processes.
+
+    Args:
+        path: The file path.
+        use_mmap: If True, memory-map the arrays (Python 3, little-endian).
+
+    Returns:
+        RangeTable: The table.
+
+    Raises:
+        ValueError: The file is not a range table.
+    """
+
+    with open(path, 'rb') as f:
+
+        magic, count, values_len = TABLE_HEADER.unpack(
+            f.read(TABLE_HEADER.size))
+
+        if magic != TABLE_MAGIC:
+
+            raise ValueError('{0} is not a range table'.format(path))
+
+        size = count * 4
+        offset = TABLE_HEADER.size
+
+        if use_mmap and MEMORYVIEW_CAST and (
+                sys.byteorder == 'little') and count:
+
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+            columns = [view[offset + i * size:offset + (i + 1) * size
+                            ].cast('I') for i in range(3)]
+            values = bytes(view[offset + 3 * size:
+                                offset + 3 * size + values_len])
+
+        else:
+
+            columns = []
+            for i in range(3):
+
+                column = array('I')
+                column.fromfile(f, count)
+                if sys.byteorder != 'little':  # pragma: no cover
+
+                    column.byteswap()
+
+                columns.append(column)
+
+            values = f.read(values_len)
+
+    return RangeTable(columns[0], columns[1], columns[2],
+                      json.loads(values.decode('utf-8')))
+
+
+class LRUCache:
+    """
+    The class for a least recently used cache.
+
+    Args:
+        size: The maximum number of entries.
+    """
+
+    def __init__(self, size=65536):
+
+        self.size = size
+        self.data = OrderedDict() if OrderedDict else {}
+        self.move_to_end = getattr(self.data, 'move_to_end', None)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key=None, default=None):
+        """
+        The function for retrieving an entry, marking it recently used.
+
+        Args:
+            key: The key.
+            default: The value returned if the key is not cached.
+
+        Returns:
+            Object: The value, or default.
+        """
+
+        data = self.data
+        try:
+
+            value = data[key]
+
+        except KeyError:
+
+            self.misses += 1
+            return default
+
+        if self.move_to_end:
+
+            self.move_to_end(key)
+
+        else:  # pragma: no cover
+
+            # Python 2; re-insert at the end.
+            del data[key]
+            data[key] = value
+
+        self.hits += 1
+
+        return value
+
+    def set(self, key=None, value=None):
+        """
+        The function for adding an entry, evicting the least recently used
+        entry if full.
+
+        Args:
+            key: The key.
+            value: The value.
+        """
+
+        if len(self.data) >= self.size:
+
+            if OrderedDict:
+
+                self.data.popitem(last=False)
+
+            else:  # pragma: no cover
+
+                self.data.clear()
+
+        self.data[key] = value
+
+
+class Enricher:
+    """
+    The class for enriching sinkhole events with range data (e.g., ASN,
+    country, organisation) by source address. Each table is searched, and
+    the fields of the matching ranges are merged; hot addresses are served
+    from an LRU cache.
+
+    Args:
+        tables: List of RangeTable objects; fields of later tables take
+            precedence.
+        cache_size: The number of addresses to cache.
+    """
+
+    def __init__(self, tables=None, cache_size=65536):
+
+        self.tables = tables or []
+        self.cache = LRUCache(cache_size)
+        self.empty = {}
+
+    def add_csv(self, path=None):
+        """
+        The function for adding a table built from a CSV file (read_csv()).
+
+        Args:
+            path: The CSV file path.
+
+        Returns:
+            RangeTable: The table.
+        """
+
+        table = build_range_table(read_csv(path))
+        self.tables.append(table)
+
+        log.info('Loaded {0} ranges from {1}'.format(len(table), path))
+
+        return table
+
+    def lookup(self, addr=None):
+        """
+        The function for looking up an IPv4 address.
+
+        Args:
+            addr: The IPv4 address (str).
+
+        Returns:
+            Dictionary: The fields of the matching ranges (empty if none).
+                The dictionary is shared; do not modify it.
+        """
+
+        fields = self.cache.get(addr)
+        if fields is not None:
+
+            return fields
+
+        value = ip_to_int(addr)
+        matches = [t.lookup(value) for t in self.tables]
+        matches = [m for m in matches if m]
+
+        if not matches:
+
+            fields = self.empty
+
+        elif len(matches) == 1:
+
+            fields = matches[0]
+
+        else:
+
+            fields = {}
+            for match in matches:
+
+                fields.update(match)
+
+        self.cache.set(addr, fields)
+
+        return fields
+
+    def iter_enriched(self, events=None):
+        """
+        The generator for enriching events by source address.
+
+        Args:
+            events: An iterable of Event objects or Event.to_tuple() tuples.
+
+        Yields:
+            Tuple: (event, fields).
+        """
+
+        lookup = self.lookup
+        for event in events:
+
+            src = event.src if isinstance(event, Event) else event[3]
+            yield event, lookup(src)
@@ -0,0 +1,440 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import calendar
+import logging
+import os
+import re
+import time
+
+log = logging.getLogger(__name__)
+
+# The iptables LOG fields used by Event, after IN=. OUT=, MAC=, TOS=, PREC=
+# are fixed; ID=, DF, FRAG= and OPT (...) may be between TTL= and PROTO=.
+EVENT_RE = re.compile(
+    br' SRC=([\d.]+) DST=([\d.]+) LEN=(\d+) TOS=\S+ PREC=\S+ TTL=(\d+) .*?'
+    br'PROTO=(\w+)(?: SPT=(\d+) DPT=(\d+)| TYPE=(\d+) CODE=(\d+))?'
+)
+
+# The TCP flags, between RES= and URGP=.
+FLAGS_RE = re.compile(br' RES=\S+ ([A-Z ]*)URGP=')
+
+# TCP flag names to bits, as in the TCP header.
+TCP_FLAGS = {
+    b'FIN': 0x01, b'SYN': 0x02, b'RST': 0x04, b'PSH': 0x08,
+    b'ACK': 0x10, b'URG': 0x20, b'ECE': 0x40, b'CWR': 0x80
+}
+
+# iptables LOG protocol names to IP protocol numbers. Other protocols are
+# logged as numbers (e.g., PROTO=47).
+PROTOCOLS = {
+    b'ICMP': 1, b'TCP': 6, b'UDP': 17, b'UDPLITE': 136, b'SCTP': 132,
+    b'ESP': 50, b'AH': 51, b'ICMPv6': 58
+}
+
+MONTHS = {
+    b'Jan': 1, b'Feb': 2, b'Mar': 3, b'Apr': 4, b'May': 5, b'Jun': 6,
+    b'Jul': 7, b'Aug': 8, b'Sep': 9, b'Oct': 10, b'Nov': 11, b'Dec': 12
+}
+
+# Cache sizes; timestamps are cached per second, hosts/interfaces are
+# interned.
+TIMESTAMP_CACHE_SIZE = 65536
+STRING_CACHE_SIZE = 4096
+
+
+class Event(object):
+    """
+    The class for a sinkhole event (an iptables LOG line). __slots__ keeps
+    millions of events compact.
+
+    Args:
+        timestamp: The syslog timestamp, as UNIX epoch seconds (float).
+        host: The syslog hostname.
+        in_iface: The input interface (IN=).
+        src: The source IPv4 address.
+        dst: The destination IPv4 address.
+        proto: The IP protocol number.
+        spt: The source port (TCP/UDP/UDPLITE/SCTP), or 0.
+        dpt: The destination port (TCP/UDP/UDPLITE/SCTP), or the ICMP
+            type * 256 + code (as in NetFlow), or 0.
+        length: The IP packet length (LEN=).
+        ttl: The IP TTL.
+        flags: The TCP flags bitmask (see TCP_FLAGS), or 0.
+    """
+
+    __slots__ = ('timestamp', 'host', 'in_iface', 'src', 'dst', 'proto',
+                 'spt', 'dpt', 'length', 'ttl', 'flags')
+
+    def __init__(self, timestamp=None, host=None, in_iface=None, src=None,
+                 dst=None, proto=0, spt=0, dpt=0, length=0, ttl=0, flags=0):
+
+        self.timestamp = timestamp
+        self.host = host
+        self.in_iface = in_iface
+        self.src = src
+        self.dst = dst
+        self.proto = proto
+        self.spt = spt
+        self.dpt = dpt
+        self.length = length
+        self.ttl = ttl
+        self.flags = flags
+
+    def __repr__(self):
+
+        return ('Event({0!r}, {1!r}, {2!r}, {3!r}, {4!r}, {5!r}, {6!r}, '
+                '{7!r}, {8!r}, {9!r}, {10!r})'.format(*self.to_tuple()))
+
+    def __eq__(self, other):
+
+        return (isinstance(other, Event) and
+                self.to_tuple() == other.to_tuple())
+
+    def __ne__(self, other):
+
+        return not self.__eq__(other)
+
+    def to_tuple(self):
+        """
+        The function for converting the event to a tuple, in __slots__
+        order.
+
+        Returns:
+            Tuple: The event fields.
+        """
+
+        return (self.timestamp, self.host, self.in_iface, self.src, self.dst,
+                self.proto, self.spt, self.dpt, self.length, self.ttl,
+                self.flags)
+
+    def to_dict(self):
+        """
+        The function for converting the event to a dictionary.
+
+        Returns:
+            Dictionary: The event fields.
+        """
+
+        return dict(zip(self.__slots__, self.to_tuple()))
+
+
+def get_flags(names=b''):
+    """
+    The function for converting iptables LOG TCP flag names to a bitmask.
+
+    Args:
+        names: The space separated flag names (bytes), e.g., b'ACK SYN'.
+
+    Returns:
+        Integer: The flags bitmask.
+    """
+
+    flags = 0
+    for name in names.split():
+
+        flags |= TCP_FLAGS.get(name, 0)
+
+    return flags
+
+
+class EventParser:
+    """
+    The class for parsing sinkhole events from the events log
+    (/var/log/nfsinkhole-events.log). Lines are parsed as bytes; only the
+    fields kept in Event are decoded. Both the traditional syslog timestamp
+    (Oct 17 00:28:51, local time) and RFC 3339 timestamps (rsyslog
+    RSYSLOG_FileFormat, syslog-ng ISO dates) are supported.
+
+    Args:
+        prefix: The iptables log prefix (log_prefix). If set, lines without
+            it are skipped. None parses any iptables LOG line.
+        year: The year for traditional syslog timestamps, which do not
+            include it. Defaults to the year of reference; timestamps after
+            reference are then from the previous year (e.g., a log rotated
+            across New Year).
+        reference: The UNIX epoch seconds the events precede, e.g., the log
+            file mtime. Defaults to the current time.
+    """
+
+    def __init__(self, prefix='[nfsinkhole] ', year=None, reference=None):
+
+        if prefix and not isinstance(prefix, bytes):
+
+            prefix = prefix.strip('"').encode('utf-8')
+
+        self.prefix = prefix or None
+        self.reference = None
+        if not year:
+
+            reference = reference or time.time()
+            year = time.localtime(reference).tm_year
+
+            # Timestamps more than a day after reference roll back a year.
+            self.reference = reference + 86400
+
+        self.year = year
+        self.timestamps = {}
+        self.strings = {}
+        self.skipped = 0
+
+    def get_string(self, value=b''):
+        """
+        The function for decoding and interning repeated strings (hosts,
+        interfaces).
+
+        Args:
+            value: The bytes to decode.
+
+        Returns:
+            String: The decoded string.
+        """
+
+        try:
+
+            return self.strings[value]
+
+        except KeyError:
+
+            if len(self.strings) >= STRING_CACHE_SIZE:
+
+                self.strings.clear()
+
+            ret = self.strings[value] = value.decode('ascii', 'replace')
+            return ret
+
+    def get_timestamp(self, value=b''):
+        """
+        The function for converting a syslog timestamp to UNIX epoch
+        seconds. Conversions are cached per second; events arrive in bursts
+        with the same second.
+
+        Args:
+            value: The timestamp (bytes), e.g., b'Oct 17 00:28:51' or
+                b'2026-10-17T00:28:51.123456+00:00'.
+
+        Returns:
+            Float: The UNIX epoch seconds, or None if it could not be parsed.
+        """
+
+        fraction = 0.0
+        if value[4:5] == b'-':
+
+            # RFC 3339; cache on the seconds and the UTC offset.
+            tz = value[-1:] if value[-1:] == b'Z' else value[-6:]
+            key = value[:19] + tz
+            if value[19:20] == b'.':
+
+                fraction = float(value[19:len(value) - len(tz)])
+
+        else:
+
+            key = value
+
+        try:
+
+            return self.timestamps[key] + fraction
+
+        except KeyError:
+
+            pass
+
+        try:
+
+            if value[4:5] == b'-':
+
+                epoch = calendar.timegm((
+                    int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                    int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                    0, 0, 0
+                ))
+
+                if value[-1:] != b'Z':
+
+                    offset = (int(value[-5:-3]) * 3600 +
+                              int(value[-2:]) * 60)
+                    epoch -= offset if value[-6:-5] == b'+' else -offset
+
+            else:
+
+                # Oct 17 00:28:51 (local time)
+                date = (MONTHS[value[0:3]], int(value[4:6]),
+                        int(value[7:9]), int(value[10:12]),
+                        int(value[13:15]), 0, 0, -1)
+                epoch = time.mktime((self.year, ) + date)
+
+                if self.reference and epoch > self.reference:
+
+                    epoch = time.mktime((self.year - 1, ) + date)
+
+        except (KeyError, ValueError, IndexError):
+
+            return None
+
+        if len(self.timestamps) >= TIMESTAMP_CACHE_SIZE:
+
+            self.timestamps.clear()
+
+        self.timestamps[key] = float(epoch)
+
+        return epoch + fraction
+
+    def get_line_timestamp(self, line=b''):
+        """
+        The function for converting the syslog timestamp of a line, without
+        parsing the rest of it.
+
+        Args:
+            line: The log line (bytes).
+
+        Returns:
+            Float: The UNIX epoch seconds, or None if it could not be parsed.
+        """
+
+        if line[4:5] == b'-':
+
+            return self.get_timestamp(line[:line.find(b' ')])
+
+        return self.get_timestamp(line[:15])
+
+    def parse_line(self, line=b''):
+        """
+        The function for parsing an events log line.
+
+        Args:
+            line: The log line (bytes).
+
+        Returns:
+            Event: The parsed event, or None if the line is not an
+                (nfsinkhole) iptables LOG line.
+        """
+
+        idx = line.find(b' IN=')
+        if idx < 0 or (self.prefix and line.find(self.prefix, 0, idx + 1) < 0):
+
+            self.skipped += 1
+            return None
+
+        m = EVENT_RE.search(line, idx)
+        if not m:
+
+            self.skipped += 1
+            return None
+
+        src, dst, length, ttl, proto, spt, dpt, icmp_type, icmp_code = (
+            m.groups())
+
+        # Syslog header; timestamp and host.
+        if line[4:5] == b'-':
+
+            ts_end = line.find(b' ')
+            host_end = line.find(b' ', ts_end + 1)
+
+        else:
+
+            ts_end = 15
+            host_end = line.find(b' ', 16)
+
+        try:
+
+            proto = PROTOCOLS[proto]
+
+        except KeyError:
+
+            proto = int(proto) if proto.isdigit() else 0
+
+        flags = 0
+        if proto == 6:
+
+            f = FLAGS_RE.search(line, m.end())
+            if f:
+
+                flags = get_flags(f.group(1))
+
+        if icmp_type is not None:
+
+            spt = 0
+            dpt = int(icmp_type) * 256 + int(icmp_code)
+
+        else:
+
+            spt = int(spt) if spt else 0
+            dpt = int(dpt) if dpt else 0
+
+        iface_end = line.find(b' ', idx + 4)
+
+        return Event(
+            self.get_timestamp(line[:ts_end]),
+            self.get_string(line[ts_end + 1:host_end]),
+            self.get_string(line[idx + 4:iface_end]),
+            src.decode('ascii'),
+            dst.decode('ascii'),
+            proto, spt, dpt, int(length), int(ttl), flags
+        )
+
+    def iter_events(self, lines=None):
+        """
+        The generator for parsing events from lines (e.g., an open binary
+        file). Lines that are not sinkhole events are skipped (counted in
+        skipped).
+
+        Args:
+            lines: An iterable of log lines (bytes).
+
+        Yields:
+            Event: The parsed events.
+        """
+
+        parse_line = self.parse_line
+        for line in lines:
+
+            event = parse_line(line)
+            if event is not None:
+
+                yield event
+
+
+def iter_events(path='/var/log/nfsinkhole-events.log',
+                prefix='[nfsinkhole] ', year=None):
+    """
+    The generator for parsing events from an events log file.
+
+    Args:
+        path: The events log path.
+        prefix: The iptables log prefix. See EventParser.
+        year: The year for traditional syslog timestamps. See EventParser.
+            Defaults to the year of the file mtime.
+
+    Yields:
+        Event: The parsed events.
+    """
+
+    with open(path, 'rb') as f:
+
+        parser = EventParser(prefix=prefix, year=year,
+                             reference=os.fstat(f.fileno()).st_mtime)
+        for event in parser.iter_events(f):
+
+            yield event
@@ -0,0 +1,118 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+# Benchmark nfsinkhole.events parsing on a single core.
+#
+# python -m nfsinkhole.examples.events_benchmark --lines 1000000
+# python -m nfsinkhole.examples.events_benchmark --file \
+#     /var/log/nfsinkhole-events.log
+
+import argparse
+import time
+from nfsinkhole.events import EventParser
+
+parser = argparse.ArgumentParser(
+    description='nfsinkhole events parser benchmark',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+)
+parser.add_argument(
+    '--lines',
+    type=int,
+    default=1000000,
+    help='The number of synthetic events log lines to parse.'
+)
+parser.add_argument(
+    '--file',
+    type=str,
+    default=None,
+    help='Parse an events log file instead of synthetic lines.'
+)
+parser.add_argument(
+    '--prefix',
+    type=str,
+    default='[nfsinkhole] ',
+    help='The iptables log prefix.'
+)
+
+TCP_LINE = (
+    'Oct 17 00:{0:02d}:{1:02d} sinkhole kernel: [1234.567890] [nfsinkhole] '
+    'IN=eth1 OUT= MAC=00:16:3e:aa:bb:cc:00:16:3e:dd:ee:ff:08:00 '
+    'SRC=192.0.{2}.{3} DST=10.0.0.1 LEN=60 TOS=0x00 PREC=0x00 TTL=52 '
+    'ID=54321 DF PROTO=TCP SPT={4} DPT={5} WINDOW=29200 RES=0x00 SYN '
+    'URGP=0 \n'
+)
+UDP_LINE = (
+    'Oct 17 00:{0:02d}:{1:02d} sinkhole kernel: [1234.567890] [nfsinkhole] '
+    'IN=eth1 OUT= MAC=00:16:3e:aa:bb:cc:00:16:3e:dd:ee:ff:08:00 '
+    'SRC=198.51.{2}.{3} DST=10.0.0.1 LEN=78 TOS=0x00 PREC=0x00 TTL=117 '
+    'ID=1234 PROTO=UDP SPT={4} DPT={5} LEN=58 \n'
+)
+
+
+def get_lines(count=0):
+    """
+    The function for generating synthetic events log lines; 3/4 TCP SYN,
+    1/4 UDP, about 100 events per second.
+    """
+
+    lines = []
+    for i in range(count):
+
+        template = UDP_LINE if i % 4 == 3 else TCP_LINE
+        lines.append(template.format(
+            (i // 6000) % 60, (i // 100) % 60, (i >> 8) % 256, i % 256,
+            1024 + i % 60000, (22, 23, 80, 443, 445, 3389)[i % 6]
+        ).encode('ascii'))
+
+    return lines
+
+
+if __name__ == '__main__':
+
+    script_args = parser.parse_args()
+    event_parser = EventParser(prefix=script_args.prefix)
+
+    if script_args.file:
+
+        with open(script_args.file, 'rb') as f:
+
+            lines = f.readlines()
+
+    else:
+
+        lines = get_lines(script_args.lines)
+
+    start = time.time()
+    count = 0
+    for event in event_parser.iter_events(lines):
+
+        count += 1
+
+    elapsed = time.time() - start
+
+    print('Parsed {0} events ({1} lines, {2} skipped) in {3:.2f}s'.format(
+        count, len(lines), event_parser.skipped, elapsed))
+    print('{0:.0f} lines/second, {1:.0f} lines/minute'.format(
+        len(lines) / elapsed, len(lines) / elapsed * 60))
@@ -51,3 +51,33 @@ class IPTablesNotExists(Exception):
     """
     An Exception for when iptables rules, related to nfsinkhole, don't exist.
     """
+
+
+class IPSetError(Exception):
+    """
+    An Exception for when a ipset process generates stderr output.
+    """
+
+
+class NFTablesError(Exception):
+    """
+    An Exception for when a nft process generates stderr output.
+    """
+
+
+class NFTablesExists(Exception):
+    """
+    An Exception for when nftables tables, related to nfsinkhole, exist.
+    """
+
+
+class NFTablesNotExists(Exception):
+    """
+    An Exception for when nftables tables, related to nfsinkhole, don't exist.
+    """
+
+
+class NFLogError(Exception):
+    """
+    An Exception for when an NFLOG netlink socket encounters an error.
+    """
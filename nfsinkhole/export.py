@@ -0,0 +1,744 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import logging
+import socket
+import time
+from . import __version__
+from .events import Event, PROTOCOLS, STRING_CACHE_SIZE, TCP_FLAGS
+
+log = logging.getLogger(__name__)
+
+# IP protocol numbers to names, for CEF/LEEF.
+PROTOCOL_NAMES = dict([(v, k.decode('ascii')) for k, v in PROTOCOLS.items()])
+
+# The protocols with ports (Event.spt/Event.dpt); ICMP dpt is type/code.
+PORT_PROTOCOLS = (6, 17, 132, 136)
+
+# The TCP flag bits, in header order, to names.
+TCP_FLAG_NAMES = sorted([(v, k.decode('ascii')) for k, v in TCP_FLAGS.items()])
+
+# The default ExportWriter buffer size (bytes).
+BUFFER_SIZE = 262144
+
+# The default number of events encoded per batch by export_events().
+BATCH_SIZE = 1000
+
+
+def get_flag_names(flags=0):
+    """
+    The function for converting a TCP flags bitmask to names.
+
+    Args:
+        flags: The TCP flags bitmask (see events.TCP_FLAGS).
+
+    Returns:
+        String: The space separated flag names, e.g., SYN ACK.
+    """
+
+    return ' '.join([name for bit, name in TCP_FLAG_NAMES if flags & bit])
+
+
+def escape_cef_header(value=''):
+    """
+    The function for escaping a CEF header field (backslash, pipe).
+
+    Args:
+        value: The string to escape.
+
+    Returns:
+        String: The escaped string.
+    """
+
+    return value.replace('\\', '\\\\').replace('|', '\\|')
+
+
+def escape_cef(value=''):
+    """
+    The function for escaping a CEF extension value (backslash, equals,
+    newlines).
+
+    Args:
+        value: The string to escape.
+
+    Returns:
+        String: The escaped string.
+    """
+
+    return value.replace('\\', '\\\\').replace('=', '\\=').replace(
+        '\r', '\\r').replace('\n', '\\n')
+
+
+def escape_leef(value=''):
+    """
+    The function for escaping a LEEF attribute value (the tab delimiter,
+    newlines).
+
+    Args:
+        value: The string to escape.
+
+    Returns:
+        String: The escaped string.
+    """
+
+    return value.replace('\t', ' ').replace('\r', ' ').replace('\n', ' ')
+
+
+def escape_format(value=''):
+    """
+    The function for escaping the braces of a literal value added to a
+    str.format() template.
+
+    Args:
+        value: The string to escape.
+
+    Returns:
+        String: The escaped string.
+    """
+
+    return value.replace('{', '{{').replace('}', '}}')
+
+
+class Encoder:
+    """
+    The base class for encoding sinkhole events as lines. Subclasses must
+    override encode_event(), and build their templates once, so encoding an
+    event is a cache lookup and a str.format() call; strings (hosts,
+    interfaces) and other repeated values are escaped once and cached.
+
+    Args:
+        fields: Optional dictionary of static fields added to every event
+            (e.g., {'sensor': 'dc1'}).
+    """
+
+    def __init__(self, fields=None):
+
+        self.fields = fields or {}
+        self.strings = {}
+        self.templates = {}
+
+    def escape(self, value=''):
+        """
+        The function for escaping a string value; overridden by subclasses.
+
+        Args:
+            value: The string to escape.
+
+        Returns:
+            String: The escaped string.
+        """
+
+        return value
+
+    def get_string(self, value=None):
+        """
+        The function for escaping and caching a string value.
+
+        Args:
+            value: The string, or None.
+
+        Returns:
+            String: The escaped string.
+        """
+
+        try:
+
+            return self.strings[value]
+
+        except KeyError:
+
+            if len(self.strings) >= STRING_CACHE_SIZE:
+
+                self.strings.clear()
+
+            ret = self.strings[value] = (
+                self.escape(value) if value is not None else ''
+            )
+            return ret
+
+    def encode_event(self, event=None):
+        """
+        The function for encoding an event; subclasses must override it.
+
+        Args:
+            event: The Event.to_tuple() tuple.
+
+        Returns:
+            String: The encoded event (no newline).
+
+        Raises:
+            NotImplementedError: Not overridden by the subclass.
+        """
+
+        raise NotImplementedError()
+
+    def encode(self, events=None):
+        """
+        The function for encoding a batch of events as newline terminated
+        lines.
+
+        Args:
+            events: An iterable of Event objects or Event.to_tuple() tuples.
+
+        Returns:
+            Bytes: The encoded lines (UTF-8).
+        """
+
+        encode_event = self.encode_event
+        lines = [
+            encode_event(e.to_tuple() if isinstance(e, Event) else e)
+            for e in events
+        ]
+
+        if not lines:
+
+            return b''
+
+        lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+
+class JSONEncoder(Encoder):
+    """
+    The class for encoding sinkhole events as newline delimited JSON, with
+    the Event.to_dict() fields.
+
+    Args:
+        fields: Optional dictionary of static fields added to every event.
+    """
+
+    def __init__(self, fields=None):
+
+        Encoder.__init__(self, fields)
+
+        extra = ''.join([
+            escape_format(',{0}:{1}'.format(json.dumps(k), json.dumps(v)))
+            for k, v in sorted(self.fields.items())
+        ])
+
+        self.template = (
+            '{{"timestamp":{0},"host":{1},"in_iface":{2},"src":"{3}",'
+            '"dst":"{4}","proto":{5},"spt":{6},"dpt":{7},"length":{8},'
+            '"ttl":{9},"flags":{10}' + extra + '}}'
+        )
+
+    def get_string(self, value=None):
+        """
+        The function for encoding and caching a JSON string value.
+
+        Args:
+            value: The string, or None.
+
+        Returns:
+            String: The JSON string, or null.
+        """
+
+        try:
+
+            return self.strings[value]
+
+        except KeyError:
+
+            if len(self.strings) >= STRING_CACHE_SIZE:
+
+                self.strings.clear()
+
+            ret = self.strings[value] = json.dumps(value)
+            return ret
+
+    def encode_event(self, event=None):
+        """
+        The function for encoding an event as a JSON object.
+
+        Args:
+            event: The Event.to_tuple() tuple.
+
+        Returns:
+            String: The JSON object.
+        """
+
+        return self.template.format(
+            'null' if event[0] is None else repr(event[0]),
+            self.get_string(event[1]), self.get_string(event[2]),
+            *event[3:]
+        )
+
+
+class CEFEncoder(Encoder):
+    """
+    The class for encoding sinkhole events as ArcSight Common Event Format
+    (CEF:0). The signature ID is the IP protocol number; rt is epoch
+    milliseconds.
+
+    Args:
+        fields: Optional dictionary of static extension fields added to every
+            event (e.g., {'dvc': '192.0.2.10'}).
+        severity: The CEF severity (0-10).
+        vendor: The device vendor.
+        product: The device product.
+        version: The device version.
+    """
+
+    def __init__(self, fields=None, severity=3, vendor='nfsinkhole',
+                 product='nfsinkhole', version=__version__):
+
+        Encoder.__init__(self, fields)
+
+        # The header fields are literals in the event templates.
+        self.header = escape_format('|'.join([
+            'CEF:0', escape_cef_header(vendor), escape_cef_header(product),
+            escape_cef_header(version)
+        ]))
+        self.severity = escape_format(str(severity))
+
+        self.extra = ''.join([
+            escape_format(' {0}={1}'.format(k, escape_cef(str(v))))
+            for k, v in sorted(self.fields.items())
+        ])
+
+    def escape(self, value=''):
+
+        return escape_cef(value)
+
+    def get_template(self, proto=0, flags=0):
+        """
+        The function for building (and caching) the template for a protocol
+        and TCP flags combination.
+
+        Args:
+            proto: The IP protocol number.
+            flags: The TCP flags bitmask.
+
+        Returns:
+            String: The template; format args are rt, dvchost,
+                deviceInboundInterface, src, dst, spt, dpt, in, ttl.
+        """
+
+        key = (proto, flags)
+        try:
+
+            return self.templates[key]
+
+        except KeyError:
+
+            pass
+
+        name = PROTOCOL_NAMES.get(proto, str(proto))
+        header = '|'.join([
+            self.header, str(proto), escape_format(escape_cef_header(
+                'Sinkhole {0} traffic'.format(name))), self.severity, ''
+        ])
+
+        ext = ('rt={0} dvchost={1} deviceInboundInterface={2} src={3} '
+               'dst={4} proto=' + escape_cef(name))
+
+        if proto in PORT_PROTOCOLS:
+
+            ext += ' spt={5} dpt={6}'
+
+        elif proto == 1:
+
+            ext += (' cn2={5} cn2Label=icmpType cn3={6} cn3Label=icmpCode')
+
+        ext += ' in={7} cn1={8} cn1Label=ttl'
+
+        if proto == 6:
+
+            ext += ' cs1={0} cs1Label=tcpFlags'.format(
+                escape_cef(get_flag_names(flags)))
+
+        ret = self.templates[key] = header + ext + self.extra
+        return ret
+
+    def encode_event(self, event=None):
+        """
+        The function for encoding an event as a CEF line.
+
+        Args:
+            event: The Event.to_tuple() tuple.
+
+        Returns:
+            String: The CEF line.
+        """
+
+        proto = event[5]
+        spt, dpt = event[6], event[7]
+        if proto == 1:
+
+            spt, dpt = dpt >> 8, dpt & 0xFF
+
+        return self.get_template(proto, event[10]).format(
+            int((event[0] or 0) * 1000), self.get_string(event[1]),
+            self.get_string(event[2]), event[3], event[4], spt, dpt,
+            event[8], event[9]
+        )
+
+
+class LEEFEncoder(Encoder):
+    """
+    The class for encoding sinkhole events as IBM QRadar Log Event Extended
+    Format (LEEF:1.0, tab delimited). The event ID is the IP protocol name;
+    devTime is UTC.
+
+    Args:
+        fields: Optional dictionary of static attributes added to every event.
+        vendor: The vendor.
+        product: The product.
+        version: The product version.
+    """
+
+    def __init__(self, fields=None, vendor='nfsinkhole', product='nfsinkhole',
+                 version=__version__):
+
+        Encoder.__init__(self, fields)
+
+        # The header fields are literals in the event templates.
+        self.header = escape_format('|'.join([
+            'LEEF:1.0', escape_cef_header(vendor), escape_cef_header(product),
+            escape_cef_header(version)
+        ]))
+
+        self.extra = ''.join([
+            escape_format('\t{0}={1}'.format(k, escape_leef(str(v))))
+            for k, v in sorted(self.fields.items())
+        ])
+
+        self.times = {}
+
+    def escape(self, value=''):
+
+        return escape_leef(value)
+
+    def get_time(self, timestamp=None):
+        """
+        The function for formatting (and caching per second) a LEEF devTime.
+
+        Args:
+            timestamp: The UNIX epoch seconds (float), or None.
+
+        Returns:
+            String: The time, e.g., Oct 17 2016 00:28:51.250 UTC.
+        """
+
+        timestamp = timestamp or 0.0
+        seconds = int(timestamp)
+
+        try:
+
+            value = self.times[seconds]
+
+        except KeyError:
+
+            if len(self.times) >= 65536:
+
+                self.times.clear()
+
+            value = self.times[seconds] = time.strftime(
+                '%b %d %Y %H:%M:%S', time.gmtime(seconds))
+
+        return '{0}.{1:03d} UTC'.format(
+            value, int((timestamp - seconds) * 1000))
+
+    def get_template(self, proto=0, flags=0):
+        """
+        The function for building (and caching) the template for a protocol
+        and TCP flags combination.
+
+        Args:
+            proto: The IP protocol number.
+            flags: The TCP flags bitmask.
+
+        Returns:
+            String: The template; format args are devTime, identHostName,
+                inIface, src, dst, srcPort, dstPort, srcBytes, ttl.
+        """
+
+        key = (proto, flags)
+        try:
+
+            return self.templates[key]
+
+        except KeyError:
+
+            pass
+
+        name = PROTOCOL_NAMES.get(proto, str(proto))
+        attrs = [
+            'devTime={0}', 'devTimeFormat=MMM dd yyyy HH:mm:ss.SSS z',
+            'identHostName={1}', 'inIface={2}', 'src={3}', 'dst={4}',
+            'proto=' + escape_leef(name)
+        ]
+
+        if proto in PORT_PROTOCOLS:
+
+            attrs.extend(['srcPort={5}', 'dstPort={6}'])
+
+        elif proto == 1:
+
+            attrs.extend(['icmpType={5}', 'icmpCode={6}'])
+
+        attrs.extend(['srcBytes={7}', 'ttl={8}'])
+
+        if proto == 6:
+
+            attrs.append('tcpFlags={0}'.format(get_flag_names(flags)))
+
+        ret = self.templates[key] = (
+            '|'.join([self.header, escape_format(escape_cef_header(name)),
+                      '']) + '\t'.join(attrs) + self.extra
+        )
+        return ret
+
+    def encode_event(self, event=None):
+        """
+        The function for encoding an event as a LEEF line.
+
+        Args:
+            event: The Event.to_tuple() tuple.
+
+        Returns:
+            String: The LEEF line.
+        """
+
+        proto = event[5]
+        spt, dpt = event[6], event[7]
+        if proto == 1:
+
+            spt, dpt = dpt >> 8, dpt & 0xFF
+
+        return self.get_template(proto, event[10]).format(
+            self.get_time(event[0]), self.get_string(event[1]),
+            self.get_string(event[2]), event[3], event[4], spt, dpt,
+            event[8], event[9]
+        )
+
+
+# Encoder names (e.g., CLI choices) to classes.
+ENCODERS = {
+    'json': JSONEncoder,
+    'cef': CEFEncoder,
+    'leef': LEEFEncoder
+}
+
+
+class ExportWriter:
+    """
+    The class for buffered writes of encoded events to a file, Unix socket
+    or TCP socket. Sockets are (re)connected on demand.
+
+    Args:
+        target: The file path, unix:///path/to/socket or tcp://host:port.
+        buffer_size: The number of bytes buffered before a write.
+        timeout: The socket connect/send timeout (seconds).
+
+    Raises:
+        ValueError: The target is invalid.
+    """
+
+    def __init__(self, target=None, buffer_size=BUFFER_SIZE, timeout=10):
+
+        self.target = target
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.buffer = []
+        self.buffered = 0
+        self.written = 0
+        self.file = None
+        self.sock = None
+
+        if target.startswith('tcp://'):
+
+            host, _, port = target[6:].rpartition(':')
+            if not host or not port.isdigit():
+
+                raise ValueError('Invalid TCP target: {0}'.format(target))
+
+            self.address = (host.strip('[]'), int(port))
+            self.family = socket.AF_INET
+
+        elif target.startswith('unix://'):
+
+            self.address = target[7:]
+            self.family = socket.AF_UNIX
+
+        else:
+
+            self.address = None
+            self.family = None
+
+    def connect(self):
+        """
+        The function for opening the file or connecting the socket.
+        """
+
+        if self.family is None:
+
+            if self.file is None:
+
+                self.file = open(self.target, 'ab')
+
+        elif self.sock is None:
+
+            if self.family == socket.AF_UNIX:
+
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.address)
+
+            else:
+
+                sock = socket.create_connection(self.address, self.timeout)
+
+            self.sock = sock
+            log.info('Connected to {0}'.format(self.target))
+
+    def disconnect(self):
+        """
+        The function for closing the file or socket.
+        """
+
+        if self.file is not None:
+
+            self.file.close()
+            self.file = None
+
+        if self.sock is not None:
+
+            self.sock.close()
+            self.sock = None
+
+    def write(self, data=b''):
+        """
+        The function for buffering data, flushing when the buffer is full.
+
+        Args:
+            data: The bytes to write (e.g., Encoder.encode() output).
+        """
+
+        if data:
+
+            self.buffer.append(data)
+            self.buffered += len(data)
+
+        if self.buffered >= self.buffer_size:
+
+            self.flush()
+
+    def flush(self):
+        """
+        The function for writing the buffer. A failed socket send is retried
+        once on a new connection.
+
+        Raises:
+            socket.error: The write failed after reconnecting.
+            IOError: The file write failed.
+        """
+
+        if not self.buffer:
+
+            return
+
+        data = b''.join(self.buffer)
+
+        for attempt in (1, 2):
+
+            try:
+
+                self.connect()
+                if self.file is not None:
+
+                    self.file.write(data)
+                    self.file.flush()
+
+                else:
+
+                    self.sock.sendall(data)
+
+                break
+
+            except socket.error as e:
+
+                self.disconnect()
+                if attempt == 2 or self.family is None:
+
+                    raise
+
+                log.warning('Write to {0} failed, reconnecting: {1}'.format(
+                    self.target, e))
+
+        self.written += len(data)
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        """
+        The function for flushing the buffer and closing the file or socket.
+        """
+
+        try:
+
+            self.flush()
+
+        finally:
+
+            self.disconnect()
+
+
+def export_events(events=None, encoder=None, writer=None,
+                  batch_size=BATCH_SIZE):
+    """
+    The function for encoding events in batches and writing them.
+
+    Args:
+        events: An iterable of Event objects or Event.to_tuple() tuples
+            (e.g., events.EventParser.iter_events()).
+        encoder: The Encoder (e.g., CEFEncoder()).
+        writer: The ExportWriter. It is flushed, but not closed.
+        batch_size: The number of events per batch.
+
+    Returns:
+        Integer: The number of events written.
+    """
+
+    count = 0
+    batch = []
+    for event in events:
+
+        batch.append(event)
+        if len(batch) >= batch_size:
+
+            writer.write(encoder.encode(batch))
+            count += len(batch)
+            batch = []
+
+    if batch:
+
+        writer.write(encoder.encode(batch))
+        count += len(batch)
+
+    writer.flush()
+
+    return count
@@ -0,0 +1,463 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import deque
+import json
+import logging
+import struct
+from .events import Event
+from .utils import ip_to_int, int_to_ip
+
+try:  # pragma: no cover
+
+    from collections import OrderedDict
+
+except ImportError:  # pragma: no cover
+
+    OrderedDict = None
+
+log = logging.getLogger(__name__)
+
+# Binary flow record; first_seen, last_seen, src, dst, proto, flags, dpt,
+# packets, bytes (40 bytes).
+FLOW_RECORD = struct.Struct('<ddIIBBHIQ')
+
+
+class Flow(object):
+    """
+    The class for a sinkhole flow; the events with the same source,
+    destination, protocol and destination port.
+
+    Args:
+        src: The source IPv4 address.
+        dst: The destination IPv4 address.
+        proto: The IP protocol number.
+        dpt: The destination port (or ICMP type/code, see events.Event).
+        first_seen: The first event timestamp (UNIX epoch seconds).
+        last_seen: The last event timestamp (UNIX epoch seconds).
+        packets: The number of events (logged packets).
+        bytes: The sum of the IP packet lengths.
+        flags: The TCP flags seen (bitwise or).
+    """
+
+    __slots__ = ('src', 'dst', 'proto', 'dpt', 'first_seen', 'last_seen',
+                 'packets', 'bytes', 'flags')
+
+    def __init__(self, src=None, dst=None, proto=0, dpt=0, first_seen=None,
+                 last_seen=None, packets=0, bytes=0, flags=0):
+
+        self.src = src
+        self.dst = dst
+        self.proto = proto
+        self.dpt = dpt
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.packets = packets
+        self.bytes = bytes
+        self.flags = flags
+
+    def __repr__(self):
+
+        return ('Flow({0!r}, {1!r}, {2!r}, {3!r}, {4!r}, {5!r}, {6!r}, {7!r}, '
+                '{8!r})'.format(*self.to_tuple()))
+
+    def __eq__(self, other):
+
+        return isinstance(other, Flow) and self.to_tuple() == other.to_tuple()
+
+    def __ne__(self, other):
+
+        return not self.__eq__(other)
+
+    def to_tuple(self):
+        """
+        The function for converting the flow to a tuple, in __slots__
+        order.
+
+        Returns:
+            Tuple: The flow fields.
+        """
+
+        return (self.src, self.dst, self.proto, self.dpt, self.first_seen,
+                self.last_seen, self.packets, self.bytes, self.flags)
+
+    def to_dict(self):
+        """
+        The function for converting the flow to a dictionary.
+
+        Returns:
+            Dictionary: The flow fields.
+        """
+
+        return dict(zip(self.__slots__, self.to_tuple()))
+
+
+class OrderedFlows(dict):
+    """
+    The class for an insertion ordered dictionary, for Python 2.6 (no
+    collections.OrderedDict). Only the operations used by FlowAggregator
+    are ordered: iteration, values(), and popitem(last=False). Keys are
+    appended to a queue when set; earlier occurrences of a key are
+    skipped.
+    """
+
+    def __init__(self):
+
+        dict.__init__(self)
+        self.order = deque()
+        self.pending = {}
+
+    def __setitem__(self, key, value):
+
+        dict.__setitem__(self, key, value)
+        self.order.append(key)
+        self.pending[key] = self.pending.get(key, 0) + 1
+
+        # Drop the skipped occurrences once they dominate the queue.
+        if len(self.order) > 2 * len(self) + 1024:
+
+            keys = list(self)
+            self.order = deque(keys)
+            self.pending = dict.fromkeys(keys, 1)
+
+    def __iter__(self):
+
+        counts = dict(self.pending)
+        for key in list(self.order):
+
+            counts[key] -= 1
+            if not counts[key] and dict.__contains__(self, key):
+
+                yield key
+
+    def keys(self):
+
+        return list(self)
+
+    def values(self):
+
+        return [self[key] for key in self]
+
+    def clear(self):
+
+        dict.clear(self)
+        self.order.clear()
+        self.pending.clear()
+
+    def popitem(self, last=False):
+        """
+        The function for removing and returning the first (key, value)
+        pair.
+
+        Args:
+            last: Must be False; only the first item can be popped.
+
+        Returns:
+            Tuple: The (key, value) pair.
+
+        Raises:
+            KeyError: The dictionary is empty.
+        """
+
+        if last:
+
+            raise ValueError('Only popitem(last=False) is supported')
+
+        order = self.order
+        pending = self.pending
+        while order:
+
+            key = order.popleft()
+            pending[key] -= 1
+            if not pending[key]:
+
+                del pending[key]
+
+                if dict.__contains__(self, key):
+
+                    return key, dict.pop(self, key)
+
+        raise KeyError('dictionary is empty')
+
+
+class FlowAggregator:
+    """
+    The class for aggregating sinkhole events into flows, keyed on (src,
+    dst, proto, dpt). Event timestamps are the clock; a flow is evicted when
+    it has been idle for idle_timeout, or when capacity is reached (least
+    recently updated first).
+
+    Args:
+        idle_timeout: The number of seconds without events after which a
+            flow is evicted.
+        capacity: The maximum number of active flows.
+    """
+
+    def __init__(self, idle_timeout=300, capacity=100000):
+
+        self.idle_timeout = idle_timeout
+        self.capacity = capacity
+        self.flows = OrderedDict() if OrderedDict else OrderedFlows()
+        self.move_to_end = getattr(self.flows, 'move_to_end', None)
+        self.events = 0
+        self.evicted = 0
+
+    def __len__(self):
+
+        return len(self.flows)
+
+    def add(self, event=None):
+        """
+        The function for adding an event.
+
+        Args:
+            event: The Event, or Event.to_tuple() tuple.
+
+        Returns:
+            List: The flows evicted (idle or capacity), possibly empty.
+        """
+
+        if isinstance(event, Event):
+
+            event = event.to_tuple()
+
+        timestamp = event[0]
+        key = (event[3], event[4], event[5], event[7])
+        flows = self.flows
+        self.events += 1
+
+        flow = flows.get(key)
+        if flow is None:
+
+            flow = flows[key] = Flow(event[3], event[4], event[5], event[7],
+                                     timestamp, timestamp, 1, event[8],
+                                     event[10])
+
+        else:
+
+            if self.move_to_end:
+
+                self.move_to_end(key)
+
+            else:  # pragma: no cover
+
+                # Python 2; re-insert at the end.
+                del flows[key]
+                flows[key] = flow
+
+            # Events without a timestamp do not update the time range.
+            if timestamp is not None:
+
+                if flow.first_seen is None:
+
+                    flow.first_seen = timestamp
+
+                if flow.last_seen is None or timestamp > flow.last_seen:
+
+                    flow.last_seen = timestamp
+
+            flow.packets += 1
+            flow.bytes += event[8]
+            flow.flags |= event[10]
+
+        return self.evict(timestamp)
+
+    def evict(self, now=None):
+        """
+        The function for evicting idle flows, and the least recently updated
+        flows over capacity.
+
+        Args:
+            now: The current time (UNIX epoch seconds), e.g., the last event
+                timestamp. None only evicts over capacity.
+
+        Returns:
+            List: The evicted flows.
+        """
+
+        evicted = []
+        flows = self.flows
+
+        while len(flows) > self.capacity:
+
+            evicted.append(flows.popitem(last=False)[1])
+
+        if now is not None:
+
+            expire = now - self.idle_timeout
+            while flows:
+
+                # Flows without a timestamp are idle.
+                flow = flows[next(iter(flows))]
+                if flow.last_seen is not None and flow.last_seen > expire:
+
+                    break
+
+                evicted.append(flows.popitem(last=False)[1])
+
+        self.evicted += len(evicted)
+
+        return evicted
+
+    def flush(self):
+        """
+        The function for evicting all flows.
+
+        Returns:
+            List: The flows, least recently updated first.
+        """
+
+        evicted = list(self.flows.values())
+        self.flows.clear()
+        self.evicted += len(evicted)
+
+        return evicted
+
+    def aggregate(self, events=None, flush=True):
+        """
+        The generator for aggregating events into flows.
+
+        Args:
+            events: An iterable of Event objects or tuples.
+            flush: If True, evict the remaining flows at the end.
+
+        Yields:
+            Flow: The evicted flows.
+        """
+
+        add = self.add
+        for event in events:
+
+            for flow in add(event):
+
+                yield flow
+
+        if flush:
+
+            for flow in self.flush():
+
+                yield flow
+
+
+class FlowWriter:
+    """
+    The class for writing flows as JSON lines, or 40 byte binary records
+    (FLOW_RECORD).
+
+    Args:
+        path: The output file path (appended to).
+        output_format: json or binary.
+    """
+
+    def __init__(self, path=None, output_format='json'):
+
+        if output_format not in ('json', 'binary'):
+
+            raise ValueError('Unsupported flow format: {0}'.format(
+                output_format))
+
+        self.path = path
+        self.output_format = output_format
+        self.file = open(path, 'ab')
+        self.count = 0
+
+    def write(self, flows=None):
+        """
+        The function for writing flows.
+
+        Args:
+            flows: An iterable of Flow objects.
+
+        Returns:
+            Integer: The number of flows written.
+        """
+
+        flows = list(flows)
+        if self.output_format == 'json':
+
+            data = b''.join([
+                json.dumps(f.to_dict(), sort_keys=True,
+                           separators=(',', ':')).encode('utf-8') + b'\n'
+                for f in flows
+            ])
+
+        else:
+
+            pack = FLOW_RECORD.pack
+            data = b''.join([
+                pack(f.first_seen or 0.0, f.last_seen or 0.0,
+                     ip_to_int(f.src), ip_to_int(f.dst), f.proto, f.flags,
+                     f.dpt, min(f.packets, 0xFFFFFFFF), f.bytes)
+                for f in flows
+            ])
+
+        self.file.write(data)
+        self.count += len(flows)
+
+        return len(flows)
+
+    def close(self):
+        """
+        The function for flushing and closing the file.
+        """
+
+        self.file.close()
+
+
+def iter_flows(path=None, output_format='json'):
+    """
+    The generator for reading flows written by FlowWriter.
+
+    Args:
+        path: The file path.
+        output_format: json or binary.
+
+    Yields:
+        Flow: The flows.
+    """
+
+    with open(path, 'rb') as f:
+
+        if output_format == 'json':
+
+            for line in f:
+
+                data = json.loads(line.decode('utf-8'))
+                yield Flow(**data)
+
+        else:
+
+            while True:
+
+                data = f.read(FLOW_RECORD.size)
+                if len(data) < FLOW_RECORD.size:
+
+                    break
+
+                (first_seen, last_seen, src, dst, proto, flags, dpt, packets,
+                 size) = FLOW_RECORD.unpack(data)
+
+                yield Flow(int_to_ip(src), int_to_ip(dst), proto, dpt,
+                           first_seen, last_seen, packets, size, flags)
@@ -0,0 +1,525 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import ctypes
+import ctypes.util
+import errno
+import glob
+import logging
+import os
+import select
+import struct
+import time
+from .events import EventParser
+from .utils import read_state_file, write_state_file
+
+log = logging.getLogger(__name__)
+
+# inotify(7) event masks and flags.
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event header; wd, mask, cookie, len.
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# Bytes read from the log per read() call.
+READ_SIZE = 1048576
+
+
+class Inotify:
+    """
+    The class for waiting on changes to a file with inotify (Linux, via
+    ctypes). The parent directory is watched, so the file can be created,
+    renamed (rotated) or deleted.
+
+    Args:
+        path: The file path to watch.
+
+    Raises:
+        OSError: inotify is not available.
+    """
+
+    def __init__(self, path=None):
+
+        self.name = os.path.basename(path).encode('utf-8')
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+
+        try:
+
+            self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        except AttributeError:
+
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+
+        if self.fd < 0:
+
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        directory = os.path.dirname(os.path.abspath(path))
+        wd = libc.inotify_add_watch(
+            self.fd, directory.encode('utf-8'),
+            IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        )
+
+        if wd < 0:
+
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch {0} failed'.format(
+                directory))
+
+    def wait(self, timeout=None):
+        """
+        The function for waiting until the file changes, or timeout.
+
+        Args:
+            timeout: The maximum number of seconds to wait, or None.
+
+        Returns:
+            Boolean: True if the file (may have) changed.
+        """
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+
+            return False
+
+        try:
+
+            buf = os.read(self.fd, 65536)
+
+        except OSError as e:  # pragma: no cover
+
+            if e.errno == errno.EAGAIN:
+
+                return False
+
+            raise
+
+        # Ignore other files in the directory (e.g., /var/log/messages).
+        pos = 0
+        changed = False
+        while pos + INOTIFY_EVENT.size <= len(buf):
+
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buf, pos)
+            name = buf[pos + INOTIFY_EVENT.size:
+                       pos + INOTIFY_EVENT.size + length].rstrip(b'\0')
+            pos += INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW or name == self.name:
+
+                changed = True
+
+        return changed
+
+    def close(self):
+        """
+        The function for closing the inotify file descriptor.
+        """
+
+        os.close(self.fd)
+
+
+class Follower:
+    """
+    The class for following the events log as it grows. inotify is used to
+    wake on writes (with a polling fallback), rename and truncate rotation
+    are detected by inode and size, and the (inode, offset) of the last
+    line handed out is checkpointed. After a restart, reading resumes at the
+    checkpoint, including the rest of a file rotated in the meantime; no
+    lines are skipped or repeated.
+
+    Lines are handed out in batches. A batch is checkpointed when the next
+    batch is requested (or checkpoint() is called), i.e., once it has been
+    processed.
+
+    Args:
+        path: The log file to follow.
+        checkpoint_path: The checkpoint (JSON) file, or None for no
+            checkpoint (start at the end of the file).
+        batch_size: The maximum number of lines/events per batch.
+        timeout: The maximum number of seconds to wait for new lines before
+            checking for rotation, and the polling interval without
+            inotify.
+        parser: The EventParser for iter_batches(). Defaults to
+            EventParser().
+        index: Optional timeindex.TimeIndex for the log, updated with the
+            lines read.
+    """
+
+    def __init__(self, path='/var/log/nfsinkhole-events.log',
+                 checkpoint_path='/var/lib/nfsinkhole/events.checkpoint',
+                 batch_size=1000, timeout=1.0, parser=None, index=None):
+
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.parser = parser or EventParser()
+        self.index = index
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.buffer = b''
+        self.inotify = None
+        self.pending = None
+
+    def get_rotated_path(self, inode=None):
+        """
+        The function for finding a rotated (renamed, uncompressed) copy of
+        the log by inode, e.g., nfsinkhole-events.log.1 or
+        nfsinkhole-events.log-20161017.
+
+        Args:
+            inode: The inode of the file.
+
+        Returns:
+            String: The rotated file path, or None.
+        """
+
+        for path in sorted(glob.glob('{0}[.-]*'.format(self.path))):
+
+            try:
+
+                if os.stat(path).st_ino == inode:
+
+                    return path
+
+            except OSError:  # pragma: no cover
+
+                pass
+
+        return None
+
+    def open(self):
+        """
+        The function for opening the log at the checkpoint. If the
+        checkpointed file was rotated, it is opened at the checkpoint offset
+        (by inode), and the new log is opened once it is drained.
+        """
+
+        state = None
+        if self.checkpoint_path:
+
+            state = read_state_file(self.checkpoint_path)
+
+        if state:
+
+            path = self.path
+            try:
+
+                inode = os.stat(self.path).st_ino
+
+            except OSError:
+
+                inode = None
+
+            if inode != state['inode']:
+
+                path = self.get_rotated_path(state['inode'])
+                if not path:
+
+                    log.warning('Checkpointed file (inode {0}) not found, '
+                                'lines may have been missed; starting at the '
+                                'beginning of {1}'.format(state['inode'],
+                                                          self.path))
+
+            if path:
+
+                self.open_file(path, state['offset'])
+                return
+
+            self.open_file(self.path, 0)
+
+        else:
+
+            # No checkpoint, only follow new lines.
+            self.open_file(self.path, None)
+
+    def open_file(self, path=None, offset=0):
+        """
+        The function for opening a file at an offset.
+
+        Args:
+            path: The file path.
+            offset: The byte offset to seek to, or None for the end of the
+                file.
+        """
+
+        if self.file:
+
+            self.file.close()
+
+        self.buffer = b''
+
+        try:
+
+            self.file = open(path, 'rb')
+
+        except (IOError, OSError) as e:
+
+            log.debug('Could not open {0}: {1}'.format(path, e))
+            self.file = None
+            self.inode = None
+            self.offset = 0
+            return
+
+        stat = os.fstat(self.file.fileno())
+        self.inode = stat.st_ino
+
+        if offset is None or offset > stat.st_size:
+
+            if offset is not None:
+
+                log.info('{0} was truncated, reading from the beginning'
+                         ''.format(path))
+                offset = 0
+
+            else:
+
+                offset = stat.st_size
+
+        self.offset = offset
+        self.file.seek(offset)
+
+        log.info('Following {0} (inode {1}) at offset {2}'.format(
+            path, self.inode, offset))
+
+    def read_lines(self):
+        """
+        The function for reading the complete lines available. A partial
+        last line is buffered until it is completed. Rotation and truncation
+        are handled.
+
+        Returns:
+            List: (lines, offset); the lines (bytes, with newlines), and the
+                file offset after the last line.
+        """
+
+        if not self.file:
+
+            self.open_file(self.path, 0)
+            if not self.file:
+
+                return [], self.offset
+
+        data = self.file.read(READ_SIZE)
+
+        if not data:
+
+            try:
+
+                stat = os.stat(self.path)
+
+            except OSError:
+
+                stat = None
+
+            if stat and stat.st_ino != self.inode:
+
+                # Rotated; the old file is drained, start the new one.
+                log.info('{0} was rotated'.format(self.path))
+                self.open_file(self.path, 0)
+                self.pending = self.pending or (self.inode, 0)
+
+            elif os.fstat(self.file.fileno()).st_size < (
+                    self.offset + len(self.buffer)):
+
+                log.info('{0} was truncated'.format(self.path))
+                self.open_file(self.path, 0)
+                self.pending = self.pending or (self.inode, 0)
+
+            else:
+
+                return [], self.offset
+
+            return self.read_lines()
+
+        data = self.buffer + data
+        end = data.rfind(b'\n') + 1
+
+        self.buffer = data[end:]
+        lines = data[:end].splitlines(True)
+        self.offset += end
+
+        return lines, self.offset
+
+    def checkpoint(self):
+        """
+        The function for saving the checkpoint of the last batch handed out.
+        """
+
+        if not self.checkpoint_path or not self.pending:
+
+            return
+
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory and not os.path.isdir(directory):
+
+            os.makedirs(directory)
+
+        write_state_file(self.checkpoint_path, {
+            'path': self.path,
+            'inode': self.pending[0],
+            'offset': self.pending[1],
+            'timestamp': time.time()
+        })
+
+        self.pending = None
+
+    def update_index(self, lines=None, inode=None, offset=0):
+        """
+        The function for adding lines read to the time index. If the lines
+        do not follow the indexed part of the log (start, rotation), the
+        index is updated from the log instead.
+
+        Args:
+            lines: The lines read.
+            inode: The inode of the file the lines were read from.
+            offset: The offset of the first line.
+        """
+
+        if self.index.inode == inode and self.index.offset == offset:
+
+            self.index.add_lines(lines, offset)
+
+        else:
+
+            self.index.update()
+
+    def wait(self):
+        """
+        The function for waiting for new lines (inotify, or sleep).
+        """
+
+        if self.inotify is None:
+
+            try:
+
+                self.inotify = Inotify(self.path)
+
+            except OSError as e:
+
+                log.info('inotify not available, polling: {0}'.format(e))
+                self.inotify = False
+
+        if self.inotify:
+
+            self.inotify.wait(self.timeout)
+
+        else:
+
+            time.sleep(self.timeout)
+
+    def iter_line_batches(self, follow=True):
+        """
+        The generator for reading lines in batches.
+
+        Args:
+            follow: If False, stop when the end of the log is reached.
+
+        Yields:
+            List: Lines (bytes), at most batch_size.
+        """
+
+        if self.file is None:
+
+            self.open()
+
+        lines = []
+        while True:
+
+            if not lines:
+
+                self.checkpoint()
+                lines, offset = self.read_lines()
+                inode = self.inode
+                offset -= sum([len(line) for line in lines])
+
+                if self.index is not None and lines:
+
+                    self.update_index(lines, inode, offset)
+
+            if not lines:
+
+                if not follow:
+
+                    return
+
+                self.wait()
+                continue
+
+            batch = lines[:self.batch_size]
+            lines = lines[self.batch_size:]
+            offset += sum([len(line) for line in batch])
+
+            self.pending = (inode, offset)
+            yield batch
+
+            # The previous batch was processed.
+            self.checkpoint()
+
+    def iter_batches(self, follow=True):
+        """
+        The generator for reading parsed events in batches. Lines that are
+        not sinkhole events are skipped.
+
+        Args:
+            follow: If False, stop when the end of the log is reached.
+
+        Yields:
+            List: Event objects.
+        """
+
+        parse_line = self.parser.parse_line
+        for lines in self.iter_line_batches(follow=follow):
+
+            events = [parse_line(line) for line in lines]
+            yield [e for e in events if e is not None]
+
+    def close(self):
+        """
+        The function for closing the log and inotify. The last batch is not
+        checkpointed; call checkpoint() first if it was processed.
+        """
+
+        if self.file:
+
+            self.file.close()
+            self.file = None
+
+        if self.inotify:
+
+            self.inotify.close()
+            self.inotify = None
@@ -0,0 +1,314 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import heapq
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+# Kernel limit for --hashlimit-htable-size and --hashlimit-htable-max.
+HTABLE_MAX_SIZE = 1048576
+
+# Kernel default for --hashlimit-htable-gcinterval (milliseconds).
+HTABLE_GCINTERVAL = 1000
+
+# Approximate kernel memory per hash table entry (struct dsthash_ent, slab
+# rounded) and per bucket (struct hlist_head), in bytes.
+ENTRY_BYTES = 128
+BUCKET_BYTES = 8
+
+
+def get_default_htable_size(meminfo_path='/proc/meminfo'):
+    """
+    The function for calculating the hash table size (buckets) the kernel
+    uses when --hashlimit-htable-size is not set.
+
+    Args:
+        meminfo_path: The path to meminfo.
+
+    Returns:
+        Integer: The number of buckets, or None if memory could not be read.
+    """
+
+    try:
+
+        with open(meminfo_path, 'r') as f:
+
+            for line in f:
+
+                if line.startswith('MemTotal:'):
+
+                    mem = int(line.split()[1]) * 1024
+                    break
+
+            else:
+
+                return None
+
+    except (IOError, OSError, ValueError) as e:  # pragma: no cover
+
+        log.debug('Could not read {0}: {1}'.format(meminfo_path, e))
+        return None
+
+    # xt_hashlimit htable_create(): memory / 16384 / sizeof(hlist_head),
+    # 8192 above 1GB, minimum 16.
+    if mem > 1024 * 1024 * 1024:
+
+        return 8192
+
+    return max(mem // 16384 // BUCKET_BYTES, 16)
+
+
+def next_power_of_two(value=0):
+    """
+    The function for rounding a number up to the next power of two.
+
+    Args:
+        value: The number.
+
+    Returns:
+        Integer: The power of two, minimum 1.
+    """
+
+    ret = 1
+    while ret < value:
+
+        ret <<= 1
+
+    return ret
+
+
+def recommend_htable(cardinality=0, expire=1800000, headroom=2.0,
+                     saturated=False):
+    """
+    The function for recommending hashlimit hash table settings from the
+    number of distinct keys (e.g., sources) seen within the expire window.
+
+    Args:
+        cardinality: The number of distinct hashlimit keys expected per
+            expire window (e.g., Hashlimit.get_stats()['entries']).
+        expire: The hashlimit expire (--hashlimit-htable-expire), in
+            milliseconds.
+        headroom: The multiplier applied to cardinality, for growth and
+            bursts.
+        saturated: If True, the cardinality was observed on a full table and
+            is a lower bound; headroom is doubled.
+
+    Returns:
+        Dictionary:
+
+        :htable_max (int): Recommended --hashlimit-htable-max; a power of
+            two, at least cardinality x headroom.
+        :htable_size (int): Recommended --hashlimit-htable-size (buckets),
+            half of htable_max; an average chain length of 2 when full.
+        :htable_gcinterval (int): Recommended
+            --hashlimit-htable-gcinterval; 1% of expire (1 - 60 seconds),
+            so expired entries do not hold slots for long.
+        :memory (int): Approximate kernel memory in bytes when full.
+        :capped (bool): True if the kernel limit (HTABLE_MAX_SIZE) was hit.
+    """
+
+    if saturated:
+
+        headroom *= 2
+
+    wanted = int(cardinality * headroom)
+    htable_max = next_power_of_two(max(wanted, 16))
+    capped = htable_max > HTABLE_MAX_SIZE
+    htable_max = min(htable_max, HTABLE_MAX_SIZE)
+    htable_size = max(htable_max // 2, 16)
+
+    htable_gcinterval = min(max(int(expire) // 100, HTABLE_GCINTERVAL), 60000)
+
+    if capped:
+
+        log.warning('Recommended hashlimit table exceeds the kernel limit '
+                    '({0}); consider a coarser --hashlimit-mode or a shorter '
+                    '--hashlimit-htable-expire.'.format(HTABLE_MAX_SIZE))
+
+    return {
+        'htable_max': htable_max,
+        'htable_size': htable_size,
+        'htable_gcinterval': htable_gcinterval,
+        'memory': htable_max * ENTRY_BYTES + htable_size * BUCKET_BYTES,
+        'capped': capped
+    }
+
+
+class Hashlimit:
+    """
+    The class for reading the live state of an iptables hashlimit table from
+    /proc/net/ipt_hashlimit/{name}.
+
+    Args:
+        name: The hashlimit name (--hashlimit-name).
+        proc_path: The hashlimit proc directory.
+    """
+
+    def __init__(self, name='sinkhole', proc_path='/proc/net/ipt_hashlimit'):
+
+        self.name = name
+        self.path = os.path.join(proc_path, name)
+
+    def iter_entries(self):
+        """
+        The generator for parsing the hash table entries. Entries are read
+        line by line, the table can hold millions.
+
+        Yields:
+            Tuple: (expires (seconds), srcip, srcport, dstip, dstport, credit,
+                credit_cap, cost). Fields not in --hashlimit-mode are 0.0.0.0
+                or 0.
+        """
+
+        with open(self.path, 'r') as f:
+
+            for line in f:
+
+                # 1795 192.0.2.1:0->10.0.0.1:22 64000 64000 32000
+                try:
+
+                    expires, addrs, credit, credit_cap, cost = line.split()
+                    src, dst = addrs.split('->')
+                    srcip, srcport = src.rsplit(':', 1)
+                    dstip, dstport = dst.rsplit(':', 1)
+
+                    yield (int(expires), srcip, int(srcport), dstip,
+                           int(dstport), int(credit), int(credit_cap),
+                           int(cost))
+
+                except ValueError:  # pragma: no cover
+
+                    log.debug('Unable to parse hashlimit entry: {0}'.format(
+                        line.strip()))
+
+    def get_stats(self, htable_size=None, htable_max=None, top=10,
+                  entries=None):
+        """
+        The function for summarizing the hash table occupancy.
+
+        Args:
+            htable_size: The configured --hashlimit-htable-size, or None for
+                the kernel default.
+            htable_max: The configured --hashlimit-htable-max, or None for
+                the kernel default.
+            top: The number of top keys to return.
+            entries: Optional iterable of entries (iter_entries() format),
+                instead of reading the proc file.
+
+        Returns:
+            Dictionary:
+
+            :entries (int): The number of entries in the table.
+            :htable_size (int): The number of buckets (None if unknown).
+            :htable_max (int): The maximum entries (None if unknown).
+            :fill_ratio (float): entries / htable_max (None if unknown).
+            :saturated (bool): True if the table is (nearly) full; new keys
+                are not logged and entries are evicted early.
+            :sources (int): The number of distinct source IPs.
+            :top_sources (list): (srcip, entries) tuples, most entries first.
+            :top_dports (list): (dstport, entries) tuples, most entries
+                first.
+            :top_limited (list): The entries with the least credit left (the
+                most rate limited keys), iter_entries() format.
+        """
+
+        if entries is None:
+
+            entries = self.iter_entries()
+
+        if not htable_size:
+
+            htable_size = get_default_htable_size()
+
+        if not htable_max and htable_size:
+
+            htable_max = 8 * htable_size
+
+        count = 0
+        sources = {}
+        dports = {}
+        limited = []
+        for entry in entries:
+
+            count += 1
+            sources[entry[1]] = sources.get(entry[1], 0) + 1
+            dports[entry[4]] = dports.get(entry[4], 0) + 1
+
+            # Keep the top N lowest credit entries in a bounded heap.
+            item = (-entry[5], count, entry)
+            if len(limited) < top:
+
+                heapq.heappush(limited, item)
+
+            elif item > limited[0]:
+
+                heapq.heapreplace(limited, item)
+
+        fill_ratio = None
+        if htable_max:
+
+            fill_ratio = float(count) / htable_max
+
+        return {
+            'entries': count,
+            'htable_size': htable_size,
+            'htable_max': htable_max,
+            'fill_ratio': fill_ratio,
+            'saturated': bool(fill_ratio is not None and fill_ratio >= 0.95),
+            'sources': len(sources),
+            'top_sources': heapq.nlargest(top, sources.items(),
+                                          key=lambda x: x[1]),
+            'top_dports': heapq.nlargest(top, dports.items(),
+                                         key=lambda x: x[1]),
+            'top_limited': [e for c, i, e in sorted(limited, reverse=True)]
+        }
+
+    def recommend(self, expire=1800000, headroom=2.0, htable_size=None,
+                  htable_max=None):
+        """
+        The function for recommending hash table settings from the live
+        table occupancy. See recommend_htable().
+
+        Args:
+            expire: The hashlimit expire, in milliseconds.
+            headroom: The multiplier applied to the observed entries.
+            htable_size: The configured --hashlimit-htable-size, or None.
+            htable_max: The configured --hashlimit-htable-max, or None.
+
+        Returns:
+            Dictionary: recommend_htable() output, plus stats (get_stats()).
+        """
+
+        stats = self.get_stats(htable_size=htable_size,
+                               htable_max=htable_max)
+
+        ret = recommend_htable(cardinality=stats['entries'], expire=expire,
+                               headroom=headroom,
+                               saturated=stats['saturated'])
+        ret['stats'] = stats
+
+        return ret
@@ -0,0 +1,266 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from .exceptions import IPSetError, SubprocessError
+from .utils import popen_wrapper
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class IPSet:
+    """
+    The class for managing an ipset set via batched ipset restore calls.
+
+    Args:
+        name: The name of the set (max 31 characters).
+        settype: The ipset type. hash:net accepts both IPs and CIDRs.
+        maxelem: The minimum maximum number of elements the set can hold. This
+            is raised automatically to fit larger batches.
+    """
+
+    def __init__(self, name='nfsinkhole-srcexclude', settype='hash:net',
+                 maxelem=65536):
+
+        self.name = name
+        self.settype = settype
+        self.maxelem = maxelem
+
+    def restore(self, lines=None):
+        """
+        The function for committing ipset commands in a single ipset restore
+        call.
+
+        Args:
+            lines: List of ipset restore command lines.
+
+        Raises:
+            IPSetError: ipset restore rejected the payload.
+        """
+
+        payload = '\n'.join(lines) + '\n'
+
+        log.debug('ipset restore payload:\n{0}'.format(payload))
+
+        cmd = ['ipset', 'restore']
+        try:
+
+            out, err = popen_wrapper(cmd_arr=cmd, raise_err=True, sudo=True,
+                                     stdin=payload)
+
+        except SubprocessError as e:  # pragma: no cover
+
+            raise IPSetError(e)
+
+        # ipset restore is silent on success; stderr is piped to stdout.
+        if out:  # pragma: no cover
+
+            raise IPSetError('Error encountered when running process "{0}":'
+                             '\n{1}'.format(' '.join(cmd),
+                                            out.decode('ascii', 'ignore')))
+
+    def list_names(self):
+        """
+        The function for retrieving the names of the existing sets.
+
+        Returns:
+            List: The set names.
+        """
+
+        out, err = popen_wrapper(['ipset', 'list', '-n'],
+                                 log_stdout_line=False, sudo=True)
+
+        return out.decode('ascii', 'ignore').split() if out else []
+
+    def get_create_lines(self, entries=None, name=None, exists=False):
+        """
+        The function for generating the ipset restore lines that create (if
+        missing) and populate a set. create -exist only ignores an identical
+        set, and maxelem is part of the comparison, so the create line is
+        omitted for an existing set.
+
+        Args:
+            entries: List of IPs/CIDRs to add to the set.
+            name: Override the set name (e.g., for a temporary swap set).
+            exists: If True, the set exists; only add the entries.
+
+        Returns:
+            List: ipset restore command lines.
+        """
+
+        name = name or self.name
+        entries = [e.strip() for e in (entries or []) if e.strip()]
+        maxelem = max(self.maxelem, len(entries) * 2)
+
+        lines = []
+        if not exists:
+
+            lines.append(
+                'create {0} {1} family inet maxelem {2} -exist'.format(
+                    name, self.settype, maxelem
+                )
+            )
+
+        for entry in entries:
+
+            lines.append('add {0} {1} -exist'.format(name, entry))
+
+        return lines
+
+    def create(self, entries=None):
+        """
+        The function for creating and populating the set in one batch.
+
+        Args:
+            entries: List of IPs/CIDRs to add to the set.
+        """
+
+        log.info('Writing ipset {0} ({1} entries)'.format(
+            self.name, len(entries or [])))
+
+        self.restore(self.get_create_lines(
+            entries, exists=self.name in self.list_names()))
+
+    def get_sync_lines(self, entries=None, names=None):
+        """
+        The function for generating the ipset restore lines that atomically
+        replace the set members (see sync()).
+
+        Args:
+            entries: List of IPs/CIDRs the set should contain.
+            names: List of the existing set names (list_names()).
+
+        Returns:
+            List: ipset restore command lines.
+        """
+
+        names = names or []
+        tmp_name = '{0}-tmp'.format(self.name[:27])
+
+        # Recreate the temporary set, in case a previous sync was
+        # interrupted; its maxelem follows the number of entries.
+        lines = []
+        if tmp_name in names:
+
+            lines.append('destroy {0}'.format(tmp_name))
+
+        tmp_lines = self.get_create_lines(entries, name=tmp_name)
+        if self.name not in names:
+
+            lines.append(tmp_lines[0].replace(tmp_name, self.name, 1))
+
+        lines += tmp_lines
+        lines += [
+            'swap {0} {1}'.format(tmp_name, self.name),
+            'destroy {0}'.format(tmp_name)
+        ]
+
+        return lines
+
+    def sync(self, entries=None):
+        """
+        The function for atomically replacing the set members. A temporary
+        set is populated and swapped with the set in a single ipset restore
+        batch; the set may be referenced by iptables rules.
+
+        Args:
+            entries: List of IPs/CIDRs the set should contain.
+        """
+
+        log.info('Syncing ipset {0} ({1} entries)'.format(
+            self.name, len(entries or [])))
+
+        self.restore(self.get_sync_lines(entries, self.list_names()))
+
+    def update(self, add=None, delete=None):
+        """
+        The function for adding and deleting set members in one batch,
+        without touching the other members. Adding an existing member, or
+        deleting a missing one, is not an error.
+
+        Args:
+            add: List of IPs/CIDRs to add to the set.
+            delete: List of IPs/CIDRs to delete from the set.
+        """
+
+        lines = []
+        for entry in add or []:
+
+            if entry.strip():
+
+                lines.append('add {0} {1} -exist'.format(self.name,
+                                                         entry.strip()))
+
+        for entry in delete or []:
+
+            if entry.strip():
+
+                lines.append('del {0} {1} -exist'.format(self.name,
+                                                         entry.strip()))
+
+        log.info('Updating ipset {0} (+{1}/-{2} entries)'.format(
+            self.name, len(add or []), len(delete or [])))
+
+        if lines:
+
+            self.restore(lines)
+
+    def list_members(self):
+        """
+        The function for retrieving the current members of the set.
+
+        Returns:
+            List: The set members, or None if the set does not exist.
+        """
+
+        out, err = popen_wrapper(['ipset', 'list', self.name],
+                                 log_stdout_line=False, sudo=True)
+
+        if not out:  # pragma: no cover
+
+            return None
+
+        lines = out.decode('ascii', 'ignore').splitlines()
+
+        try:
+
+            idx = lines.index('Members:')
+
+        except ValueError:
+
+            # Set does not exist.
+            return None
+
+        return [line.strip() for line in lines[idx + 1:] if line.strip()]
+
+    def destroy(self):
+        """
+        The function for destroying the set. The set must not be referenced
+        by any iptables rule.
+        """
+
+        log.info('Destroying ipset {0}'.format(self.name))
+
+        self.restore(['destroy {0}'.format(self.name)])
@@ -22,199 +22,1525 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+
 from .exceptions import (IPTablesError, IPTablesExists, IPTablesNotExists,
                          SubprocessError)
-from .utils import popen_wrapper
+from .ipset import IPSet
+from .utils import (popen_wrapper, read_state_file, write_state_file,
+                    delete_state_file, get_config_hash, read_address_file)
 import logging
+import re
+import time
+
+log = logging.getLogger(__name__)
+
+# Characters that require an iptables-restore argument to be quoted.
+RESTORE_QUOTE_RE = re.compile(r'[\s"\'\\]')
+
+# Rule counters; iptables-save -c prefix [packets:bytes], or iptables -v -S
+# suffix -c packets bytes.
+COUNTERS_PREFIX_RE = re.compile(r'^\[(\d+):(\d+)\]\s+')
+COUNTERS_SUFFIX_RE = re.compile(r'\s+-c\s+(\d+)\s+(\d+)$')
+
+# Rule option tokens (e.g., -i, --hashlimit-name), as opposed to values.
+OPTION_RE = re.compile(r'^--?[a-zA-Z][\w-]*$')
+
+# iptables -S/iptables-save rule tokens; double quoted (with backslash
+# escapes) or whitespace delimited.
+TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+UNESCAPE_RE = re.compile(r'\\(.)')
+
+# Option aliases, mapped to the name output by iptables -S.
+OPTION_ALIASES = {
+    '--source': '-s',
+    '--destination': '-d',
+    '--in-interface': '-i',
+    '--out-interface': '-o',
+    '--protocol': '-p',
+    '--hashlimit': '--hashlimit-upto',
+    '--dport': '--dports',
+    '--sport': '--sports'
+}
+
+# Seconds per rate unit for hashlimit/limit rates.
+RATE_SECONDS = {
+    's': 1, 'sec': 1, 'second': 1,
+    'm': 60, 'min': 60, 'minute': 60,
+    'h': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400
+}
+
+
+def normalize_option(option=None, value=None):
+    """
+    The function for normalizing a rule option and value, so rules generated
+    by nfsinkhole compare equal to the iptables -S output for the same rule
+    (e.g., -s 127.0.0.1 vs -s 127.0.0.1/32, --hashlimit 1/h vs
+    --hashlimit-upto 1/hour).
+
+    Args:
+        option: The option name.
+        value: The option value.
+
+    Returns:
+        Tuple: (option, value) normalized.
+    """
+
+    negate = option.startswith('!')
+    option = OPTION_ALIASES.get(option.lstrip('!'), option.lstrip('!'))
+
+    if value is not None:
+
+        if option in ('-s', '-d') and '/' not in value:
+
+            value += '/32'
+
+        elif option in ('--hashlimit-upto', '--hashlimit-above', '--limit'):
+
+            # Compare rates as packets per second; iptables may print a
+            # different unit than it was given (60/m is printed as 1/sec).
+            try:
+
+                count, unit = value.split('/')
+                value = '{0:.6g}'.format(float(count) / RATE_SECONDS[unit])
+
+            except (KeyError, ValueError):  # pragma: no cover
+
+                pass
+
+    return ('!' + option if negate else option), value
+
+
+def split_rule(line=None):
+    """
+    The function for splitting an iptables -S/iptables-save rule line into
+    tokens, keeping track of quoting, so a quoted value that looks like an
+    option (e.g., --log-prefix "-foo") is not parsed as one.
+
+    Args:
+        line: The rule line.
+
+    Returns:
+        List: Tuples (token, quoted).
+    """
+
+    # Quoting is rare; skip the regex for the common case.
+    if '"' not in line:
+
+        return [(token, False) for token in line.split()]
+
+    tokens = []
+    for m in TOKEN_RE.finditer(line):
+
+        if m.group(2) is None:
+
+            tokens.append((UNESCAPE_RE.sub(r'\1', m.group(1)), True))
+
+        else:
+
+            tokens.append((m.group(2), False))
+
+    return tokens
+
+
+def quote_restore_arg(arg):
+    """
+    The function for quoting a single argument for an iptables-restore
+    payload. iptables-restore tokenizes lines similar to a shell; arguments
+    containing whitespace or quotes must be double quoted and escaped.
+
+    Args:
+        arg: The argument string to quote.
+
+    Returns:
+        String: The argument, quoted if required.
+    """
+
+    if arg and not RESTORE_QUOTE_RE.search(arg):
+
+        return arg
+
+    return '"{0}"'.format(arg.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def build_restore_payload(tables=None):
+    """
+    The function for rendering iptables-restore input from lists of rule
+    statements.
+
+    Args:
+        tables: List of tuples (table, statements), where statements is a
+            list of rule argument lists (e.g., ['-A', 'SINKHOLE', '-j', 'LOG'])
+            or pre-rendered lines (strings, e.g., from iptables -S).
+
+    Returns:
+        String: The iptables-restore payload, one COMMIT per table.
+    """
+
+    lines = []
+    for table, statements in tables:
+
+        lines.append('*{0}'.format(table))
+        for stmt in statements:
+
+            if isinstance(stmt, list):
+
+                stmt = ' '.join([quote_restore_arg(a) for a in stmt])
+
+            lines.append(stmt)
+
+        lines.append('COMMIT')
+
+    return '\n'.join(lines) + '\n'
+
+
+class IPTablesRule:
+    """
+    The class for a single parsed iptables rule, as output by iptables -S or
+    iptables-save.
+
+    Args:
+        line: The rule line (e.g., -A INPUT -i eth1 -j DROP).
+        table: The table the rule belongs to.
+        index: The position of the line in the ruleset output.
+
+    Attributes:
+        line: The stripped rule line.
+        action: The rule command (-A, -N or -P).
+        chain: The chain name.
+        params: List of tuples (option, value) preceding any -m match.
+            Negated options are prefixed with ! (e.g., !-i).
+        matches: List of tuples (module, [(option, value), ...]).
+        target: The -j/-g target, policy for -P, or None.
+        target_options: List of tuples (option, value) for the target.
+        packets: The packet counter, if the output included counters.
+        bytes: The byte counter, if the output included counters.
+    """
+
+    def __init__(self, line=None, table='filter', index=0):
+
+        self.packets = None
+        self.bytes = None
+
+        # Strip the counters, so the line matches plain iptables -S output.
+        line = line.strip()
+        m = COUNTERS_PREFIX_RE.match(line) or COUNTERS_SUFFIX_RE.search(line)
+        if m:
+
+            self.packets, self.bytes = int(m.group(1)), int(m.group(2))
+            line = line[:m.start()] + line[m.end():]
+
+        self.line = line
+        self.table = table
+        self.index = index
+        self.action = None
+        self.chain = None
+        self.params = []
+        self.matches = []
+        self.target = None
+        self.target_options = []
+
+        self.parse()
+
+    def __repr__(self):
+
+        return 'IPTablesRule({0!r})'.format(self.line)
+
+    def parse(self):
+        """
+        The function for parsing the rule line into its parts.
+        """
+
+        split = split_rule(self.line)
+        tokens = [token for token, quoted in split]
+
+        if len(tokens) < 2:
+
+            return
+
+        self.action, self.chain = tokens[0], tokens[1]
+
+        # Policy lines: -P INPUT ACCEPT
+        if self.action == '-P':
+
+            self.target = tokens[2] if len(tokens) > 2 else None
+            return
+
+        current = self.params
+        option = None
+        negate = False
+        i = 2
+        while i < len(tokens):
+
+            # Quoted tokens are always values.
+            token, quoted = split[i]
+            if not quoted and token == '!':
+
+                negate = True
+
+            elif not quoted and token == '-m':
+
+                i += 1
+                current = []
+                self.matches.append((tokens[i], current))
+                option = None
+
+            elif not quoted and token in ('-j', '-g'):
+
+                i += 1
+                self.target = tokens[i]
+                current = self.target_options
+                option = None
+
+            elif not quoted and OPTION_RE.match(token):
+
+                option = [token, None]
+                if negate:
+
+                    option[0] = '!' + token
+                    negate = False
+
+                current.append(option)
+
+            elif option is not None:
+
+                # Values are space joined (e.g., --match-set name src)
+                option[1] = token if option[1] is None else '{0} {1}'.format(
+                    option[1], token)
+
+            i += 1
+
+        # Convert the option lists to tuples
+        self.params = [tuple(o) for o in self.params]
+        self.matches = [(m, [tuple(o) for o in opts])
+                        for m, opts in self.matches]
+        self.target_options = [tuple(o) for o in self.target_options]
+
+    def get(self, option=None, default=None):
+        """
+        The function for retrieving the value of an option from the rule
+        params, matches or target options.
+
+        Args:
+            option: The option name (e.g., -i, --hashlimit-name).
+            default: The value to return if the option is not found.
+
+        Returns:
+            String: The option value, or default.
+        """
+
+        opts = list(self.params) + list(self.target_options)
+        for module, match_opts in self.matches:
+
+            opts += match_opts
+
+        for key, value in opts:
+
+            if key == option:
+
+                return value
+
+        return default
+
+    def get_match(self, module=None):
+        """
+        The function for retrieving the normalized options of a match
+        module.
+
+        Args:
+            module: The match module name (e.g., hashlimit).
+
+        Returns:
+            Tuple: Sorted (option, value) tuples, or None if the rule does not
+                use the module.
+        """
+
+        for name, opts in self.matches:
+
+            if name == module:
+
+                return tuple(sorted([normalize_option(k, v)
+                                     for k, v in opts]))
+
+        return None
+
+    def get_key(self):
+        """
+        The function for generating a comparable key for the rule, ignoring
+        option order, option aliases and value formatting differences.
+
+        Returns:
+            Tuple: The rule key.
+        """
+
+        def _norm(opts):
+
+            return tuple(sorted([normalize_option(k, v) for k, v in opts]))
+
+        return (
+            self.chain,
+            self.target,
+            _norm(self.params),
+            tuple(sorted([(m, _norm(o)) for m, o in self.matches])),
+            _norm(self.target_options)
+        )
+
+
+class IPTablesRuleset:
+    """
+    The class for a parsed iptables ruleset, indexed by chain and target.
+    Accepts iptables -S or iptables-save output.
+
+    Args:
+        lines: List of lines (str or bytes).
+        table: The table for iptables -S output (iptables-save output
+            sets the table per section).
+
+    Attributes:
+        rules: All rules (including -N/-P) in output order.
+        chains: Dictionary of chain name to ordered list of -A rules. Chains
+            without rules have an empty list.
+        policies: Dictionary of built-in chain name to policy.
+        targets: Dictionary of target name to ordered list of rules.
+    """
+
+    def __init__(self, lines=None, table='filter'):
+
+        self.rules = []
+        self.chains = {}
+        self.policies = {}
+        self.targets = {}
+
+        for line in lines or []:
+
+            try:
+
+                line = line.decode('ascii', 'ignore')
+
+            except AttributeError:  # pragma: no cover
+
+                pass
+
+            line = line.strip()
+            if not line or line.startswith('#') or line == 'COMMIT':
+
+                continue
+
+            if line.startswith('*'):
+
+                table = line[1:]
+                continue
+
+            # iptables-save chain declaration: :SINKHOLE - [0:0]
+            if line.startswith(':'):
+
+                chain, policy = line[1:].split()[:2]
+                line = ('-N {0}'.format(chain) if policy == '-' else
+                        '-P {0} {1}'.format(chain, policy))
+
+            self.add(IPTablesRule(line, table, len(self.rules)))
+
+    def add(self, rule=None):
+        """
+        The function for adding a parsed rule to the ruleset indexes.
+
+        Args:
+            rule: The IPTablesRule to add.
+        """
+
+        self.rules.append(rule)
+        chain = self.chains.setdefault(rule.chain, [])
+
+        if rule.action == '-P':
+
+            self.policies[rule.chain] = rule.target
+
+        elif rule.action == '-A':
+
+            chain.append(rule)
+            self.targets.setdefault(rule.target, []).append(rule)
+
+    def find(self, chain=None, target=None):
+        """
+        The function for retrieving rules by chain and/or target, in output
+        order.
+
+        Args:
+            chain: The chain name to filter on.
+            target: The target name to filter on.
+
+        Returns:
+            List: Matching IPTablesRule objects.
+        """
+
+        if chain is not None:
+
+            rules = self.chains.get(chain, [])
+            if target is not None:
+
+                rules = [r for r in rules if r.target == target]
+
+            return rules
+
+        return self.targets.get(target, [])
+
+
+class IPTablesSinkhole:
+    """
+    The class for managing sinkhole configuration within iptables.
+
+    Args:
+        interface: The secondary network interface dedicated to sinkhole
+            traffic.
+            Warning: Do not accidentally set this to your primary interface.
+            It will drop all traffic, and kill your remote access.
+        interface_addr: The IP address assigned to interface.
+        log_prefix: Prefix for syslog messages.
+        protocol: The protocol(s) to log (all traffic will still be dropped).
+            Accepts a comma separated string of protocols
+            (tcp,udp,udplite,icmp,esp,ah,sctp) or all.
+        dport: The destination port(s) to log (for applicable protocols).
+            Range should be in the format startport:endport or 0,1,2,3,n..
+        hashlimit: Set the hashlimit rate. Hashlimit is used to tune the
+            amount of events logged. See the iptables-extensions docs:
+            http://ipset.netfilter.org/iptables-extensions.man.html
+        hashlimitmode: Set the hashlimit mode, a comma separated string of
+            options (srcip,srcport,dstip,dstport). More options here results
+            in more logs generated.
+        hashlimitburst: Maximum initial number of packets to match.
+        hashlimitexpire: Number of milliseconds to keep entries in the hash
+            table.
+        hashlimit_htable_size: The number of buckets in the hashlimit hash
+            table, or None for the kernel default (based on memory).
+        hashlimit_htable_max: The maximum number of entries in the hashlimit
+            hash table, or None for the kernel default (8 x buckets).
+        hashlimit_htable_gcinterval: Number of milliseconds between hashlimit
+            hash table garbage collection runs, or None for the kernel
+            default (1000).
+        srcexclude: Exclude a comma separated string of source IPs/CIDRs from
+            logging.
+        srcexclude_ipset: If True, load srcexclude into a hash:net ipset
+            (nfsinkhole-srcexclude) and match it with a single rule, instead
+            of one RETURN rule per IP/CIDR. Requires ipset.
+        srcexclude_file: Optional file of additional source IPs/CIDRs to
+            exclude from logging (one per line, # comments). Runtime
+            exclusion changes are synced from this file.
+        notrack: If True, exempt interface traffic from connection tracking
+            via a raw table SINKHOLE chain (NOTRACK). Scans/floods to the
+            sinkhole no longer fill nf_conntrack. Logging is unaffected.
+        rawdrop: If True, drop interface traffic that would never be logged
+            (srcexclude sources, and protocols/ports not matching
+            protocol/dport) in the raw table, before connection tracking and
+            the filter table.
+        nflog_group: The NFLOG netlink group (0 - 2^16-1) for packet capture.
+        nflog_size: The number of bytes of each packet copied to userspace
+            (snaplen), or None for the full packet.
+        nflog_threshold: The number of packets queued in the kernel before
+            they are sent to userspace in a single netlink message.
+        state_path: The file storing the hash of the last configuration
+            applied by reconcile().
+    """
+
+    def __init__(self, interface=None, interface_addr=None,
+                 log_prefix='"[nfsinkhole] "',
+                 protocol='all', dport='0:65535',
+                 hashlimit='1/h', hashlimitmode='srcip,dstip,dstport',
+                 hashlimitburst='1', hashlimitexpire='1800000',
+                 hashlimit_htable_size=None, hashlimit_htable_max=None,
+                 hashlimit_htable_gcinterval=None,
+                 srcexclude='127.0.0.1', srcexclude_ipset=False,
+                 srcexclude_file=None, notrack=False, rawdrop=False,
+                 nflog_group='0', nflog_size=None, nflog_threshold='1',
+                 state_path='/var/run/nfsinkhole.state'
+                 ):
+
+        # TODO: add arg checks across all classes
+        self.interface = interface
+        self.interface_addr = interface_addr
+        self.log_prefix = log_prefix
+        self.protocol = protocol
+        self.dport = dport
+        self.hashlimit = hashlimit
+        self.hashlimitmode = hashlimitmode
+        self.hashlimitburst = hashlimitburst
+        self.hashlimitexpire = hashlimitexpire
+        self.hashlimit_htable_size = hashlimit_htable_size
+        self.hashlimit_htable_max = hashlimit_htable_max
+        self.hashlimit_htable_gcinterval = hashlimit_htable_gcinterval
+        self.srcexclude = srcexclude
+        self.srcexclude_ipset = srcexclude_ipset
+        self.srcexclude_file = srcexclude_file
+        self.notrack = notrack
+        self.rawdrop = rawdrop
+        self.nflog_group = nflog_group
+        self.nflog_size = nflog_size
+        self.nflog_threshold = nflog_threshold
+        self.state_path = state_path
+        self.ipset = IPSet(name='nfsinkhole-srcexclude')
+        self.rulesets = {}
+        self.counters = None
+
+    def get_ruleset(self, refresh=False, table='filter'):
+        """
+        The function for retrieving a parsed iptables table. The result is
+        cached on the object, and invalidated when nfsinkhole writes rules
+        (apply_rules()).
+
+        Args:
+            refresh: Boolean for ignoring the cache.
+            table: The iptables table (filter, raw).
+
+        Returns:
+            IPTablesRuleset: The parsed output of iptables -S.
+
+        Raises:
+            IPTablesError: A Linux process had an error (stderr).
+        """
+
+        if table in self.rulesets and not refresh:
+
+            return self.rulesets[table]
+
+        # Get list summary of iptables rules
+        cmd = ['iptables', '-t', table, '-S']
+
+        # Get all of the iptables rules
+        try:
+
+            out, err = popen_wrapper(cmd, sudo=True)
+
+        except OSError as e:  # pragma: no cover
+
+            raise IPTablesError('Error encountered when running process "{0}":'
+                                '\n{1}'.format(' '.join(cmd), e))
+
+        # If any errors, iterate them and write to log, then raise
+        # IPTablesError.
+        if err:  # pragma: no cover
+
+            arr = err.splitlines()
+            raise IPTablesError('Error encountered when running process "{0}":'
+                                '\n{1}'.format(' '.join(cmd), '\n'.join(arr)))
+
+        self.rulesets[table] = IPTablesRuleset(out.splitlines(), table)
+
+        return self.rulesets[table]
+
+    def list_existing_rules(self, filter_io_drop=False, table='filter'):
+        """
+        The function for retrieving current iptables rules related to
+        nfsinkhole.
+
+        Args:
+            filter_io_drop: Boolean for only showing the DROP rules for INPUT
+                and OUTPUT. These are not shown by default. This exists to
+                avoid allowing packets on the interface if the service is down.
+                If installed, the interface always drops all traffic regardless
+                of the service state.
+            table: The iptables table (filter, raw).
+
+        Returns:
+            List: Matching sinkhole lines returned by iptables -S.
+
+        Raises:
+            IPTablesError: A Linux process had an error (stderr).
+        """
+
+        ruleset = self.get_ruleset(table=table)
+
+        # The SINKHOLE chain definition, its rules, and jumps to it.
+        matched = ruleset.find(target='SINKHOLE')
+        if 'SINKHOLE' in ruleset.chains:
+
+            matched = matched + [r for r in ruleset.rules
+                                 if r.chain == 'SINKHOLE']
+
+        if filter_io_drop:
+
+            drop_lines = (
+                '-A INPUT -i {0} -j DROP'.format(self.interface),
+                '-A OUTPUT -o {0} -j DROP'.format(self.interface)
+            )
+            matched = matched + [r for r in ruleset.find(target='DROP')
+                                 if r.line in drop_lines]
+
+        # Return in iptables -S order.
+        matched.sort(key=lambda r: r.index)
+
+        return [r.line for r in matched]
+
+    def get_exclusions(self):
+        """
+        The function for retrieving the effective source exclusions;
+        srcexclude, plus the entries in srcexclude_file.
+
+        Returns:
+            List: Unique IPs/CIDRs, in order.
+        """
+
+        entries = [e.strip() for e in self.srcexclude.split(',') if e.strip()]
+        if self.srcexclude_file:
+
+            try:
+
+                entries += read_address_file(self.srcexclude_file)
+
+            except (IOError, OSError) as e:
+
+                log.error('Could not read srcexclude_file {0}: {1}'.format(
+                    self.srcexclude_file, e))
+
+        ret = []
+        for entry in entries:
+
+            if entry not in ret:
+
+                ret.append(entry)
+
+        return ret
+
+    def get_live_exclusions(self):
+        """
+        The function for retrieving the source exclusions currently applied;
+        the ipset members, or the SINKHOLE chain RETURN rules.
+
+        Returns:
+            List: IPs/CIDRs, in order.
+        """
+
+        if self.srcexclude_ipset:
+
+            return self.ipset.list_members() or []
+
+        ruleset = self.get_ruleset(refresh=True)
+
+        return [r.get('-s') for r in ruleset.find('SINKHOLE', 'RETURN')
+                if r.get('-s')]
+
+    def exclusions_changed(self, live=None):
+        """
+        The function for checking if the live source exclusions differ from
+        the configured exclusions (e.g., after --exclude-add/--exclude-del).
+
+        Args:
+            live: The live IPs/CIDRs (get_live_exclusions()), or None to
+                retrieve them.
+
+        Returns:
+            Boolean: True if the live exclusions differ.
+        """
+
+        if live is None:
+
+            live = self.get_live_exclusions()
+
+        return (set([normalize_option('-s', e) for e in live]) !=
+                set([normalize_option('-s', e)
+                     for e in self.get_exclusions()]))
+
+    def get_exclusion_rule_stmts(self, ruleset=None, entries=None,
+                                 target='RETURN'):
+        """
+        The function for generating the statements that change only the live
+        SINKHOLE source exclusion rules (-s ADDR -j RETURN, or -j DROP in the
+        raw table) to entries. The other SINKHOLE rules (LOG/NFLOG, etc.) and
+        the jump into the chain are left as they are.
+
+        Args:
+            ruleset: The live IPTablesRuleset for the table.
+            entries: List of IPs/CIDRs that should be excluded.
+            target: The exclusion rule target (RETURN, or DROP for rawdrop).
+
+        Returns:
+            List: iptables-restore statements, empty if nothing changed.
+        """
+
+        keys = []
+        for entry in entries or []:
+
+            key = normalize_option('-s', entry)
+            if key not in keys:
+
+                keys.append(key)
+
+        stmts = []
+        live = []
+        for rule in ruleset.find('SINKHOLE', target):
+
+            src = rule.get('-s')
+            if not src or rule.line.split() != [
+                    '-A', 'SINKHOLE', '-s', src, '-j', target]:
+
+                continue
+
+            key = normalize_option('-s', src)
+            if key in keys and key not in live:
+
+                live.append(key)
+
+            else:
+
+                stmts.append('-D' + rule.line[2:])
+
+        # Exclusions are at the top of the chain, before LOG/NFLOG.
+        for key in reversed([k for k in keys if k not in live]):
+
+            stmts.append(['-I', 'SINKHOLE', '1', '-s', key[1], '-j', target])
+
+        return stmts
+
+    def apply_exclusions(self, entries=None):
+        """
+        The function for applying a new exclusion list to the live rules,
+        without recreating the SINKHOLE chain. With srcexclude_ipset, the set
+        is atomically replaced in one ipset restore batch; otherwise only the
+        changed RETURN rules (and the rawdrop DROP rules, if the applied
+        configuration has rawdrop) are written in one iptables-restore
+        transaction. No other rule is changed.
+
+        Args:
+            entries: List of IPs/CIDRs that should be excluded.
+
+        Returns:
+            Integer: The number of statements applied.
+
+        Raises:
+            IPTablesNotExists: The SINKHOLE chain does not exist.
+        """
+
+        entries = [e.strip() for e in entries or [] if e.strip()]
+
+        # Runtime changes replace the configured exclusions; a later
+        # reconcile (service reload) reverts to the configuration.
+        self.srcexclude = ','.join(entries)
+        self.srcexclude_file = None
+
+        if self.srcexclude_ipset:
+
+            self.ipset.sync(entries)
+            return len(entries)
+
+        ruleset = self.get_ruleset(refresh=True)
+        if 'SINKHOLE' not in ruleset.chains:
+
+            raise IPTablesNotExists('No existing SINKHOLE chain found.')
+
+        tables = [('filter', self.get_exclusion_rule_stmts(ruleset, entries,
+                                                           'RETURN'))]
+
+        # The live rules may have been created with other arguments; use the
+        # last applied configuration, if any.
+        config = (read_state_file(self.state_path) or {}).get('config') or {}
+        if config.get('rawdrop', self.rawdrop):
+
+            raw_ruleset = self.get_ruleset(refresh=True, table='raw')
+            if 'SINKHOLE' in raw_ruleset.chains:
+
+                tables.append(('raw', self.get_exclusion_rule_stmts(
+                    raw_ruleset, entries, 'DROP')))
+
+        tables = [(table, stmts) for table, stmts in tables if stmts]
+        count = sum([len(stmts) for table, stmts in tables])
+
+        if tables:
+
+            self.apply_rules(tables)
+
+        return count
+
+    def add_exclusions(self, entries=None):
+        """
+        The function for adding source exclusions to the live rules.
+
+        Args:
+            entries: List of IPs/CIDRs to exclude.
+
+        Returns:
+            Integer: The number of entries/statements applied.
+        """
+
+        log.info('Adding {0} source exclusions'.format(len(entries or [])))
+
+        if self.srcexclude_ipset:
+
+            self.ipset.update(add=entries)
+            return len(entries or [])
+
+        live = self.get_live_exclusions()
+        keys = [normalize_option('-s', e.strip()) for e in live]
+
+        for entry in entries or []:
+
+            key = normalize_option('-s', entry.strip())
+            if entry.strip() and key not in keys:
+
+                keys.append(key)
+                live.append(entry.strip())
+
+        return self.apply_exclusions(live)
+
+    def delete_exclusions(self, entries=None):
+        """
+        The function for deleting source exclusions from the live rules.
+
+        Args:
+            entries: List of IPs/CIDRs to stop excluding.
+
+        Returns:
+            Integer: The number of entries/statements applied.
+        """
+
+        log.info('Deleting {0} source exclusions'.format(len(entries or [])))
+
+        if self.srcexclude_ipset:
+
+            self.ipset.update(delete=entries)
+            return len(entries or [])
+
+        keys = [normalize_option('-s', e.strip()) for e in entries or []]
+
+        return self.apply_exclusions([
+            e for e in self.get_live_exclusions()
+            if normalize_option('-s', e) not in keys
+        ])
+
+    def sync_exclusions(self, entries=None):
+        """
+        The function for replacing the live source exclusions.
+
+        Args:
+            entries: List of IPs/CIDRs that should be excluded.
+
+        Returns:
+            Integer: The number of entries/statements applied.
+        """
+
+        log.info('Syncing {0} source exclusions'.format(len(entries or [])))
+
+        return self.apply_exclusions(entries)
+
+    def get_drop_rules(self, action='-I'):
+        """
+        The function for generating the iptables DROP rule statements for the
+        interface.
+
+        Args:
+            action: The iptables command for the rules; -I to insert at the
+                top of INPUT/OUTPUT or -D to delete.
+
+        Returns:
+            List: iptables argument lists for the filter table.
+        """
+
+        position = ['1'] if action == '-I' else []
+
+        return [
+            [action, 'INPUT'] + position + [
+                '-i', self.interface, '-j', 'DROP'
+            ],
+            [action, 'OUTPUT'] + position + [
+                '-o', self.interface, '-j', 'DROP'
+            ]
+        ]
+
+    def get_nflog_args(self):
+        """
+        The function for generating the NFLOG target options. Defaults are
+        omitted.
+
+        Returns:
+            List: NFLOG target options.
+        """
+
+        args = []
+        if str(self.nflog_group) != '0':
+
+            args += ['--nflog-group', str(self.nflog_group)]
+
+        # Copy only the first nflog_size bytes of each packet.
+        if self.nflog_size:
+
+            args += ['--nflog-size', str(self.nflog_size)]
+
+        # Batch nflog_threshold packets per netlink message.
+        if str(self.nflog_threshold) != '1':
+
+            args += ['--nflog-threshold', str(self.nflog_threshold)]
+
+        return args
+
+    def get_rules(self):
+        """
+        The function for generating the iptables statements for the SINKHOLE
+        chain and the INPUT jump. The statements are ordered for a single
+        iptables-restore transaction.
+
+        Returns:
+            List: iptables argument lists for the filter table.
+        """
+
+        # Create a new iptables chain for logging
+        rules = [':SINKHOLE - [0:0]']
+
+        # Exclude IPs/CIDRs from logging (scanners, monitoring, pen-testers,
+        # etc):
+        if self.srcexclude_ipset:
+
+            # A single set lookup, regardless of the number of exclusions.
+            rules.append([
+                '-A', 'SINKHOLE',
+                '-m', 'set', '--match-set', self.ipset.name, 'src',
+                '-j', 'RETURN'
+            ])
+
+        else:
+
+            for addr in self.get_exclusions():
+
+                rules.append(['-A', 'SINKHOLE', '-s', addr, '-j', 'RETURN'])
+
+        # Tell the chain to log and use the prefix self.log_prefix:
+        rules.append([
+            '-A', 'SINKHOLE',
+            '-j', 'LOG',
+            '--log-prefix', self.log_prefix
+        ])
+
+        # Tell the chain to also log to netfilter (for packet capture):
+        rules.append(['-A', 'SINKHOLE', '-j', 'NFLOG'] + self.get_nflog_args())
+
+        # Tell the chain to trigger on hashlimit and protocol/port settings
+        tmp_arr = [
+            '-I', 'INPUT', '1',
+            '-i', self.interface,
+            '-d', self.interface_addr
+        ]
+
+        # if --protocol filtered, set the protocol
+        if self.protocol != 'all':
+
+            tmp_arr += ['-p', self.protocol]
+
+        tmp_arr += [
+            '-m', 'hashlimit',
+            '--hashlimit', self.hashlimit,
+            '--hashlimit-burst', self.hashlimitburst,
+            '--hashlimit-mode', self.hashlimitmode,
+            '--hashlimit-name', 'sinkhole',
+            '--hashlimit-htable-expire', self.hashlimitexpire
+        ]
+
+        # Hash table sizing, if not the kernel defaults
+        for option, value in (
+                ('--hashlimit-htable-size', self.hashlimit_htable_size),
+                ('--hashlimit-htable-max', self.hashlimit_htable_max),
+                ('--hashlimit-htable-gcinterval',
+                 self.hashlimit_htable_gcinterval)):
+
+            if value:
+
+                tmp_arr += [option, str(value)]
+
+        # if --protocol filtered, set mode to multiport and set destination
+        # port if provided and applicable to the protocol(s)
+        if self.protocol != 'all' and self.dport != '0:65535':
+
+            tmp_arr += ['-m', 'multiport', '--dports', self.dport]
+
+        rules.append(tmp_arr + ['-j', 'SINKHOLE'])
+
+        return rules
+
+    def get_raw_rules(self):
+        """
+        The function for generating the raw table statements for notrack
+        and rawdrop. Traffic on the interface jumps to a raw table SINKHOLE
+        chain, before connection tracking.
+
+        Returns:
+            List: iptables argument lists for the raw table, or an empty list
+                if neither notrack nor rawdrop is enabled.
+        """
+
+        if not (self.notrack or self.rawdrop):
+
+            return []
+
+        rules = [':SINKHOLE - [0:0]']
+        notrack = ['-j', 'NOTRACK'] if self.notrack else ['-j', 'RETURN']
+
+        if self.rawdrop:
+
+            # Excluded sources are never logged.
+            if self.srcexclude_ipset:
+
+                rules.append([
+                    '-A', 'SINKHOLE',
+                    '-m', 'set', '--match-set', self.ipset.name, 'src',
+                    '-j', 'DROP'
+                ])
+
+            else:
+
+                for addr in self.get_exclusions():
+
+                    rules.append(['-A', 'SINKHOLE', '-s', addr, '-j', 'DROP'])
+
+        if self.rawdrop and self.protocol != 'all':
+
+            # Only the logged protocol/ports continue to the filter table.
+            tmp_arr = ['-A', 'SINKHOLE', '-p', self.protocol]
+            if self.dport != '0:65535':
+
+                tmp_arr += ['-m', 'multiport', '--dports', self.dport]
+
+            rules.append(tmp_arr + notrack)
+            rules.append(['-A', 'SINKHOLE', '-j', 'DROP'])
+
+        elif self.notrack:
+
+            rules.append(['-A', 'SINKHOLE'] + notrack)
+
+        rules.append(['-I', 'PREROUTING', '1', '-i', self.interface,
+                      '-j', 'SINKHOLE'])
+
+        return rules
+
+    def apply_rules(self, tables=None):
+        """
+        The function for committing iptables statements in a single
+        iptables-restore --noflush transaction. Either every statement is
+        applied, or none are.
+
+        Args:
+            tables: List of tuples (table, statements). See
+                build_restore_payload().
+
+        Raises:
+            IPTablesError: iptables-restore rejected the payload.
+        """
+
+        payload = build_restore_payload(tables)
+
+        # The cached rulesets are stale once anything is written.
+        self.rulesets = {}
 
-log = logging.getLogger(__name__)
+        for line in payload.splitlines():
 
+            log.info('Writing: {0}'.format(line))
 
-class IPTablesSinkhole:
-    """
-    The class for managing sinkhole configuration within iptables.
+        cmd = ['iptables-restore', '--noflush']
+        try:
 
-    Args:
-        interface: The secondary network interface dedicated to sinkhole
-            traffic.
-            Warning: Do not accidentally set this to your primary interface.
-            It will drop all traffic, and kill your remote access.
-        interface_addr: The IP address assigned to interface.
-        log_prefix: Prefix for syslog messages.
-        protocol: The protocol(s) to log (all traffic will still be dropped).
-            Accepts a comma separated string of protocols
-            (tcp,udp,udplite,icmp,esp,ah,sctp) or all.
-        dport: The destination port(s) to log (for applicable protocols).
-            Range should be in the format startport:endport or 0,1,2,3,n..
-        hashlimit: Set the hashlimit rate. Hashlimit is used to tune the
-            amount of events logged. See the iptables-extensions docs:
-            http://ipset.netfilter.org/iptables-extensions.man.html
-        hashlimitmode: Set the hashlimit mode, a comma separated string of
-            options (srcip,srcport,dstip,dstport). More options here results
-            in more logs generated.
-        hashlimitburst: Maximum initial number of packets to match.
-        hashlimitexpire: Number of milliseconds to keep entries in the hash
-            table.
-        srcexclude: Exclude a comma separated string of source IPs/CIDRs from
-            logging.
-    """
+            out, err = popen_wrapper(cmd_arr=cmd, raise_err=True, sudo=True,
+                                     stdin=payload)
 
-    def __init__(self, interface=None, interface_addr=None,
-                 log_prefix='"[nfsinkhole] "',
-                 protocol='all', dport='0:65535',
-                 hashlimit='1/h', hashlimitmode='srcip,dstip,dstport',
-                 hashlimitburst='1', hashlimitexpire='1800000',
-                 srcexclude='127.0.0.1'
-                 ):
+        except SubprocessError as e:  # pragma: no cover
 
-        # TODO: add arg checks across all classes
-        self.interface = interface
-        self.interface_addr = interface_addr
-        self.log_prefix = log_prefix
-        self.protocol = protocol
-        self.dport = dport
-        self.hashlimit = hashlimit
-        self.hashlimitmode = hashlimitmode
-        self.hashlimitburst = hashlimitburst
-        self.hashlimitexpire = hashlimitexpire
-        self.srcexclude = srcexclude
+            raise IPTablesError(e)
 
-    def list_existing_rules(self, filter_io_drop=False):
+        # iptables-restore is silent on success; stderr is piped to stdout.
+        if out:  # pragma: no cover
+
+            raise IPTablesError('Error encountered when running process '
+                                '"{0}":\n{1}'.format(
+                                    ' '.join(cmd),
+                                    out.decode('ascii', 'ignore')))
+
+    def get_counters(self, zero=False):
         """
-        The function for retrieving current iptables rules related to
-        nfsinkhole.
+        The function for sampling the packet and byte counters of the
+        nfsinkhole rules (INPUT jump, SINKHOLE chain, and interface DROP
+        rules). Deltas are relative to the previous sample taken by this
+        object.
 
         Args:
-            filter_io_drop: Boolean for only showing the DROP rules for INPUT
-                and OUTPUT. These are not shown by default. This exists to
-                avoid allowing packets on the interface if the service is down.
-                If installed, the interface always drops all traffic regardless
-                of the service state.
+            zero: Boolean for zeroing the counters as they are read. Each
+                chain holding nfsinkhole rules (INPUT, OUTPUT, SINKHOLE) is
+                listed and zeroed in one iptables -S -v -Z call, so no packets
+                are lost between the read and the zero. This zeroes the other
+                rules in INPUT and OUTPUT too.
 
         Returns:
-            List: Matching sinkhole lines returned by iptables -S.
+            Dictionary: See sample_counters().
 
         Raises:
             IPTablesError: A Linux process had an error (stderr).
         """
 
-        # Get list summary of iptables rules
-        cmd = ['iptables', '-S']
+        if zero:
 
-        existing = []
+            cmds = [['iptables', '-t', 'filter', '-S', chain, '-v', '-Z']
+                    for chain in ('INPUT', 'OUTPUT', 'SINKHOLE')]
 
-        # Get all of the iptables rules
-        try:
+        else:
 
-            out, err = popen_wrapper(cmd, sudo=True)
+            cmds = [['iptables-save', '-c', '-t', 'filter']]
 
-        except OSError as e:  # pragma: no cover
+        lines = []
+        for cmd in cmds:
 
-            raise IPTablesError('Error encountered when running process "{0}":'
-                                '\n{1}'.format(' '.join(cmd), e))
+            try:
 
-        # If any errors, iterate them and write to log, then raise
-        # IPTablesError.
-        if err:  # pragma: no cover
+                out, err = popen_wrapper(cmd, raise_err=True, sudo=True)
 
-            arr = err.splitlines()
-            raise IPTablesError('Error encountered when running process "{0}":'
-                                '\n{1}'.format(' '.join(cmd), '\n'.join(arr)))
+            except SubprocessError as e:  # pragma: no cover
 
-        # Iterate the iptables rules, only grabbing nfsinkhole related rules.
-        arr = out.splitlines()
-        for line in arr:
-            tmp_line = line.decode('ascii', 'ignore')
-            if ('SINKHOLE' in tmp_line
-                ) or filter_io_drop and tmp_line.strip() in [
-                    '-A INPUT -i {0} -j DROP'.format(self.interface),
-                    '-A OUTPUT -o {0} -j DROP'.format(self.interface)
-            ]:
-                existing.append(tmp_line.strip())
+                raise IPTablesError(e)
 
-        return existing
+            lines += out.splitlines()
 
-    def create_rules(self):
+        return self.sample_counters(IPTablesRuleset(lines), zeroed=zero)
+
+    def sample_counters(self, ruleset=None, zeroed=False):
         """
-        The function for writing iptables rules related to nfsinkhole.
+        The function for extracting the nfsinkhole rule counters from a
+        ruleset read with counters (see get_counters()).
+
+        Args:
+            ruleset: The IPTablesRuleset (iptables-save -c or iptables -S -v
+                output).
+            zeroed: Boolean for whether the counters were zeroed as they were
+                read; the next deltas start from zero.
+
+        Returns:
+            Dictionary:
+
+            :timestamp (Float): The sample time (epoch seconds).
+            :interval (Float): Seconds since the previous sample, or None.
+            :input (List): Counters for the INPUT jumps to SINKHOLE.
+            :sinkhole (List): Counters for the SINKHOLE chain rules (RETURN,
+                LOG, NFLOG).
+            :drop (List): Counters for the interface INPUT/OUTPUT DROP rules.
+            :summary (Dictionary): Packet deltas for total (INPUT DROP),
+                logged (INPUT jump, passed hashlimit), suppressed (total -
+                logged), excluded (srcexclude RETURN) and nflog (NFLOG).
+
+            Each counter entry is a dictionary with the keys rule, chain,
+            target, packets, bytes, packets_delta, and bytes_delta.
         """
 
-        log.info('Checking for existing iptables rules.')
-        existing = self.list_existing_rules()
+        now = time.time()
 
-        # Existing sinkhole related iptables lines found, can't create.
-        if len(existing) > 0:
+        last, last_time = self.counters or ({}, None)
 
-            raise IPTablesExists('Existing iptables rules found for '
-                                 'nfsinkhole:\n{0}'
-                                 ''.format('\n'.join(existing)))
+        drop_lines = (
+            '-A INPUT -i {0} -j DROP'.format(self.interface),
+            '-A OUTPUT -o {0} -j DROP'.format(self.interface)
+        )
 
-        log.info('Writing iptables config')
+        groups = (
+            ('input', ruleset.find(target='SINKHOLE')),
+            ('sinkhole', ruleset.find(chain='SINKHOLE')),
+            ('drop', [r for r in ruleset.find(target='DROP')
+                      if r.line in drop_lines])
+        )
 
-        # Create a new iptables chain for logging
-        tmp_arr = ['iptables', '-N', 'SINKHOLE']
+        ret = {
+            'timestamp': now,
+            'interval': (now - last_time) if last_time else None,
+            'summary': {}
+        }
+        current = {}
+        for name, rules in groups:
 
-        log.info('Writing: {0}'.format(' '.join(tmp_arr)))
-        popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+            entries = []
+            for rule in rules:
 
-        # Exclude IPs/CIDRs from logging (scanners, monitoring, pen-testers,
-        # etc):
-        for addr in self.srcexclude.split(','):
+                packets, num_bytes = rule.packets or 0, rule.bytes or 0
+                last_packets, last_bytes = last.get(rule.line, (0, 0))
 
-            tmp_arr = [
-                'iptables',
-                '-A', 'SINKHOLE',
-                '-s', addr,
-                '-j', 'RETURN'
-            ]
+                # Counters lower than the last sample were zeroed elsewhere.
+                if packets < last_packets or num_bytes < last_bytes:
 
-            log.info('Writing: {0}'.format(' '.join(tmp_arr)))
-            popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+                    last_packets, last_bytes = 0, 0
 
-        # Tell the chain to log and use the prefix self.log_prefix:
-        tmp_arr = [
-            'iptables',
-            '-A', 'SINKHOLE',
-            '-j', 'LOG',
-            '--log-prefix', self.log_prefix
-        ]
+                entries.append({
+                    'rule': rule.line,
+                    'chain': rule.chain,
+                    'target': rule.target,
+                    'packets': packets,
+                    'bytes': num_bytes,
+                    'packets_delta': packets - last_packets,
+                    'bytes_delta': num_bytes - last_bytes
+                })
+                current[rule.line] = (packets, num_bytes)
 
-        log.info('Writing: {0}'.format(' '.join(tmp_arr)))
-        popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+            ret[name] = entries
 
-        # Tell the chain to also log to netfilter (for packet capture):
-        tmp_arr = ['iptables', '-A', 'SINKHOLE',
-                   '-j', 'NFLOG']
+        def _sum(entries, chain=None, target=None):
 
-        log.info('Writing: {0}'.format(' '.join(tmp_arr)))
-        popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+            return sum([e['packets_delta'] for e in entries if (
+                chain is None or e['chain'] == chain) and (
+                target is None or e['target'] == target)])
 
-        # Tell the chain to trigger on hashlimit and protocol/port settings
-        tmp_arr = [
-            'iptables',
-            '-i', self.interface,
-            '-d', self.interface_addr,
-            '-j', 'SINKHOLE',
-            '-m', 'hashlimit',
-            '--hashlimit', self.hashlimit,
-            '--hashlimit-burst', self.hashlimitburst,
-            '--hashlimit-mode', self.hashlimitmode,
-            '--hashlimit-name', 'sinkhole',
-            '--hashlimit-htable-expire', self.hashlimitexpire,
-            '-I', 'INPUT', '1'
-        ]
+        total = _sum(ret['drop'], chain='INPUT')
+        logged = _sum(ret['input'])
+        ret['summary'] = {
+            'total': total,
+            'logged': logged,
+            'suppressed': max(total - logged, 0),
+            'excluded': _sum(ret['sinkhole'], target='RETURN'),
+            'nflog': _sum(ret['sinkhole'], target='NFLOG')
+        }
 
-        # if --protocol filtered, set mode to multiport with protocol, and
-        # set destination port if provided and applicable to the protocol(s)
-        if self.protocol != 'all':
+        if zeroed:
 
-            tmp_arr += ['-m', 'multiport', '--protocol', self.protocol]
+            current = dict([(k, (0, 0)) for k in current])
 
-            if self.dport != '0:65535':
-                tmp_arr += ['--dport', self.dport]
+        self.counters = (current, now)
+
+        return ret
+
+    def get_config(self):
+        """
+        The function for retrieving the sinkhole configuration that
+        determines the generated rules.
+
+        Returns:
+            Dictionary: The configuration.
+        """
+
+        return {
+            'interface': self.interface,
+            'interface_addr': self.interface_addr,
+            'log_prefix': self.log_prefix,
+            'protocol': self.protocol,
+            'dport': self.dport,
+            'hashlimit': self.hashlimit,
+            'hashlimitmode': self.hashlimitmode,
+            'hashlimitburst': self.hashlimitburst,
+            'hashlimitexpire': self.hashlimitexpire,
+            'hashlimit_htable_size': self.hashlimit_htable_size,
+            'hashlimit_htable_max': self.hashlimit_htable_max,
+            'hashlimit_htable_gcinterval': self.hashlimit_htable_gcinterval,
+            'srcexclude': ','.join(self.get_exclusions()),
+            'srcexclude_ipset': self.srcexclude_ipset,
+            'notrack': self.notrack,
+            'rawdrop': self.rawdrop,
+            'nflog_group': self.nflog_group,
+            'nflog_size': self.nflog_size,
+            'nflog_threshold': self.nflog_threshold
+        }
+
+    def get_reconcile_stmts(self, ruleset=None, desired=None,
+                            parent='INPUT'):
+        """
+        The function for generating the statements that change the live
+        SINKHOLE chain and its jump into the desired rules, leaving unchanged
+        rules in place.
+
+        Args:
+            ruleset: The live IPTablesRuleset for the table.
+            desired: The desired rules (get_rules() or get_raw_rules()).
+            parent: The built-in chain that jumps to SINKHOLE.
+
+        Returns:
+            List: iptables-restore statements, empty if nothing changed.
+        """
+
+        stmts = []
+
+        # Only declare the chain if it is missing; declaring an existing
+        # chain with --noflush flushes it.
+        if 'SINKHOLE' not in ruleset.chains:
+
+            stmts.append(':SINKHOLE - [0:0]')
 
-        log.info('Writing: {0}'.format(' '.join(tmp_arr)))
-        popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+        chain = []
+        jump = None
+        for stmt in desired:
+
+            if isinstance(stmt, list) and stmt[:2] == ['-A', 'SINKHOLE']:
+
+                line = ' '.join([quote_restore_arg(a) for a in stmt])
+                chain.append((stmt, IPTablesRule(line).get_key()))
+
+            elif isinstance(stmt, list) and stmt[1] == parent:
+
+                line = ' '.join([quote_restore_arg(a) for a in stmt])
+                jump = (stmt, IPTablesRule(line).get_key())
+
+        desired_keys = [key for stmt, key in chain]
+
+        # Delete stale rules by spec.
+        live = []
+        for rule in ruleset.find(chain='SINKHOLE'):
+
+            key = rule.get_key()
+            if key in desired_keys:
+
+                live.append(key)
+
+            else:
+
+                stmts.append('-D' + rule.line[2:])
+
+        # Insert missing rules, and move misplaced rules, by position.
+        for i, (stmt, key) in enumerate(chain):
+
+            if i < len(live) and live[i] == key:
+
+                continue
+
+            if key in live[i:]:
+
+                j = live.index(key, i)
+                stmts.append(['-D', 'SINKHOLE', str(j + 1)])
+                del live[j]
+
+            stmts.append(['-I', 'SINKHOLE', str(i + 1)] + stmt[2:])
+            live.insert(i, key)
+
+        # Delete duplicates beyond the desired rules.
+        for j in range(len(live) - 1, len(chain) - 1, -1):
+
+            stmts.append(['-D', 'SINKHOLE', str(j + 1)])
+
+        # Replace the jump only if it changed. The new jump is inserted
+        # before the old one is deleted, in the same transaction, so the
+        # hashlimit table (referenced by name) is kept.
+        live_jumps = ruleset.find(chain=parent, target='SINKHOLE')
+        keep = [r for r in live_jumps if r.get_key() == jump[1]][:1]
+
+        if not keep:
+
+            stmts.append(jump[0])
+
+        for rule in live_jumps:
+
+            if rule not in keep:
+
+                stmts.append('-D' + rule.line[2:])
+
+        return stmts
+
+    def reconcile(self, force=False):
+        """
+        The function for incrementally updating the live iptables rules to
+        the current configuration. Only changed rules are written, in a
+        single iptables-restore transaction; unchanged rules, and the
+        hashlimit table, are kept. The hashlimit table is recreated if its
+        settings changed. A hash of the applied configuration is
+        stored in state_path; if it matches, the SINKHOLE chain exists, and
+        the live exclusions match the configuration (runtime exclusion
+        changes are reverted), nothing is done.
+
+        Args:
+            force: Boolean for ignoring the stored configuration hash.
+
+        Returns:
+            Integer: The number of statements applied.
+        """
+
+        config_hash = get_config_hash(self.get_config())
+        state = read_state_file(self.state_path) or {}
+
+        ruleset = self.get_ruleset()
+
+        if (not force and state.get('hash') == config_hash and
+                'SINKHOLE' in ruleset.chains and
+                not self.exclusions_changed()):
+
+            log.info('iptables config unchanged, nothing to reconcile.')
+            return 0
+
+        log.info('Reconciling iptables config')
+
+        raw_ruleset = self.get_ruleset(table='raw')
+        previous = [r.line for r in ruleset.rules + raw_ruleset.rules]
+
+        # The set must exist before a rule can reference it.
+        if self.srcexclude_ipset:
+
+            self.ipset.sync(self.get_exclusions())
+
+        # The kernel keeps a hashlimit table, and its settings (rate, mode,
+        # size, etc.), for as long as any rule references its name, even
+        # within one restore transaction. If the settings changed, remove the
+        # old jump first so the table is recreated.
+        jump = self.get_rules()[-1]
+        hashlimit = IPTablesRule(' '.join([quote_restore_arg(a) for a in jump])
+                                 ).get_match('hashlimit')
+        stale = [r.line for r in ruleset.find('INPUT', 'SINKHOLE')
+                 if r.get_match('hashlimit') != hashlimit]
+        if stale:
+
+            log.info('hashlimit settings changed, recreating the sinkhole '
+                     'hashlimit table')
+            self.apply_rules([('filter', ['-D' + line[2:] for line in stale])])
+            ruleset = self.get_ruleset()
+
+        tables = [('filter', self.get_reconcile_stmts(
+            ruleset, self.get_rules(), 'INPUT'))]
+
+        raw_rules = self.get_raw_rules()
+        if raw_rules:
+
+            tables.append(('raw', self.get_reconcile_stmts(
+                raw_ruleset, raw_rules, 'PREROUTING')))
+
+        else:
+
+            existing_raw = self.list_existing_rules(table='raw')
+            tables.append(('raw', self.get_delete_stmts(existing_raw)))
+
+        tables = [(table, stmts) for table, stmts in tables if stmts]
+        count = sum([len(stmts) for table, stmts in tables]) + len(stale)
+
+        if tables:
+
+            self.apply_rules(tables)
+
+        # Destroy the set if it is no longer used.
+        match_set = '--match-set {0} '.format(self.ipset.name)
+        if not self.srcexclude_ipset and [
+                line for line in previous if match_set in line]:
+
+            self.ipset.destroy()
+
+        write_state_file(self.state_path, {
+            'hash': config_hash,
+            'config': self.get_config(),
+            'timestamp': time.time()
+        })
+
+        log.info('Reconciled iptables config ({0} statements)'.format(count))
+
+        return count
+
+    def create_rules(self):
+        """
+        The function for writing iptables rules related to nfsinkhole.
+        """
+
+        log.info('Checking for existing iptables rules.')
+        existing = self.list_existing_rules()
+        raw_rules = self.get_raw_rules()
+        if raw_rules:
+
+            existing += self.list_existing_rules(table='raw')
+
+        # Existing sinkhole related iptables lines found, can't create.
+        if len(existing) > 0:
+
+            raise IPTablesExists('Existing iptables rules found for '
+                                 'nfsinkhole:\n{0}'
+                                 ''.format('\n'.join(existing)))
+
+        # The set must exist before a rule can reference it.
+        if self.srcexclude_ipset:
+
+            self.ipset.create(self.get_exclusions())
+
+        log.info('Writing iptables config')
+
+        tables = [('filter', self.get_rules())]
+        if raw_rules:
+
+            tables.append(('raw', raw_rules))
+
+        self.apply_rules(tables)
 
     def create_drop_rule(self):
         """
@@ -241,33 +1567,46 @@ class IPTablesSinkhole:
         log.info('Writing iptables DROP config')
 
         # Create rules to drop all I/O traffic:
-        tmp_arr = [
-            'iptables',
-            '-i', self.interface,
-            '-j', 'DROP',
-            '-I', 'INPUT', '1'
-        ]
+        self.apply_rules([('filter', self.get_drop_rules('-I'))])
 
-        log.info('Writing: {0}'.format(' '.join(tmp_arr)))
-        popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+    def get_delete_stmts(self, existing=None):
+        """
+        The function for generating the statements that delete existing
+        nfsinkhole rules (not the interface DROP rules) from a table.
 
-        tmp_arr = [
-            'iptables',
-            '-o', self.interface,
-            '-j', 'DROP',
-            '-I', 'OUTPUT', '1'
-        ]
+        Args:
+            existing: List of existing rule lines (list_existing_rules()).
 
-        log.info('Writing: {0}'.format(' '.join(tmp_arr)))
+        Returns:
+            List: iptables-restore lines.
+        """
 
-        # TODO: replicate exception handling to other subprocess calls
-        try:
+        # Iterate all of the active sinkhole related iptables lines
+        flush = False
+        stmts = []
+        for line in existing:
 
-            popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+            if line.startswith('-A SINKHOLE') or line == '-N SINKHOLE':
 
-        except SubprocessError as e:  # pragma: no cover
+                # Don't try to delete the SINKHOLE chain yet, it needs to be
+                # empty. Set flush to clear it after this loop.
+                flush = True
 
-            raise IPTablesError(e)
+            elif line not in (
+                '-A INPUT -i {0} -j DROP'.format(self.interface),
+                '-A OUTPUT -o {0} -j DROP'.format(self.interface)
+            ):
+
+                # Delete a single line (not the SINKHOLE chain itself).
+                stmts.append('-D' + line[2:])
+
+        # The SINKHOLE chain was detected. Flush it, then delete it, in the
+        # same transaction as the jumps that reference it.
+        if flush:
+
+            stmts += ['-F SINKHOLE', '-X SINKHOLE']
+
+        return stmts
 
     def delete_rules(self):
         """
@@ -277,53 +1616,39 @@ class IPTablesSinkhole:
         log.info('Checking for existing iptables rules.')
         existing = self.list_existing_rules()
 
+        # The raw table is always checked; the rules may have been created
+        # with notrack/rawdrop.
+        existing_raw = self.list_existing_rules(table='raw')
+
         # No sinkhole related iptables lines found.
-        if len(existing) == 0:
+        if len(existing) + len(existing_raw) == 0:
 
             raise IPTablesNotExists('No existing rules found.')
 
         log.info('Deleting iptables config (only what was created)')
 
-        # Iterate all of the active sinkhole related iptables lines
-        flush = False
-        for line in existing:
-
-            if '-A SINKHOLE' in line or line == '-N SINKHOLE':
-
-                # Don't try to delete the SINKHOLE chain yet, it needs to be
-                # empty. Set flush to clear it after this loop.
-                flush = True
-
-            elif line not in (
-                '-A INPUT -i {0} -j DROP'.format(self.interface),
-                '-A OUTPUT -o {0} -j DROP'.format(self.interface)
-            ):
-
-                # Delete a single line (not the SINKHOLE chain itself).
-                stmt = line.replace('-A', '-D').strip().split(' ')
-                tmp_arr = ['iptables'] + stmt
+        tables = []
+        for table, lines in (('filter', existing), ('raw', existing_raw)):
 
-                log.info('Deleting: {0}'.format(' '.join(tmp_arr)))
-                popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+            if lines:
 
-        # The SINKHOLE chain was detected. Remove it.
-        if flush:
+                tables.append((table, self.get_delete_stmts(lines)))
 
-            # All lines in the SINKHOLE chain should have been flushed already,
-            # but run a flush to be sure.
-            tmp_arr = ['iptables', '-F', 'SINKHOLE']
+        self.apply_rules(tables)
 
-            log.info('Flushing: {0}'.format(' '.join(tmp_arr)))
-            popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+        # The rules applied by reconcile() are gone.
+        delete_state_file(self.state_path)
 
-            # Now that the SINKHOLE chain has been flushed, we can delete it.
-            tmp_arr = ['iptables', '-X', 'SINKHOLE']
+        # The set can only be destroyed once no rule references it. Check the
+        # removed rules rather than self.srcexclude_ipset, the rules may have
+        # been created with different arguments.
+        match_set = '--match-set {0} '.format(self.ipset.name)
+        if [line for line in existing + existing_raw if match_set in line]:
 
-            log.info('Deleting: {0}'.format(' '.join(tmp_arr)))
-            popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+            self.ipset.destroy()
 
         # Return a list of matching lines.
-        return len(existing)
+        return len(existing) + len(existing_raw)
 
     def delete_drop_rule(self):
         """
@@ -340,20 +1665,20 @@ class IPTablesSinkhole:
 
         log.info('Deleting iptables DROP config.')
 
-        count = 0
+        stmts = []
         for line in existing:
 
             if line in (
                     '-A INPUT -i {0} -j DROP'.format(self.interface),
                     '-A OUTPUT -o {0} -j DROP'.format(self.interface)
             ):
-                count += 1
+
                 # Delete a single line (not the SINKHOLE chain itself).
-                stmt = line.replace('-A', '-D').split(' ')
-                tmp_arr = ['iptables'] + stmt
+                stmts.append('-D' + line[2:])
 
-                log.info('Deleting: {0}'.format(' '.join(tmp_arr)))
-                popen_wrapper(cmd_arr=tmp_arr, raise_err=True, sudo=True)
+        if stmts:
+
+            self.apply_rules([('filter', stmts)])
 
         # Return the number of matching lines.
-        return count
+        return len(stmts)
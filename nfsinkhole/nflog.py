@@ -0,0 +1,548 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from .exceptions import NFLogError
+import errno
+import logging
+import os
+import socket
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+# Netlink/nfnetlink_log constants (linux/netlink.h, linux/netfilter/
+# nfnetlink.h, linux/netfilter/nfnetlink_log.h).
+NETLINK_NETFILTER = 12
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NFNL_SUBSYS_ULOG = 4
+NFULNL_MSG_PACKET = (NFNL_SUBSYS_ULOG << 8) | 0
+NFULNL_MSG_CONFIG = (NFNL_SUBSYS_ULOG << 8) | 1
+NFNETLINK_V0 = 0
+
+# Config commands and attributes.
+NFULNL_CFG_CMD_BIND = 1
+NFULNL_CFG_CMD_UNBIND = 2
+NFULNL_CFG_CMD_PF_BIND = 3
+NFULNL_CFG_CMD_PF_UNBIND = 4
+NFULA_CFG_CMD = 1
+NFULA_CFG_MODE = 2
+NFULA_CFG_NLBUFSIZ = 3
+NFULA_CFG_TIMEOUT = 4
+NFULA_CFG_QTHRESH = 5
+NFULA_CFG_FLAGS = 6
+NFULNL_COPY_PACKET = 2
+NFULNL_CFG_F_SEQ = 0x0001
+
+# Packet attributes.
+NFULA_PACKET_HDR = 1
+NFULA_TIMESTAMP = 3
+NFULA_IFINDEX_INDEV = 4
+NFULA_PAYLOAD = 9
+NFULA_PREFIX = 10
+NFULA_SEQ = 12
+
+# Attribute type flags (NLA_F_NESTED, NLA_F_NET_BYTEORDER).
+NLA_TYPE_MASK = 0x3FFF
+
+# Not in the socket module.
+SOL_NETLINK = 270
+SO_RCVBUFFORCE = 33
+
+# nlmsghdr (host byte order), nfgenmsg (res_id is big endian), nlattr.
+NLMSGHDR = struct.Struct('=IHHII')
+NFGENMSG = struct.Struct('!BBH')
+NLATTR = struct.Struct('=HH')
+NLMSG_ERR = struct.Struct('=i')
+BE16 = struct.Struct('!H')
+BE32 = struct.Struct('!I')
+BE64X2 = struct.Struct('!QQ')
+CFG_MODE = struct.Struct('!IBB')
+
+# The kernel nlbufsiz maximum; packets are batched into messages this size.
+NLBUFSIZ = 131072
+
+# The receive buffer (bytes) requested for the socket.
+RCVBUF_SIZE = 8388608
+
+
+def align(length=0):
+    """
+    The function for aligning a netlink length to 4 bytes.
+
+    Args:
+        length: The length.
+
+    Returns:
+        Integer: The aligned length.
+    """
+
+    return (length + 3) & ~3
+
+
+def get_attr(attr_type=0, data=b''):
+    """
+    The function for encoding a netlink attribute (padded).
+
+    Args:
+        attr_type: The attribute type.
+        data: The attribute payload (bytes).
+
+    Returns:
+        Bytes: The attribute.
+    """
+
+    length = NLATTR.size + len(data)
+
+    return (NLATTR.pack(length, attr_type) + data +
+            b'\x00' * (align(length) - length))
+
+
+def get_config_message(group=0, family=socket.AF_UNSPEC, attrs=None,
+                       seq=0):
+    """
+    The function for encoding an nfnetlink_log config request (with ack).
+
+    Args:
+        group: The NFLOG group (nfgenmsg res_id).
+        family: The protocol family (nfgenmsg family).
+        attrs: List of encoded attributes (see get_attr()).
+        seq: The message sequence number.
+
+    Returns:
+        Bytes: The netlink message.
+    """
+
+    payload = NFGENMSG.pack(family, NFNETLINK_V0, group) + b''.join(
+        attrs or [])
+
+    return NLMSGHDR.pack(NLMSGHDR.size + len(payload), NFULNL_MSG_CONFIG,
+                         NLM_F_REQUEST | NLM_F_ACK, seq, 0) + payload
+
+
+def parse_packets(view=None, length=0):
+    """
+    The function for decoding the packets in a (multipart) netlink receive
+    buffer. Payloads are memoryview slices of the buffer (zero-copy); they
+    are only valid until the buffer is reused.
+
+    Args:
+        view: The memoryview of the receive buffer.
+        length: The number of bytes received.
+
+    Returns:
+        List: Packet tuples (timestamp, payload, prefix, indev, seq);
+            timestamp is UNIX epoch seconds (float) or None, payload is a
+            memoryview of the IP packet, prefix is the rule --nflog-prefix
+            (bytes), indev is the input ifindex, seq is the group sequence
+            number or None. Error (ack) messages are returned as
+            (None, None, None, None, -errno) tuples.
+    """
+
+    packets = []
+    unpack_hdr = NLMSGHDR.unpack_from
+    unpack_attr = NLATTR.unpack_from
+
+    offset = 0
+    while offset + NLMSGHDR.size <= length:
+
+        msg_len, msg_type, flags, msg_seq, pid = unpack_hdr(view, offset)
+        if msg_len < NLMSGHDR.size or offset + msg_len > length:
+
+            break
+
+        end = offset + msg_len
+
+        if msg_type == NFULNL_MSG_PACKET:
+
+            timestamp = None
+            payload = None
+            prefix = None
+            indev = None
+            seq = None
+
+            pos = offset + NLMSGHDR.size + NFGENMSG.size
+            while pos + NLATTR.size <= end:
+
+                attr_len, attr_type = unpack_attr(view, pos)
+                if attr_len < NLATTR.size:
+
+                    break
+
+                data = pos + NLATTR.size
+                attr_type &= NLA_TYPE_MASK
+
+                if attr_type == NFULA_PAYLOAD:
+
+                    payload = view[data:pos + attr_len]
+
+                elif attr_type == NFULA_TIMESTAMP:
+
+                    sec, usec = BE64X2.unpack_from(view, data)
+                    timestamp = sec + usec / 1000000.0
+
+                elif attr_type == NFULA_PREFIX:
+
+                    prefix = view[data:pos + attr_len].tobytes().rstrip(
+                        b'\x00')
+
+                elif attr_type == NFULA_IFINDEX_INDEV:
+
+                    indev = BE32.unpack_from(view, data)[0]
+
+                elif attr_type == NFULA_SEQ:
+
+                    seq = BE32.unpack_from(view, data)[0]
+
+                pos += align(attr_len)
+
+            if payload is not None:
+
+                packets.append((timestamp, payload, prefix, indev, seq))
+
+        elif msg_type == NLMSG_ERROR:
+
+            error = NLMSG_ERR.unpack_from(view, offset + NLMSGHDR.size)[0]
+            packets.append((None, None, None, None, error))
+
+        offset += align(msg_len)
+
+    return packets
+
+
+class NFLog:
+    """
+    The class for receiving packets from an NFLOG group over an
+    AF_NETLINK NFNETLINK_LOG socket, in process (no tcpdump). Packets are
+    received in batches (multipart messages of up to nlbufsiz bytes) into a
+    single reused buffer, and decoded into memoryview slices of it.
+    Requires root (CAP_NET_ADMIN).
+
+    Drops are counted two ways: ENOBUFS (the socket receive buffer
+    overflowed) and gaps in the group sequence numbers.
+
+    Args:
+        group: The NFLOG group (nflog_group).
+        copy_range: The number of bytes of each packet to copy (the rule
+            --nflog-size takes precedence).
+        rcvbuf: The socket receive buffer size (bytes). SO_RCVBUFFORCE is
+            tried first, so net.core.rmem_max does not apply as root.
+        nlbufsiz: The kernel batch (netlink message) buffer size.
+        qthreshold: Optional number of packets batched per message (the
+            rule --nflog-threshold takes precedence).
+        timeout: Optional maximum time (1/100 s) a partial batch is held in
+            the kernel.
+    """
+
+    def __init__(self, group=0, copy_range=0xFFFF, rcvbuf=RCVBUF_SIZE,
+                 nlbufsiz=NLBUFSIZ, qthreshold=None, timeout=None):
+
+        self.group = int(group)
+        self.copy_range = copy_range
+        self.rcvbuf = rcvbuf
+        self.nlbufsiz = nlbufsiz
+        self.qthreshold = qthreshold
+        self.timeout = timeout
+        self.sock = None
+        self.seq = 0
+
+        # Room for a full batch plus one maximum size packet.
+        self.buffer = bytearray(nlbufsiz + 0x20000)
+        self.view = memoryview(self.buffer)
+
+        self.packets = 0
+        self.bytes = 0
+        self.messages = 0
+        self.overruns = 0
+        self.lost = 0
+        self.last_seq = None
+
+    def get_stats(self):
+        """
+        The function for getting the receive statistics.
+
+        Returns:
+            Dictionary: The statistics:
+
+            :packets (int): The packets received.
+            :bytes (int): The packet bytes received.
+            :messages (int): The netlink receive calls with data.
+            :overruns (int): The ENOBUFS (receive buffer overflow) errors.
+            :lost (int): The packets lost, by sequence number gaps.
+        """
+
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'messages': self.messages,
+            'overruns': self.overruns,
+            'lost': self.lost
+        }
+
+    def request(self, family=socket.AF_UNSPEC, attrs=None, group=None):
+        """
+        The function for sending a config request and checking the ack.
+
+        Args:
+            family: The protocol family.
+            attrs: List of encoded attributes.
+            group: The group, or None for self.group.
+
+        Raises:
+            NFLogError: The kernel rejected the request.
+        """
+
+        self.seq += 1
+        self.sock.send(get_config_message(
+            self.group if group is None else group, family, attrs, self.seq))
+
+        length = self.sock.recv_into(self.buffer)
+        for packet in parse_packets(self.view, length):
+
+            if packet[4] is not None and packet[0] is None and packet[4] < 0:
+
+                raise NFLogError('NFLOG config request failed: {0}'.format(
+                    os.strerror(-packet[4])))
+
+    def open(self):
+        """
+        The function for opening the socket, and binding it to the group in
+        copy packet mode.
+
+        Raises:
+            NFLogError: The socket could not be opened or bound.
+        """
+
+        try:
+
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                      NETLINK_NETFILTER)
+            self.sock.bind((0, 0))
+
+        except (OSError, socket.error) as e:
+
+            raise NFLogError('Could not open the NFLOG socket: {0}'.format(e))
+
+        try:
+
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE,
+                                 self.rcvbuf)
+
+        except (OSError, socket.error):
+
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 self.rcvbuf)
+
+        log.info('NFLOG receive buffer: {0} bytes'.format(
+            self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)))
+
+        try:
+
+            # Older kernels need the AF_INET handler bound (with group 0).
+            try:
+
+                self.request(socket.AF_INET, [get_attr(
+                    NFULA_CFG_CMD, struct.pack('B', NFULNL_CFG_CMD_PF_BIND)
+                )], group=0)
+
+            except NFLogError:
+
+                pass
+
+            self.request(attrs=[get_attr(
+                NFULA_CFG_CMD, struct.pack('B', NFULNL_CFG_CMD_BIND))])
+
+            attrs = [
+                get_attr(NFULA_CFG_MODE, CFG_MODE.pack(
+                    self.copy_range, NFULNL_COPY_PACKET, 0)),
+                get_attr(NFULA_CFG_NLBUFSIZ, BE32.pack(self.nlbufsiz)),
+                get_attr(NFULA_CFG_FLAGS, BE16.pack(NFULNL_CFG_F_SEQ))
+            ]
+
+            if self.qthreshold:
+
+                attrs.append(get_attr(NFULA_CFG_QTHRESH,
+                                      BE32.pack(int(self.qthreshold))))
+
+            if self.timeout:
+
+                attrs.append(get_attr(NFULA_CFG_TIMEOUT,
+                                      BE32.pack(int(self.timeout))))
+
+            self.request(attrs=attrs)
+
+        except (OSError, socket.error) as e:
+
+            self.close()
+            raise NFLogError('Could not bind NFLOG group {0}: {1}'.format(
+                self.group, e))
+
+        except NFLogError:
+
+            self.close()
+            raise
+
+        log.info('Bound to NFLOG group {0}'.format(self.group))
+
+    def recv(self):
+        """
+        The function for receiving the next batch of packets (blocking,
+        unless a socket timeout is set).
+
+        Returns:
+            List: Packet tuples; see parse_packets(). Payloads are valid
+                until the next recv() call.
+        """
+
+        while True:
+
+            try:
+
+                length = self.sock.recv_into(self.buffer)
+
+            except (OSError, socket.error) as e:
+
+                if e.errno == errno.ENOBUFS:
+
+                    self.overruns += 1
+                    log.warning('NFLOG receive buffer overrun')
+                    continue
+
+                if e.errno == errno.EINTR:  # pragma: no cover
+
+                    continue
+
+                raise
+
+            packets = [p for p in parse_packets(self.view, length)
+                       if p[1] is not None]
+
+            if not packets:
+
+                continue
+
+            self.messages += 1
+            self.packets += len(packets)
+
+            last_seq = self.last_seq
+            for packet in packets:
+
+                self.bytes += len(packet[1])
+
+                seq = packet[4]
+                if seq is not None:
+
+                    if last_seq is not None:
+
+                        self.lost += (seq - last_seq - 1) & 0xFFFFFFFF
+
+                    last_seq = seq
+
+            self.last_seq = last_seq
+
+            return packets
+
+    def iter_packets(self):
+        """
+        The generator for receiving packets; see recv().
+
+        Yields:
+            Tuple: Packet tuples; see parse_packets().
+        """
+
+        while True:
+
+            for packet in self.recv():
+
+                yield packet
+
+    def close(self):
+        """
+        The function for unbinding the group and closing the socket.
+        """
+
+        if self.sock is None:
+
+            return
+
+        try:
+
+            self.sock.send(get_config_message(self.group, attrs=[get_attr(
+                NFULA_CFG_CMD, struct.pack('B', NFULNL_CFG_CMD_UNBIND))]))
+
+        except (OSError, socket.error):  # pragma: no cover
+
+            pass
+
+        self.sock.close()
+        self.sock = None
+
+
+def capture(nflog=None, writer=None, count=None, stats_interval=300):
+    """
+    The function for writing NFLOG packets to a pcap writer. Packets without
+    a kernel timestamp get the receive time.
+
+    Args:
+        nflog: The open NFLog.
+        writer: The pcap.PcapWriter (LINKTYPE_RAW).
+        count: Optional number of packets to capture, or None to run until
+            interrupted.
+        stats_interval: The number of seconds between statistics log
+            entries.
+
+    Returns:
+        Integer: The number of packets written.
+    """
+
+    written = 0
+    next_stats = time.time() + stats_interval
+    while count is None or written < count:
+
+        packets = nflog.recv()
+        now = time.time()
+
+        for timestamp, payload, prefix, indev, seq in packets:
+
+            writer.write(timestamp or now, payload)
+            written += 1
+
+            if count is not None and written >= count:
+
+                break
+
+        if now >= next_stats:
+
+            writer.flush()
+            log.info('NFLOG capture statistics: {0}'.format(
+                nflog.get_stats()))
+            next_stats = now + stats_interval
+
+    writer.flush()
+
+    return written
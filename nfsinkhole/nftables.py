@@ -0,0 +1,905 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from .exceptions import (NFTablesError, NFTablesExists, NFTablesNotExists,
+                         SubprocessError)
+from .utils import (popen_wrapper, read_state_file, write_state_file,
+                    delete_state_file, get_config_hash, read_address_file,
+                    get_cidr_range, ip_to_int)
+import logging
+import socket
+import time
+
+log = logging.getLogger(__name__)
+
+# iptables hashlimit rate units to nftables limit rate units
+RATE_UNITS = {
+    's': 'second', 'sec': 'second', 'second': 'second',
+    'm': 'minute', 'min': 'minute', 'minute': 'minute',
+    'h': 'hour', 'hour': 'hour',
+    'd': 'day', 'day': 'day'
+}
+
+# The notrack/rawdrop chain; raw priority (-300), before conntrack.
+RAW_CHAIN_SPEC = 'type filter hook prerouting priority -300; policy accept;'
+
+# iptables hashlimit modes to nftables (key expression, key type)
+HASHLIMIT_MODES = {
+    'srcip': ('ip saddr', 'ipv4_addr'),
+    'dstip': ('ip daddr', 'ipv4_addr'),
+    'srcport': ('th sport', 'inet_service'),
+    'dstport': ('th dport', 'inet_service')
+}
+
+
+def get_intervals(entries=None):
+    """
+    The function for converting nftables interval set elements (addresses,
+    CIDRs, and start-end ranges) to sorted, merged address intervals, as
+    the set stores them with auto-merge.
+
+    Args:
+        entries: List of set elements.
+
+    Returns:
+        List: Tuples (start, end) of integer addresses (inclusive).
+
+    Raises:
+        ValueError: An element is not an IPv4 address, CIDR or range.
+    """
+
+    intervals = []
+    for entry in entries or []:
+
+        try:
+
+            if '-' in entry:
+
+                start, end = [ip_to_int(v.strip())
+                              for v in entry.split('-', 1)]
+
+            else:
+
+                network, netmask = get_cidr_range(entry.strip())
+                start, end = network, network | (~netmask & 0xFFFFFFFF)
+
+        except socket.error as e:
+
+            raise ValueError('Invalid set element {0}: {1}'.format(entry, e))
+
+        intervals.append((start, end))
+
+    ret = []
+    for start, end in sorted(intervals):
+
+        # Overlapping or adjacent intervals are merged.
+        if ret and start <= ret[-1][1] + 1:
+
+            ret[-1] = (ret[-1][0], max(ret[-1][1], end))
+
+        else:
+
+            ret.append((start, end))
+
+    return ret
+
+
+class NFTablesSinkhole:
+    """
+    The class for managing sinkhole configuration within nftables. This is a
+    drop-in alternative to iptables.IPTablesSinkhole; source exclusions and
+    destination ports are native nftables sets, the hashlimit is a dynamic
+    set with a per key limit, and every change is a single nft -f
+    transaction.
+
+    Args:
+        interface: The secondary network interface dedicated to sinkhole
+            traffic.
+            Warning: Do not accidentally set this to your primary interface.
+            It will drop all traffic, and kill your remote access.
+        interface_addr: The IP address assigned to interface.
+        log_prefix: Prefix for syslog messages.
+        protocol: The protocol(s) to log (all traffic will still be dropped).
+            Accepts a comma separated string of protocols
+            (tcp,udp,udplite,icmp,esp,ah,sctp) or all.
+        dport: The destination port(s) to log (for applicable protocols).
+            Range should be in the format startport:endport or 0,1,2,3,n..
+        hashlimit: Set the hashlimit rate (iptables format, e.g., 1/h).
+        hashlimitmode: Set the hashlimit mode, a comma separated string of
+            options (srcip,srcport,dstip,dstport). More options here results
+            in more logs generated.
+        hashlimitburst: Maximum initial number of packets to match.
+        hashlimitexpire: Number of milliseconds to keep entries in the hash
+            table.
+        hashlimit_htable_size: Not applicable to nftables (sets are resized
+            by the kernel); accepted for compatibility with
+            IPTablesSinkhole.
+        hashlimit_htable_max: The maximum number of entries in the hashlimit
+            set (size), or None for the kernel default.
+        hashlimit_htable_gcinterval: Number of milliseconds between hashlimit
+            set garbage collection runs (gc-interval), or None for the kernel
+            default.
+        srcexclude: Exclude a comma separated string of source IPs/CIDRs from
+            logging.
+        srcexclude_file: Optional file of additional source IPs/CIDRs to
+            exclude from logging (one per line, # comments). Runtime
+            exclusion changes are synced from this file.
+        srcexclude_ipset: Accepted for compatibility with IPTablesSinkhole;
+            the exclusions are always a native nftables set.
+        notrack: If True, exempt interface traffic from connection tracking
+            (notrack in a raw priority prerouting chain).
+        rawdrop: If True, drop interface traffic that would never be logged
+            (excluded sources, and other protocols/ports) in the raw
+            priority prerouting chain, before connection tracking.
+        nflog_group: The NFLOG netlink group (0 - 2^16-1) for packet capture.
+        nflog_size: The number of bytes of each packet copied to userspace
+            (snaplen), or None for the full packet.
+        nflog_threshold: The number of packets queued in the kernel before
+            they are sent to userspace in a single netlink message.
+        table: The nftables table name. The DROP rules are kept in a
+            separate table, {table}_drop, so they persist when the logging
+            table is deleted.
+        state_path: The file storing the last configuration applied by
+            reconcile().
+    """
+
+    def __init__(self, interface=None, interface_addr=None,
+                 log_prefix='"[nfsinkhole] "',
+                 protocol='all', dport='0:65535',
+                 hashlimit='1/h', hashlimitmode='srcip,dstip,dstport',
+                 hashlimitburst='1', hashlimitexpire='1800000',
+                 hashlimit_htable_size=None, hashlimit_htable_max=None,
+                 hashlimit_htable_gcinterval=None,
+                 srcexclude='127.0.0.1', srcexclude_file=None,
+                 srcexclude_ipset=False, notrack=False, rawdrop=False,
+                 nflog_group='0', nflog_size=None, nflog_threshold='1',
+                 table='nfsinkhole',
+                 state_path='/var/run/nfsinkhole.state'
+                 ):
+
+        self.interface = interface
+        self.interface_addr = interface_addr
+        self.log_prefix = log_prefix
+        self.protocol = protocol
+        self.dport = dport
+        self.hashlimit = hashlimit
+        self.hashlimitmode = hashlimitmode
+        self.hashlimitburst = hashlimitburst
+        self.hashlimitexpire = hashlimitexpire
+        self.hashlimit_htable_size = hashlimit_htable_size
+        self.hashlimit_htable_max = hashlimit_htable_max
+        self.hashlimit_htable_gcinterval = hashlimit_htable_gcinterval
+        self.srcexclude = srcexclude
+        self.srcexclude_file = srcexclude_file
+        self.srcexclude_ipset = srcexclude_ipset
+        self.notrack = notrack
+        self.rawdrop = rawdrop
+        self.nflog_group = nflog_group
+        self.nflog_size = nflog_size
+        self.nflog_threshold = nflog_threshold
+        self.table = table
+        self.drop_table = '{0}_drop'.format(table)
+        self.state_path = state_path
+
+    def get_exclusions(self):
+        """
+        The function for retrieving the effective source exclusions;
+        srcexclude, plus the entries in srcexclude_file.
+
+        Returns:
+            List: Unique IPs/CIDRs, in order.
+        """
+
+        entries = [e.strip() for e in self.srcexclude.split(',') if e.strip()]
+        if self.srcexclude_file:
+
+            try:
+
+                entries += read_address_file(self.srcexclude_file)
+
+            except (IOError, OSError) as e:
+
+                log.error('Could not read srcexclude_file {0}: {1}'.format(
+                    self.srcexclude_file, e))
+
+        ret = []
+        for entry in entries:
+
+            if entry not in ret:
+
+                ret.append(entry)
+
+        return ret
+
+    def get_limit_rate(self):
+        """
+        The function for converting the iptables hashlimit rate to an
+        nftables limit rate.
+
+        Returns:
+            String: The nftables rate (e.g., 1/hour).
+
+        Raises:
+            ValueError: The hashlimit rate could not be converted.
+        """
+
+        try:
+
+            count, unit = self.hashlimit.split('/')
+            return '{0}/{1}'.format(int(count), RATE_UNITS[unit])
+
+        except (KeyError, ValueError):
+
+            raise ValueError('Unsupported hashlimit rate: {0}'.format(
+                self.hashlimit))
+
+    def get_nflog_statement(self):
+        """
+        The function for generating the nflog log statement.
+
+        Returns:
+            String: The nftables log statement.
+        """
+
+        statement = 'log group {0}'.format(self.nflog_group)
+
+        # Copy only the first nflog_size bytes of each packet.
+        if self.nflog_size:
+
+            statement += ' snaplen {0}'.format(self.nflog_size)
+
+        # Batch nflog_threshold packets per netlink message.
+        if str(self.nflog_threshold) != '1':
+
+            statement += ' queue-threshold {0}'.format(self.nflog_threshold)
+
+        return statement
+
+    def get_match(self):
+        """
+        The function for generating the protocol/port match of the logged
+        traffic.
+
+        Returns:
+            String: The nftables match expression (with a trailing space),
+                or an empty string for all traffic.
+        """
+
+        match = ''
+        if self.protocol != 'all':
+
+            match += 'meta l4proto {{ {0} }} '.format(
+                ', '.join(self.protocol.split(',')))
+
+            if self.dport != '0:65535':
+
+                match += 'th dport @dport '
+
+        return match
+
+    def get_raw_lines(self):
+        """
+        The function for generating the raw priority prerouting chain for
+        notrack and rawdrop. Interface traffic is handled before connection
+        tracking, as with the IPTablesSinkhole raw table rules.
+
+        Returns:
+            List: The chain lines, or an empty list if neither notrack nor
+                rawdrop is enabled.
+        """
+
+        if not (self.notrack or self.rawdrop):
+
+            return []
+
+        iface = 'iifname "{0}" '.format(self.interface)
+        verdict = 'notrack' if self.notrack else 'accept'
+
+        lines = [
+            '  chain prerouting {',
+            '    {0}'.format(RAW_CHAIN_SPEC)
+        ]
+
+        if self.rawdrop:
+
+            # Excluded sources are never logged.
+            lines.append('    {0}ip saddr @srcexclude drop'.format(iface))
+
+        if self.rawdrop and self.protocol != 'all':
+
+            # Only the logged protocol/ports continue to the input hook.
+            lines += [
+                '    {0}{1}{2}'.format(iface, self.get_match(), verdict),
+                '    {0}drop'.format(iface)
+            ]
+
+        elif self.notrack:
+
+            lines.append('    {0}notrack'.format(iface))
+
+        lines.append('  }')
+
+        return lines
+
+    def get_ruleset(self):
+        """
+        The function for generating the nftables logging table.
+
+        Returns:
+            String: The nft -f payload.
+        """
+
+        keys = []
+        key_types = []
+        for mode in self.hashlimitmode.split(','):
+
+            key, key_type = HASHLIMIT_MODES[mode.strip()]
+            keys.append(key)
+            key_types.append(key_type)
+
+        # Match the interface, address, and protocol/port settings
+        match = 'iifname "{0}" ip daddr {1} {2}'.format(
+            self.interface, self.interface_addr, self.get_match())
+
+        # nft rejects an empty elements list.
+        exclusions = self.get_exclusions()
+        ports = [p for p in self.dport.replace(':', '-').split(',') if p]
+
+        lines = [
+            'table ip {0} {{'.format(self.table),
+            '  set srcexclude {',
+            '    type ipv4_addr',
+            '    flags interval',
+            '    auto-merge'
+        ]
+
+        if exclusions:
+
+            lines.append('    elements = {{ {0} }}'.format(
+                ', '.join(exclusions)))
+
+        lines += [
+            '  }',
+            '  set dport {',
+            '    type inet_service',
+            '    flags interval'
+        ]
+
+        if ports:
+
+            lines.append('    elements = {{ {0} }}'.format(', '.join(ports)))
+
+        lines += [
+            '  }',
+            '  set sinkhole {',
+            '    type {0}'.format(' . '.join(key_types)),
+            '    flags dynamic,timeout',
+            '    timeout {0}ms'.format(self.hashlimitexpire)
+        ]
+
+        # Set sizing, if not the kernel defaults
+        if self.hashlimit_htable_max:
+
+            lines.append('    size {0}'.format(self.hashlimit_htable_max))
+
+        if self.hashlimit_htable_gcinterval:
+
+            lines.append('    gc-interval {0}ms'.format(
+                self.hashlimit_htable_gcinterval))
+
+        lines += [
+            '  }',
+            '  chain input {',
+            '    type filter hook input priority -1; policy accept;',
+            '    {0}update @sinkhole {{ {1} limit rate {2} burst {3} packets '
+            '}} jump sinkhole'.format(match, ' . '.join(keys),
+                                      self.get_limit_rate(),
+                                      self.hashlimitburst),
+            '  }',
+            '  chain sinkhole {',
+            '    ip saddr @srcexclude return',
+            '    log prefix "{0}"'.format(self.log_prefix.strip('"')),
+            '    {0}'.format(self.get_nflog_statement()),
+            '  }'
+        ]
+
+        lines += self.get_raw_lines()
+        lines.append('}')
+
+        return '\n'.join(lines) + '\n'
+
+    def get_drop_ruleset(self):
+        """
+        The function for generating the nftables DROP table.
+
+        Returns:
+            String: The nft -f payload.
+        """
+
+        lines = [
+            'table ip {0} {{'.format(self.drop_table),
+            '  chain input {',
+            '    type filter hook input priority 0; policy accept;',
+            '    iifname "{0}" drop'.format(self.interface),
+            '  }',
+            '  chain output {',
+            '    type filter hook output priority 0; policy accept;',
+            '    oifname "{0}" drop'.format(self.interface),
+            '  }',
+            '}'
+        ]
+
+        return '\n'.join(lines) + '\n'
+
+    def apply_ruleset(self, payload=None):
+        """
+        The function for committing an nftables payload in a single nft -f
+        transaction. Either the whole payload is applied, or none of it.
+
+        Args:
+            payload: The nft -f payload.
+
+        Raises:
+            NFTablesError: nft rejected the payload.
+        """
+
+        for line in payload.splitlines():
+
+            log.info('Writing: {0}'.format(line))
+
+        cmd = ['nft', '-f', '-']
+        try:
+
+            out, err = popen_wrapper(cmd_arr=cmd, raise_err=True, sudo=True,
+                                     stdin=payload)
+
+        except SubprocessError as e:  # pragma: no cover
+
+            raise NFTablesError(e)
+
+        # nft -f is silent on success; stderr is piped to stdout.
+        if out:  # pragma: no cover
+
+            raise NFTablesError('Error encountered when running process '
+                                '"{0}":\n{1}'.format(
+                                    ' '.join(cmd),
+                                    out.decode('ascii', 'ignore')))
+
+    def get_exclusion_stmts(self, add=None, delete=None, flush=False):
+        """
+        The function for generating the nft statements that change the
+        srcexclude set in place.
+
+        Args:
+            add: List of IPs/CIDRs to add to the set.
+            delete: List of IPs/CIDRs to delete from the set.
+            flush: Boolean for removing all set elements first.
+
+        Returns:
+            String: The nft -f payload.
+        """
+
+        lines = []
+        if flush:
+
+            lines.append('flush set ip {0} srcexclude'.format(self.table))
+
+        delete = [e.strip() for e in delete or [] if e.strip()]
+        if delete:
+
+            lines.append('delete element ip {0} srcexclude {{ {1} }}'.format(
+                self.table, ', '.join(delete)))
+
+        add = [e.strip() for e in add or [] if e.strip()]
+        if add:
+
+            lines.append('add element ip {0} srcexclude {{ {1} }}'.format(
+                self.table, ', '.join(add)))
+
+        return '\n'.join(lines) + '\n'
+
+    def get_live_exclusions(self):
+        """
+        The function for retrieving the elements of the live srcexclude set.
+
+        Returns:
+            List: IPs/CIDRs/ranges, in nft list order.
+        """
+
+        out, err = popen_wrapper(['nft', 'list', 'set', 'ip', self.table,
+                                  'srcexclude'], log_stdout_line=False,
+                                 sudo=True)
+
+        text = (out or b'').decode('ascii', 'ignore')
+        if 'elements = {' not in text:
+
+            return []
+
+        text = text.split('elements = {', 1)[1].split('}', 1)[0]
+
+        return [e.strip() for e in text.split(',') if e.strip()]
+
+    def exclusions_changed(self, live=None):
+        """
+        The function for checking if the live source exclusions differ from
+        the configured exclusions (e.g., after --exclude-add/--exclude-del).
+        Both are compared as merged intervals (see get_intervals()), since
+        auto-merge merges adjacent and overlapping elements.
+
+        Args:
+            live: The live set elements (get_live_exclusions()), or None to
+                retrieve them.
+
+        Returns:
+            Boolean: True if the live exclusions differ.
+        """
+
+        if live is None:
+
+            live = self.get_live_exclusions()
+
+        try:
+
+            return get_intervals(live) != get_intervals(self.get_exclusions())
+
+        except ValueError as e:
+
+            log.warning('Could not compare source exclusions: {0}'.format(e))
+            return True
+
+    def add_exclusions(self, entries=None):
+        """
+        The function for adding source exclusions to the live set.
+
+        Args:
+            entries: List of IPs/CIDRs to exclude.
+
+        Returns:
+            Integer: The number of entries applied.
+        """
+
+        log.info('Adding {0} source exclusions'.format(len(entries or [])))
+
+        self.apply_ruleset(self.get_exclusion_stmts(add=entries))
+
+        return len(entries or [])
+
+    def delete_exclusions(self, entries=None):
+        """
+        The function for deleting source exclusions from the live set.
+        Entries that are not elements of the set as listed by nft (e.g.,
+        merged into a range) are not deleted, and logged.
+
+        Args:
+            entries: List of IPs/CIDRs to stop excluding.
+
+        Returns:
+            Integer: The number of entries applied.
+        """
+
+        live = self.get_live_exclusions()
+        entries = [e.strip() for e in entries or [] if e.strip()]
+
+        # auto-merge may have merged entries into ranges; nft can only
+        # delete elements as listed.
+        missing = [e for e in entries if e not in live]
+        if missing:
+
+            log.warning('Not deleting {0} source exclusions that are not '
+                        'elements of the set (missing, or merged into a '
+                        'range): {1}'.format(len(missing), ', '.join(missing)))
+
+        entries = [e for e in entries if e in live]
+
+        log.info('Deleting {0} source exclusions'.format(len(entries)))
+
+        if entries:
+
+            self.apply_ruleset(self.get_exclusion_stmts(delete=entries))
+
+        return len(entries)
+
+    def sync_exclusions(self, entries=None):
+        """
+        The function for replacing the live source exclusions. The set is
+        flushed and reloaded in a single nft -f transaction.
+
+        Args:
+            entries: List of IPs/CIDRs that should be excluded.
+
+        Returns:
+            Integer: The number of entries applied.
+        """
+
+        log.info('Syncing {0} source exclusions'.format(len(entries or [])))
+
+        self.apply_ruleset(self.get_exclusion_stmts(add=entries, flush=True))
+
+        return len(entries or [])
+
+    def list_tables(self):
+        """
+        The function for retrieving the current nftables table names.
+
+        Returns:
+            List: Table names (family and name, e.g., ip nfsinkhole).
+
+        Raises:
+            NFTablesError: A Linux process had an error (stderr).
+        """
+
+        cmd = ['nft', 'list', 'tables']
+        out, err = popen_wrapper(cmd, sudo=True)
+
+        if err:  # pragma: no cover
+
+            raise NFTablesError('Error encountered when running process "{0}":'
+                                '\n{1}'.format(' '.join(cmd), err))
+
+        tables = []
+        for line in (out or b'').splitlines():
+
+            tmp_line = line.decode('ascii', 'ignore').strip()
+            if tmp_line.startswith('table '):
+
+                tables.append(tmp_line[6:])
+
+        return tables
+
+    def list_existing_rules(self, filter_io_drop=False):
+        """
+        The function for retrieving current nftables rules related to
+        nfsinkhole.
+
+        Args:
+            filter_io_drop: Boolean for also showing the DROP table for the
+                interface. This is not shown by default.
+
+        Returns:
+            List: Lines returned by nft list table for the nfsinkhole
+                table(s).
+
+        Raises:
+            NFTablesError: A Linux process had an error (stderr).
+        """
+
+        tables = self.list_tables()
+
+        names = [self.table]
+        if filter_io_drop:
+
+            names.append(self.drop_table)
+
+        existing = []
+        for name in names:
+
+            if 'ip {0}'.format(name) not in tables:
+
+                continue
+
+            out, err = popen_wrapper(['nft', 'list', 'table', 'ip', name],
+                                     sudo=True)
+
+            for line in (out or b'').splitlines():
+
+                tmp_line = line.decode('ascii', 'ignore').strip()
+                if tmp_line:
+
+                    existing.append(tmp_line)
+
+        return existing
+
+    def get_config(self):
+        """
+        The function for retrieving the sinkhole configuration that
+        determines the generated ruleset.
+
+        Returns:
+            Dictionary: The configuration.
+        """
+
+        return {
+            'interface': self.interface,
+            'interface_addr': self.interface_addr,
+            'log_prefix': self.log_prefix,
+            'protocol': self.protocol,
+            'dport': self.dport,
+            'hashlimit': self.hashlimit,
+            'hashlimitmode': self.hashlimitmode,
+            'hashlimitburst': self.hashlimitburst,
+            'hashlimitexpire': self.hashlimitexpire,
+            'hashlimit_htable_max': self.hashlimit_htable_max,
+            'hashlimit_htable_gcinterval': self.hashlimit_htable_gcinterval,
+            'srcexclude': ','.join(self.get_exclusions()),
+            'notrack': self.notrack,
+            'rawdrop': self.rawdrop,
+            'nflog_group': self.nflog_group,
+            'nflog_size': self.nflog_size,
+            'nflog_threshold': self.nflog_threshold
+        }
+
+    def reconcile(self, force=False):
+        """
+        The function for updating the live nftables table to the current
+        configuration in a single nft -f transaction. The chains and the
+        exclusion/port sets are reloaded in place; the hashlimit set (and its
+        per key state) is kept unless its key or timeout changed. A hash of
+        the applied configuration is stored in state_path; if it matches,
+        the table exists, and the live exclusions match the configuration
+        (runtime exclusion changes are reverted), nothing is done.
+
+        Args:
+            force: Boolean for ignoring the stored configuration hash.
+
+        Returns:
+            Integer: 1 if the ruleset was applied, or 0.
+        """
+
+        config = self.get_config()
+        config_hash = get_config_hash(config)
+        state = read_state_file(self.state_path) or {}
+        exists = 'ip {0}'.format(self.table) in self.list_tables()
+
+        if (not force and state.get('hash') == config_hash and exists and
+                not self.exclusions_changed()):
+
+            log.info('nftables config unchanged, nothing to reconcile.')
+            return 0
+
+        log.info('Reconciling nftables config')
+
+        self.apply_ruleset(self.get_reconcile_payload(
+            state.get('config') if exists else None, exists))
+
+        write_state_file(self.state_path, {
+            'hash': config_hash,
+            'config': config,
+            'timestamp': time.time()
+        })
+
+        return 1
+
+    def get_reconcile_payload(self, previous=None, exists=True):
+        """
+        The function for generating the nft -f payload that updates the live
+        table to the current configuration (see reconcile()).
+
+        Args:
+            previous: The previously applied configuration (get_config()),
+                or None.
+            exists: Boolean for whether the table exists.
+
+        Returns:
+            String: The nft -f payload.
+        """
+
+        lines = []
+        if exists:
+
+            lines = [
+                'flush chain ip {0} input'.format(self.table),
+                'flush chain ip {0} sinkhole'.format(self.table),
+                'flush set ip {0} srcexclude'.format(self.table),
+                'flush set ip {0} dport'.format(self.table),
+
+                # The raw chain may not exist yet; add (a no-op if it does)
+                # before flushing, and delete it if it is now disabled.
+                'add chain ip {0} prerouting {{ {1} }}'.format(
+                    self.table, RAW_CHAIN_SPEC),
+                'flush chain ip {0} prerouting'.format(self.table)
+            ]
+
+            if not (self.notrack or self.rawdrop):
+
+                lines.append('delete chain ip {0} prerouting'.format(
+                    self.table))
+
+            # The set key, timeout and size can not be changed in place.
+            previous = previous or {}
+            config = self.get_config()
+            if [k for k in ('hashlimitmode', 'hashlimitexpire',
+                            'hashlimit_htable_max',
+                            'hashlimit_htable_gcinterval')
+                    if previous.get(k) != config[k]]:
+
+                lines.append('delete set ip {0} sinkhole'.format(self.table))
+
+        return '\n'.join(lines + [self.get_ruleset()])
+
+    def create_rules(self):
+        """
+        The function for writing nftables rules related to nfsinkhole.
+        """
+
+        log.info('Checking for existing nftables rules.')
+        existing = self.list_existing_rules()
+
+        # Existing sinkhole related nftables table found, can't create.
+        if len(existing) > 0:
+
+            raise NFTablesExists('Existing nftables rules found for '
+                                 'nfsinkhole:\n{0}'
+                                 ''.format('\n'.join(existing)))
+
+        log.info('Writing nftables config')
+        self.apply_ruleset(self.get_ruleset())
+
+    def create_drop_rule(self):
+        """
+        The function for writing the nftables DROP rules for the interface.
+        """
+
+        log.info('Checking for existing nftables DROP rules.')
+
+        if 'ip {0}'.format(self.drop_table) in self.list_tables():
+
+            raise NFTablesExists('Existing nftables DROP table found for '
+                                 'nfsinkhole: {0}'.format(self.drop_table))
+
+        log.info('Writing nftables DROP config')
+        self.apply_ruleset(self.get_drop_ruleset())
+
+    def delete_rules(self):
+        """
+        The function for deleting nftables rules related to nfsinkhole.
+
+        Returns:
+            Integer: The number of lines in the deleted table.
+        """
+
+        log.info('Checking for existing nftables rules.')
+        existing = self.list_existing_rules()
+
+        # No sinkhole related nftables table found.
+        if len(existing) == 0:
+
+            raise NFTablesNotExists('No existing rules found.')
+
+        log.info('Deleting nftables config')
+        self.apply_ruleset('delete table ip {0}\n'.format(self.table))
+
+        # The rules applied by reconcile() are gone.
+        delete_state_file(self.state_path)
+
+        return len(existing)
+
+    def delete_drop_rule(self):
+        """
+        The function for deleting the nftables DROP rules for the interface.
+
+        Returns:
+            Integer: The number of DROP rules deleted.
+        """
+
+        log.info('Checking for existing nftables DROP rules.')
+
+        if 'ip {0}'.format(self.drop_table) not in self.list_tables():
+
+            raise NFTablesNotExists('No existing rules found.')
+
+        log.info('Deleting nftables DROP config.')
+        self.apply_ruleset('delete table ip {0}\n'.format(self.drop_table))
+
+        return 2
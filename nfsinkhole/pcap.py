@@ -0,0 +1,577 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import glob
+import gzip
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# pcap magic numbers (microsecond and nanosecond timestamps).
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+
+# Link types; raw IPv4/IPv6 packets (NFLOG payloads), and NFLOG TLVs.
+LINKTYPE_RAW = 101
+LINKTYPE_NFLOG = 239
+
+# The pcap global header and record header (little endian when written).
+PCAP_HEADER = struct.Struct('<IHHiIII')
+PCAP_RECORD = struct.Struct('<IIII')
+
+# The default snapshot length.
+SNAPLEN = 65535
+
+# The default write buffer size (bytes).
+BUFFER_SIZE = 1048576
+
+# The default PcapRing file size (bytes), age (seconds) and count.
+RING_FILE_SIZE = 104857600
+RING_FILE_SECONDS = 3600
+RING_FILE_COUNT = 10
+
+
+class PcapWriter:
+    """
+    The class for writing packets to a pcap file (microsecond timestamps).
+
+    Args:
+        path: The pcap file path.
+        linktype: The link type (LINKTYPE_RAW for NFLOG payloads).
+        snaplen: The maximum number of bytes saved per packet.
+        append: If True and the file exists, packets are appended (the link
+            type must match); otherwise the file is replaced.
+        buffer_size: The write buffer size (bytes).
+
+    Raises:
+        ValueError: The existing file is not a pcap file of linktype.
+    """
+
+    def __init__(self, path=None, linktype=LINKTYPE_RAW, snaplen=SNAPLEN,
+                 append=True, buffer_size=BUFFER_SIZE):
+
+        self.path = path
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.packets = 0
+        self.bytes = 0
+
+        if append and os.path.exists(path) and os.path.getsize(path):
+
+            with open(path, 'rb') as f:
+
+                header = read_header(f)
+
+            if header[3] != linktype:
+
+                raise ValueError('{0} has linktype {1}, not {2}'.format(
+                    path, header[3], linktype))
+
+            if header[0] != '<' or header[1]:
+
+                raise ValueError('{0} is not a little endian, microsecond '
+                                 'pcap file'.format(path))
+
+            self.file = open(path, 'ab', buffer_size)
+
+        else:
+
+            self.file = open(path, 'wb', buffer_size)
+            self.file.write(PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, snaplen,
+                                             linktype))
+
+    def write(self, timestamp=0.0, data=b'', orig_len=None):
+        """
+        The function for writing a packet.
+
+        Args:
+            timestamp: The packet time, UNIX epoch seconds (float).
+            data: The packet (bytes, bytearray or memoryview).
+            orig_len: The original packet length, if data was truncated.
+        """
+
+        length = len(data)
+        if length > self.snaplen:
+
+            data = data[:self.snaplen]
+
+        sec = int(timestamp)
+        caplen = len(data)
+
+        self.file.write(PCAP_RECORD.pack(
+            sec, int((timestamp - sec) * 1000000), caplen,
+            max(orig_len or length, caplen)
+        ))
+        self.file.write(data)
+
+        self.packets += 1
+        self.bytes += PCAP_RECORD.size + caplen
+
+    def flush(self):
+        """
+        The function for flushing buffered packets to the file.
+        """
+
+        self.file.flush()
+
+    def close(self):
+        """
+        The function for flushing and closing the file.
+        """
+
+        self.file.close()
+
+
+def compress_file(path=None):
+    """
+    The function for gzip compressing a file, replacing it with path.gz
+    (with the file's modification time, as gzip does).
+
+    Args:
+        path: The file path.
+    """
+
+    try:
+
+        with open(path, 'rb') as f_in:
+
+            # GzipFile is not a context manager on Python 2.6.
+            f_out = gzip.open('{0}.gz.tmp'.format(path), 'wb')
+            try:
+
+                shutil.copyfileobj(f_in, f_out, BUFFER_SIZE)
+
+            finally:
+
+                f_out.close()
+
+        shutil.copystat(path, '{0}.gz.tmp'.format(path))
+        os.rename('{0}.gz.tmp'.format(path), '{0}.gz'.format(path))
+        os.remove(path)
+
+    except (IOError, OSError) as e:
+
+        log.error('Could not compress {0}: {1}'.format(path, e))
+
+
+def finish_file(path=None, compress=True, index=False):
+    """
+    The function for post-processing a closed capture file; indexing it by
+    flow (pcapindex.build_index()), then gzip compressing it.
+
+    Args:
+        path: The pcap file path.
+        compress: If True, gzip the file.
+        index: If True, index the file.
+    """
+
+    if index:
+
+        # pcapindex imports this module.
+        from .pcapindex import build_index
+
+        try:
+
+            build_index(path)
+
+        except (IOError, OSError, ValueError) as e:
+
+            log.error('Could not index {0}: {1}'.format(path, e))
+
+    if compress:
+
+        compress_file(path)
+
+
+class PcapRing:
+    """
+    The class for writing packets to a ring of pcap files, rotated by size
+    and age, so disk use is bounded. Files are named after path with the
+    time they were started (e.g., /var/log/nfsinkhole.pcap ->
+    /var/log/nfsinkhole-20161017002851.000000.pcap). Closed files are gzip
+    compressed (and optionally indexed, see pcapindex) in a background
+    thread, and the oldest files are deleted beyond file_count. Has the
+    PcapWriter write()/flush()/close() interface.
+
+    Args:
+        path: The base pcap file path.
+        file_size: The file size (bytes) after which a new file is started.
+        file_seconds: The file age (seconds) after which a new file is
+            started (checked on write), or None.
+        file_count: The maximum number of files kept, including the file
+            being written.
+        compress: If True, gzip closed files.
+        linktype: The link type.
+        snaplen: The maximum number of bytes saved per packet.
+        index: If True, write a flow index (.idx) for closed files.
+    """
+
+    def __init__(self, path='/var/log/nfsinkhole.pcap',
+                 file_size=RING_FILE_SIZE, file_seconds=RING_FILE_SECONDS,
+                 file_count=RING_FILE_COUNT, compress=True,
+                 linktype=LINKTYPE_RAW, snaplen=SNAPLEN, index=False):
+
+        self.path = path
+        self.file_size = file_size
+        self.file_seconds = file_seconds
+        self.file_count = file_count
+        self.compress = compress
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.index = index
+        self.root, self.ext = os.path.splitext(path)
+        self.writer = None
+        self.started = None
+        self.threads = []
+        self.packets = 0
+
+        # Finish files left uncompressed (e.g., the process was killed).
+        if compress or index:
+
+            for file_path in self.get_files():
+
+                if not file_path.endswith('.gz'):
+
+                    self.start_finish(file_path)
+
+    def get_files(self):
+        """
+        The function for listing the ring files, oldest first.
+
+        Returns:
+            List: The file paths (.pcap, or .pcap.gz once compressed).
+        """
+
+        pattern = '{0}-[0-9]*{1}'.format(self.root, self.ext)
+        files = set(glob.glob(pattern))
+
+        # A file being compressed may exist as both .pcap and .pcap.gz.
+        files.update([
+            f for f in glob.glob(pattern + '.gz') if f[:-3] not in files
+        ])
+
+        return sorted(files)
+
+    def start_finish(self, path=None):
+        """
+        The function for indexing and/or compressing a closed file in a
+        background thread (finish_file()).
+
+        Args:
+            path: The file path.
+        """
+
+        thread = threading.Thread(target=finish_file,
+                                  args=(path, self.compress, self.index))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def wait(self):
+        """
+        The function for waiting for background indexing/compression to
+        finish.
+        """
+
+        for thread in self.threads:
+
+            thread.join()
+
+        self.threads = []
+
+    def rotate(self, now=None):
+        """
+        The function for closing the current file (compressing it), starting
+        a new file, and deleting the oldest files beyond file_count.
+        Compression of the previous file is waited for first, so it can not
+        fall behind the capture.
+
+        Args:
+            now: The current time (UNIX epoch seconds), or None.
+        """
+
+        now = now or time.time()
+        closed = None
+
+        if self.writer is not None:
+
+            self.writer.close()
+            closed = self.writer.path
+            log.info('Closed {0} ({1} packets)'.format(
+                closed, self.writer.packets))
+
+        self.wait()
+
+        path = '{0}-{1}.{2:06d}{3}'.format(
+            self.root, time.strftime('%Y%m%d%H%M%S', time.gmtime(now)),
+            int(now % 1 * 1000000), self.ext
+        )
+
+        self.writer = PcapWriter(path, self.linktype, self.snaplen,
+                                 append=False)
+        self.started = now
+
+        files = [f for f in self.get_files() if f != path]
+        while len(files) >= self.file_count:
+
+            old = files.pop(0)
+            log.info('Deleting {0}'.format(old))
+
+            for old_path in (old, '{0}.idx'.format(
+                    old[:-3] if old.endswith('.gz') else old)):
+
+                try:
+
+                    os.remove(old_path)
+
+                except OSError:
+
+                    pass
+
+        if (self.compress or self.index) and closed in files:
+
+            self.start_finish(closed)
+
+    def write(self, timestamp=0.0, data=b'', orig_len=None):
+        """
+        The function for writing a packet, rotating first if needed.
+
+        Args:
+            timestamp: The packet time, UNIX epoch seconds (float).
+            data: The packet (bytes, bytearray or memoryview).
+            orig_len: The original packet length, if data was truncated.
+        """
+
+        if self.writer is None or (
+                PCAP_HEADER.size + self.writer.bytes >= self.file_size):
+
+            self.rotate()
+
+        elif self.file_seconds:
+
+            now = time.time()
+            if now - self.started >= self.file_seconds:
+
+                self.rotate(now)
+
+        self.writer.write(timestamp, data, orig_len)
+        self.packets += 1
+
+    def flush(self):
+        """
+        The function for flushing buffered packets to the current file.
+        """
+
+        if self.writer is not None:
+
+            self.writer.flush()
+
+    def close(self):
+        """
+        The function for closing (and compressing) the current file, and
+        waiting for compression to finish.
+        """
+
+        if self.writer is not None:
+
+            self.writer.close()
+
+            if self.compress or self.index:
+
+                self.start_finish(self.writer.path)
+
+            self.writer = None
+
+        self.wait()
+
+
+def read_header(f=None):
+    """
+    The function for reading a pcap global header.
+
+    Args:
+        f: The file object (binary), at offset 0.
+
+    Returns:
+        Tuple: (byteorder, nanosecond, snaplen, linktype); byteorder is the
+            struct byte order character (< or >), nanosecond is True for
+            nanosecond timestamps.
+
+    Raises:
+        ValueError: Not a pcap file.
+    """
+
+    data = f.read(PCAP_HEADER.size)
+    if len(data) < PCAP_HEADER.size:
+
+        raise ValueError('Not a pcap file (short header)')
+
+    for byteorder in ('<', '>'):
+
+        magic = struct.unpack(byteorder + 'I', data[:4])[0]
+        if magic in (PCAP_MAGIC, PCAP_MAGIC_NS):
+
+            (magic, major, minor, zone, sigfigs, snaplen,
+             linktype) = struct.unpack(byteorder + 'IHHiIII', data)
+
+            return byteorder, magic == PCAP_MAGIC_NS, snaplen, linktype
+
+    raise ValueError('Not a pcap file (magic)')
+
+
+class PcapReader:
+    """
+    The class for reading packets from a pcap file (plain or gzip; gzip
+    files can only be read, or seeked, forward efficiently).
+
+    Args:
+        path: The pcap file path (.gz is decompressed).
+
+    Raises:
+        ValueError: Not a pcap file.
+    """
+
+    def __init__(self, path=None):
+
+        self.path = path
+        if path.endswith('.gz'):
+
+            self.file = gzip.open(path, 'rb')
+
+        else:
+
+            self.file = open(path, 'rb', BUFFER_SIZE)
+
+        try:
+
+            (self.byteorder, self.nanosecond, self.snaplen,
+             self.linktype) = read_header(self.file)
+
+        except ValueError:
+
+            self.file.close()
+            raise
+
+        self.record = struct.Struct(self.byteorder + 'IIII')
+        self.divisor = 1000000000.0 if self.nanosecond else 1000000.0
+
+    def read_packet(self, offset=None):
+        """
+        The function for reading a packet.
+
+        Args:
+            offset: The packet record offset to seek to, or None for the
+                next packet.
+
+        Returns:
+            Tuple: (timestamp, data, orig_len), or None at the end of the
+                file.
+        """
+
+        if offset is not None:
+
+            self.file.seek(offset)
+
+        header = self.file.read(self.record.size)
+        if len(header) < self.record.size:
+
+            return None
+
+        sec, frac, caplen, orig_len = self.record.unpack(header)
+        data = self.file.read(caplen)
+        if len(data) < caplen:
+
+            log.warning('Truncated packet at the end of {0}'.format(
+                self.path))
+            return None
+
+        return sec + frac / self.divisor, data, orig_len
+
+    def iter_records(self):
+        """
+        The generator for reading the packets with their offsets, from the
+        first packet.
+
+        Yields:
+            Tuple: (offset, timestamp, data, orig_len); offset is the record
+                offset in the (uncompressed) file.
+        """
+
+        self.file.seek(PCAP_HEADER.size)
+        offset = PCAP_HEADER.size
+        record_size = self.record.size
+        read_packet = self.read_packet
+
+        while True:
+
+            packet = read_packet()
+            if packet is None:
+
+                break
+
+            yield (offset,) + packet
+            offset += record_size + len(packet[1])
+
+    def close(self):
+        """
+        The function for closing the file.
+        """
+
+        self.file.close()
+
+
+def iter_packets(path=None):
+    """
+    The generator for reading the packets of a pcap file (plain or gzip).
+
+    Args:
+        path: The pcap file path.
+
+    Yields:
+        Tuple: (timestamp, data, orig_len); timestamp is UNIX epoch seconds
+            (float), data is the captured bytes.
+    """
+
+    reader = PcapReader(path)
+    try:
+
+        read_packet = reader.read_packet
+        while True:
+
+            packet = read_packet()
+            if packet is None:
+
+                break
+
+            yield packet
+
+    finally:
+
+        reader.close()
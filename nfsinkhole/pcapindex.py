@@ -0,0 +1,523 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import os
+import struct
+from .pcap import (LINKTYPE_NFLOG, LINKTYPE_RAW, PcapReader, PcapWriter,
+                   SNAPLEN)
+from .utils import IPV4, get_cidr_range
+
+log = logging.getLogger(__name__)
+
+# Ethernet link type (pcaps not captured from NFLOG).
+LINKTYPE_ETHERNET = 1
+
+# Index header; magic, linktype, flow count, packet count, first/last packet
+# time.
+INDEX_MAGIC = b'NFSKPIX1'
+INDEX_HEADER = struct.Struct('<8sIIQdd')
+
+# Index flow entry; src, dst, proto, dport, first/last packet time, offsets
+# array start, packet count.
+INDEX_FLOW = struct.Struct('<IIHHddQI')
+
+# Packet record offset, in the offsets array that follows the flow entries.
+INDEX_OFFSET = struct.Struct('<Q')
+
+# NFLOG TLV header (host byte order of the capturing system, little endian
+# assumed) and the payload TLV type.
+NFLOG_TLV = struct.Struct('<HH')
+NFULA_PAYLOAD = 9
+
+# Protocols with ports.
+PORT_PROTOCOLS = (6, 17, 132, 136)
+
+
+def get_ip_offset(data=b'', linktype=LINKTYPE_RAW):
+    """
+    The function for finding the IP header in a captured packet.
+
+    Args:
+        data: The packet (bytes).
+        linktype: The pcap link type.
+
+    Returns:
+        Integer: The IP header offset, or None.
+    """
+
+    if linktype == LINKTYPE_RAW:
+
+        return 0
+
+    if linktype == LINKTYPE_NFLOG:
+
+        offset = 4
+        while offset + NFLOG_TLV.size <= len(data):
+
+            length, tlv_type = NFLOG_TLV.unpack_from(data, offset)
+            if length < NFLOG_TLV.size:
+
+                return None
+
+            if tlv_type == NFULA_PAYLOAD:
+
+                return offset + NFLOG_TLV.size
+
+            offset += (length + 3) & ~3
+
+        return None
+
+    if linktype == LINKTYPE_ETHERNET:
+
+        if data[12:14] == b'\x08\x00':
+
+            return 14
+
+    return None
+
+
+def get_flow(data=b'', linktype=LINKTYPE_RAW):
+    """
+    The function for getting the flow key of an IPv4 packet. The dport is
+    the ICMP type * 256 + code for ICMP (as events.Event), or 0 for
+    protocols without ports.
+
+    Args:
+        data: The packet (bytes).
+        linktype: The pcap link type.
+
+    Returns:
+        Tuple: (src, dst, proto, dport); addresses are integers. None if the
+            packet is not IPv4.
+    """
+
+    offset = get_ip_offset(data, linktype)
+    if offset is None or len(data) < offset + 20:
+
+        return None
+
+    header = bytearray(data[offset:offset + 24])
+    if header[0] >> 4 != 4:
+
+        return None
+
+    proto = header[9]
+    src = IPV4.unpack_from(data, offset + 12)[0]
+    dst = IPV4.unpack_from(data, offset + 16)[0]
+
+    dport = 0
+    transport = offset + (header[0] & 0x0F) * 4
+
+    # Only the first fragment has the transport header.
+    if not (header[6] & 0x1F or header[7]) and (
+            len(data) >= transport + 4):
+
+        if proto in PORT_PROTOCOLS:
+
+            dport = struct.unpack_from('!H', data, transport + 2)[0]
+
+        elif proto == 1:
+
+            dport = struct.unpack_from('!H', data, transport)[0]
+
+    return src, dst, proto, dport
+
+
+def get_index_path(path=None):
+    """
+    The function for getting the index path of a capture file; the same
+    index is used once the capture is compressed (e.g., nfsinkhole.pcap and
+    nfsinkhole.pcap.gz -> nfsinkhole.pcap.idx).
+
+    Args:
+        path: The pcap file path.
+
+    Returns:
+        String: The index path.
+    """
+
+    if path.endswith('.gz'):
+
+        path = path[:-3]
+
+    return path + '.idx'
+
+
+def is_indexed(path=None, index_path=None):
+    """
+    The function for checking if a capture file has an up to date index
+    (e.g., tcpdump ring files are overwritten in turn).
+
+    Args:
+        path: The pcap file path.
+        index_path: The index path, or None for get_index_path(path).
+
+    Returns:
+        Boolean: True if the index exists and is not older than the file.
+    """
+
+    index_path = index_path or get_index_path(path)
+    try:
+
+        return os.path.getmtime(index_path) >= os.path.getmtime(path)
+
+    except OSError:
+
+        return False
+
+
+def build_index(path=None, index_path=None):
+    """
+    The function for indexing the packets of a capture file by flow
+    (src, dst, proto, dport), with each flow's time range and packet
+    offsets. Non IPv4 packets are not indexed.
+
+    Args:
+        path: The pcap file path (plain or gzip).
+        index_path: The index path, or None for get_index_path(path).
+
+    Returns:
+        Integer: The number of flows indexed.
+    """
+
+    index_path = index_path or get_index_path(path)
+    reader = PcapReader(path)
+    linktype = reader.linktype
+
+    # Offsets are packed as they are read; 8 bytes per packet.
+    pack_offset = INDEX_OFFSET.pack
+    size = INDEX_OFFSET.size
+    flows = {}
+    packets = 0
+    first_seen = None
+    last_seen = None
+
+    try:
+
+        for offset, timestamp, data, orig_len in reader.iter_records():
+
+            if first_seen is None or timestamp < first_seen:
+
+                first_seen = timestamp
+
+            if last_seen is None or timestamp > last_seen:
+
+                last_seen = timestamp
+
+            key = get_flow(data, linktype)
+            if key is None:
+
+                continue
+
+            try:
+
+                flow = flows[key]
+                if timestamp < flow[0]:
+
+                    flow[0] = timestamp
+
+                if timestamp > flow[1]:
+
+                    flow[1] = timestamp
+
+                flow[2] += pack_offset(offset)
+
+            except KeyError:
+
+                flows[key] = [timestamp, timestamp,
+                              bytearray(pack_offset(offset))]
+
+            packets += 1
+
+    finally:
+
+        reader.close()
+
+    tmp_path = '{0}.tmp'.format(index_path)
+    with open(tmp_path, 'wb') as f:
+
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, linktype, len(flows), packets,
+                                  first_seen or 0.0, last_seen or 0.0))
+
+        start = 0
+        keys = sorted(flows)
+        for key in keys:
+
+            flow = flows[key]
+            count = len(flow[2]) // size
+            f.write(INDEX_FLOW.pack(key[0], key[1], key[2], key[3], flow[0],
+                                    flow[1], start, count))
+            start += count
+
+        for key in keys:
+
+            f.write(flows[key][2])
+
+    os.rename(tmp_path, index_path)
+
+    log.info('Indexed {0}: {1} flows, {2} packets'.format(
+        path, len(flows), packets))
+
+    return len(flows)
+
+
+class FlowIndex:
+    """
+    The class for querying a capture file flow index (see build_index()).
+    The header is read on load, the flow table on the first query within
+    the file's time range, and packet offsets per matching flow.
+
+    Args:
+        index_path: The index path.
+
+    Raises:
+        ValueError: Not an index file.
+    """
+
+    def __init__(self, index_path=None):
+
+        self.index_path = index_path
+
+        with open(index_path, 'rb') as f:
+
+            header = f.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size:
+
+                raise ValueError('Not a flow index: {0}'.format(index_path))
+
+            (magic, self.linktype, count, self.packets, self.first_seen,
+             self.last_seen) = INDEX_HEADER.unpack(header)
+
+            if magic != INDEX_MAGIC:
+
+                raise ValueError('Not a flow index: {0}'.format(index_path))
+
+        self.count = count
+        self.flows = None
+        self.offsets_start = INDEX_HEADER.size + INDEX_FLOW.size * count
+
+    def __len__(self):
+
+        return self.count
+
+    def load(self):
+        """
+        The function for reading the flow table.
+
+        Returns:
+            List: The INDEX_FLOW tuples, sorted.
+        """
+
+        if self.flows is None:
+
+            with open(self.index_path, 'rb') as f:
+
+                f.seek(INDEX_HEADER.size)
+                data = f.read(INDEX_FLOW.size * self.count)
+
+            self.flows = [
+                INDEX_FLOW.unpack_from(data, i * INDEX_FLOW.size)
+                for i in range(self.count)
+            ]
+
+        return self.flows
+
+    def find(self, src=None, dst=None, proto=None, dport=None, start=None,
+             end=None):
+        """
+        The function for finding the flows matching the filters.
+
+        Args:
+            src: Optional source IPv4 address/CIDR.
+            dst: Optional destination IPv4 address/CIDR.
+            proto: Optional IP protocol number.
+            dport: Optional destination port.
+            start: Optional start time, UNIX epoch seconds (inclusive).
+            end: Optional end time, UNIX epoch seconds (exclusive).
+
+        Returns:
+            List: The matching INDEX_FLOW tuples (src, dst, proto, dport,
+                first_seen, last_seen, offsets start, count).
+        """
+
+        if (start is not None and self.last_seen < start) or (
+                end is not None and self.first_seen >= end):
+
+            return []
+
+        src_range = get_cidr_range(src) if src else None
+        dst_range = get_cidr_range(dst) if dst else None
+
+        matches = []
+        for flow in self.load():
+
+            if src_range and flow[0] & src_range[1] != src_range[0]:
+
+                continue
+
+            if dst_range and flow[1] & dst_range[1] != dst_range[0]:
+
+                continue
+
+            if proto is not None and flow[2] != proto:
+
+                continue
+
+            if dport is not None and flow[3] != dport:
+
+                continue
+
+            if start is not None and flow[5] < start:
+
+                continue
+
+            if end is not None and flow[4] >= end:
+
+                continue
+
+            matches.append(flow)
+
+        return matches
+
+    def get_offsets(self, flows=None):
+        """
+        The function for reading the packet offsets of flows.
+
+        Args:
+            flows: The flows (from find()).
+
+        Returns:
+            List: The packet record offsets, sorted.
+        """
+
+        offsets = []
+        size = INDEX_OFFSET.size
+        with open(self.index_path, 'rb') as f:
+
+            for flow in flows:
+
+                f.seek(self.offsets_start + flow[6] * size)
+                data = f.read(flow[7] * size)
+                offsets.extend(struct.unpack(
+                    '<{0}Q'.format(len(data) // size),
+                    data[:len(data) // size * size]))
+
+        return sorted(offsets)
+
+
+def extract(paths=None, output_path=None, src=None, dst=None, proto=None,
+            dport=None, start=None, end=None, build=True):
+    """
+    The function for extracting the packets matching the filters from
+    indexed capture files into a new pcap. Only the matching packets are
+    read (by seeking to their offsets). Packets are written in file order,
+    then capture order.
+
+    Args:
+        paths: List of pcap file paths (plain or gzip), e.g., oldest first.
+        output_path: The output pcap path.
+        src: Optional source IPv4 address/CIDR.
+        dst: Optional destination IPv4 address/CIDR.
+        proto: Optional IP protocol number.
+        dport: Optional destination port.
+        start: Optional start time, UNIX epoch seconds (inclusive).
+        end: Optional end time, UNIX epoch seconds (exclusive).
+        build: If True, index capture files without an up to date index
+            first.
+
+    Returns:
+        Integer: The number of packets written.
+
+    Raises:
+        ValueError: The capture files have different link types.
+    """
+
+    writer = None
+    written = 0
+
+    try:
+
+        for path in paths:
+
+            index_path = get_index_path(path)
+            if not is_indexed(path, index_path):
+
+                if not build:
+
+                    log.warning('No index for {0}, skipping'.format(path))
+                    continue
+
+                build_index(path, index_path)
+
+            index = FlowIndex(index_path)
+            flows = index.find(src, dst, proto, dport, start, end)
+            if not flows:
+
+                continue
+
+            if writer is None:
+
+                writer = PcapWriter(output_path, index.linktype, SNAPLEN,
+                                    append=False)
+
+            elif writer.linktype != index.linktype:
+
+                raise ValueError('{0} has linktype {1}, not {2}'.format(
+                    path, index.linktype, writer.linktype))
+
+            reader = PcapReader(path)
+            try:
+
+                for offset in index.get_offsets(flows):
+
+                    packet = reader.read_packet(offset)
+                    if packet is None:
+
+                        break
+
+                    timestamp, data, orig_len = packet
+
+                    if (start is not None and timestamp < start) or (
+                            end is not None and timestamp >= end):
+
+                        continue
+
+                    writer.write(timestamp, data, orig_len)
+                    written += 1
+
+            finally:
+
+                reader.close()
+
+    finally:
+
+        if writer is not None:
+
+            writer.close()
+
+    log.info('Extracted {0} packets to {1}'.format(written, output_path))
+
+    return written
@@ -0,0 +1,264 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import heapq
+import logging
+from .pcap import PcapReader, PcapWriter
+from .pcapindex import FlowIndex, get_flow, get_index_path, is_indexed
+from .utils import get_cidr_range
+
+log = logging.getLogger(__name__)
+
+
+def get_first_packet(path=None):
+    """
+    The function for reading the header and first packet time of a pcap
+    file.
+
+    Args:
+        path: The pcap file path (plain or gzip).
+
+    Returns:
+        Tuple: (timestamp, linktype, snaplen); timestamp is None if the file
+            has no packets.
+    """
+
+    reader = PcapReader(path)
+    try:
+
+        packet = reader.read_packet()
+
+    finally:
+
+        reader.close()
+
+    return packet[0] if packet else None, reader.linktype, reader.snaplen
+
+
+class PcapMerger:
+    """
+    The class for merging pcap files (e.g., rotated or per NFLOG group
+    captures that overlap in time) into one stream ordered by packet time,
+    with a heap based k-way merge. Each file is expected to be in capture
+    order. Only one packet per open file is held, and a file is only opened
+    once the merge reaches its first packet, so memory (and open files) is
+    bounded by the number of files that overlap in time.
+
+    Args:
+        paths: List of pcap file paths (plain or gzip).
+        start: Optional start time, UNIX epoch seconds (inclusive).
+        end: Optional end time, UNIX epoch seconds (exclusive).
+        src: Optional source IPv4 address/CIDR.
+        dst: Optional destination IPv4 address/CIDR.
+
+    Raises:
+        ValueError: The files have different link types, or one is not a
+            pcap file.
+    """
+
+    def __init__(self, paths=None, start=None, end=None, src=None,
+                 dst=None):
+
+        self.start = start
+        self.end = end
+        self.src_range = get_cidr_range(src) if src else None
+        self.dst_range = get_cidr_range(dst) if dst else None
+        self.linktype = None
+        self.snaplen = 0
+        self.packets = 0
+        self.filtered = 0
+        self.files = []
+
+        for path in paths:
+
+            # Files outside the time window are skipped by their flow index.
+            if (start is not None or end is not None) and is_indexed(path):
+
+                index = FlowIndex(get_index_path(path))
+                if ((start is not None and index.last_seen < start) or
+                        (end is not None and index.first_seen >= end)):
+
+                    log.debug('Skipping {0} (time range)'.format(path))
+                    continue
+
+            timestamp, linktype, snaplen = get_first_packet(path)
+            if self.linktype is None:
+
+                self.linktype = linktype
+
+            elif linktype != self.linktype:
+
+                raise ValueError('{0} has linktype {1}, not {2}'.format(
+                    path, linktype, self.linktype))
+
+            if timestamp is None or (end is not None and timestamp >= end):
+
+                continue
+
+            self.snaplen = max(self.snaplen, snaplen)
+            self.files.append((timestamp, path))
+
+    def match(self, data=b''):
+        """
+        The function for checking a packet against the CIDR filters.
+
+        Args:
+            data: The packet (bytes).
+
+        Returns:
+            Boolean: True if the packet matches (or there are no filters).
+        """
+
+        if not (self.src_range or self.dst_range):
+
+            return True
+
+        flow = get_flow(data, self.linktype)
+        if flow is None:
+
+            return False
+
+        if self.src_range and (
+                flow[0] & self.src_range[1] != self.src_range[0]):
+
+            return False
+
+        if self.dst_range and (
+                flow[1] & self.dst_range[1] != self.dst_range[0]):
+
+            return False
+
+        return True
+
+    def iter_packets(self):
+        """
+        The generator for merging the packets. Packets with the same time
+        are in file (paths) order.
+
+        Yields:
+            Tuple: (timestamp, data, orig_len).
+        """
+
+        start = self.start
+        end = self.end
+        match = self.match
+        readers = {}
+
+        # Heap entries are (timestamp, file number, data, orig_len); a file
+        # has one entry at a time, its first packet (data None) until opened.
+        heap = [(timestamp, i, None, None)
+                for i, (timestamp, path) in enumerate(self.files)]
+        heapq.heapify(heap)
+
+        try:
+
+            while heap:
+
+                timestamp, i, data, orig_len = heap[0]
+
+                if end is not None and timestamp >= end:
+
+                    break
+
+                if data is None:
+
+                    log.debug('Opening {0}'.format(self.files[i][1]))
+                    readers[i] = PcapReader(self.files[i][1])
+
+                else:
+
+                    if start is None or timestamp >= start:
+
+                        if match(data):
+
+                            self.packets += 1
+                            yield timestamp, data, orig_len
+
+                        else:
+
+                            self.filtered += 1
+
+                    else:
+
+                        self.filtered += 1
+
+                packet = readers[i].read_packet()
+                if packet is None:
+
+                    heapq.heappop(heap)
+                    readers.pop(i).close()
+
+                else:
+
+                    heapq.heapreplace(heap, (packet[0], i) + packet[1:])
+
+        finally:
+
+            for reader in readers.values():
+
+                reader.close()
+
+
+def merge_files(paths=None, output_path=None, start=None, end=None,
+                src=None, dst=None):
+    """
+    The function for merging pcap files into one pcap ordered by packet
+    time (see PcapMerger).
+
+    Args:
+        paths: List of pcap file paths (plain or gzip).
+        output_path: The output pcap path.
+        start: Optional start time, UNIX epoch seconds (inclusive).
+        end: Optional end time, UNIX epoch seconds (exclusive).
+        src: Optional source IPv4 address/CIDR.
+        dst: Optional destination IPv4 address/CIDR.
+
+    Returns:
+        Integer: The number of packets written.
+    """
+
+    merger = PcapMerger(paths, start, end, src, dst)
+    if not merger.files:
+
+        log.info('No packets to merge')
+        return 0
+
+    writer = PcapWriter(output_path, merger.linktype, merger.snaplen,
+                        append=False)
+    try:
+
+        write = writer.write
+        for timestamp, data, orig_len in merger.iter_packets():
+
+            write(timestamp, data, orig_len)
+
+    finally:
+
+        writer.close()
+
+    log.info('Merged {0} files to {1}: {2} packets, {3} filtered'.format(
+        len(merger.files), output_path, merger.packets, merger.filtered))
+
+    return merger.packets
@@ -0,0 +1,314 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import binascii
+import calendar
+import gzip
+import logging
+import multiprocessing
+import os
+import time
+from .pcap import LINKTYPE_NFLOG, LINKTYPE_RAW, PcapWriter
+
+log = logging.getLogger(__name__)
+
+# The width of the hex part of a tcpdump -X/-XX line (8 groups of " xxxx").
+HEX_WIDTH = 40
+
+# The pcap snapshot length for converted packets (NFLOG headers included).
+SNAPLEN = 262144
+
+# Timestamps cached per second.
+TIMESTAMP_CACHE_SIZE = 65536
+
+
+def get_linktype(data=b''):
+    """
+    The function for detecting the link type of a hex dumped packet. With
+    -XX on an nflog interface, the dump starts with the NFLOG header
+    (family AF_INET/AF_INET6, version 0); otherwise with the IP header.
+
+    Args:
+        data: The packet (bytes).
+
+    Returns:
+        Integer: LINKTYPE_NFLOG or LINKTYPE_RAW.
+    """
+
+    head = bytearray(data[:2])
+    if len(head) == 2 and head[0] in (2, 10) and head[1] == 0:
+
+        return LINKTYPE_NFLOG
+
+    return LINKTYPE_RAW
+
+
+class TextCaptureParser:
+    """
+    The class for parsing the tcpdump -nnlttttvvXXs 0 text capture log
+    (/var/log/nfsinkhole-pcap.log) back into packets. A packet is a header
+    line starting with the -tttt timestamp, followed by -vv decode lines
+    (ignored) and 0x0000: hex dump lines.
+
+    Args:
+        utc: If True, the timestamps are UTC (nfsinkhole-setup.py sets the
+            system timezone to UTC); otherwise local time.
+    """
+
+    def __init__(self, utc=True):
+
+        self.utc = utc
+        self.timestamps = {}
+        self.skipped = 0
+
+    def get_timestamp(self, line=b''):
+        """
+        The function for parsing a header line timestamp
+        (YYYY-MM-DD HH:MM:SS.ffffff).
+
+        Args:
+            line: The header line (bytes).
+
+        Returns:
+            Float: UNIX epoch seconds, or None if not a header line.
+        """
+
+        key = line[:19]
+        try:
+
+            seconds = self.timestamps[key]
+
+        except KeyError:
+
+            try:
+
+                parsed = time.strptime(key.decode('ascii'),
+                                       '%Y-%m-%d %H:%M:%S')
+
+            except (ValueError, UnicodeDecodeError):
+
+                return None
+
+            if len(self.timestamps) >= TIMESTAMP_CACHE_SIZE:
+
+                self.timestamps.clear()
+
+            seconds = self.timestamps[key] = (
+                calendar.timegm(parsed) if self.utc else time.mktime(parsed)
+            )
+
+        fraction = 0.0
+        if line[19:20] == b'.':
+
+            end = line.find(b' ', 20)
+            digits = line[20:end if end > 0 else None].strip()
+            if digits.isdigit():
+
+                fraction = int(digits) / float(10 ** len(digits))
+
+        return seconds + fraction
+
+    def iter_packets(self, lines=None):
+        """
+        The generator for parsing packets from text capture log lines.
+        Packets with a missing or out of order hex dump are skipped
+        (counted in skipped).
+
+        Args:
+            lines: An iterable of lines (bytes), e.g., a file object.
+
+        Yields:
+            Tuple: (timestamp, data); timestamp is UNIX epoch seconds
+                (float), data is the dumped packet (bytes).
+        """
+
+        unhexlify = binascii.unhexlify
+        timestamp = None
+        data = []
+        length = 0
+        valid = False
+
+        for line in lines:
+
+            stripped = line.lstrip()
+
+            if stripped[:2] == b'0x':
+
+                if timestamp is None or not valid:
+
+                    continue
+
+                colon = stripped.find(b':')
+                try:
+
+                    offset = int(stripped[2:colon], 16)
+                    chunk = unhexlify(stripped[
+                        colon + 2:colon + 2 + HEX_WIDTH].replace(b' ', b''))
+
+                except (ValueError, TypeError, binascii.Error):
+
+                    valid = False
+                    continue
+
+                if offset != length:
+
+                    valid = False
+                    continue
+
+                data.append(chunk)
+                length += len(chunk)
+
+            elif line[:1].isdigit():
+
+                if timestamp is not None:
+
+                    if valid and length:
+
+                        yield timestamp, b''.join(data)
+
+                    else:
+
+                        self.skipped += 1
+
+                timestamp = self.get_timestamp(line)
+                data = []
+                length = 0
+                valid = timestamp is not None
+
+        if timestamp is not None:
+
+            if valid and length:
+
+                yield timestamp, b''.join(data)
+
+            else:
+
+                self.skipped += 1
+
+
+def get_output_path(path=None, output_dir=None):
+    """
+    The function for getting the pcap path for a text capture log, e.g.,
+    nfsinkhole-pcap.log -> nfsinkhole-pcap.pcap, and
+    nfsinkhole-pcap.log.1.gz -> nfsinkhole-pcap.log.1.pcap.
+
+    Args:
+        path: The text capture log path.
+        output_dir: The output directory, or None for the log directory.
+
+    Returns:
+        String: The pcap path.
+    """
+
+    directory, name = os.path.split(path)
+    if name.endswith('.gz'):
+
+        name = name[:-3]
+
+    if name.endswith('.log'):
+
+        name = name[:-4]
+
+    return os.path.join(output_dir or directory, name + '.pcap')
+
+
+def convert_file(task=None):
+    """
+    The function for converting a text capture log (plain or gzip) to pcap,
+    streaming (a process pool task). The link type is detected from the
+    first packet.
+
+    Args:
+        task: Tuple (path, output_path, utc).
+
+    Returns:
+        Tuple: (path, output_path, packets, skipped).
+    """
+
+    path, output_path, utc = task
+    parser = TextCaptureParser(utc=utc)
+    writer = None
+
+    f = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    try:
+
+        for timestamp, data in parser.iter_packets(f):
+
+            if writer is None:
+
+                writer = PcapWriter(output_path, get_linktype(data),
+                                    SNAPLEN, append=False)
+
+            writer.write(timestamp, data)
+
+    finally:
+
+        f.close()
+
+        if writer is not None:
+
+            writer.close()
+
+    packets = writer.packets if writer is not None else 0
+    log.info('Converted {0} to {1}: {2} packets, {3} skipped'.format(
+        path, output_path, packets, parser.skipped))
+
+    return path, output_path, packets, parser.skipped
+
+
+def convert_files(paths=None, output_dir=None, processes=None, utc=True):
+    """
+    The function for converting text capture logs to pcap files, one file
+    per process. Memory use per process is bounded by the largest packet,
+    not the file size.
+
+    Args:
+        paths: List of text capture log paths (plain or gzip).
+        output_dir: The output directory, or None for each log directory.
+        processes: The number of worker processes. Defaults to the number of
+            CPUs.
+        utc: If True, the timestamps are UTC; otherwise local time.
+
+    Returns:
+        List: (path, output_path, packets, skipped) tuples, in paths order.
+            Logs without packets do not create a pcap.
+    """
+
+    tasks = [(p, get_output_path(p, output_dir), utc) for p in paths]
+
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1 or len(tasks) < 2:
+
+        return [convert_file(task) for task in tasks]
+
+    pool = multiprocessing.Pool(min(processes, len(tasks)))
+    try:
+
+        return pool.map(convert_file, tasks, chunksize=1)
+
+    finally:
+
+        pool.close()
+        pool.join()
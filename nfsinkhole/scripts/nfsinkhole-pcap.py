@@ -0,0 +1,215 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import argparse
+import logging
+import time
+from nfsinkhole.bulk import get_paths
+from nfsinkhole.pcapindex import build_index, extract
+from nfsinkhole.pcapmerge import merge_files
+from nfsinkhole.pcaptext import convert_files
+from nfsinkhole.utils import parse_timestamp
+
+# Setup the arg parser.
+parser = argparse.ArgumentParser(
+    description='nfsinkhole packet capture utilities',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+)
+
+# Mututally exclusive arg group - the operation
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument(
+    '--convert',
+    type=str,
+    nargs='+',
+    metavar='FILE',
+    help='Convert tcpdump text capture logs (/var/log/nfsinkhole-pcap.log*, '
+         'plain or gzip; glob patterns accepted) to pcap files.'
+)
+group.add_argument(
+    '--index',
+    type=str,
+    nargs='+',
+    metavar='FILE',
+    help='Write a flow index (FILE.idx) for pcap files (plain or gzip; glob '
+         'patterns accepted).'
+)
+group.add_argument(
+    '--extract',
+    type=str,
+    nargs='+',
+    metavar='FILE',
+    help='Write the packets matching --src, --dst, --proto, --dport, '
+         '--start and --end in pcap files (plain or gzip; glob patterns '
+         'accepted, oldest first) to --output, using (and writing missing) '
+         'flow indexes.'
+)
+group.add_argument(
+    '--merge',
+    type=str,
+    nargs='+',
+    metavar='FILE',
+    help='Merge pcap files (plain or gzip; glob patterns accepted), e.g., '
+         'rotated or per NFLOG group captures, into --output ordered by '
+         'packet time, filtered by --src, --dst, --start and --end.'
+)
+
+parser.add_argument(
+    '--output-dir',
+    type=str,
+    default=None,
+    help='The directory for --convert pcap files. Defaults to the directory '
+         'of each log.'
+)
+
+parser.add_argument(
+    '--output',
+    type=str,
+    default='nfsinkhole-extract.pcap',
+    help='The pcap file --extract or --merge writes.'
+)
+
+parser.add_argument(
+    '--src',
+    type=str,
+    default=None,
+    help='The --extract/--merge source IPv4 address/CIDR.'
+)
+
+parser.add_argument(
+    '--dst',
+    type=str,
+    default=None,
+    help='The --extract/--merge destination IPv4 address/CIDR.'
+)
+
+parser.add_argument(
+    '--proto',
+    type=int,
+    default=None,
+    help='The --extract IP protocol number (e.g., 6 for TCP).'
+)
+
+parser.add_argument(
+    '--dport',
+    type=int,
+    default=None,
+    help='The --extract destination port (ICMP type * 256 + code).'
+)
+
+parser.add_argument(
+    '--start',
+    type=parse_timestamp,
+    default=None,
+    help='The --extract/--merge start time (inclusive); UNIX epoch seconds '
+         'or UTC YYYY-MM-DDTHH:MM:SS.'
+)
+
+parser.add_argument(
+    '--end',
+    type=parse_timestamp,
+    default=None,
+    help='The --extract/--merge end time (exclusive); UNIX epoch seconds '
+         'or UTC YYYY-MM-DDTHH:MM:SS.'
+)
+
+parser.add_argument(
+    '--processes',
+    type=int,
+    default=None,
+    help='The number of worker processes. Defaults to the number of CPUs.'
+)
+
+parser.add_argument(
+    '--local-time',
+    action='store_true',
+    help='The --convert log timestamps are local time, not UTC.'
+)
+
+parser.add_argument(
+    '--loglevel',
+    type=str,
+    default='info',
+    choices=['debug', 'info', 'warning', 'error', 'critical'],
+    help='Logging level for nfsinkhole events. Must be one of debug, info, '
+         'warning, error, critical.'
+)
+
+# Get the args
+script_args = parser.parse_args()
+
+# Logging
+LOG_FORMAT = ('[%(asctime)s.%(msecs)03d] [%(levelname)s] '
+              '[%(filename)s:%(lineno)s] [%(funcName)s()] %(message)s')
+logging.basicConfig(format=LOG_FORMAT,
+                    level=getattr(logging, script_args.loglevel.upper()),
+                    datefmt='%Y-%m-%dT%H:%M:%S')
+logging.Formatter.converter = time.gmtime
+log = logging.getLogger(__name__)
+log.info('nfsinkhole-pcap.py called')
+
+paths = []
+for pattern in (script_args.convert or script_args.index or
+                script_args.extract or script_args.merge):
+
+    paths += [p for p in get_paths(pattern)
+              if p not in paths and not p.endswith('.idx')]
+
+if script_args.convert:
+
+    results = convert_files(paths, output_dir=script_args.output_dir,
+                            processes=script_args.processes,
+                            utc=not script_args.local_time)
+
+    for path, output_path, packets, skipped in results:
+
+        print('{0} -> {1}: {2} packets, {3} skipped'.format(
+            path, output_path if packets else '(none)', packets, skipped))
+
+elif script_args.index:
+
+    for path in paths:
+
+        print('{0}: {1} flows'.format(path, build_index(path)))
+
+elif script_args.extract:
+
+    count = extract(paths, script_args.output, src=script_args.src,
+                    dst=script_args.dst, proto=script_args.proto,
+                    dport=script_args.dport, start=script_args.start,
+                    end=script_args.end)
+
+    print('{0}: {1} packets'.format(script_args.output, count))
+
+elif script_args.merge:
+
+    count = merge_files(paths, script_args.output, start=script_args.start,
+                        end=script_args.end, src=script_args.src,
+                        dst=script_args.dst)
+
+    print('{0}: {1} packets'.format(script_args.output, count))
+
+# All done
+log.info('Operations completed.')
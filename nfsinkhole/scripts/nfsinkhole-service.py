@@ -24,12 +24,20 @@
 
 import argparse
 import logging
+import os
+import signal
 import subprocess
+import sys
 import time
 # TODO: generic errors via IPTablesError
-from nfsinkhole.exceptions import (IPTablesError, IPTablesExists,
-                                   IPTablesNotExists)
+from nfsinkhole.exceptions import (IPSetError, IPTablesError, IPTablesExists,
+                                   IPTablesNotExists, NFLogError,
+                                   NFTablesError, NFTablesExists,
+                                   NFTablesNotExists)
 from nfsinkhole.iptables import IPTablesSinkhole
+from nfsinkhole.nflog import NFLog, capture
+from nfsinkhole.nftables import NFTablesSinkhole
+from nfsinkhole.pcap import PcapRing, PcapWriter
 from nfsinkhole.utils import (ANSI, popen_wrapper, get_interface_addr)
 
 # Setup the arg parser.
@@ -38,7 +46,8 @@ parser = argparse.ArgumentParser(
     formatter_class=argparse.ArgumentDefaultsHelpFormatter
 )
 
-# Mututally exclusive arg group - must be --create OR --delete (not both)
+# Mututally exclusive arg group - must be --create, --delete, --reconcile,
+# --capture, OR an --exclude-* runtime exclusion update
 group = parser.add_mutually_exclusive_group(required=True)
 group.add_argument(
     '--create',
@@ -50,6 +59,105 @@ group.add_argument(
     action='store_true',
     help='Remove the configuration.'
 )
+group.add_argument(
+    '--reconcile',
+    action='store_true',
+    help='Perform the configuration incrementally; only rules that differ '
+         'from the live rules are changed. Does nothing if the configuration '
+         'matches the last one applied (/var/run/nfsinkhole.state).'
+)
+group.add_argument(
+    '--exclude-add',
+    type=str,
+    metavar='ADDRS',
+    help='Add a comma separated string of source IPs/CIDRs to the live '
+         'exclusions, without changing any other rule. --reconcile (service '
+         'reload) reverts runtime changes to the configured exclusions.'
+)
+group.add_argument(
+    '--exclude-del',
+    type=str,
+    metavar='ADDRS',
+    help='Delete a comma separated string of source IPs/CIDRs from the live '
+         'exclusions, without changing any other rule. --reconcile (service '
+         'reload) reverts runtime changes to the configured exclusions.'
+)
+group.add_argument(
+    '--exclude-sync',
+    type=str,
+    metavar='FILE',
+    help='Replace the live exclusions with --srcexclude plus the IPs/CIDRs '
+         'in FILE, in a single batch.'
+)
+
+group.add_argument(
+    '--capture',
+    action='store_true',
+    help='Capture the --nflog-group packets to --capture-file (pcap) in '
+         'process, until stopped.'
+)
+
+parser.add_argument(
+    '--capture-file',
+    type=str,
+    default='/var/log/nfsinkhole.pcap',
+    help='The pcap file --capture appends to.'
+)
+
+parser.add_argument(
+    '--capture-ring',
+    action='store_true',
+    help='With --capture, write a ring of pcap files named after '
+         '--capture-file, rotated by --capture-size and --capture-seconds.'
+)
+
+parser.add_argument(
+    '--capture-size',
+    type=int,
+    default=100,
+    help='The --capture-ring file size, in millions of bytes.'
+)
+
+parser.add_argument(
+    '--capture-count',
+    type=int,
+    default=10,
+    help='The number of --capture-ring files kept.'
+)
+
+parser.add_argument(
+    '--capture-seconds',
+    type=int,
+    default=3600,
+    help='The --capture-ring file age (seconds) after which a new file is '
+         'started.'
+)
+
+parser.add_argument(
+    '--capture-no-compress',
+    action='store_true',
+    help='Do not gzip --capture-ring files when they are closed.'
+)
+
+parser.add_argument(
+    '--capture-index',
+    action='store_true',
+    help='Write a flow index for --capture-ring files when they are closed.'
+)
+
+parser.add_argument(
+    '--exclude-watch',
+    action='store_true',
+    help='With --exclude-sync, keep running and re-sync whenever FILE '
+         'changes.'
+)
+
+parser.add_argument(
+    '--exclude-interval',
+    type=float,
+    default=5,
+    help='The number of seconds between --exclude-watch checks.'
+)
 
 parser.add_argument(
     '--protocol',
@@ -107,6 +215,31 @@ parser.add_argument(
     help='Number of milliseconds to keep entries in the hash table.'
 )
 
+parser.add_argument(
+    '--hashlimit-htable-size',
+    type=int,
+    default=None,
+    help='The number of buckets in the hashlimit hash table. Defaults to a '
+         'kernel value based on memory.'
+)
+
+parser.add_argument(
+    '--hashlimit-htable-max',
+    type=int,
+    default=None,
+    help='The maximum number of entries in the hashlimit hash table. When '
+         'full, new sources are not logged. Defaults to 8 x '
+         '--hashlimit-htable-size.'
+)
+
+parser.add_argument(
+    '--hashlimit-htable-gcinterval',
+    type=int,
+    default=None,
+    help='Number of milliseconds between hashlimit hash table garbage '
+         'collection runs. Defaults to 1000.'
+)
+
 parser.add_argument(
     '--srcexclude',
     type=str,
@@ -114,6 +247,71 @@ parser.add_argument(
     help='Exclude a comma separated string of source IPs/CIDRs from logging.'
 )
 
+parser.add_argument(
+    '--srcexclude-ipset',
+    action='store_true',
+    help='Load --srcexclude into a hash:net ipset (nfsinkhole-srcexclude), '
+         'matched by a single iptables rule. Recommended for large exclusion '
+         'lists. Requires ipset.'
+)
+
+parser.add_argument(
+    '--srcexclude-file',
+    type=str,
+    default=None,
+    help='A file of additional source IPs/CIDRs to exclude from logging '
+         '(newline, space or comma separated; # comments).'
+)
+
+parser.add_argument(
+    '--notrack',
+    action='store_true',
+    help='Exempt sinkhole interface traffic from connection tracking '
+         '(iptables raw table NOTRACK), so scans/floods do not fill '
+         'nf_conntrack. Logging is unaffected.'
+)
+
+parser.add_argument(
+    '--rawdrop',
+    action='store_true',
+    help='Drop sinkhole interface traffic that would never be logged '
+         '(--srcexclude sources, and protocols/ports not matching '
+         '--protocol/--dport) in the iptables raw table, before connection '
+         'tracking.'
+)
+
+parser.add_argument(
+    '--nflog-group',
+    type=str,
+    default='0',
+    help='The NFLOG netlink group (0 - 65535) for packet capture.'
+)
+
+parser.add_argument(
+    '--nflog-size',
+    type=str,
+    default=None,
+    help='The number of bytes of each packet copied to userspace for packet '
+         'capture (snaplen), e.g., headers plus the first N bytes of '
+         'payload. The full packet is copied if not set.'
+)
+
+parser.add_argument(
+    '--nflog-threshold',
+    type=str,
+    default='1',
+    help='The number of packets queued in the kernel before they are sent '
+         'to userspace in a single netlink message.'
+)
+
+parser.add_argument(
+    '--backend',
+    type=str,
+    default='iptables',
+    choices=['iptables', 'nftables'],
+    help='The firewall backend used to manage the sinkhole rules.'
+)
+
 parser.add_argument(
     '--loglevel',
     type=str,
@@ -154,12 +352,63 @@ log.info('nfsinkhole-service.py called')
 
 # Get the network interface info
 interface = script_args.interface
-interface_addr = get_interface_addr(interface)
+interface_addr = None if script_args.capture else get_interface_addr(interface)
+
+if script_args.capture:
+
+    log.info('Capturing NFLOG group {0} to {1} (--capture)'.format(
+        script_args.nflog_group, script_args.capture_file))
+
+    # Stop cleanly (flush the pcap, unbind the group) on service stop.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    nflog = NFLog(
+        group=script_args.nflog_group,
+        copy_range=int(script_args.nflog_size or 0xFFFF)
+    )
+    writer = None
+    try:
+
+        nflog.open()
+        if script_args.capture_ring:
+
+            writer = PcapRing(
+                script_args.capture_file,
+                file_size=script_args.capture_size * 1000000,
+                file_seconds=script_args.capture_seconds,
+                file_count=script_args.capture_count,
+                compress=not script_args.capture_no_compress,
+                index=script_args.capture_index
+            )
+
+        else:
+
+            writer = PcapWriter(script_args.capture_file)
+
+        capture(nflog, writer)
+
+    except NFLogError as e:
+
+        log.info('An error occurred capturing NFLOG packets: {0}'.format(e))
+        raise e
+
+    except (KeyboardInterrupt, SystemExit):  # pragma: no cover
+
+        log.info('Capture stopped.')
+
+    finally:
+
+        if writer:
+
+            writer.close()
 
-if interface_addr:
+        nflog.close()
+        log.info('NFLOG capture statistics: {0}'.format(nflog.get_stats()))
 
-    # Instantiate the iptable object with the script arguments.
-    myobj = IPTablesSinkhole(
+elif interface_addr:
+
+    # Instantiate the iptable/nftables object with the script arguments.
+    kwargs = dict(
         interface=interface,
         interface_addr=interface_addr,
         log_prefix=script_args.prefix,
@@ -169,9 +418,27 @@ if interface_addr:
         hashlimitmode=script_args.hashlimitmode,
         hashlimitburst=script_args.hashlimitburst,
         hashlimitexpire=script_args.hashlimitexpire,
-        srcexclude=script_args.srcexclude
+        hashlimit_htable_size=script_args.hashlimit_htable_size,
+        hashlimit_htable_max=script_args.hashlimit_htable_max,
+        hashlimit_htable_gcinterval=script_args.hashlimit_htable_gcinterval,
+        srcexclude=script_args.srcexclude,
+        srcexclude_file=script_args.srcexclude_file,
+        srcexclude_ipset=script_args.srcexclude_ipset,
+        notrack=script_args.notrack,
+        rawdrop=script_args.rawdrop,
+        nflog_group=script_args.nflog_group,
+        nflog_size=script_args.nflog_size,
+        nflog_threshold=script_args.nflog_threshold
     )
 
+    if script_args.backend == 'nftables':
+
+        myobj = NFTablesSinkhole(**kwargs)
+
+    else:
+
+        myobj = IPTablesSinkhole(**kwargs)
+
     # Delete the iptables configuration (not DROP statements)
     if script_args.delete:
 
@@ -181,22 +448,22 @@ if interface_addr:
 
             myobj.delete_rules()
 
-        except IPTablesError as e:
+        except (IPTablesError, NFTablesError) as e:
 
             log.info('An error occurred deleting the iptables rules: {0}'
                      ''.format(e))
             raise e
 
-        except IPTablesNotExists as e:
+        except (IPTablesNotExists, NFTablesNotExists) as e:
 
             log.info('An error occurred deleting the iptables rules: {0}'
                      ''.format(e))
             pass
 
     # Create the iptables configuration (create DROP statements if missing)
-    if script_args.create:
+    if script_args.create or script_args.reconcile:
 
-        log.info('Creating configuration (--create)')
+        log.info('Creating configuration (--create/--reconcile)')
 
         log.info('Creating iptables DROP rules for interface {0}. This should '
                  'fail under normal circumstances. '
@@ -206,30 +473,103 @@ if interface_addr:
 
             myobj.create_drop_rule()
 
-        except IPTablesError as e:
+        except (IPTablesError, NFTablesError) as e:
 
             log.info('An error occurred creating the iptables DROP rules: {0}'
                      ''.format(e))
             raise e
 
-        except IPTablesExists as e:
+        except (IPTablesExists, NFTablesExists) as e:
 
             log.info('An error occurred creating the iptables DROP rules: {0}'
                      ''.format(e))
             pass
 
+    if script_args.reconcile:
+
+        log.info('Reconciling iptables sinkhole logging rules for interface '
+                 '{0}'.format(script_args.interface))
+        try:
+
+            myobj.reconcile()
+
+        except (IPTablesError, NFTablesError) as e:
+
+            log.info('An error occurred reconciling the iptables rules: {0}'
+                     ''.format(e))
+            raise e
+
+    elif script_args.create:
+
         log.info('Creating iptables sinkhole logging rules for interface {0}'
                  ''.format(script_args.interface))
         try:
 
             myobj.create_rules()
 
-        except (IPTablesError, IPTablesExists) as e:
+        except (IPTablesError, IPTablesExists, NFTablesError,
+                NFTablesExists) as e:
 
             log.info('An error occurred creating the iptables rules: {0}'
                      ''.format(e))
             raise e
 
+    # Runtime exclusion updates (only the exclusion set/rules are changed)
+    try:
+
+        if script_args.exclude_add:
+
+            myobj.add_exclusions(script_args.exclude_add.split(','))
+
+        elif script_args.exclude_del:
+
+            myobj.delete_exclusions(script_args.exclude_del.split(','))
+
+        elif script_args.exclude_sync:
+
+            myobj.srcexclude_file = script_args.exclude_sync
+            srcexclude = myobj.srcexclude
+            last_stat = None
+
+            while True:
+
+                try:
+
+                    stat = os.stat(script_args.exclude_sync)
+                    stat = (stat.st_mtime, stat.st_size, stat.st_ino)
+
+                except OSError as e:
+
+                    log.error('Could not stat {0}: {1}'.format(
+                        script_args.exclude_sync, e))
+                    stat = None
+
+                if stat and stat != last_stat:
+
+                    # apply_exclusions() replaces srcexclude/srcexclude_file;
+                    # restore them so each sync reads the current file.
+                    myobj.srcexclude = srcexclude
+                    myobj.srcexclude_file = script_args.exclude_sync
+                    myobj.sync_exclusions(myobj.get_exclusions())
+                    last_stat = stat
+
+                if not script_args.exclude_watch:
+
+                    break
+
+                time.sleep(script_args.exclude_interval)
+
+    except (IPTablesError, IPTablesNotExists, IPSetError, NFTablesError,
+            NFTablesNotExists) as e:
+
+        log.info('An error occurred updating the exclusions: {0}'
+                 ''.format(e))
+        raise e
+
+    except KeyboardInterrupt:  # pragma: no cover
+
+        log.info('Exclusion watch stopped.')
+
 else:
 
     log.error('No address found for interface: {0}'.format(interface))
@@ -29,8 +29,11 @@ import subprocess
 import time
 from nfsinkhole.apparmor import AppArmor
 from nfsinkhole.exceptions import (IPTablesError, IPTablesExists,
-                                   IPTablesNotExists, BinaryNotFound)
+                                   IPTablesNotExists, NFTablesError,
+                                   NFTablesExists, NFTablesNotExists,
+                                   BinaryNotFound)
 from nfsinkhole.iptables import IPTablesSinkhole
+from nfsinkhole.nftables import NFTablesSinkhole
 from nfsinkhole.rsyslog import RSyslog
 from nfsinkhole.service import SystemService
 from nfsinkhole.syslog_ng import SyslogNG
@@ -124,6 +127,31 @@ parser.add_argument(
     help='Number of milliseconds to keep entries in the hash table.'
 )
 
+parser.add_argument(
+    '--hashlimit-htable-size',
+    type=int,
+    default=None,
+    help='The number of buckets in the hashlimit hash table. Defaults to a '
+         'kernel value based on memory.'
+)
+
+parser.add_argument(
+    '--hashlimit-htable-max',
+    type=int,
+    default=None,
+    help='The maximum number of entries in the hashlimit hash table. When '
+         'full, new sources are not logged. Defaults to 8 x '
+         '--hashlimit-htable-size.'
+)
+
+parser.add_argument(
+    '--hashlimit-htable-gcinterval',
+    type=int,
+    default=None,
+    help='Number of milliseconds between hashlimit hash table garbage '
+         'collection runs. Defaults to 1000.'
+)
+
 parser.add_argument(
     '--srcexclude',
     type=str,
@@ -131,6 +159,22 @@ parser.add_argument(
     help='Exclude a comma separated string of source IPs/CIDRs from logging.'
 )
 
+parser.add_argument(
+    '--srcexclude-ipset',
+    action='store_true',
+    help='Load --srcexclude into a hash:net ipset (nfsinkhole-srcexclude), '
+         'matched by a single iptables rule. Recommended for large exclusion '
+         'lists. Requires ipset.'
+)
+
+parser.add_argument(
+    '--srcexclude-file',
+    type=str,
+    default=None,
+    help='A file of additional source IPs/CIDRs to exclude from logging '
+         '(newline, space or comma separated; # comments).'
+)
+
 parser.add_argument(
     '--pcap',
     action='store_true',
@@ -144,6 +188,109 @@ parser.add_argument(
          )
 )
 
+parser.add_argument(
+    '--capture',
+    type=str,
+    default='tcpdump',
+    choices=['tcpdump', 'nflog'],
+    help='The --pcap capture method. nflog receives packets in process '
+         '(nfsinkhole-service.py --capture) and writes '
+         '/var/log/nfsinkhole.pcap; tcpdump and AppArmor changes are not '
+         'needed.'
+)
+
+parser.add_argument(
+    '--pcap-ring',
+    action='store_true',
+    help='Capture to a ring of binary pcap files (/var/log/nfsinkhole.pcap*) '
+         'rotated by size (and age, with --capture nflog), so disk use is '
+         'bounded.'
+)
+
+parser.add_argument(
+    '--pcap-file-size',
+    type=int,
+    default=100,
+    help='The --pcap-ring file size, in millions of bytes.'
+)
+
+parser.add_argument(
+    '--pcap-file-count',
+    type=int,
+    default=10,
+    help='The number of --pcap-ring files kept.'
+)
+
+parser.add_argument(
+    '--pcap-file-seconds',
+    type=int,
+    default=3600,
+    help='The --pcap-ring file age (seconds) after which a new file is '
+         'started (--capture nflog only).'
+)
+
+parser.add_argument(
+    '--pcap-no-compress',
+    action='store_true',
+    help='Do not gzip --pcap-ring files when they are closed.'
+)
+
+parser.add_argument(
+    '--pcap-index',
+    action='store_true',
+    help='Write a flow index for --pcap-ring files when they are closed, '
+         'for nfsinkhole-pcap.py --extract. --capture nflog only.'
+)
+
+parser.add_argument(
+    '--notrack',
+    action='store_true',
+    help='Exempt sinkhole interface traffic from connection tracking '
+         '(iptables raw table NOTRACK), so scans/floods do not fill '
+         'nf_conntrack. Logging is unaffected.'
+)
+
+parser.add_argument(
+    '--rawdrop',
+    action='store_true',
+    help='Drop sinkhole interface traffic that would never be logged '
+         '(--srcexclude sources, and protocols/ports not matching '
+         '--protocol/--dport) in the iptables raw table, before connection '
+         'tracking.'
+)
+
+parser.add_argument(
+    '--nflog-group',
+    type=str,
+    default='0',
+    help='The NFLOG netlink group (0 - 65535) for packet capture.'
+)
+
+parser.add_argument(
+    '--nflog-size',
+    type=str,
+    default=None,
+    help='The number of bytes of each packet copied to userspace for packet '
+         'capture (snaplen), e.g., headers plus the first N bytes of '
+         'payload. The full packet is copied if not set.'
+)
+
+parser.add_argument(
+    '--nflog-threshold',
+    type=str,
+    default='1',
+    help='The number of packets queued in the kernel before they are sent '
+         'to userspace in a single netlink message.'
+)
+
+parser.add_argument(
+    '--backend',
+    type=str,
+    default='iptables',
+    choices=['iptables', 'nftables'],
+    help='The firewall backend used to manage the sinkhole rules.'
+)
+
 parser.add_argument(
     '--loglevel',
     type=str,
@@ -192,8 +339,26 @@ system_service = SystemService(
     hashlimitmode=script_args.hashlimitmode,
     hashlimitburst=script_args.hashlimitburst,
     hashlimitexpire=script_args.hashlimitexpire,
+    hashlimit_htable_size=script_args.hashlimit_htable_size,
+    hashlimit_htable_max=script_args.hashlimit_htable_max,
+    hashlimit_htable_gcinterval=script_args.hashlimit_htable_gcinterval,
     srcexclude=script_args.srcexclude,
+    srcexclude_ipset=script_args.srcexclude_ipset,
+    srcexclude_file=script_args.srcexclude_file,
+    notrack=script_args.notrack,
+    rawdrop=script_args.rawdrop,
+    nflog_group=script_args.nflog_group,
+    nflog_size=script_args.nflog_size,
+    nflog_threshold=script_args.nflog_threshold,
     pcap=script_args.pcap,
+    capture=script_args.capture,
+    pcap_ring=script_args.pcap_ring,
+    pcap_file_size=script_args.pcap_file_size,
+    pcap_file_count=script_args.pcap_file_count,
+    pcap_file_seconds=script_args.pcap_file_seconds,
+    pcap_compress=not script_args.pcap_no_compress,
+    pcap_index=script_args.pcap_index,
+    backend=script_args.backend,
     loglevel=script_args.loglevel
 )
 is_systemd, svc_path = system_service.check_systemd()
@@ -224,27 +389,50 @@ if script_args.uninstall:
     log.info('Deleting iptables DROP rules for interface {0}'.format(
         script_args.interface
     ))
-    myobj = IPTablesSinkhole(
-        interface=script_args.interface,
-    )
+    if script_args.backend == 'nftables':
+
+        myobj = NFTablesSinkhole(interface=script_args.interface)
+
+    else:
+
+        myobj = IPTablesSinkhole(interface=script_args.interface)
+
+    # The service keeps the sinkhole rules when stopped.
+    log.info('Deleting sinkhole rules')
+    try:
+
+        myobj.delete_rules()
+
+    except (IPTablesError, NFTablesError) as e:
+
+        log.info('An error occurred deleting the sinkhole rules: {0}'
+                 ''.format(e))
+        raise e
+
+    except (IPTablesNotExists, NFTablesNotExists) as e:
+
+        log.info('An error occurred deleting the sinkhole rules: {0}'
+                 ''.format(e))
+        pass
 
     try:
 
         myobj.delete_drop_rule()
 
-    except IPTablesError as e:
+    except (IPTablesError, NFTablesError) as e:
 
         log.info('An error occurred deleting the iptables DROP rules: {0}'
                  ''.format(e))
         raise e
 
-    except IPTablesNotExists as e:
+    except (IPTablesNotExists, NFTablesNotExists) as e:
 
         log.info('An error occurred deleting the iptables DROP rules: {0}'
                  ''.format(e))
         pass
 
-    if app_armor.exists and script_args.pcap:
+    if (app_armor.exists and script_args.pcap and
+            script_args.capture == 'tcpdump'):
 
         log.info('AppArmor found and --pcap provided, enabling enforcement '
                  'for usr.sbin.tcpdump')
@@ -276,21 +464,25 @@ if script_args.install:
     log.info('Creating iptables DROP rules for interface {0}'.format(
         script_args.interface
     ))
-    myobj = IPTablesSinkhole(
-        interface=script_args.interface,
-    )
+    if script_args.backend == 'nftables':
+
+        myobj = NFTablesSinkhole(interface=script_args.interface)
+
+    else:
+
+        myobj = IPTablesSinkhole(interface=script_args.interface)
 
     try:
 
         myobj.create_drop_rule()
 
-    except IPTablesError as e:
+    except (IPTablesError, NFTablesError) as e:
 
         log.info('An error occurred creating the iptables DROP rules: {0}'
                  ''.format(e))
         raise e
 
-    except IPTablesExists as e:
+    except (IPTablesExists, NFTablesExists) as e:
 
         log.info('An error occurred creating the iptables DROP rules: {0}'
                  ''.format(e))
@@ -299,7 +491,8 @@ if script_args.install:
     log.info('Setting system timezone to UTC')
     set_system_timezone('UTC')
 
-    if app_armor.exists and script_args.pcap:
+    if (app_armor.exists and script_args.pcap and
+            script_args.capture == 'tcpdump'):
 
         log.info('AppArmor found and --pcap provided, disabling enforcement '
                  'for usr.sbin.tcpdump')
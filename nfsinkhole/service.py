@@ -42,7 +42,7 @@ SYSTEMD_SERVICE_TEMPLATE = (
     'Type=forking\n'
     'ExecStartPre={svcexecstartpre}\n'
     'ExecStart={svcexecstart}\n'
-    'ExecStop={svcexecstop}\n'
+    'ExecReload={svcexecreload}\n'
     'User=root\n'
     '\n'
     '[Install]\n'
@@ -61,6 +61,9 @@ INITD_SERVICE_TEMPLATE = (
     'stop() {{\n{stop}\n'
     '}}\n'
     '\n'
+    'reload() {{\n{reload}\n'
+    '}}\n'
+    '\n'
     'case "$1" in\n'
     '    start)\n'
     '        start\n'
@@ -72,10 +75,13 @@ INITD_SERVICE_TEMPLATE = (
     '        stop\n'
     '        start\n'
     '        ;;\n'
+    '    reload)\n'
+    '        reload\n'
+    '        ;;\n'
     '    status)\n'
     '        ;;\n'
     '    *)\n'
-    '        echo "Usage: $0 {{start|stop|status|restart}}"\n'
+    '        echo "Usage: $0 {{start|stop|status|restart|reload}}"\n'
     'esac\n'
     'exit 0'
 )
@@ -106,9 +112,47 @@ class SystemService:
         hashlimitburst: Maximum initial number of packets to match.
         hashlimitexpire: Number of milliseconds to keep entries in the hash
             table.
+        hashlimit_htable_size: The number of buckets in the hashlimit hash
+            table, or None for the kernel default.
+        hashlimit_htable_max: The maximum number of entries in the hashlimit
+            hash table, or None for the kernel default.
+        hashlimit_htable_gcinterval: Number of milliseconds between hashlimit
+            hash table garbage collection runs, or None for the kernel
+            default.
         srcexclude: Exclude a comma separated string of source IPs/CIDRs from
             logging.
+        srcexclude_ipset: If True, load srcexclude into a hash:net ipset
+            and match it with a single rule. Requires ipset.
+        srcexclude_file: Optional file of additional source IPs/CIDRs to
+            exclude from logging. Re-read on service reload.
+        notrack: If True, exempt interface traffic from connection tracking
+            (iptables raw table NOTRACK).
+        rawdrop: If True, drop interface traffic that would never be logged
+            in the iptables raw table, before connection tracking.
+        nflog_group: The NFLOG netlink group for packet capture. tcpdump
+            captures from this group.
+        nflog_size: The number of bytes of each packet copied to userspace
+            (snaplen), or None for the full packet.
+        nflog_threshold: The number of packets batched per netlink message.
         pcap: Enable packet capture text or raw depending on tcpdump version.
+        capture: The packet capture method; tcpdump, or nflog for the
+            in-process NFLOG receiver (nflog.NFLog), which writes
+            /var/log/nfsinkhole.pcap and does not need tcpdump or AppArmor
+            changes.
+        pcap_ring: If True, capture to a ring of binary pcap files rotated by
+            size (and age, with capture nflog), instead of one growing file
+            or text log.
+        pcap_file_size: The pcap ring file size, in millions of bytes.
+        pcap_file_count: The number of pcap ring files kept.
+        pcap_file_seconds: The pcap ring file age (seconds) after which a new
+            file is started. capture nflog only; tcpdump rings are size
+            rotated.
+        pcap_compress: If True, gzip pcap ring files when they are closed.
+        pcap_index: If True, write a flow index for pcap ring files when
+            they are closed (see pcapindex). capture nflog only; tcpdump
+            ring files are indexed on first extract.
+        backend: The firewall backend for the sinkhole rules, iptables or
+            nftables.
         loglevel: Logging level for nfsinkhole events. This does not affect
             sinkhole traffic logs, only service/library event logs. Must be
             one of debug, info, warning, error, critical.
@@ -119,13 +163,29 @@ class SystemService:
                  protocol='all', dport='0:65535',
                  hashlimit='1/h', hashlimitmode='srcip,dstip,dstport',
                  hashlimitburst='1', hashlimitexpire='1800000',
-                 srcexclude='127.0.0.1', pcap=True, loglevel='info'
+                 hashlimit_htable_size=None, hashlimit_htable_max=None,
+                 hashlimit_htable_gcinterval=None,
+                 srcexclude='127.0.0.1', srcexclude_ipset=False,
+                 srcexclude_file=None, notrack=False, rawdrop=False,
+                 nflog_group='0', nflog_size=None, nflog_threshold='1',
+                 pcap=True, capture='tcpdump', pcap_ring=False,
+                 pcap_file_size=100, pcap_file_count=10,
+                 pcap_file_seconds=3600, pcap_compress=True,
+                 pcap_index=False, backend='iptables', loglevel='info'
                  ):
 
         self.exists = os.path.exists('/etc/systemd')
         self.is_systemd = False
         self.svc_path = '/etc/init.d/nfsinkhole'
         self.pcap = pcap
+        self.capture = capture
+        self.pcap_ring = pcap_ring
+        self.pcap_file_size = pcap_file_size
+        self.pcap_file_count = pcap_file_count
+        self.pcap_file_seconds = pcap_file_seconds
+        self.pcap_compress = pcap_compress
+        self.pcap_index = pcap_index
+        self.backend = backend
         self.interface = interface
         self.interface_addr = interface_addr
         self.log_prefix = log_prefix
@@ -135,12 +195,22 @@ class SystemService:
         self.hashlimitmode = hashlimitmode
         self.hashlimitburst = hashlimitburst
         self.hashlimitexpire = hashlimitexpire
+        self.hashlimit_htable_size = hashlimit_htable_size
+        self.hashlimit_htable_max = hashlimit_htable_max
+        self.hashlimit_htable_gcinterval = hashlimit_htable_gcinterval
         self.srcexclude = srcexclude
+        self.srcexclude_ipset = srcexclude_ipset
+        self.srcexclude_file = srcexclude_file
+        self.notrack = notrack
+        self.rawdrop = rawdrop
+        self.nflog_group = nflog_group
+        self.nflog_size = nflog_size
+        self.nflog_threshold = nflog_threshold
         self.loglevel = loglevel
 
         # Check if packet printing is supported
-        tcp_dump = TCPDump()
-        self.packet_print = tcp_dump.check_packet_print()
+        self.tcp_dump = TCPDump()
+        self.packet_print = self.tcp_dump.check_packet_print()
 
     def check_systemd(self):
         """
@@ -170,10 +240,11 @@ class SystemService:
         service = open('nfsinkhole.service', "w")
         with service:
 
-            # Run pre main process execution
+            # Run pre main process execution. Reconcile creates the rules,
+            # or updates existing rules in place (reload).
             execstartpre = (
                 '-{pyfp} {fp}/nfsinkhole-service.py '
-                '--create --interface {interface} '
+                '--reconcile --interface {interface} '
                 '--protocol {protocol} '
                 '--dport {dport} '
                 '--prefix {prefix} '
@@ -181,7 +252,16 @@ class SystemService:
                 '--hashlimitmode {hashlimitmode} '
                 '--hashlimitburst {hashlimitburst} '
                 '--hashlimitexpire {hashlimitexpire} '
+                '{htable}'
                 '--srcexclude {srcexclude} '
+                '{srcexclude_ipset}'
+                '{srcexclude_file}'
+                '{notrack}'
+                '{rawdrop}'
+                '--nflog-group {nflog_group} '
+                '{nflog_size}'
+                '--nflog-threshold {nflog_threshold} '
+                '--backend {backend} '
                 '--loglevel {loglevel} '
                 ''.format(
                     pyfp=sys.executable,
@@ -194,32 +274,101 @@ class SystemService:
                     hashlimitmode=self.hashlimitmode,
                     hashlimitburst=self.hashlimitburst,
                     hashlimitexpire=self.hashlimitexpire,
+                    htable=''.join([
+                        '--hashlimit-htable-{0} {1} '.format(k, v)
+                        for k, v in (
+                            ('size', self.hashlimit_htable_size),
+                            ('max', self.hashlimit_htable_max),
+                            ('gcinterval', self.hashlimit_htable_gcinterval)
+                        ) if v
+                    ]),
                     srcexclude=self.srcexclude,
+                    srcexclude_ipset=('--srcexclude-ipset '
+                                      if self.srcexclude_ipset else ''),
+                    srcexclude_file=('--srcexclude-file {0} '.format(
+                        self.srcexclude_file) if self.srcexclude_file else ''),
+                    notrack='--notrack ' if self.notrack else '',
+                    rawdrop='--rawdrop ' if self.rawdrop else '',
+                    nflog_group=self.nflog_group,
+                    nflog_size=('--nflog-size {0} '.format(self.nflog_size)
+                                if self.nflog_size else ''),
+                    nflog_threshold=self.nflog_threshold,
+                    backend=self.backend,
                     loglevel=self.loglevel
                 )
             )
 
-            # Run after main process stops
-            execstop = (
-                '-{pyfp} {fp}/nfsinkhole-service.py '
-                '--delete --interface {interface} --loglevel {loglevel}'.format(
-                    pyfp=sys.executable,
-                    fp=os.path.dirname(sys.executable),
-                    interface=self.interface,
-                    loglevel=self.loglevel
+            # Stopping the service keeps the rules and the reconcile state,
+            # so a restart with an unchanged configuration does not rebuild
+            # them. The rules are deleted by nfsinkhole-setup.py --uninstall
+            # (or nfsinkhole-service.py --delete).
+            execstop = ':'
+
+            if self.pcap and self.capture == 'nflog':
+
+                # Main process, the in-process NFLOG receiver.
+                # Output to pcap file (/var/log/nfsinkhole.pcap).
+                execstart = (
+                    '{pyfp} {fp}/nfsinkhole-service.py '
+                    '--capture --interface {interface} '
+                    '--nflog-group {nflog_group} '
+                    '{nflog_size}'
+                    '{ring}'
+                    '--loglevel {loglevel} > /dev/null 2>&1 &'.format(
+                        pyfp=sys.executable,
+                        fp=os.path.dirname(sys.executable),
+                        interface=self.interface,
+                        nflog_group=self.nflog_group,
+                        nflog_size=('--nflog-size {0} '.format(
+                            self.nflog_size) if self.nflog_size else ''),
+                        ring=(
+                            '--capture-ring --capture-size {0} '
+                            '--capture-count {1} --capture-seconds {2} '
+                            '{3}{4}'.format(
+                                self.pcap_file_size, self.pcap_file_count,
+                                self.pcap_file_seconds,
+                                '' if self.pcap_compress else
+                                '--capture-no-compress ',
+                                '--capture-index ' if self.pcap_index else ''
+                            ) if self.pcap_ring else ''
+                        ),
+                        loglevel=self.loglevel
+                    )
                 )
-            )
 
-            if self.pcap:
+                # Doesn't work with init.d
+                if self.is_systemd:
+
+                    execstart = '/bin/sh -c \'' + execstart + '\''
+
+            elif self.pcap:
+
+                # tcpdump captures from the configured NFLOG group.
+                nflog_iface = 'nflog:{0}'.format(self.nflog_group)
+
+                if self.pcap_ring:
+
+                    # Main process, binary pcap ring
+                    # (/var/log/nfsinkhole.pcap0 .. N-1), size rotated.
+                    # gzip must replace the last lap's .gz files.
+                    execstart = '{0}{1} > /dev/null 2>&1 &'.format(
+                        'GZIP=-f ' if self.pcap_compress else '',
+                        ' '.join(self.tcp_dump.get_ring_args(
+                            nflog_iface, '/var/log/nfsinkhole.pcap',
+                            self.pcap_file_size, self.pcap_file_count,
+                            self.pcap_compress
+                        ))
+                    )
 
-                if self.packet_print:
+                elif self.packet_print:
 
                     # Main process, with tcp dump version >= 4.5.
                     # Output printed packets to /var/log/nfsinkhole-pcap.log.
                     execstart = (
                         '/usr/sbin/tcpdump '
-                        '-nnlttttvvXXs 0 -i nflog >> '
-                        '/var/log/nfsinkhole-pcap.log 2>&1 &'
+                        '-nnlttttvvXXs 0 -i {0} >> '
+                        '/var/log/nfsinkhole-pcap.log 2>&1 &'.format(
+                            nflog_iface)
                     )
 
                 else:
@@ -230,8 +379,8 @@ class SystemService:
                     execstart = (
                         '/usr/sbin/tcpdump '
                         '-UnnttttvvXXs 0 -i '
-                        'nflog -w /var/log/nfsinkhole.pcap '
-                        '> /dev/null 2>&1 &'
+                        '{0} -w /var/log/nfsinkhole.pcap '
+                        '> /dev/null 2>&1 &'.format(nflog_iface)
                     )
 
                 # Doesn't work with init.d
@@ -251,7 +400,7 @@ class SystemService:
                 service.write(SYSTEMD_SERVICE_TEMPLATE.format(
                     svcexecstartpre=execstartpre,
                     svcexecstart=execstart,
-                    svcexecstop=execstop
+                    svcexecreload=execstartpre
                 ))
 
             # Write the init.d service
@@ -259,7 +408,8 @@ class SystemService:
                 service.write(INITD_SERVICE_TEMPLATE.format(
                     start='{0}\ndaemon {1}'.format(execstartpre[1:],
                                                    execstart),
-                    stop=execstop[1:]
+                    stop=execstop,
+                    reload=execstartpre[1:]
                 ))
 
         # Write the temporary service file to svc_path
@@ -0,0 +1,733 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+# Requires Python 3.5+ (asyncio, async/await); not imported by the package.
+
+import asyncio
+import collections
+import glob
+import logging
+import os
+import ssl
+import struct
+import time
+from .export import JSONEncoder
+from .utils import read_state_file, write_state_file
+
+log = logging.getLogger(__name__)
+
+# Spool record header; the payload length.
+SPOOL_RECORD = struct.Struct('<I')
+
+# The default spool segment and total sizes (bytes).
+SEGMENT_SIZE = 67108864
+SPOOL_SIZE = 1073741824
+
+
+def get_ssl_context(cafile=None, certfile=None, keyfile=None, verify=True):
+    """
+    The function for creating a TLS client context from local certificate
+    files.
+
+    Args:
+        cafile: The CA bundle used to verify the collector, or None for the
+            system CAs.
+        certfile: The client certificate (PEM), for mutual TLS.
+        keyfile: The client key (PEM), if not in certfile.
+        verify: If False, the collector certificate and hostname are not
+            verified.
+
+    Returns:
+        ssl.SSLContext: The context.
+    """
+
+    context = ssl.create_default_context(cafile=cafile)
+
+    if certfile:
+
+        context.load_cert_chain(certfile, keyfile)
+
+    if not verify:
+
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    return context
+
+
+class Spool:
+    """
+    The class for an append-only, on-disk FIFO of batches. Batches are
+    length prefixed records in numbered segment files; the read position is
+    kept in a state file, and fully read segments are deleted. A new segment
+    is started on open, so a record cut short by a crash is only ever at the
+    end of a segment, and is skipped.
+
+    Args:
+        path: The spool directory (created if needed).
+        segment_size: The segment file size (bytes) after which a new
+            segment is started.
+        max_size: The maximum spool size (bytes); the oldest segments are
+            dropped beyond it.
+    """
+
+    def __init__(self, path='/var/lib/nfsinkhole/spool',
+                 segment_size=SEGMENT_SIZE, max_size=SPOOL_SIZE):
+
+        self.path = path
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.state_path = os.path.join(path, 'spool.state')
+        self.dropped = 0
+
+        if not os.path.isdir(path):
+
+            os.makedirs(path)
+
+        self.segments = sorted([
+            int(os.path.basename(p)[:-4])
+            for p in glob.glob(os.path.join(path, '*.seg'))
+        ])
+
+        state = read_state_file(self.state_path) or {}
+        self.read_segment = state.get('segment')
+        self.read_offset = state.get('offset', 0)
+
+        if self.read_segment not in self.segments:
+
+            self.read_segment = self.segments[0] if self.segments else None
+            self.read_offset = 0
+
+        self.size = sum([
+            os.path.getsize(self.get_segment_path(s)) for s in self.segments
+        ]) - self.read_offset
+
+        self.read_file = None
+        self.write_segment = (self.segments[-1] + 1) if self.segments else 0
+        self.write_file = None
+
+    def __len__(self):
+
+        return self.size
+
+    def get_segment_path(self, segment=0):
+        """
+        The function for getting a segment file path.
+
+        Args:
+            segment: The segment number.
+
+        Returns:
+            String: The path.
+        """
+
+        return os.path.join(self.path, '{0:016d}.seg'.format(segment))
+
+    def append(self, data=b''):
+        """
+        The function for appending a batch.
+
+        Args:
+            data: The batch (bytes).
+        """
+
+        if self.write_file is None or (
+                self.write_file.tell() >= self.segment_size):
+
+            if self.write_file is not None:
+
+                self.write_file.close()
+                self.write_segment += 1
+
+            self.write_file = open(
+                self.get_segment_path(self.write_segment), 'ab')
+            self.segments.append(self.write_segment)
+
+            if self.read_segment is None:
+
+                self.read_segment = self.write_segment
+                self.read_offset = 0
+
+        self.write_file.write(SPOOL_RECORD.pack(len(data)) + data)
+        self.write_file.flush()
+        self.size += SPOOL_RECORD.size + len(data)
+
+        while self.size > self.max_size and len(self.segments) > 1:
+
+            segment = self.segments[0]
+            size = os.path.getsize(self.get_segment_path(segment))
+            log.error('Spool full, dropping segment {0} ({1} bytes)'.format(
+                segment, size - self.read_offset))
+
+            self.dropped += size - self.read_offset
+            self.size -= size - self.read_offset
+            self.next_segment()
+
+    def next_segment(self):
+        """
+        The function for deleting the segment being read, and moving to the
+        next.
+        """
+
+        if self.read_file is not None:
+
+            self.read_file.close()
+            self.read_file = None
+
+        segment = self.segments.pop(0)
+        os.remove(self.get_segment_path(segment))
+
+        self.read_segment = self.segments[0] if self.segments else None
+        self.read_offset = 0
+        self.save()
+
+    def peek(self):
+        """
+        The function for reading the oldest batch, without removing it.
+
+        Returns:
+            Tuple: (data, position); the batch and the position to pass to
+                commit(), or (None, None) if the spool is empty.
+        """
+
+        while self.read_segment is not None:
+
+            if self.read_file is None:
+
+                self.read_file = open(
+                    self.get_segment_path(self.read_segment), 'rb')
+
+            self.read_file.seek(self.read_offset)
+            header = self.read_file.read(SPOOL_RECORD.size)
+
+            if len(header) == SPOOL_RECORD.size:
+
+                length = SPOOL_RECORD.unpack(header)[0]
+                data = self.read_file.read(length)
+                if len(data) == length:
+
+                    return data, (self.read_segment, self.read_offset +
+                                  SPOOL_RECORD.size + length)
+
+            if self.read_segment == self.write_segment and (
+                    self.write_file is not None):
+
+                # The end of the segment being written.
+                return None, None
+
+            if header:
+
+                log.warning('Skipping a partial record in spool segment {0}'
+                            ''.format(self.read_segment))
+                self.size -= (os.fstat(self.read_file.fileno()).st_size -
+                              self.read_offset)
+
+            self.next_segment()
+
+        return None, None
+
+    def commit(self, position=None):
+        """
+        The function for removing the batches up to a position returned by
+        peek().
+
+        Args:
+            position: The (segment, offset) position.
+        """
+
+        segment, offset = position
+        if segment != self.read_segment:
+
+            return
+
+        self.size -= offset - self.read_offset
+        self.read_offset = offset
+
+        if segment != self.write_segment and offset >= os.path.getsize(
+                self.get_segment_path(segment)):
+
+            self.next_segment()
+
+        else:
+
+            self.save()
+
+    def save(self):
+        """
+        The function for writing the read position to the state file.
+        """
+
+        write_state_file(self.state_path, {
+            'segment': self.read_segment,
+            'offset': self.read_offset
+        })
+
+    def close(self):
+        """
+        The function for closing the segment files.
+        """
+
+        for f in (self.read_file, self.write_file):
+
+            if f is not None:
+
+                f.close()
+
+        self.read_file = None
+        self.write_file = None
+
+
+class Shipper:
+    """
+    The class for shipping sinkhole events from a follow.Follower to a TCP
+    (or TLS) collector with asyncio. Events are encoded in batches, flushed
+    by size (batch_size) or age (batch_timeout), and put on a bounded queue
+    for the sender.
+
+    When the queue is full (the collector is slow or down), the queue and
+    new batches spill to the Spool, and are replayed from it in order once
+    the collector accepts them; new batches keep going to the spool until it
+    is drained. Without a spool, a full queue pauses reading the log, and
+    batches still queued on stop are lost.
+
+    Delivery is at least once; a batch sent while it was spilled is sent
+    again from the spool.
+
+    Args:
+        follower: The follow.Follower for the events log. Its timeout is the
+            batch_timeout precision.
+        host: The collector host.
+        port: The collector port.
+        encoder: The export.Encoder. Defaults to JSONEncoder().
+        ssl_context: Optional ssl.SSLContext for TLS (see
+            get_ssl_context()).
+        batch_size: The maximum number of events per batch.
+        batch_timeout: The maximum age (seconds) of a partial batch.
+        queue_size: The maximum number of batches queued in memory.
+        spool: Optional Spool for batches that do not fit in the queue.
+        timeout: The connect/send timeout (seconds).
+        retry_interval: The initial reconnect interval (seconds); doubled
+            per failure up to max_retry_interval.
+        max_retry_interval: The maximum reconnect interval (seconds).
+        drain_timeout: The number of seconds stop() waits for the queue and
+            spool to be sent before spooling the queue.
+        metrics_interval: The number of seconds between metrics log entries,
+            or None.
+    """
+
+    def __init__(self, follower=None, host='localhost', port=514, encoder=None,
+                 ssl_context=None, batch_size=1000, batch_timeout=1.0,
+                 queue_size=100, spool=None, timeout=10, retry_interval=0.5,
+                 max_retry_interval=30, drain_timeout=5,
+                 metrics_interval=60):
+
+        self.follower = follower
+        self.host = host
+        self.port = port
+        self.encoder = encoder or JSONEncoder()
+        self.ssl_context = ssl_context
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.queue_size = queue_size
+        self.spool = spool
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.drain_timeout = drain_timeout
+        self.metrics_interval = metrics_interval
+
+        self.queue = collections.deque()
+        self.running = False
+        self.loop = None
+        self.wakeup = None
+        self.reader = None
+        self.writer = None
+
+        self.events = 0
+        self.batches = 0
+        self.sent_batches = 0
+        self.sent_bytes = 0
+        self.send_errors = 0
+        self.spilled_batches = 0
+        self.latency_last = 0.0
+        self.latency_max = 0.0
+        self.latency_total = 0.0
+
+    def get_metrics(self):
+        """
+        The function for getting the shipper metrics.
+
+        Returns:
+            Dictionary: The metrics:
+
+            :events (int): The events read.
+            :batches (int): The batches queued or spooled.
+            :queue_depth (int): The batches in the memory queue.
+            :spool_bytes (int): The bytes in the spool.
+            :spool_dropped (int): The bytes dropped from a full spool.
+            :spilled_batches (int): The batches written to the spool.
+            :sent_batches (int): The batches sent.
+            :sent_bytes (int): The bytes sent.
+            :send_errors (int): The failed connects/sends.
+            :send_latency (float): The last send latency (seconds).
+            :send_latency_max (float): The maximum send latency.
+            :send_latency_avg (float): The average send latency.
+            :connected (bool): If connected to the collector.
+        """
+
+        return {
+            'events': self.events,
+            'batches': self.batches,
+            'queue_depth': len(self.queue),
+            'spool_bytes': len(self.spool) if self.spool else 0,
+            'spool_dropped': self.spool.dropped if self.spool else 0,
+            'spilled_batches': self.spilled_batches,
+            'sent_batches': self.sent_batches,
+            'sent_bytes': self.sent_bytes,
+            'send_errors': self.send_errors,
+            'send_latency': self.latency_last,
+            'send_latency_max': self.latency_max,
+            'send_latency_avg': (self.latency_total / self.sent_batches
+                                 if self.sent_batches else 0.0),
+            'connected': self.writer is not None
+        }
+
+    def spill(self):
+        """
+        The function for moving the memory queue to the spool, in order.
+        """
+
+        while self.queue:
+
+            self.spool.append(self.queue.popleft())
+            self.spilled_batches += 1
+
+    async def put(self, data=b''):
+        """
+        The coroutine for queueing a batch, spilling to the spool if the
+        queue is full or the spool is being replayed; without a spool, it
+        waits for space in the queue.
+
+        Args:
+            data: The encoded batch.
+        """
+
+        self.batches += 1
+
+        if self.spool is not None:
+
+            if len(self.spool) or len(self.queue) >= self.queue_size:
+
+                self.spill()
+                self.spool.append(data)
+                self.spilled_batches += 1
+                self.wakeup.set()
+                return
+
+        else:
+
+            while len(self.queue) >= self.queue_size:
+
+                await asyncio.sleep(0.05)
+
+        self.queue.append(data)
+        self.wakeup.set()
+
+    async def connect(self):
+        """
+        The coroutine for connecting to the collector.
+        """
+
+        kwargs = {}
+        if self.ssl_context is not None:
+
+            kwargs['ssl'] = self.ssl_context
+            kwargs['server_hostname'] = self.host
+
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, **kwargs),
+            self.timeout
+        )
+
+        log.info('Connected to {0}:{1}'.format(self.host, self.port))
+
+    def disconnect(self):
+        """
+        The function for closing the collector connection.
+        """
+
+        if self.writer is not None:
+
+            self.writer.close()
+
+        self.reader = None
+        self.writer = None
+
+    async def send(self, data=b''):
+        """
+        The coroutine for sending a batch, (re)connecting if needed.
+
+        Args:
+            data: The encoded batch.
+
+        Returns:
+            Boolean: True if the batch was sent, False on a connection error.
+        """
+
+        try:
+
+            if self.writer is not None and self.reader.at_eof():
+
+                log.info('Collector closed the connection')
+                self.disconnect()
+
+            if self.writer is None:
+
+                await self.connect()
+
+            start = time.time()
+            self.writer.write(data)
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+        except (OSError, asyncio.TimeoutError) as e:
+
+            log.warning('Could not send to {0}:{1}: {2!r}'.format(
+                self.host, self.port, e))
+            self.send_errors += 1
+            self.disconnect()
+            return False
+
+        latency = time.time() - start
+        self.latency_last = latency
+        self.latency_max = max(self.latency_max, latency)
+        self.latency_total += latency
+        self.sent_batches += 1
+        self.sent_bytes += len(data)
+
+        return True
+
+    async def run_sender(self):
+        """
+        The coroutine for sending the queue, then the spool, in order.
+        """
+
+        interval = self.retry_interval
+        while True:
+
+            position = None
+            if self.queue:
+
+                data = self.queue[0]
+
+            elif self.spool is not None and len(self.spool):
+
+                data, position = self.spool.peek()
+
+            else:
+
+                data = None
+
+            if data is None:
+
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            if not await self.send(data):
+
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.max_retry_interval)
+                continue
+
+            interval = self.retry_interval
+            if position is not None:
+
+                self.spool.commit(position)
+
+            elif self.queue and self.queue[0] is data:
+
+                self.queue.popleft()
+
+    async def run_metrics(self):
+        """
+        The coroutine for logging the metrics every metrics_interval.
+        """
+
+        while True:
+
+            await asyncio.sleep(self.metrics_interval)
+            log.info('Shipper metrics: {0}'.format(self.get_metrics()))
+
+    def read_batch(self, batches=None):
+        """
+        The function for reading the next follower batch (run in an
+        executor).
+
+        Args:
+            batches: The follower iter_batches() generator.
+
+        Returns:
+            List: The events, or None at the end of the log.
+        """
+
+        return next(batches, None)
+
+    async def run(self):
+        """
+        The coroutine for shipping until stop() is called. On stop, the
+        partial batch is queued, the queue and spool are given
+        drain_timeout to be sent, the rest of the queue is spooled, and the
+        follower is checkpointed.
+        """
+
+        self.loop = asyncio.get_event_loop()
+        self.wakeup = asyncio.Event()
+        self.running = True
+
+        sender = asyncio.ensure_future(self.run_sender())
+        metrics = None
+        if self.metrics_interval:
+
+            metrics = asyncio.ensure_future(self.run_metrics())
+
+        encode = self.encoder.encode
+        pending = []
+        count = 0
+        started = None
+        batches = None
+
+        try:
+
+            while self.running:
+
+                if batches is None:
+
+                    batches = self.follower.iter_batches(follow=False)
+
+                events = await self.loop.run_in_executor(
+                    None, self.read_batch, batches)
+
+                if events is None:
+
+                    batches = None
+
+                elif events:
+
+                    self.events += len(events)
+                    pending.append(encode(events))
+                    count += len(events)
+                    started = started or time.time()
+
+                if pending and (count >= self.batch_size or
+                                time.time() - started >= self.batch_timeout):
+
+                    await self.put(b''.join(pending))
+                    pending = []
+                    count = 0
+                    started = None
+
+                if events is None and self.running:
+
+                    await self.loop.run_in_executor(None, self.follower.wait)
+
+                if sender.done():
+
+                    sender.result()
+
+            if batches is not None:
+
+                batches.close()
+
+            if pending:
+
+                await self.put(b''.join(pending))
+
+            # Give the sender a chance to drain the queue and spool.
+            deadline = time.time() + self.drain_timeout
+            while (self.queue or (self.spool is not None and
+                                  len(self.spool))) and (
+                    time.time() < deadline):
+
+                await asyncio.sleep(0.05)
+
+        finally:
+
+            sender.cancel()
+            if metrics is not None:
+
+                metrics.cancel()
+
+            try:
+
+                await sender
+
+            except asyncio.CancelledError:
+
+                pass
+
+            self.disconnect()
+
+            if self.queue:
+
+                if self.spool is not None:
+
+                    self.spill()
+
+                else:
+
+                    log.warning('{0} batches were not sent (no spool)'
+                                ''.format(len(self.queue)))
+
+            if self.spool is not None:
+
+                self.spool.close()
+
+            self.follower.checkpoint()
+            self.follower.close()
+            log.info('Shipper stopped: {0}'.format(self.get_metrics()))
+
+    def stop(self):
+        """
+        The function for stopping run(); safe to call from other threads.
+        """
+
+        self.running = False
+
+    def ship(self):
+        """
+        The function for running the shipper in a new event loop, until
+        stop() is called.
+        """
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        try:
+
+            loop.run_until_complete(self.run())
+
+        finally:
+
+            loop.close()
@@ -0,0 +1,685 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from array import array
+import base64
+import hashlib
+import heapq
+import logging
+import math
+import struct
+import sys
+import time
+from .events import Event
+from .utils import ip_to_int, int_to_ip
+
+log = logging.getLogger(__name__)
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+HASH64 = struct.Struct('<Q')
+
+
+def hash64(value=None):
+    """
+    The function for a deterministic (unsalted, unlike hash()) 64-bit hash;
+    sketches built in different processes can be merged. Integers (e.g.,
+    IPv4 addresses, ports) use the fast splitmix64 finalizer, other values
+    md5.
+
+    Args:
+        value: The int, str or bytes to hash.
+
+    Returns:
+        Integer: The 64-bit hash.
+    """
+
+    if isinstance(value, int):
+
+        z = (value + 0x9E3779B97F4A7C15) & MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+
+        return z ^ (z >> 31)
+
+    if not isinstance(value, bytes):
+
+        value = str(value).encode('utf-8')
+
+    return HASH64.unpack(hashlib.md5(value).digest()[:8])[0]
+
+
+def encode_array(values=None):
+    """
+    The function for serializing an array (little-endian) to base64 text.
+
+    Args:
+        values: The array.array.
+
+    Returns:
+        String: The base64 text.
+    """
+
+    if sys.byteorder != 'little':  # pragma: no cover
+
+        values = array(values.typecode, values)
+        values.byteswap()
+
+    if hasattr(values, 'tobytes'):
+
+        data = values.tobytes()
+
+    else:  # pragma: no cover
+
+        data = values.tostring()
+
+    return base64.b64encode(data).decode('ascii')
+
+
+def decode_array(typecode='B', text=''):
+    """
+    The function for deserializing base64 text from encode_array().
+
+    Args:
+        typecode: The array.array typecode.
+        text: The base64 text.
+
+    Returns:
+        array.array: The array.
+    """
+
+    values = array(typecode)
+    data = base64.b64decode(text.encode('ascii'))
+    if hasattr(values, 'frombytes'):
+
+        values.frombytes(data)
+
+    else:  # pragma: no cover
+
+        values.fromstring(data)
+
+    if sys.byteorder != 'little':  # pragma: no cover
+
+        values.byteswap()
+
+    return values
+
+
+class HyperLogLog:
+    """
+    The class for estimating the number of distinct values in fixed memory
+    (HyperLogLog). The standard error is about 1.04 / sqrt(2^precision);
+    0.8% with 2^14 one byte registers (16KB).
+
+    Args:
+        precision: The number of index bits (4 - 18); 2^precision
+            registers.
+    """
+
+    def __init__(self, precision=14):
+
+        if not 4 <= precision <= 18:
+
+            raise ValueError('precision must be 4 - 18')
+
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value=None):
+        """
+        The function for adding a value.
+
+        Args:
+            value: The value (int, str, bytes).
+        """
+
+        h = hash64(value)
+        index = h >> (64 - self.precision)
+        rest = (h << self.precision) & MASK64
+
+        # The position of the first 1 bit (1 based) in the remaining bits.
+        rank = 64 - self.precision + 1
+        if rest:
+
+            rank = 64 - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+
+            self.registers[index] = rank
+
+    def count(self):
+        """
+        The function for estimating the number of distinct values.
+
+        Returns:
+            Integer: The estimate.
+        """
+
+        m = float(self.size)
+        if self.size >= 128:
+
+            alpha = 0.7213 / (1 + 1.079 / m)
+
+        else:
+
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.size]
+
+        total = 0.0
+        zeros = 0
+        for register in self.registers:
+
+            total += 2.0 ** -register
+            if not register:
+
+                zeros += 1
+
+        estimate = alpha * m * m / total
+
+        # Small range correction (linear counting).
+        if estimate <= 2.5 * m and zeros:
+
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    def merge(self, other=None):
+        """
+        The function for merging another HyperLogLog (same precision) into
+        this one; the union of the values.
+
+        Args:
+            other: The HyperLogLog.
+        """
+
+        if other.precision != self.precision:
+
+            raise ValueError('Cannot merge different precisions')
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def to_dict(self):
+        """
+        The function for serializing the sketch (JSON friendly).
+
+        Returns:
+            Dictionary: The precision and base64 registers.
+        """
+
+        return {
+            'precision': self.precision,
+            'registers': base64.b64encode(bytes(self.registers)
+                                          ).decode('ascii')
+        }
+
+
+def hll_from_dict(data=None):
+    """
+    The function for deserializing HyperLogLog.to_dict() output.
+
+    Args:
+        data: The dictionary.
+
+    Returns:
+        HyperLogLog: The sketch.
+    """
+
+    hll = HyperLogLog(data['precision'])
+    hll.registers = bytearray(base64.b64decode(
+        data['registers'].encode('ascii')))
+
+    return hll
+
+
+class CountMinSketch:
+    """
+    The class for estimating value frequencies in fixed memory (Count-Min
+    Sketch). Estimates never undercount; the overcount is at most
+    2 / width of the total, with probability 1 - 0.5^depth. Memory is
+    width * depth * 8 bytes (128KB by default).
+
+    Args:
+        width: The number of counters per row.
+        depth: The number of rows (hash functions).
+    """
+
+    def __init__(self, width=4096, depth=4):
+
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.rows = [array('d', [0.0]) * width for i in range(depth)]
+
+    def get_indexes(self, value=None):
+        """
+        The function for calculating the counter index for each row (double
+        hashing of one 64-bit hash).
+
+        Args:
+            value: The value (int, str, bytes).
+
+        Returns:
+            List: The indexes, one per row.
+        """
+
+        h = hash64(value)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, value=None, count=1):
+        """
+        The function for counting a value.
+
+        Args:
+            value: The value (int, str, bytes).
+            count: The amount to add.
+
+        Returns:
+            Integer: The new estimate for the value.
+        """
+
+        self.total += count
+        estimate = None
+        for row, index in zip(self.rows, self.get_indexes(value)):
+
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+
+                estimate = row[index]
+
+        return int(estimate)
+
+    def estimate(self, value=None):
+        """
+        The function for estimating the count of a value.
+
+        Args:
+            value: The value (int, str, bytes).
+
+        Returns:
+            Integer: The estimate.
+        """
+
+        return int(min([row[index] for row, index in
+                        zip(self.rows, self.get_indexes(value))]))
+
+    def merge(self, other=None):
+        """
+        The function for merging another CountMinSketch (same width/depth)
+        into this one.
+
+        Args:
+            other: The CountMinSketch.
+        """
+
+        if (other.width, other.depth) != (self.width, self.depth):
+
+            raise ValueError('Cannot merge different dimensions')
+
+        self.total += other.total
+        for row, other_row in zip(self.rows, other.rows):
+
+            for i, value in enumerate(other_row):
+
+                if value:
+
+                    row[i] += value
+
+    def to_dict(self):
+        """
+        The function for serializing the sketch (JSON friendly).
+
+        Returns:
+            Dictionary: The dimensions, total, and base64 rows.
+        """
+
+        return {
+            'width': self.width,
+            'depth': self.depth,
+            'total': self.total,
+            'rows': [encode_array(row) for row in self.rows]
+        }
+
+
+def cms_from_dict(data=None):
+    """
+    The function for deserializing CountMinSketch.to_dict() output.
+
+    Args:
+        data: The dictionary.
+
+    Returns:
+        CountMinSketch: The sketch.
+    """
+
+    cms = CountMinSketch(data['width'], data['depth'])
+    cms.total = data['total']
+    cms.rows = [decode_array('d', row) for row in data['rows']]
+
+    return cms
+
+
+class TopK:
+    """
+    The class for tracking the k most frequent values (heavy hitters) in
+    fixed memory; a CountMinSketch for the counts, plus a min-heap of the k
+    largest.
+
+    Args:
+        k: The number of values to track.
+        width: The CountMinSketch width.
+        depth: The CountMinSketch depth.
+    """
+
+    def __init__(self, k=100, width=4096, depth=4):
+
+        self.k = k
+        self.cms = CountMinSketch(width, depth)
+        self.counts = {}
+        self.heap = []
+
+    def add(self, value=None, count=1):
+        """
+        The function for counting a value.
+
+        Args:
+            value: The value (int, str, bytes). Values must be of the same
+                type.
+            count: The amount to add.
+        """
+
+        estimate = self.cms.add(value, count)
+        counts = self.counts
+
+        if value in counts:
+
+            # The heap entry is stale (lower); fixed when it is the min.
+            counts[value] = estimate
+            return
+
+        if len(counts) < self.k:
+
+            counts[value] = estimate
+            heapq.heappush(self.heap, (estimate, value))
+            return
+
+        heap = self.heap
+        while True:
+
+            low, low_value = heap[0]
+            if counts[low_value] == low:
+
+                break
+
+            heapq.heapreplace(heap, (counts[low_value], low_value))
+
+        if estimate > low:
+
+            heapq.heapreplace(heap, (estimate, value))
+            del counts[low_value]
+            counts[value] = estimate
+
+    def top(self, n=None):
+        """
+        The function for retrieving the most frequent values.
+
+        Args:
+            n: The number of values, at most k. Defaults to k.
+
+        Returns:
+            List: (value, estimated count) tuples, most frequent first.
+        """
+
+        return heapq.nlargest(n or self.k, self.counts.items(),
+                              key=lambda x: x[1])
+
+    def merge(self, other=None):
+        """
+        The function for merging another TopK (same dimensions) into this
+        one. Values tracked by either are re-estimated from the merged
+        sketch.
+
+        Args:
+            other: The TopK.
+        """
+
+        self.cms.merge(other.cms)
+
+        values = set(self.counts) | set(other.counts)
+        counts = [(self.cms.estimate(v), v) for v in values]
+        counts = heapq.nlargest(self.k, counts)
+
+        self.counts = dict([(v, c) for c, v in counts])
+        self.heap = counts
+        heapq.heapify(self.heap)
+
+    def to_dict(self):
+        """
+        The function for serializing the tracker (JSON friendly).
+
+        Returns:
+            Dictionary: k, the sketch, and the tracked counts.
+        """
+
+        return {
+            'k': self.k,
+            'cms': self.cms.to_dict(),
+            'counts': [[v, c] for v, c in self.top()]
+        }
+
+
+def topk_from_dict(data=None):
+    """
+    The function for deserializing TopK.to_dict() output.
+
+    Args:
+        data: The dictionary.
+
+    Returns:
+        TopK: The tracker.
+    """
+
+    topk = TopK(data['k'])
+    topk.cms = cms_from_dict(data['cms'])
+    topk.counts = dict([(v, c) for v, c in data['counts']])
+    topk.heap = [(c, v) for v, c in data['counts']]
+    heapq.heapify(topk.heap)
+
+    return topk
+
+
+class SinkholeStats:
+    """
+    The class for streaming sinkhole event statistics in fixed memory:
+    distinct sources and destination ports (HyperLogLog), and the top source
+    /24s and destination ports (TopK).
+
+    Args:
+        precision: The HyperLogLog precision.
+        k: The number of heavy hitters to track.
+        width: The CountMinSketch width.
+        depth: The CountMinSketch depth.
+    """
+
+    def __init__(self, precision=14, k=100, width=4096, depth=4):
+
+        self.events = 0
+        self.start = None
+        self.end = None
+        self.sources = HyperLogLog(precision)
+        self.dports = HyperLogLog(precision)
+        self.top_networks = TopK(k, width, depth)
+        self.top_dports = TopK(k, width, depth)
+
+    def add(self, event=None):
+        """
+        The function for adding an event.
+
+        Args:
+            event: The Event, or Event.to_tuple() tuple.
+        """
+
+        if isinstance(event, Event):
+
+            timestamp, src, dpt = event.timestamp, event.src, event.dpt
+
+        else:
+
+            timestamp, src, dpt = event[0], event[3], event[7]
+
+        self.events += 1
+        if timestamp is not None:
+
+            if self.start is None or timestamp < self.start:
+
+                self.start = timestamp
+
+            if self.end is None or timestamp > self.end:
+
+                self.end = timestamp
+
+        src = ip_to_int(src)
+        self.sources.add(src)
+        self.dports.add(dpt)
+        self.top_networks.add(src & 0xFFFFFF00)
+        self.top_dports.add(dpt)
+
+    def update(self, events=None):
+        """
+        The function for adding events, e.g., from
+        events.EventParser.iter_events() or follow.Follower.iter_batches()
+        batches.
+
+        Args:
+            events: An iterable of Event objects or tuples.
+
+        Returns:
+            Integer: The number of events added.
+        """
+
+        count = 0
+        add = self.add
+        for event in events:
+
+            add(event)
+            count += 1
+
+        return count
+
+    def merge(self, other=None):
+        """
+        The function for merging another SinkholeStats (same dimensions)
+        into this one, e.g., from another process or host.
+
+        Args:
+            other: The SinkholeStats.
+        """
+
+        self.events += other.events
+        for attr, func in (('start', min), ('end', max)):
+
+            values = [v for v in (getattr(self, attr), getattr(other, attr))
+                      if v is not None]
+            setattr(self, attr, func(values) if values else None)
+
+        self.sources.merge(other.sources)
+        self.dports.merge(other.dports)
+        self.top_networks.merge(other.top_networks)
+        self.top_dports.merge(other.top_dports)
+
+    def summary(self, n=None):
+        """
+        The function for summarizing the statistics.
+
+        Args:
+            n: The number of heavy hitters. Defaults to k.
+
+        Returns:
+            Dictionary:
+
+            :events (int): The number of events.
+            :start (float): The first event timestamp.
+            :end (float): The last event timestamp.
+            :sources (int): The estimated distinct source IPs.
+            :dports (int): The estimated distinct destination ports.
+            :top_networks (list): (source /24, estimated events) tuples.
+            :top_dports (list): (destination port, estimated events)
+                tuples.
+        """
+
+        return {
+            'events': self.events,
+            'start': self.start,
+            'end': self.end,
+            'sources': self.sources.count(),
+            'dports': self.dports.count(),
+            'top_networks': [('{0}/24'.format(int_to_ip(v)), c)
+                             for v, c in self.top_networks.top(n)],
+            'top_dports': self.top_dports.top(n)
+        }
+
+    def snapshot(self):
+        """
+        The function for serializing the statistics (JSON friendly, a few
+        hundred KB by default), e.g., to persist or ship them.
+
+        Returns:
+            Dictionary: The statistics and sketches.
+        """
+
+        return {
+            'timestamp': time.time(),
+            'events': self.events,
+            'start': self.start,
+            'end': self.end,
+            'sources': self.sources.to_dict(),
+            'dports': self.dports.to_dict(),
+            'top_networks': self.top_networks.to_dict(),
+            'top_dports': self.top_dports.to_dict()
+        }
+
+
+def stats_from_snapshot(data=None):
+    """
+    The function for deserializing SinkholeStats.snapshot() output.
+
+    Args:
+        data: The dictionary.
+
+    Returns:
+        SinkholeStats: The statistics.
+    """
+
+    stats = SinkholeStats()
+    stats.events = data['events']
+    stats.start = data['start']
+    stats.end = data['end']
+    stats.sources = hll_from_dict(data['sources'])
+    stats.dports = hll_from_dict(data['dports'])
+    stats.top_networks = topk_from_dict(data['top_networks'])
+    stats.top_dports = topk_from_dict(data['top_dports'])
+
+    return stats
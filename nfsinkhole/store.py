@@ -0,0 +1,337 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import os
+import socket
+from .events import Event
+from .utils import IPV4, int_to_ip, get_cidr_range
+
+try:  # pragma: no cover
+
+    import numpy as np
+
+except ImportError:  # pragma: no cover
+
+    np = None
+
+log = logging.getLogger(__name__)
+
+# The EventTable columns and their dtypes. timestamp is UNIX epoch
+# microseconds.
+COLUMNS = (
+    ('timestamp', 'int64'),
+    ('src', 'uint32'),
+    ('dst', 'uint32'),
+    ('spt', 'uint16'),
+    ('dpt', 'uint16'),
+    ('proto', 'uint8'),
+    ('flags', 'uint8'),
+    ('length', 'uint16'),
+    ('ttl', 'uint8')
+)
+
+# The default number of rows the table grows by.
+CHUNK_SIZE = 1048576
+
+
+class EventTable:
+    """
+    The class for storing sinkhole events in columnar NumPy arrays
+    (IPv4 addresses as uint32, ports as uint16, protocol/flags as uint8,
+    timestamps as int64 microseconds). About 25 bytes per event, versus
+    several hundred as Python objects. The syslog host and interface are
+    not stored. Requires numpy.
+
+    Args:
+        chunk_size: The number of rows the arrays grow by.
+        columns: Optional dictionary of column arrays (e.g., loaded or
+            memory-mapped); the table is the length of the arrays.
+
+    Raises:
+        ImportError: numpy is not installed.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, columns=None):
+
+        if np is None:
+
+            raise ImportError('numpy is required for nfsinkhole.store')
+
+        self.chunk_size = chunk_size
+
+        if columns:
+
+            self.columns = columns
+            self.size = len(columns['timestamp'])
+
+        else:
+
+            self.columns = {}
+            for name, dtype in COLUMNS:
+
+                self.columns[name] = np.zeros(0, dtype=dtype)
+
+            self.size = 0
+
+    def __len__(self):
+
+        return self.size
+
+    def __getitem__(self, name):
+
+        return self.columns[name][:self.size]
+
+    def reserve(self, count=0):
+        """
+        The function for growing the arrays (by whole chunks) to fit count
+        more rows.
+
+        Args:
+            count: The number of rows to fit.
+        """
+
+        capacity = len(self.columns['timestamp'])
+        needed = self.size + count
+        if needed <= capacity:
+
+            return
+
+        chunks = (needed - capacity + self.chunk_size - 1) // self.chunk_size
+        capacity += chunks * self.chunk_size
+
+        for name, dtype in COLUMNS:
+
+            column = np.zeros(capacity, dtype=dtype)
+            column[:self.size] = self.columns[name][:self.size]
+            self.columns[name] = column
+
+    def append_rows(self, rows=None):
+        """
+        The function for appending rows of column values.
+
+        Args:
+            rows: Dictionary of equal length lists/arrays, by column name
+                (COLUMNS).
+        """
+
+        count = len(rows['timestamp'])
+        self.reserve(count)
+
+        for name, dtype in COLUMNS:
+
+            self.columns[name][self.size:self.size + count] = rows[name]
+
+        self.size += count
+
+    def extend(self, events=None):
+        """
+        The function for appending events, e.g., from
+        events.EventParser.iter_events() or bulk.iter_events(). Events are
+        converted in chunks.
+
+        Args:
+            events: An iterable of Event objects or Event.to_tuple() tuples.
+
+        Returns:
+            Integer: The number of events appended.
+        """
+
+        names = [name for name, dtype in COLUMNS]
+        count = 0
+        rows = dict([(name, []) for name in names])
+
+        timestamp = rows['timestamp'].append
+        src = rows['src'].append
+        dst = rows['dst'].append
+        spt = rows['spt'].append
+        dpt = rows['dpt'].append
+        proto = rows['proto'].append
+        flags = rows['flags'].append
+        length = rows['length'].append
+        ttl = rows['ttl'].append
+
+        for event in events:
+
+            if isinstance(event, Event):
+
+                event = event.to_tuple()
+
+            timestamp(int((event[0] or 0) * 1000000))
+            src(IPV4.unpack(socket.inet_aton(event[3]))[0])
+            dst(IPV4.unpack(socket.inet_aton(event[4]))[0])
+            proto(event[5])
+            spt(event[6])
+            dpt(event[7])
+            length(event[8])
+            ttl(event[9])
+            flags(event[10])
+
+            count += 1
+            if count % self.chunk_size == 0:
+
+                self.append_rows(rows)
+                for name in names:
+
+                    del rows[name][:]
+
+        if rows['timestamp']:
+
+            self.append_rows(rows)
+
+        return count
+
+    def cidr(self, cidr=None, column='src'):
+        """
+        The function for filtering on an IPv4 CIDR.
+
+        Args:
+            cidr: The IPv4 CIDR (e.g., 192.0.2.0/24).
+            column: The address column (src, dst).
+
+        Returns:
+            numpy.ndarray: The boolean mask.
+        """
+
+        network, netmask = get_cidr_range(cidr)
+
+        return (self[column] & np.uint32(netmask)) == np.uint32(network)
+
+    def port_range(self, start=0, end=65535, column='dpt'):
+        """
+        The function for filtering on a port range (inclusive).
+
+        Args:
+            start: The first port.
+            end: The last port.
+            column: The port column (spt, dpt).
+
+        Returns:
+            numpy.ndarray: The boolean mask.
+        """
+
+        values = self[column]
+
+        return (values >= start) & (values <= end)
+
+    def time_window(self, start=None, end=None):
+        """
+        The function for filtering on a time window.
+
+        Args:
+            start: The start, UNIX epoch seconds (inclusive), or None.
+            end: The end, UNIX epoch seconds (exclusive), or None.
+
+        Returns:
+            numpy.ndarray: The boolean mask.
+        """
+
+        values = self['timestamp']
+        mask = np.ones(self.size, dtype=bool)
+
+        if start is not None:
+
+            mask &= values >= int(start * 1000000)
+
+        if end is not None:
+
+            mask &= values < int(end * 1000000)
+
+        return mask
+
+    def select(self, mask=None):
+        """
+        The function for creating a table of the rows in a mask.
+
+        Args:
+            mask: The boolean mask (or index array).
+
+        Returns:
+            EventTable: A new table (copy).
+        """
+
+        return EventTable(chunk_size=self.chunk_size, columns=dict([
+            (name, self[name][mask]) for name, dtype in COLUMNS
+        ]))
+
+    def get_event(self, index=0):
+        """
+        The function for converting a row to an Event.
+
+        Args:
+            index: The row index.
+
+        Returns:
+            Event: The event (host and in_iface are None).
+        """
+
+        return Event(
+            self['timestamp'][index] / 1000000.0, None, None,
+            int_to_ip(self['src'][index]), int_to_ip(self['dst'][index]),
+            int(self['proto'][index]), int(self['spt'][index]),
+            int(self['dpt'][index]), int(self['length'][index]),
+            int(self['ttl'][index]), int(self['flags'][index])
+        )
+
+    def save(self, path=None):
+        """
+        The function for saving the table as a directory of .npy files, one
+        per column.
+
+        Args:
+            path: The directory path (created if needed).
+        """
+
+        if not os.path.isdir(path):
+
+            os.makedirs(path)
+
+        for name, dtype in COLUMNS:
+
+            np.save(os.path.join(path, '{0}.npy'.format(name)), self[name])
+
+        log.info('Saved {0} events to {1}'.format(self.size, path))
+
+
+def load_table(path=None, mmap=False):
+    """
+    The function for loading a table saved by EventTable.save().
+
+    Args:
+        path: The directory path.
+        mmap: If True, memory-map the columns read-only instead of
+            reading them; for datasets larger than memory.
+
+    Returns:
+        EventTable: The table.
+    """
+
+    columns = {}
+    for name, dtype in COLUMNS:
+
+        columns[name] = np.load(os.path.join(path, '{0}.npy'.format(name)),
+                                mmap_mode='r' if mmap else None)
+
+    return EventTable(columns=columns)
@@ -95,3 +95,35 @@ class TCPDump:
                         pass
 
         return tcpdump_version
+
+    def get_ring_args(self, interface=None, path='/var/log/nfsinkhole.pcap',
+                      file_size=100, file_count=10, compress=True):
+        """
+        The function for generating the tcpdump arguments for a binary pcap
+        ring; size rotated files (path0 .. pathN-1) overwritten in turn.
+        tcpdump ignores the file count when rotating by time too (-G), so
+        rotation is by size only; see pcap.PcapRing for size and age.
+
+        Args:
+            interface: The capture interface (e.g., nflog:0).
+            path: The base pcap file path.
+            file_size: The file size (millions of bytes) after which tcpdump
+                starts the next file.
+            file_count: The number of files in the ring.
+            compress: If True, gzip each file when it is closed (-z). gzip
+                must overwrite the previous lap's .gz; run with GZIP=-f.
+
+        Returns:
+            List: The tcpdump command (binary and arguments).
+        """
+
+        args = [
+            self.sbin, '-Unn', '-s', '0', '-i', str(interface), '-w', path,
+            '-C', str(file_size), '-W', str(file_count)
+        ]
+
+        if compress:
+
+            args += ['-z', 'gzip']
+
+        return args
@@ -42,3 +42,11 @@ class TestCommon(unittest.TestCase):
             # Basic Python 2.6 check instead of copying the whole
             # assertSequenceEqual function from later Python versions
             self.assertEqual(list(seq1), list(seq2))
+
+    if not hasattr(unittest.TestCase, 'assertIn'):
+        def assertIn(self, member, container, msg=None):
+            if member not in container:
+                self.fail(self._formatMessage(
+                    msg,
+                    '{0} not found in {1}'.format(member, container)
+                ))
@@ -0,0 +1,101 @@
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+from nfsinkhole.bulk import (get_ranges, get_tasks, iter_events, iter_run,
+                             merge_events, merge_runs, sort_range)
+from nfsinkhole.events import EventParser
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_events import LINES
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PATH = '/tmp/test_nfsinkhole-bulk.log'
+
+
+class TestBulk(TestCommon):
+
+    def setUp(self):
+
+        with open(PATH, 'wb') as f:
+
+            f.writelines(LINES * 50)
+
+        f = gzip.open(PATH + '.1.gz', 'wb')
+        try:
+
+            f.writelines(LINES[1:3])
+
+        finally:
+
+            f.close()
+
+    def test_get_ranges(self):
+
+        ranges = get_ranges(PATH, chunk_size=1000)
+        self.assertTrue(len(ranges) > 1)
+        self.assertEqual(ranges[0][0], 0)
+
+        data = open(PATH, 'rb').read()
+        self.assertEqual(ranges[-1][1], len(data))
+
+        for start, end in ranges:
+
+            self.assertEqual(data[end - 1:end], b'\n')
+
+        self.assertEqual(len(get_tasks([PATH, PATH + '.1.gz'],
+                                       chunk_size=1000)), len(ranges) + 1)
+
+    def test_merge_events(self):
+
+        merged = list(merge_events([[(1.0, 'a'), (3.0, 'b')],
+                                    [(None, 'c'), (1.0, 'd')]]))
+        self.assertEqual([e[1] for e in merged], ['c', 'a', 'd', 'b'])
+
+    def test_iter_events(self):
+
+        expected = list(EventParser(year=2016).iter_events(LINES * 50))
+        expected += list(EventParser(year=2016).iter_events(LINES[1:3]))
+        expected.sort(key=lambda e: e.timestamp)
+
+        for processes in (1, 2):
+
+            events = list(iter_events([PATH, PATH + '.1.gz'], year=2016,
+                                      processes=processes, chunk_size=1000))
+
+            self.assertEqual(len(events), len(expected))
+            self.assertEqual([e.timestamp for e in events],
+                             [e.timestamp for e in expected])
+            self.assertEqual(events[-1], expected[-1])
+
+    def test_runs(self):
+
+        run_dir = tempfile.mkdtemp()
+        try:
+
+            # Bounded runs, merged in passes.
+            runs = sort_range((PATH, 0, os.path.getsize(PATH), '[nfsinkhole] ',
+                               2016, run_dir, 7))
+            self.assertTrue(len(runs) > 4)
+
+            merged = merge_runs(runs, run_dir, merge_files=2)
+            self.assertEqual(len(merged), 2)
+            self.assertEqual(len(os.listdir(run_dir)), 2)
+
+            events = list(merge_events([iter_run(r) for r in merged]))
+            expected = [e.to_tuple() for e in
+                        EventParser(year=2016).iter_events(LINES * 50)]
+            expected.sort(key=lambda e: e[0] or 0.0)
+            self.assertEqual(events, expected)
+
+        finally:
+
+            shutil.rmtree(run_dir)
+
+        events = list(iter_events([PATH], year=2016, processes=1,
+                                  run_size=5, tmp_dir='/tmp'))
+        self.assertEqual(len(events), len(expected))
@@ -0,0 +1,103 @@
+import logging
+from nfsinkhole.enrich import (Enricher, LRUCache, read_csv,
+                               flatten_ranges, build_range_table,
+                               load_range_table)
+from nfsinkhole.events import EventParser
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_events import LINES
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+ASN_CSV = (
+    'network,asn,org\n'
+    '192.0.0.0/16,64496,Example Net\n'
+    '192.0.2.0/24,64497,Example Sinkhole\n'
+    '2001:db8::/32,64498,IPv6\n'
+    'bad,1,Bad\n'
+)
+GEO_CSV = (
+    'start,end,country\n'
+    '192.0.0.0,192.0.255.255,US\n'
+    '3325256704,3325256959,CA\n'
+)
+
+
+class TestEnrich(TestCommon):
+
+    def setUp(self):
+
+        with open('/tmp/test_nfsinkhole-asn.csv', 'w') as f:
+
+            f.write(ASN_CSV)
+
+        with open('/tmp/test_nfsinkhole-geo.csv', 'w') as f:
+
+            f.write(GEO_CSV)
+
+    def test_flatten_ranges(self):
+
+        self.assertEqual(
+            flatten_ranges([(0, 99, 'a'), (10, 19, 'b'), (12, 13, 'c'),
+                            (20, 29, 'a'), (200, 210, 'd')]),
+            [(0, 9, 'a'), (10, 11, 'b'), (12, 13, 'c'), (14, 19, 'b'),
+             (20, 99, 'a'), (200, 210, 'd')]
+        )
+
+    def test_range_table(self):
+
+        ranges = list(read_csv('/tmp/test_nfsinkhole-asn.csv'))
+        self.assertEqual(len(ranges), 2)
+
+        table = build_range_table(ranges)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.lookup(3221225985)['asn'], '64497')
+        self.assertEqual(table.lookup(3221225472)['asn'], '64496')
+        self.assertEqual(table.lookup(1), None)
+
+        path = '/tmp/test_nfsinkhole-asn.tbl'
+        table.save(path)
+        for use_mmap in (True, False):
+
+            loaded = load_range_table(path, use_mmap=use_mmap)
+            self.assertEqual(list(loaded.starts), list(table.starts))
+            self.assertEqual(loaded.lookup(3221225985), {
+                'asn': '64497', 'org': 'Example Sinkhole'})
+
+        self.assertRaises(ValueError, load_range_table,
+                          '/tmp/test_nfsinkhole-asn.csv')
+
+    def test_lru_cache(self):
+
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_enricher(self):
+
+        enricher = Enricher()
+        enricher.add_csv('/tmp/test_nfsinkhole-asn.csv')
+        enricher.add_csv('/tmp/test_nfsinkhole-geo.csv')
+
+        self.assertEqual(enricher.lookup('192.0.2.1'), {
+            'asn': '64497', 'org': 'Example Sinkhole', 'country': 'US'})
+        self.assertEqual(enricher.lookup('198.51.100.7'), {
+            'country': 'CA'})
+        self.assertEqual(enricher.lookup('10.0.0.1'), {})
+
+        # Cached
+        self.assertTrue(enricher.lookup('192.0.2.1') is
+                        enricher.lookup('192.0.2.1'))
+
+        events = EventParser(year=2016).iter_events(LINES)
+        enriched = list(enricher.iter_enriched(events))
+        self.assertEqual(enriched[0][1]['asn'], '64497')
+        self.assertEqual(enriched[3][1], {'country': 'CA'})
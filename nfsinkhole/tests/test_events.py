@@ -0,0 +1,98 @@
+import calendar
+import logging
+import os
+import time
+from nfsinkhole.events import Event, EventParser, get_flags, iter_events
+from nfsinkhole.tests import TestCommon
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+LINES = [
+    b'Oct 17 00:28:51 sinkhole kernel: [12345.678901] [nfsinkhole] IN=eth1 '
+    b'OUT= MAC=00:16:3e:aa:bb:cc:00:16:3e:dd:ee:ff:08:00 SRC=192.0.2.1 '
+    b'DST=10.0.0.1 LEN=60 TOS=0x00 PREC=0x00 TTL=52 ID=1234 DF PROTO=TCP '
+    b'SPT=41234 DPT=22 WINDOW=29200 RES=0x00 ACK SYN URGP=0 \n',
+    b'2016-10-17T00:28:51.250000+02:00 sinkhole kernel: [nfsinkhole] '
+    b'IN=eth1 OUT= MAC= SRC=192.0.2.9 DST=10.0.0.1 LEN=84 TOS=0x00 '
+    b'PREC=0x00 TTL=64 ID=0 DF PROTO=ICMP TYPE=8 CODE=0 ID=1 SEQ=1 \n',
+    b'2016-10-17T00:28:52Z sinkhole kernel: [nfsinkhole] IN=eth1 OUT= MAC= '
+    b'SRC=198.51.100.7 DST=10.0.0.1 LEN=78 TOS=0x00 PREC=0x00 TTL=117 '
+    b'ID=1234 PROTO=UDP SPT=5353 DPT=53 LEN=58 \n',
+    b'2016-10-17T00:28:52Z sinkhole kernel: [nfsinkhole] IN=eth1 OUT= MAC= '
+    b'SRC=198.51.100.7 DST=10.0.0.1 LEN=40 TOS=0x00 PREC=0x00 TTL=117 '
+    b'ID=1234 PROTO=47 \n',
+    b'2016-10-17T00:28:53Z sinkhole kernel: [other] IN=eth1 OUT= MAC= '
+    b'SRC=198.51.100.7 DST=10.0.0.1 LEN=40 TOS=0x00 PREC=0x00 TTL=117 '
+    b'ID=1234 PROTO=47 \n',
+    b'2016-10-17T00:28:53Z sinkhole sshd[123]: unrelated\n'
+]
+
+
+class TestEvents(TestCommon):
+
+    def test_parse_line(self):
+
+        parser = EventParser(year=2016)
+        events = list(parser.iter_events(LINES))
+
+        self.assertEqual(len(events), 4)
+        self.assertEqual(parser.skipped, 2)
+
+        self.assertEqual(events[0], Event(
+            time.mktime((2016, 10, 17, 0, 28, 51, 0, 0, -1)), 'sinkhole',
+            'eth1', '192.0.2.1', '10.0.0.1', 6, 41234, 22, 60, 52, 0x12
+        ))
+
+        # ICMP type/code in dpt, RFC 3339 fraction and offset
+        utc = calendar.timegm((2016, 10, 16, 22, 28, 51, 0, 0, 0))
+        self.assertEqual(events[1].timestamp, utc + 0.25)
+        self.assertEqual((events[1].proto, events[1].dpt), (1, 2048))
+
+        self.assertEqual(events[2].to_dict()['dpt'], 53)
+        self.assertEqual(events[2].timestamp, utc + 7201)
+        self.assertEqual((events[3].proto, events[3].spt), (47, 0))
+
+        # Cached per second
+        self.assertEqual(len(parser.timestamps), 3)
+
+        # No prefix filter
+        self.assertEqual(
+            len(list(EventParser(prefix=None).iter_events(LINES))), 5)
+
+    def test_year(self):
+
+        # A log rotated across New Year; December is the previous year.
+        reference = time.mktime((2017, 1, 1, 0, 10, 0, 0, 0, -1))
+        parser = EventParser(reference=reference)
+        self.assertEqual(parser.get_timestamp(b'Dec 31 23:59:59'),
+                         time.mktime((2016, 12, 31, 23, 59, 59, 0, 0, -1)))
+        self.assertEqual(parser.get_timestamp(b'Jan  1 00:05:00'),
+                         time.mktime((2017, 1, 1, 0, 5, 0, 0, 0, -1)))
+
+        # An explicit year is used as is.
+        parser = EventParser(year=2017, reference=reference)
+        self.assertEqual(parser.get_timestamp(b'Dec 31 23:59:59'),
+                         time.mktime((2017, 12, 31, 23, 59, 59, 0, 0, -1)))
+
+    def test_get_flags(self):
+
+        self.assertEqual(get_flags(b'FIN PSH ACK'), 0x19)
+        self.assertEqual(get_flags(b''), 0)
+
+    def test_iter_events(self):
+
+        path = '/tmp/test_nfsinkhole-events.log'
+        with open(path, 'wb') as f:
+
+            f.writelines(LINES)
+
+        self.assertEqual(len(list(iter_events(path, year=2016))), 4)
+
+        # The year defaults to the year of the file mtime.
+        mtime = time.mktime((2017, 1, 1, 0, 0, 0, 0, 0, -1))
+        os.utime(path, (mtime, mtime))
+        self.assertEqual(next(iter_events(path)).timestamp,
+                         time.mktime((2016, 10, 17, 0, 28, 51, 0, 0, -1)))
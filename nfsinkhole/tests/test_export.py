@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import socket
+import threading
+from nfsinkhole.events import EventParser
+from nfsinkhole.export import (ENCODERS, CEFEncoder, Encoder, ExportWriter,
+                               JSONEncoder, LEEFEncoder, escape_cef,
+                               export_events, get_flag_names)
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_events import LINES
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PATH = '/tmp/test_nfsinkhole-export.log'
+SOCKET_PATH = '/tmp/test_nfsinkhole-export.sock'
+
+
+def receive(server=None, received=None):
+
+    conn, addr = server.accept()
+    while True:
+
+        data = conn.recv(65536)
+        if not data:
+
+            break
+
+        received.append(data)
+
+    conn.close()
+
+
+class TestExport(TestCommon):
+
+    def setUp(self):
+
+        self.events = list(EventParser().iter_events(LINES))
+
+        for path in (PATH, SOCKET_PATH):
+
+            if os.path.exists(path):
+
+                os.remove(path)
+
+    def test_helpers(self):
+
+        self.assertEqual(get_flag_names(0x12), 'SYN ACK')
+        self.assertEqual(get_flag_names(0), '')
+        self.assertEqual(escape_cef('a=b\\c\n'), 'a\\=b\\\\c\\n')
+
+    def test_encoder(self):
+
+        # The base class is abstract; the encoders override encode_event().
+        self.assertRaises(NotImplementedError, Encoder().encode, self.events)
+
+        for name, encoder in ENCODERS.items():
+
+            self.assertNotEqual(encoder.encode_event, Encoder.encode_event)
+            self.assertEqual(len(encoder().encode(self.events).splitlines()),
+                             4)
+
+        # The string cache is bounded.
+        encoder = CEFEncoder()
+        for i in range(5000):
+
+            encoder.get_string('host{0}'.format(i))
+
+        self.assertTrue(len(encoder.strings) <= 4096)
+
+    def test_json(self):
+
+        data = JSONEncoder(fields={'sensor': 'd{c}1'}).encode(self.events)
+        lines = data.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+
+        for line, event in zip(lines, self.events):
+
+            expected = event.to_dict()
+            expected['sensor'] = 'd{c}1'
+            self.assertEqual(json.loads(line), expected)
+
+        self.assertEqual(JSONEncoder().encode([]), b'')
+
+    def test_cef(self):
+
+        lines = CEFEncoder(fields={'dvc': '192.0.2.10'}).encode(
+            [e.to_tuple() for e in self.events]).decode('utf-8').splitlines()
+
+        self.assertEqual(lines[0], (
+            'CEF:0|nfsinkhole|nfsinkhole|0.1.0|6|Sinkhole TCP traffic|3|'
+            'rt={0} dvchost=sinkhole deviceInboundInterface=eth1 '
+            'src=192.0.2.1 dst=10.0.0.1 proto=TCP spt=41234 dpt=22 in=60 '
+            'cn1=52 cn1Label=ttl cs1=SYN ACK cs1Label=tcpFlags '
+            'dvc=192.0.2.10'.format(int(self.events[0].timestamp * 1000))
+        ))
+        self.assertIn('rt=1476656931250 ', lines[1])
+        self.assertIn(' cn2=8 cn2Label=icmpType cn3=0 ', lines[1])
+        self.assertIn('|47|Sinkhole 47 traffic|', lines[3])
+
+        # Header values are literals.
+        encoder = CEFEncoder(vendor='a{b}', product='{0}|x', version='{{')
+        lines = encoder.encode(self.events).decode('utf-8').splitlines()
+        self.assertTrue(lines[0].startswith(
+            'CEF:0|a{b}|{0}\\|x|{{|6|Sinkhole TCP traffic|3|rt='))
+
+    def test_leef(self):
+
+        lines = LEEFEncoder().encode(self.events).decode(
+            'utf-8').splitlines()
+
+        self.assertTrue(lines[1].startswith(
+            'LEEF:1.0|nfsinkhole|nfsinkhole|0.1.0|ICMP|'
+            'devTime=Oct 16 2016 22:28:51.250 UTC\t'
+        ))
+        self.assertIn('\ticmpType=8\ticmpCode=0\t', lines[1])
+        self.assertIn('\tsrcPort=5353\tdstPort=53\t', lines[2])
+
+        lines = LEEFEncoder(vendor='a{b}', version='}').encode(
+            self.events).decode('utf-8').splitlines()
+        self.assertTrue(lines[0].startswith(
+            'LEEF:1.0|a{b}|nfsinkhole|}|TCP|devTime='))
+
+    def test_writer_file(self):
+
+        writer = ExportWriter(PATH, buffer_size=1024)
+        count = export_events(self.events * 10, JSONEncoder(), writer,
+                              batch_size=7)
+        writer.close()
+
+        self.assertEqual(count, 40)
+        with open(PATH, 'rb') as f:
+
+            self.assertEqual(len(f.read().splitlines()), 40)
+
+        self.assertRaises(ValueError, ExportWriter, 'tcp://localhost')
+
+    def test_writer_sockets(self):
+
+        unix = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix.bind(SOCKET_PATH)
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp.bind(('127.0.0.1', 0))
+
+        targets = (
+            (unix, 'unix://{0}'.format(SOCKET_PATH)),
+            (tcp, 'tcp://127.0.0.1:{0}'.format(tcp.getsockname()[1]))
+        )
+
+        for server, target in targets:
+
+            server.listen(1)
+            received = []
+            thread = threading.Thread(target=receive, args=(server, received))
+            thread.start()
+
+            writer = ExportWriter(target)
+            self.assertEqual(
+                export_events(self.events, CEFEncoder(), writer), 4)
+            writer.close()
+            thread.join(5)
+            server.close()
+
+            self.assertEqual(b''.join(received).count(b'\nCEF:0|'), 3)
+            self.assertEqual(writer.written, len(b''.join(received)))
@@ -0,0 +1,145 @@
+import logging
+import os
+from nfsinkhole.events import Event, EventParser
+from nfsinkhole.flows import (Flow, FlowAggregator, FlowWriter, OrderedFlows,
+                              iter_flows)
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_events import LINES
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+
+def get_event(timestamp=0.0, src='192.0.2.1', dpt=22, flags=2):
+
+    return Event(timestamp, 'sinkhole', 'eth1', src, '10.0.0.1', 6, 40000,
+                 dpt, 60, 64, flags)
+
+
+class TestFlows(TestCommon):
+
+    def test_aggregate(self):
+
+        aggregator = FlowAggregator(idle_timeout=60, capacity=10)
+        self.assertEqual(aggregator.add(get_event(0.0, flags=2)), [])
+        self.assertEqual(aggregator.add(get_event(10.0, flags=16)), [])
+        self.assertEqual(aggregator.add(get_event(20.0, dpt=23).to_tuple()),
+                         [])
+        self.assertEqual(len(aggregator), 2)
+
+        flow = aggregator.flows[('192.0.2.1', '10.0.0.1', 6, 22)]
+        self.assertEqual(flow.first_seen, 0.0)
+        self.assertEqual(flow.last_seen, 10.0)
+        self.assertEqual(flow.packets, 2)
+        self.assertEqual(flow.bytes, 120)
+        self.assertEqual(flow.flags, 18)
+
+        # Idle timeout (event time)
+        evicted = aggregator.add(get_event(75.0, src='192.0.2.2'))
+        self.assertEqual([f.dpt for f in evicted], [22])
+        self.assertEqual(len(aggregator), 2)
+
+        flows = aggregator.flush()
+        self.assertEqual([f.dpt for f in flows], [23, 22])
+        self.assertEqual(len(aggregator), 0)
+        self.assertEqual(aggregator.evicted, 3)
+
+        events = EventParser().iter_events(LINES)
+        flows = list(FlowAggregator().aggregate(events))
+        self.assertEqual(len(flows), 4)
+
+    def test_no_timestamp(self):
+
+        aggregator = FlowAggregator(idle_timeout=60, capacity=10)
+        self.assertEqual(aggregator.add(get_event(None)), [])
+        self.assertEqual(aggregator.add(get_event(None)), [])
+        self.assertEqual(aggregator.add(get_event(5.0)), [])
+
+        flow = aggregator.flows[('192.0.2.1', '10.0.0.1', 6, 22)]
+        self.assertEqual((flow.first_seen, flow.last_seen), (5.0, 5.0))
+        self.assertEqual(flow.packets, 3)
+
+        # Flows without a timestamp are idle.
+        aggregator.add(get_event(None, dpt=23))
+        evicted = aggregator.add(get_event(6.0, dpt=24))
+        self.assertEqual([f.dpt for f in evicted], [])
+        evicted = aggregator.evict(100.0)
+        self.assertEqual([f.dpt for f in evicted], [22, 23, 24])
+
+    def test_capacity(self):
+
+        aggregator = FlowAggregator(idle_timeout=300, capacity=2)
+        aggregator.add(get_event(0.0, dpt=1))
+        aggregator.add(get_event(1.0, dpt=2))
+        aggregator.add(get_event(2.0, dpt=1))
+
+        # dpt 2 is least recently updated
+        evicted = aggregator.add(get_event(3.0, dpt=3))
+        self.assertEqual([f.dpt for f in evicted], [2])
+        self.assertEqual(sorted(k[3] for k in aggregator.flows), [1, 3])
+
+    def test_ordered_flows(self):
+
+        # The Python 2.6 OrderedDict fallback
+        flows = OrderedFlows()
+        for key in ('a', 'b', 'c', 'd'):
+
+            flows[key] = key.upper()
+
+        # Re-insert at the end
+        del flows['a']
+        flows['a'] = 'A'
+        del flows['c']
+
+        self.assertEqual(list(flows), ['b', 'd', 'a'])
+        self.assertEqual(flows.values(), ['B', 'D', 'A'])
+        self.assertEqual(flows.popitem(last=False), ('b', 'B'))
+        self.assertEqual(len(flows), 2)
+        self.assertRaises(ValueError, flows.popitem, True)
+
+        # Skipped occurrences are dropped.
+        for i in range(5000):
+
+            flows['d'] = i
+
+        self.assertTrue(len(flows.order) < 2000)
+        self.assertEqual(flows.keys(), ['a', 'd'])
+
+        flows.clear()
+        self.assertRaises(KeyError, flows.popitem)
+
+        # The aggregator with the fallback
+        aggregator = FlowAggregator(idle_timeout=60, capacity=2)
+        aggregator.flows = OrderedFlows()
+        aggregator.move_to_end = None
+        for event in EventParser(year=2016).iter_events(LINES):
+
+            aggregator.add(event)
+
+        self.assertEqual(len(aggregator), 2)
+        self.assertEqual(aggregator.evicted, 2)
+
+    def test_writer(self):
+
+        flows = [
+            Flow('192.0.2.1', '10.0.0.1', 6, 22, 1.5, 2.5, 3, 180, 18),
+            Flow('198.51.100.7', '10.0.0.1', 17, 53, 3.0, 3.0, 1, 78, 0)
+        ]
+
+        for output_format in ('json', 'binary'):
+
+            path = '/tmp/test_nfsinkhole-flows.{0}'.format(output_format)
+            if os.path.exists(path):
+
+                os.remove(path)
+
+            writer = FlowWriter(path, output_format)
+            self.assertEqual(writer.write(iter(flows)), 2)
+            writer.close()
+
+            self.assertEqual(list(iter_flows(path, output_format)), flows)
+            os.remove(path)
+
+        self.assertRaises(ValueError, FlowWriter, '/tmp/x', 'csv')
@@ -0,0 +1,135 @@
+import logging
+import os
+from nfsinkhole.follow import Follower, Inotify
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_events import LINES
+from nfsinkhole.utils import delete_state_file
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PATH = '/tmp/test_nfsinkhole-follow.log'
+CHECKPOINT = '/tmp/test_nfsinkhole-follow.checkpoint'
+
+
+class TestFollower(TestCommon):
+
+    def setUp(self):
+
+        for path in (PATH, PATH + '.1'):
+
+            if os.path.exists(path):
+
+                os.remove(path)
+
+        delete_state_file(CHECKPOINT)
+
+    def get_lines(self, **kwargs):
+
+        follower = Follower(PATH, checkpoint_path=CHECKPOINT, **kwargs)
+        lines = []
+        for batch in follower.iter_line_batches(follow=False):
+
+            lines += batch
+
+        follower.close()
+
+        return lines
+
+    def test_checkpoint(self):
+
+        with open(PATH, 'wb') as f:
+
+            f.writelines(LINES[:3])
+
+            # Partial line
+            f.write(LINES[3][:10])
+
+        # Without a checkpoint, following starts at the end of the file;
+        # start at the beginning instead.
+        follower = Follower(PATH, checkpoint_path=CHECKPOINT, batch_size=2)
+        follower.open_file(PATH, 0)
+        batches = list(follower.iter_line_batches(follow=False))
+        follower.close()
+
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        self.assertEqual(batches[0][0], LINES[0])
+
+        # Resume after the last line, completing the partial line
+        with open(PATH, 'ab') as f:
+
+            f.write(LINES[3][10:])
+            f.write(LINES[4])
+
+        self.assertEqual(self.get_lines(), LINES[3:5])
+        self.assertEqual(self.get_lines(), [])
+
+    def test_rotation(self):
+
+        with open(PATH, 'wb') as f:
+
+            f.writelines(LINES[:1])
+
+        follower = Follower(PATH, checkpoint_path=CHECKPOINT)
+        follower.open_file(PATH, 0)
+        list(follower.iter_line_batches(follow=False))
+        follower.close()
+
+        # Written, then rotated (renamed) while not running
+        with open(PATH, 'ab') as f:
+
+            f.write(LINES[1])
+
+        os.rename(PATH, PATH + '.1')
+
+        with open(PATH, 'wb') as f:
+
+            f.write(LINES[2])
+
+        self.assertEqual(self.get_lines(), LINES[1:3])
+
+        # Truncated
+        with open(PATH, 'wb') as f:
+
+            f.write(LINES[3])
+
+        self.assertEqual(self.get_lines(), LINES[3:4])
+
+    def test_iter_batches(self):
+
+        with open(PATH, 'wb') as f:
+
+            f.writelines(LINES)
+
+        follower = Follower(PATH, checkpoint_path=None)
+        follower.open_file(PATH, 0)
+        events = []
+        for batch in follower.iter_batches(follow=False):
+
+            events += batch
+
+        self.assertEqual(len(events), 4)
+
+    def test_inotify(self):
+
+        with open(PATH, 'wb') as f:
+
+            f.write(LINES[0])
+
+        inotify = Inotify(PATH)
+        self.assertFalse(inotify.wait(0))
+
+        with open(PATH + '.1', 'wb') as f:
+
+            f.write(LINES[0])
+
+        self.assertFalse(inotify.wait(0))
+
+        with open(PATH, 'ab') as f:
+
+            f.write(LINES[1])
+
+        self.assertTrue(inotify.wait(1))
+        inotify.close()
@@ -0,0 +1,91 @@
+import logging
+from nfsinkhole.hashlimit import (Hashlimit, recommend_htable,
+                                  next_power_of_two, HTABLE_MAX_SIZE)
+from nfsinkhole.iptables import IPTablesSinkhole
+from nfsinkhole.tests import TestCommon
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PROC_DATA = (
+    '1795 192.0.2.1:0->10.0.0.1:22 64000 64000 32000\n'
+    '1700 192.0.2.1:0->10.0.0.1:23 0 64000 32000\n'
+    '1600 198.51.100.7:0->10.0.0.1:22 32000 64000 32000\n'
+)
+
+
+class TestHashlimit(TestCommon):
+
+    def test_iter_entries(self):
+
+        with open('/tmp/sinkhole', 'w') as f:
+
+            f.write(PROC_DATA)
+
+        hashlimit = Hashlimit(proc_path='/tmp')
+        entries = list(hashlimit.iter_entries())
+
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(entries[0], (1795, '192.0.2.1', 0, '10.0.0.1', 22,
+                                      64000, 64000, 32000))
+
+    def test_get_stats(self):
+
+        with open('/tmp/sinkhole', 'w') as f:
+
+            f.write(PROC_DATA)
+
+        stats = Hashlimit(proc_path='/tmp').get_stats(htable_size=1, top=2)
+
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['htable_max'], 8)
+        self.assertEqual(stats['fill_ratio'], 3.0 / 8)
+        self.assertFalse(stats['saturated'])
+        self.assertEqual(stats['sources'], 2)
+        self.assertEqual(stats['top_sources'][0], ('192.0.2.1', 2))
+        self.assertEqual(stats['top_dports'][0], (22, 2))
+        self.assertEqual([e[4] for e in stats['top_limited']], [23, 22])
+        self.assertEqual(stats['top_limited'][1][1], '198.51.100.7')
+
+        stats = Hashlimit().get_stats(htable_max=3, entries=[
+            (1, '192.0.2.{0}'.format(i), 0, '10.0.0.1', 22, 0, 0, 0)
+            for i in range(3)
+        ])
+        self.assertTrue(stats['saturated'])
+
+    def test_recommend_htable(self):
+
+        self.assertEqual(next_power_of_two(0), 1)
+        self.assertEqual(next_power_of_two(1000), 1024)
+
+        ret = recommend_htable(cardinality=100000, expire=1800000)
+        self.assertEqual(ret['htable_max'], 262144)
+        self.assertEqual(ret['htable_size'], 131072)
+        self.assertEqual(ret['htable_gcinterval'], 18000)
+        self.assertFalse(ret['capped'])
+
+        # Saturated tables double the headroom
+        self.assertEqual(recommend_htable(
+            cardinality=100000, saturated=True)['htable_max'], 524288)
+
+        ret = recommend_htable(cardinality=10000000, expire=60000)
+        self.assertEqual(ret['htable_max'], HTABLE_MAX_SIZE)
+        self.assertEqual(ret['htable_gcinterval'], 1000)
+        self.assertTrue(ret['capped'])
+
+    def test_htable_rule(self):
+
+        myobj = IPTablesSinkhole(
+            interface='eth1',
+            interface_addr='127.0.0.1',
+            hashlimit_htable_size=131072,
+            hashlimit_htable_max=262144
+        )
+        jump = myobj.get_rules()[-1]
+
+        self.assertIn('--hashlimit-htable-size', jump)
+        self.assertEqual(jump[jump.index('--hashlimit-htable-max') + 1],
+                         '262144')
+        self.assertNotIn('--hashlimit-htable-gcinterval', jump)
@@ -0,0 +1,104 @@
+import logging
+from nfsinkhole.ipset import IPSet
+from nfsinkhole.iptables import IPTablesSinkhole
+from nfsinkhole.tests import TestCommon
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+
+class TestIPSet(TestCommon):
+
+    def test_get_create_lines(self):
+
+        ipset = IPSet(maxelem=4)
+
+        expected = [
+            'create nfsinkhole-srcexclude hash:net family inet maxelem 6 '
+            '-exist',
+            'add nfsinkhole-srcexclude 127.0.0.1 -exist',
+            'add nfsinkhole-srcexclude 10.0.0.0/8 -exist',
+            'add nfsinkhole-srcexclude 192.0.2.1 -exist'
+        ]
+        self.assertSequenceEqual(
+            ipset.get_create_lines(['127.0.0.1', ' 10.0.0.0/8', '192.0.2.1',
+                                    '']),
+            expected, seq_type=list
+        )
+
+    def test_srcexclude_rule(self):
+
+        myobj = IPTablesSinkhole(
+            interface='eth1',
+            interface_addr='127.0.0.1',
+            srcexclude='127.0.0.1,10.0.0.0/8',
+            srcexclude_ipset=True
+        )
+
+        # A single set rule, regardless of the number of exclusions
+        expected = [
+            ['-A', 'SINKHOLE', '-m', 'set', '--match-set',
+             'nfsinkhole-srcexclude', 'src', '-j', 'RETURN']
+        ]
+        rules = [r for r in myobj.get_rules() if 'RETURN' in r]
+        self.assertEqual(rules, expected)
+
+    def test_sync_lines(self):
+
+        def restore(sets, lines):
+
+            # The ipset restore semantics used by sync().
+            for line in lines:
+
+                args = line.split()
+                if args[0] == 'create':
+
+                    if args[1] in sets:
+
+                        if '-exist' in args and (
+                                sets[args[1]]['maxelem'] == args[6]):
+
+                            continue
+
+                        raise ValueError('set with the same name already '
+                                         'exists: {0}'.format(line))
+
+                    sets[args[1]] = {'maxelem': args[6], 'members': set()}
+
+                elif args[0] == 'add':
+
+                    sets[args[1]]['members'].add(args[2])
+
+                elif args[0] == 'swap':
+
+                    sets[args[1]], sets[args[2]] = (sets[args[2]],
+                                                    sets[args[1]])
+
+                elif args[0] == 'destroy':
+
+                    del sets[args[1]]
+
+        ipset = IPSet()
+        sets = {}
+
+        # A feed larger than the default maxelem / 2, synced twice.
+        entries = ['10.{0}.{1}.0/24'.format(i // 256, i % 256)
+                   for i in range(40000)]
+
+        for feed in (entries, entries[:35000], entries):
+
+            restore(sets, ipset.get_sync_lines(feed, list(sets)))
+            self.assertEqual(list(sets), [ipset.name])
+            self.assertEqual(sets[ipset.name]['members'], set(feed))
+
+        # An interrupted sync left the temporary set.
+        sets['nfsinkhole-srcexclude-tmp'] = {'maxelem': '4', 'members': set()}
+        restore(sets, ipset.get_sync_lines(entries[:10], list(sets)))
+        self.assertEqual(sets[ipset.name]['members'], set(entries[:10]))
+
+        self.assertEqual(
+            ipset.get_create_lines(['192.0.2.1'], exists=True),
+            ['add nfsinkhole-srcexclude 192.0.2.1 -exist']
+        )
@@ -1,7 +1,7 @@
 import logging
-from nfsinkhole.exceptions import (IPTablesError, IPTablesExists,
-                                   IPTablesNotExists, SubprocessError)
-from nfsinkhole.iptables import IPTablesSinkhole
+from nfsinkhole.exceptions import IPTablesExists, IPTablesNotExists
+from nfsinkhole.iptables import (IPTablesSinkhole, IPTablesRuleset,
+                                 build_restore_payload, quote_restore_arg)
 from nfsinkhole.tests import TestCommon
 
 LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
@@ -105,3 +105,358 @@ class TestIPTablesSinkhole(TestCommon):
 
         self._test_create_rules()
         self._test_delete_rules()
+
+    def test_get_rules(self):
+
+        myobj = IPTablesSinkhole(
+            interface='eth1',
+            interface_addr='127.0.0.1',
+            protocol='tcp',
+            dport='0:53'
+        )
+
+        # Content check
+        expected = (
+            '*filter\n'
+            ':SINKHOLE - [0:0]\n'
+            '-A SINKHOLE -s 127.0.0.1 -j RETURN\n'
+            '-A SINKHOLE -j LOG --log-prefix "\\"[nfsinkhole] \\""\n'
+            '-A SINKHOLE -j NFLOG\n'
+            '-I INPUT 1 -i eth1 -d 127.0.0.1 -p tcp -m hashlimit '
+            '--hashlimit 1/h --hashlimit-burst 1 --hashlimit-mode '
+            'srcip,dstip,dstport --hashlimit-name sinkhole '
+            '--hashlimit-htable-expire 1800000 -m multiport '
+            '--dports 0:53 -j SINKHOLE\n'
+            'COMMIT\n'
+        )
+        self.assertEqual(
+            build_restore_payload([('filter', myobj.get_rules())]), expected
+        )
+
+        # Delete statements
+        expected = [
+            ['-D', 'INPUT', '-i', 'eth1', '-j', 'DROP'],
+            ['-D', 'OUTPUT', '-o', 'eth1', '-j', 'DROP']
+        ]
+        self.assertEqual(myobj.get_drop_rules('-D'), expected)
+
+    def test_quote_restore_arg(self):
+
+        self.assertEqual(quote_restore_arg('eth1'), 'eth1')
+        self.assertEqual(quote_restore_arg(''), '""')
+        self.assertEqual(quote_restore_arg('a b'), '"a b"')
+        self.assertEqual(quote_restore_arg('"a"'), '"\\"a\\""')
+
+    def test_ruleset(self):
+
+        lines = [
+            b'-P INPUT ACCEPT',
+            b'-N SINKHOLE',
+            b'-N DOCKER',
+            b'-A INPUT -d 127.0.0.1/32 -i eth1 -m hashlimit --hashlimit-upto '
+            b'1/hour --hashlimit-name sinkhole -j SINKHOLE',
+            b'-A INPUT -i eth1 -j DROP',
+            b'-A OUTPUT -o eth1 -j DROP',
+            b'-A DOCKER ! -i docker0 -j RETURN',
+            b'-A SINKHOLE -s 127.0.0.1/32 -j RETURN',
+            b'-A SINKHOLE -j LOG --log-prefix "\\"[nfsinkhole] \\""',
+            b'-A SINKHOLE -j NFLOG'
+        ]
+        ruleset = IPTablesRuleset(lines)
+
+        self.assertEqual(ruleset.policies, {'INPUT': 'ACCEPT'})
+        self.assertEqual(len(ruleset.chains['SINKHOLE']), 3)
+        self.assertEqual(len(ruleset.find(target='DROP')), 2)
+        self.assertEqual(len(ruleset.find(chain='SINKHOLE', target='LOG')), 1)
+
+        rule = ruleset.find(target='SINKHOLE')[0]
+        self.assertEqual(rule.chain, 'INPUT')
+        self.assertEqual(rule.get('-i'), 'eth1')
+        self.assertEqual(rule.get('--hashlimit-name'), 'sinkhole')
+        self.assertEqual(rule.matches[0][0], 'hashlimit')
+
+        rule = ruleset.find(chain='SINKHOLE', target='LOG')[0]
+        self.assertEqual(rule.get('--log-prefix'), '"[nfsinkhole] "')
+
+        rule = ruleset.find(chain='DOCKER')[0]
+        self.assertEqual(rule.params, [('!-i', 'docker0')])
+
+        # Cached ruleset filtering (no iptables call)
+        myobj = IPTablesSinkhole(interface='eth1')
+        myobj.rulesets['filter'] = ruleset
+        self.assertSequenceEqual(myobj.list_existing_rules(), [
+            '-N SINKHOLE',
+            lines[3].decode('ascii'),
+            '-A SINKHOLE -s 127.0.0.1/32 -j RETURN',
+            lines[8].decode('ascii'),
+            '-A SINKHOLE -j NFLOG'
+        ], seq_type=list)
+        self.assertEqual(len(myobj.list_existing_rules(filter_io_drop=True)),
+                         7)
+
+    def test_ruleset_counters(self):
+
+        lines = [
+            b'*filter',
+            b':INPUT ACCEPT [100:8000]',
+            b':SINKHOLE - [0:0]',
+            b'[5:300] -A INPUT -i eth1 -j SINKHOLE',
+            b'[90:7000] -A INPUT -i eth1 -j DROP',
+            b'[2:100] -A SINKHOLE -s 127.0.0.1/32 -j RETURN',
+            b'[3:200] -A SINKHOLE -j LOG --log-prefix "-c 1 2"',
+            b'COMMIT'
+        ]
+        ruleset = IPTablesRuleset(lines)
+
+        self.assertEqual(ruleset.policies, {'INPUT': 'ACCEPT'})
+        self.assertIn('SINKHOLE', ruleset.chains)
+
+        rule = ruleset.find(chain='INPUT', target='DROP')[0]
+        self.assertEqual((rule.packets, rule.bytes), (90, 7000))
+        self.assertEqual(rule.line, '-A INPUT -i eth1 -j DROP')
+
+        rule = ruleset.find(chain='SINKHOLE', target='LOG')[0]
+        self.assertEqual((rule.packets, rule.bytes), (3, 200))
+        self.assertEqual(rule.get('--log-prefix'), '-c 1 2')
+
+        # iptables -v -S output
+        ruleset = IPTablesRuleset([b'-A INPUT -i eth1 -j DROP -c 7 420'])
+        rule = ruleset.rules[0]
+        self.assertEqual((rule.packets, rule.bytes), (7, 420))
+        self.assertEqual(rule.line, '-A INPUT -i eth1 -j DROP')
+
+    def test_ruleset_quoted_values(self):
+
+        # Quoted values that look like options, or contain quotes.
+        ruleset = IPTablesRuleset([
+            b'-A SINKHOLE -j LOG --log-prefix "-foo" --log-level 6',
+            b'-A SINKHOLE -m comment --comment "-j DROP" -j NFLOG',
+            b'-A SINKHOLE -j LOG --log-prefix "\\"-x\\" \\\\"'
+        ])
+
+        rule = ruleset.rules[0]
+        self.assertEqual(rule.target_options, [('--log-prefix', '-foo'),
+                                               ('--log-level', '6')])
+
+        rule = ruleset.rules[1]
+        self.assertEqual(rule.target, 'NFLOG')
+        self.assertEqual(rule.matches, [('comment',
+                                         [('--comment', '-j DROP')])])
+
+        rule = ruleset.rules[2]
+        self.assertEqual(rule.get('--log-prefix'), '"-x" \\')
+
+    def test_sample_counters(self):
+
+        myobj = IPTablesSinkhole(interface='eth1')
+
+        # iptables -S <chain> -v -Z output
+        def get_ruleset(drop, jump, nflog):
+
+            return IPTablesRuleset([
+                '-P INPUT ACCEPT -c 0 0',
+                '-A INPUT -i eth1 -j SINKHOLE -c {0} 0'.format(jump),
+                '-A INPUT -i eth1 -j DROP -c {0} 0'.format(drop),
+                '-P OUTPUT ACCEPT -c 0 0',
+                '-A OUTPUT -o eth1 -j DROP -c 0 0',
+                '-N SINKHOLE',
+                '-A SINKHOLE -j NFLOG -c {0} 0'.format(nflog)
+            ])
+
+        ret = myobj.sample_counters(get_ruleset(100, 10, 8), zeroed=True)
+        self.assertEqual(ret['summary'], {'total': 100, 'logged': 10,
+                                          'suppressed': 90, 'excluded': 0,
+                                          'nflog': 8})
+
+        # The counters were zeroed as read; deltas are the new values.
+        ret = myobj.sample_counters(get_ruleset(5, 1, 1))
+        self.assertEqual(ret['summary']['total'], 5)
+
+        ret = myobj.sample_counters(get_ruleset(7, 1, 1))
+        self.assertEqual(ret['summary']['total'], 2)
+        self.assertEqual(ret['summary']['logged'], 0)
+
+    def test_get_raw_rules(self):
+
+        # Disabled by default
+        myobj = IPTablesSinkhole(interface='eth1')
+        self.assertEqual(myobj.get_raw_rules(), [])
+
+        # notrack only
+        myobj = IPTablesSinkhole(interface='eth1', notrack=True)
+        expected = (
+            '*raw\n'
+            ':SINKHOLE - [0:0]\n'
+            '-A SINKHOLE -j NOTRACK\n'
+            '-I PREROUTING 1 -i eth1 -j SINKHOLE\n'
+            'COMMIT\n'
+        )
+        self.assertEqual(
+            build_restore_payload([('raw', myobj.get_raw_rules())]), expected
+        )
+
+        # notrack and rawdrop, filtered protocol/ports
+        myobj = IPTablesSinkhole(interface='eth1', protocol='tcp',
+                                 dport='0:53', notrack=True, rawdrop=True)
+        expected = (
+            '*raw\n'
+            ':SINKHOLE - [0:0]\n'
+            '-A SINKHOLE -s 127.0.0.1 -j DROP\n'
+            '-A SINKHOLE -p tcp -m multiport --dports 0:53 -j NOTRACK\n'
+            '-A SINKHOLE -j DROP\n'
+            '-I PREROUTING 1 -i eth1 -j SINKHOLE\n'
+            'COMMIT\n'
+        )
+        self.assertEqual(
+            build_restore_payload([('raw', myobj.get_raw_rules())]), expected
+        )
+
+        # Delete statements
+        existing = [
+            '-N SINKHOLE',
+            '-A PREROUTING -i eth1 -j SINKHOLE',
+            '-A SINKHOLE -j NOTRACK'
+        ]
+        self.assertEqual(myobj.get_delete_stmts(existing), [
+            '-D PREROUTING -i eth1 -j SINKHOLE', '-F SINKHOLE', '-X SINKHOLE'
+        ])
+
+    def test_get_nflog_args(self):
+
+        # Defaults are omitted
+        myobj = IPTablesSinkhole(interface='eth1', interface_addr='127.0.0.1')
+        self.assertEqual(myobj.get_nflog_args(), [])
+
+        myobj = IPTablesSinkhole(interface='eth1', interface_addr='127.0.0.1',
+                                 nflog_group='5', nflog_size='128',
+                                 nflog_threshold='32')
+        self.assertIn(
+            ['-A', 'SINKHOLE', '-j', 'NFLOG', '--nflog-group', '5',
+             '--nflog-size', '128', '--nflog-threshold', '32'],
+            myobj.get_rules()
+        )
+
+    def test_get_reconcile_stmts(self):
+
+        myobj = IPTablesSinkhole(
+            interface='eth1',
+            interface_addr='127.0.0.1',
+            protocol='tcp',
+            dport='0:53'
+        )
+        ruleset = IPTablesRuleset([
+            b'-N SINKHOLE',
+            b'-A INPUT -d 127.0.0.1/32 -i eth1 -p tcp -m hashlimit '
+            b'--hashlimit-upto 1/hour --hashlimit-burst 1 --hashlimit-mode '
+            b'srcip,dstip,dstport --hashlimit-name sinkhole '
+            b'--hashlimit-htable-expire 1800000 -m multiport --dports 0:53 '
+            b'-j SINKHOLE',
+            b'-A INPUT -i eth1 -j DROP',
+            b'-A SINKHOLE -s 127.0.0.1/32 -j RETURN',
+            b'-A SINKHOLE -s 192.0.2.1/32 -j RETURN',
+            b'-A SINKHOLE -j LOG --log-prefix "\\"[nfsinkhole] \\""',
+            b'-A SINKHOLE -j NFLOG'
+        ])
+
+        # Unchanged
+        myobj.srcexclude = '127.0.0.1,192.0.2.1'
+        self.assertEqual(
+            myobj.get_reconcile_stmts(ruleset, myobj.get_rules()), []
+        )
+
+        # Exclusions changed; the INPUT jump (hashlimit) is untouched
+        myobj.srcexclude = '127.0.0.1,10.0.0.0/8'
+        self.assertEqual(
+            myobj.get_reconcile_stmts(ruleset, myobj.get_rules()), [
+                '-D SINKHOLE -s 192.0.2.1/32 -j RETURN',
+                ['-I', 'SINKHOLE', '2', '-s', '10.0.0.0/8', '-j', 'RETURN']
+            ]
+        )
+
+        # Port changed; new jump inserted, old jump deleted
+        myobj.srcexclude = '127.0.0.1,192.0.2.1'
+        myobj.dport = '0:80'
+        stmts = myobj.get_reconcile_stmts(ruleset, myobj.get_rules())
+        self.assertEqual(len(stmts), 2)
+        self.assertEqual(stmts[0][:3], ['-I', 'INPUT', '1'])
+        self.assertTrue(stmts[1].startswith('-D INPUT -d 127.0.0.1/32'))
+
+        # Nothing exists
+        stmts = myobj.get_reconcile_stmts(IPTablesRuleset([]),
+                                          myobj.get_rules())
+        self.assertEqual(stmts[0], ':SINKHOLE - [0:0]')
+        self.assertEqual(len(stmts), 6)
+
+    def test_get_exclusion_rule_stmts(self):
+
+        # Default arguments; the live rules were created with others.
+        myobj = IPTablesSinkhole(interface='eth1', interface_addr='127.0.0.1')
+        ruleset = IPTablesRuleset([
+            b'-N SINKHOLE',
+            b'-A INPUT -d 127.0.0.1/32 -i eth1 -p tcp -m multiport '
+            b'--dports 0:53 -j SINKHOLE',
+            b'-A SINKHOLE -s 127.0.0.1/32 -j RETURN',
+            b'-A SINKHOLE -s 192.0.2.1/32 -j RETURN',
+            b'-A SINKHOLE -j LOG --log-prefix "[x] "',
+            b'-A SINKHOLE -j NFLOG --nflog-group 5'
+        ])
+
+        # Only the exclusion rules change.
+        self.assertEqual(
+            myobj.get_exclusion_rule_stmts(
+                ruleset, ['127.0.0.1', '192.0.2.1', '1.2.3.4']),
+            [['-I', 'SINKHOLE', '1', '-s', '1.2.3.4/32', '-j', 'RETURN']]
+        )
+        self.assertEqual(
+            myobj.get_exclusion_rule_stmts(ruleset, ['10.0.0.0/8']), [
+                '-D SINKHOLE -s 127.0.0.1/32 -j RETURN',
+                '-D SINKHOLE -s 192.0.2.1/32 -j RETURN',
+                ['-I', 'SINKHOLE', '1', '-s', '10.0.0.0/8', '-j', 'RETURN']
+            ]
+        )
+
+        # rawdrop; the catch-all DROP is kept.
+        raw_ruleset = IPTablesRuleset([
+            b'-N SINKHOLE',
+            b'-A PREROUTING -i eth1 -j SINKHOLE',
+            b'-A SINKHOLE -s 127.0.0.1/32 -j DROP',
+            b'-A SINKHOLE -p tcp -j RETURN',
+            b'-A SINKHOLE -j DROP'
+        ])
+        self.assertEqual(
+            myobj.get_exclusion_rule_stmts(raw_ruleset, ['192.0.2.1'],
+                                           'DROP'), [
+                '-D SINKHOLE -s 127.0.0.1/32 -j DROP',
+                ['-I', 'SINKHOLE', '1', '-s', '192.0.2.1/32', '-j', 'DROP']
+            ]
+        )
+
+    def test_get_exclusions(self):
+
+        path = '/tmp/test_nfsinkhole.exclude'
+        with open(path, 'w') as f:
+
+            f.write('10.0.0.0/8\n127.0.0.1\n')
+
+        myobj = IPTablesSinkhole(
+            interface='eth1',
+            interface_addr='127.0.0.1',
+            srcexclude='127.0.0.1,192.0.2.1',
+            srcexclude_file=path
+        )
+
+        self.assertEqual(myobj.get_exclusions(),
+                         ['127.0.0.1', '192.0.2.1', '10.0.0.0/8'])
+        self.assertIn(['-A', 'SINKHOLE', '-s', '10.0.0.0/8', '-j', 'RETURN'],
+                      myobj.get_rules())
+
+        # A missing file leaves the srcexclude entries
+        myobj.srcexclude_file = '/tmp/asdasd/asdasd'
+        self.assertEqual(myobj.get_exclusions(), ['127.0.0.1', '192.0.2.1'])
+
+        # Runtime exclusion changes are detected by reconcile().
+        self.assertFalse(myobj.exclusions_changed(
+            ['192.0.2.1/32', '127.0.0.1/32']))
+        self.assertTrue(myobj.exclusions_changed(
+            ['127.0.0.1/32', '192.0.2.1/32', '198.51.100.1/32']))
+        self.assertTrue(myobj.exclusions_changed(['127.0.0.1/32']))
@@ -0,0 +1,131 @@
+import logging
+import socket
+import struct
+from nfsinkhole.exceptions import NFLogError
+from nfsinkhole.nflog import (BE32, BE64X2, NFGENMSG, NFULA_CFG_CMD,
+                              NFULA_IFINDEX_INDEV, NFULA_PAYLOAD,
+                              NFULA_PREFIX, NFULA_SEQ, NFULA_TIMESTAMP,
+                              NFULNL_MSG_CONFIG, NFULNL_MSG_PACKET,
+                              NLMSG_ERROR, NLMSGHDR, NFLog, capture,
+                              get_attr, get_config_message, parse_packets)
+from nfsinkhole.pcap import PcapWriter, iter_packets
+from nfsinkhole.tests import TestCommon
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PACKET = b'\x45\x00\x00\x1c' + b'\x00' * 24
+
+
+def get_packet_message(payload=PACKET, seq=None, timestamp=None):
+
+    attrs = [get_attr(NFULA_PAYLOAD, payload),
+             get_attr(NFULA_PREFIX, b'[nfsinkhole] \x00'),
+             get_attr(NFULA_IFINDEX_INDEV, BE32.pack(3))]
+
+    if timestamp is not None:
+
+        attrs.append(get_attr(NFULA_TIMESTAMP, BE64X2.pack(
+            int(timestamp), int(round(timestamp % 1 * 1000000)))))
+
+    if seq is not None:
+
+        attrs.append(get_attr(NFULA_SEQ, BE32.pack(seq)))
+
+    data = NFGENMSG.pack(socket.AF_INET, 0, 5) + b''.join(attrs)
+
+    return NLMSGHDR.pack(NLMSGHDR.size + len(data), NFULNL_MSG_PACKET, 2, 0,
+                         0) + data
+
+
+class TestNFLog(TestCommon):
+
+    def test_get_config_message(self):
+
+        message = get_config_message(5, attrs=[
+            get_attr(NFULA_CFG_CMD, b'\x01')], seq=7)
+
+        self.assertEqual(len(message), 28)
+        self.assertEqual(NLMSGHDR.unpack_from(message),
+                         (28, NFULNL_MSG_CONFIG, 5, 7, 0))
+        self.assertEqual(NFGENMSG.unpack_from(message, 16), (0, 0, 5))
+        self.assertEqual(message[20:], b'\x05\x00\x01\x00\x01\x00\x00\x00')
+
+    def test_parse_packets(self):
+
+        data = bytearray(
+            get_packet_message(seq=1, timestamp=1476664131.25) +
+            get_packet_message(PACKET[:21], seq=2) +
+            NLMSGHDR.pack(20, NLMSG_ERROR, 0, 1, 0) +
+            struct.pack('=i', -1) + b'\x00' * 4
+        )
+        view = memoryview(data)
+
+        packets = parse_packets(view, len(data))
+        self.assertEqual(len(packets), 3)
+
+        timestamp, payload, prefix, indev, seq = packets[0]
+        self.assertEqual(timestamp, 1476664131.25)
+        self.assertIsInstance(payload, memoryview)
+        self.assertEqual(payload.tobytes(), PACKET)
+        self.assertEqual(prefix, b'[nfsinkhole] ')
+        self.assertEqual((indev, seq), (3, 1))
+
+        # Unaligned payload
+        self.assertEqual(packets[1][1].tobytes(), PACKET[:21])
+        self.assertEqual(packets[1][0], None)
+        self.assertEqual(packets[2], (None, None, None, None, -1))
+
+        # Zero-copy; the payload is a view of the buffer.
+        data[NLMSGHDR.size + NFGENMSG.size + 4] = 0x46
+        self.assertEqual(payload.tobytes()[:1], b'\x46')
+
+        # Partial message
+        self.assertEqual(len(parse_packets(view, 30)), 0)
+
+    def test_recv(self):
+
+        # A datagram socket pair stands in for the netlink socket.
+        nflog = NFLog(group=5)
+        nflog.sock, peer = socket.socketpair(socket.AF_UNIX,
+                                             socket.SOCK_DGRAM)
+
+        peer.send(get_packet_message(seq=10) + get_packet_message(seq=11))
+        peer.send(get_packet_message(seq=15, timestamp=1476664131.5))
+
+        packets = nflog.recv()
+        self.assertEqual([p[4] for p in packets], [10, 11])
+
+        path = '/tmp/test_nfsinkhole-nflog.pcap'
+        writer = PcapWriter(path, append=False)
+        self.assertEqual(capture(nflog, writer, count=1), 1)
+        writer.close()
+
+        self.assertEqual(list(iter_packets(path)),
+                         [(1476664131.5, PACKET, len(PACKET))])
+        self.assertEqual(nflog.get_stats(), {
+            'packets': 3, 'bytes': 84, 'messages': 2, 'overruns': 0,
+            'lost': 3
+        })
+
+        nflog.sock.close()
+        peer.close()
+
+    def test_open(self):
+
+        nflog = NFLog(group=65000)
+        try:
+
+            nflog.open()
+
+        except NFLogError as e:
+
+            self.skipTest('NFLOG bind not permitted: {0}'.format(e))
+
+        self.assertGreaterEqual(nflog.sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF), 65536)
+
+        nflog.close()
+        self.assertEqual(nflog.sock, None)
@@ -0,0 +1,170 @@
+import logging
+from nfsinkhole.nftables import NFTablesSinkhole, get_intervals
+from nfsinkhole.tests import TestCommon
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+
+class TestNFTablesSinkhole(TestCommon):
+
+    def test_get_ruleset(self):
+
+        myobj = NFTablesSinkhole(
+            interface='eth1',
+            interface_addr='127.0.0.1',
+            protocol='tcp,udp',
+            dport='0:53,80',
+            srcexclude='127.0.0.1,10.0.0.0/8'
+        )
+        ruleset = myobj.get_ruleset()
+
+        self.assertTrue(ruleset.startswith('table ip nfsinkhole {\n'))
+        self.assertIn('elements = { 127.0.0.1, 10.0.0.0/8 }', ruleset)
+        self.assertIn('elements = { 0-53, 80 }', ruleset)
+        self.assertIn('type ipv4_addr . ipv4_addr . inet_service', ruleset)
+        self.assertIn('timeout 1800000ms', ruleset)
+        self.assertIn(
+            'iifname "eth1" ip daddr 127.0.0.1 meta l4proto { tcp, udp } '
+            'th dport @dport update @sinkhole { ip saddr . ip daddr . '
+            'th dport limit rate 1/hour burst 1 packets } jump sinkhole',
+            ruleset
+        )
+        self.assertIn('log prefix "[nfsinkhole] "', ruleset)
+
+        # All protocols, no port set match
+        myobj = NFTablesSinkhole(
+            interface='eth1',
+            interface_addr='127.0.0.1',
+            hashlimitmode='srcip'
+        )
+        ruleset = myobj.get_ruleset()
+        self.assertIn(
+            'iifname "eth1" ip daddr 127.0.0.1 update @sinkhole { ip saddr '
+            'limit rate 1/hour burst 1 packets } jump sinkhole',
+            ruleset
+        )
+
+    def test_get_ruleset_empty(self):
+
+        # nft rejects an empty elements list.
+        myobj = NFTablesSinkhole(interface='eth1', interface_addr='127.0.0.1',
+                                 srcexclude='')
+        ruleset = myobj.get_ruleset()
+        self.assertNotIn('elements = { }', ruleset)
+        self.assertEqual(ruleset.count('elements = '), 1)
+        self.assertNotIn('chain prerouting', ruleset)
+
+    def test_get_raw_lines(self):
+
+        myobj = NFTablesSinkhole(interface='eth1', interface_addr='127.0.0.1',
+                                 notrack=True)
+        self.assertEqual(myobj.get_raw_lines()[2:], [
+            '    iifname "eth1" notrack',
+            '  }'
+        ])
+
+        myobj = NFTablesSinkhole(interface='eth1', interface_addr='127.0.0.1',
+                                 protocol='tcp', dport='22', rawdrop=True)
+        self.assertEqual(myobj.get_raw_lines(), [
+            '  chain prerouting {',
+            '    type filter hook prerouting priority -300; policy accept;',
+            '    iifname "eth1" ip saddr @srcexclude drop',
+            '    iifname "eth1" meta l4proto { tcp } th dport @dport accept',
+            '    iifname "eth1" drop',
+            '  }'
+        ])
+
+        myobj.notrack = True
+        self.assertIn('meta l4proto { tcp } th dport @dport notrack',
+                      myobj.get_raw_lines()[3])
+
+        ruleset = myobj.get_ruleset()
+        self.assertTrue(ruleset.endswith('    iifname "eth1" drop\n  }\n}\n'))
+
+    def test_get_reconcile_payload(self):
+
+        myobj = NFTablesSinkhole(interface='eth1', interface_addr='127.0.0.1')
+        self.assertEqual(myobj.get_reconcile_payload(exists=False),
+                         myobj.get_ruleset())
+
+        payload = myobj.get_reconcile_payload(myobj.get_config())
+        self.assertIn('flush chain ip nfsinkhole prerouting\n'
+                      'delete chain ip nfsinkhole prerouting\n', payload)
+        self.assertNotIn('delete set', payload)
+
+        myobj.rawdrop = True
+        payload = myobj.get_reconcile_payload({})
+        self.assertNotIn('delete chain', payload)
+        self.assertIn('delete set ip nfsinkhole sinkhole\n', payload)
+        self.assertIn('chain prerouting {', payload)
+
+    def test_exclusions_changed(self):
+
+        myobj = NFTablesSinkhole(srcexclude='127.0.0.1,10.0.0.0/8')
+        self.assertFalse(myobj.exclusions_changed(['10.0.0.0/8',
+                                                   '127.0.0.1']))
+        self.assertTrue(myobj.exclusions_changed(['127.0.0.1']))
+
+        # Merged by auto-merge
+        myobj.srcexclude = '192.0.2.0/25,192.0.2.128/25,192.0.2.5,10.0.0.1'
+        self.assertFalse(myobj.exclusions_changed(['10.0.0.1',
+                                                   '192.0.2.0/24']))
+        myobj.srcexclude = '192.0.2.1,192.0.2.2,192.0.2.3'
+        self.assertFalse(myobj.exclusions_changed(['192.0.2.1-192.0.2.3']))
+        self.assertTrue(myobj.exclusions_changed(['192.0.2.1-192.0.2.4']))
+        self.assertTrue(myobj.exclusions_changed(['bad']))
+
+    def test_get_intervals(self):
+
+        self.assertEqual(get_intervals(['10.0.0.2', '10.0.0.0/31',
+                                        '10.0.0.8-10.0.0.9', '10.0.0.5']),
+                         [(167772160, 167772162), (167772165, 167772165),
+                          (167772168, 167772169)])
+        self.assertEqual(get_intervals([]), [])
+        self.assertRaises(ValueError, get_intervals, ['10.0.0.300'])
+
+    def test_get_limit_rate(self):
+
+        myobj = NFTablesSinkhole(hashlimit='10/s')
+        self.assertEqual(myobj.get_limit_rate(), '10/second')
+
+        myobj = NFTablesSinkhole(hashlimit='10/fortnight')
+        self.assertRaises(ValueError, myobj.get_limit_rate)
+
+    def test_get_drop_ruleset(self):
+
+        myobj = NFTablesSinkhole(interface='eth1')
+        ruleset = myobj.get_drop_ruleset()
+
+        self.assertTrue(ruleset.startswith('table ip nfsinkhole_drop {\n'))
+        self.assertIn('iifname "eth1" drop', ruleset)
+        self.assertIn('oifname "eth1" drop', ruleset)
+
+    def test_get_nflog_statement(self):
+
+        myobj = NFTablesSinkhole()
+        self.assertEqual(myobj.get_nflog_statement(), 'log group 0')
+
+        myobj = NFTablesSinkhole(nflog_group='5', nflog_size='128',
+                                 nflog_threshold='32')
+        self.assertEqual(myobj.get_nflog_statement(),
+                         'log group 5 snaplen 128 queue-threshold 32')
+
+    def test_get_exclusion_stmts(self):
+
+        myobj = NFTablesSinkhole(interface='eth1', interface_addr='127.0.0.1')
+
+        self.assertEqual(
+            myobj.get_exclusion_stmts(add=['10.0.0.0/8', ' 192.0.2.1'],
+                                      delete=['198.51.100.1']),
+            'delete element ip nfsinkhole srcexclude { 198.51.100.1 }\n'
+            'add element ip nfsinkhole srcexclude { 10.0.0.0/8, 192.0.2.1 }\n'
+        )
+        self.assertEqual(
+            myobj.get_exclusion_stmts(add=['10.0.0.0/8'], flush=True),
+            'flush set ip nfsinkhole srcexclude\n'
+            'add element ip nfsinkhole srcexclude { 10.0.0.0/8 }\n'
+        )
@@ -0,0 +1,102 @@
+import glob
+import gzip
+import logging
+import os
+import shutil
+import time
+from nfsinkhole.pcap import (LINKTYPE_NFLOG, LINKTYPE_RAW, PCAP_HEADER,
+                             PcapRing, PcapWriter, iter_packets, read_header)
+from nfsinkhole.tests import TestCommon
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PATH = '/tmp/test_nfsinkhole.pcap'
+RING_PATH = '/tmp/test_nfsinkhole-ring/nfsinkhole.pcap'
+
+
+class TestPcap(TestCommon):
+
+    def setUp(self):
+
+        if os.path.exists(PATH):
+
+            os.remove(PATH)
+
+        shutil.rmtree(os.path.dirname(RING_PATH), ignore_errors=True)
+        os.makedirs(os.path.dirname(RING_PATH))
+
+    def test_writer(self):
+
+        writer = PcapWriter(PATH, snaplen=4)
+        writer.write(1476664131.25, memoryview(b'\x45\x00\x00\x1c\x00'))
+        writer.close()
+
+        with open(PATH, 'rb') as f:
+
+            self.assertEqual(read_header(f), ('<', False, 4, LINKTYPE_RAW))
+            self.assertEqual(os.path.getsize(PATH), PCAP_HEADER.size + 20)
+
+        # Append
+        writer = PcapWriter(PATH, snaplen=4)
+        writer.write(1476664132.0, b'\x45\x00', orig_len=40)
+        writer.close()
+
+        self.assertEqual(list(iter_packets(PATH)), [
+            (1476664131.25, b'\x45\x00\x00\x1c', 5),
+            (1476664132.0, b'\x45\x00', 40)
+        ])
+
+        self.assertRaises(ValueError, PcapWriter, PATH,
+                          linktype=LINKTYPE_NFLOG)
+
+        with open(PATH, 'wb') as f:
+
+            f.write(b'\x00' * 24)
+
+        self.assertRaises(ValueError, list, iter_packets(PATH))
+
+    def test_ring(self):
+
+        # 3 packets (40 bytes each, plus headers) per file.
+        ring = PcapRing(RING_PATH, file_size=PCAP_HEADER.size + 3 * 56,
+                        file_seconds=None, file_count=3)
+
+        for i in range(10):
+
+            ring.write(1476664131 + i, b'\x45' + b'\x00' * 39)
+            time.sleep(0.001)
+
+        ring.close()
+
+        files = ring.get_files()
+        self.assertEqual(len(files), 3)
+        self.assertTrue(all([f.endswith('.pcap.gz') for f in files]))
+        self.assertEqual(glob.glob(RING_PATH[:-5] + '-*.pcap'), [])
+
+        # The newest files (packets 3-9) are kept, in order.
+        timestamps = []
+        for path in files:
+
+            with gzip.open(path, 'rb') as f_in:
+
+                with open(PATH, 'wb') as f_out:
+
+                    f_out.write(f_in.read())
+
+            timestamps += [p[0] for p in iter_packets(PATH)]
+
+        self.assertEqual(timestamps, [1476664131.0 + i for i in range(3, 10)])
+
+        # Age rotation
+        ring = PcapRing(RING_PATH, file_seconds=0.01, file_count=10,
+                        compress=False)
+        ring.write(1476664131, b'\x45')
+        time.sleep(0.02)
+        ring.write(1476664132, b'\x45')
+        ring.close()
+
+        self.assertEqual(len([f for f in ring.get_files()
+                              if not f.endswith('.gz')]), 2)
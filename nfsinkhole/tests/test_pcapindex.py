@@ -0,0 +1,132 @@
+import logging
+import os
+import shutil
+import socket
+import struct
+from nfsinkhole.pcap import (LINKTYPE_NFLOG, PcapRing, PcapWriter,
+                             compress_file, iter_packets)
+from nfsinkhole.pcapindex import (FlowIndex, build_index, extract, get_flow,
+                                  get_index_path, is_indexed)
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.utils import ip_to_int
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+DIR = '/tmp/test_nfsinkhole-pcapindex'
+
+# 2016-10-17T00:28:51Z
+BASE = 1476664131
+
+
+def get_packet(src='192.0.2.1', dst='10.0.0.1', proto=6, dport=22):
+
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 40, 0, 0, 64, proto, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+
+    if proto == 1:
+
+        return header + struct.pack('!BBHI', 8, 0, 0, 0) + b'\x00' * 12
+
+    return header + struct.pack('!HHII', 1024, dport, 0, 0) + b'\x00' * 8
+
+
+class TestPcapIndex(TestCommon):
+
+    def setUp(self):
+
+        shutil.rmtree(DIR, ignore_errors=True)
+        os.makedirs(DIR)
+
+    def test_get_flow(self):
+
+        src = ip_to_int('192.0.2.1')
+        dst = ip_to_int('10.0.0.1')
+
+        self.assertEqual(get_flow(get_packet()), (src, dst, 6, 22))
+        self.assertEqual(get_flow(get_packet(proto=1)), (src, dst, 1, 2048))
+        self.assertEqual(get_flow(b'\x60' + b'\x00' * 39), None)
+        self.assertEqual(get_flow(b'\x45\x00'), None)
+
+        # NFLOG; prefix TLV, then the payload TLV.
+        nflog = (b'\x02\x00\x00\x00' + struct.pack('<HH', 6, 10) +
+                 b'ab\x00\x00' + struct.pack('<HH', 44, 9) + get_packet())
+        self.assertEqual(get_flow(nflog, LINKTYPE_NFLOG), (src, dst, 6, 22))
+
+        # Ethernet
+        ether = b'\x00' * 12 + b'\x08\x00' + get_packet()
+        self.assertEqual(get_flow(ether, 1), (src, dst, 6, 22))
+
+        self.assertEqual(get_index_path('/tmp/a.pcap.gz'), '/tmp/a.pcap.idx')
+
+    def test_extract(self):
+
+        paths = []
+        for day in range(3):
+
+            path = os.path.join(DIR, 'nfsinkhole-{0}.pcap'.format(day))
+            writer = PcapWriter(path)
+            for i in range(300):
+
+                writer.write(BASE + day * 86400 + i, get_packet(
+                    '192.0.2.{0}'.format(i % 3), dport=(22, 23)[i % 2]))
+
+            writer.close()
+            paths.append(path)
+
+        self.assertEqual(build_index(paths[0]), 6)
+        self.assertTrue(is_indexed(paths[0]))
+
+        index = FlowIndex(get_index_path(paths[0]))
+        self.assertEqual((len(index), index.packets), (6, 300))
+        self.assertEqual(index.first_seen, BASE)
+        self.assertEqual(index.last_seen, BASE + 299)
+
+        flows = index.find(src='192.0.2.1', dport=22)
+        self.assertEqual(len(flows), 1)
+        self.assertEqual(flows[0][7], 50)
+        self.assertEqual(len(index.find(src='192.0.2.0/30', proto=6)), 6)
+        self.assertEqual(index.find(start=BASE + 300), [])
+        self.assertEqual(index.find(proto=17), [])
+
+        # Still indexed once compressed; the others are indexed on extract.
+        compress_file(paths[0])
+        paths[0] += '.gz'
+        self.assertTrue(is_indexed(paths[0]))
+
+        output = os.path.join(DIR, 'extract.pcap')
+        self.assertEqual(extract(paths, output, src='192.0.2.1', dport=22,
+                                 start=BASE + 100, end=BASE + 86400 + 100),
+                         50)
+
+        packets = list(iter_packets(output))
+        self.assertEqual(len(packets), 50)
+        self.assertEqual(packets[0][0], BASE + 100)
+        self.assertEqual(packets[-1][0], BASE + 86400 + 94)
+        self.assertTrue(all([get_flow(p[1])[3] == 22 for p in packets]))
+        self.assertTrue(all([is_indexed(p) for p in paths]))
+
+        self.assertEqual(extract(paths, output, dst='198.51.100.0/24'), 0)
+
+    def test_ring(self):
+
+        path = os.path.join(DIR, 'nfsinkhole.pcap')
+        ring = PcapRing(path, file_size=1000, file_seconds=None,
+                        file_count=2, index=True)
+
+        for i in range(40):
+
+            ring.write(BASE + i, get_packet(dport=i))
+
+        ring.close()
+
+        files = ring.get_files()
+        self.assertEqual(len(files), 2)
+        self.assertTrue(all([is_indexed(f) for f in files]))
+        self.assertEqual(len([f for f in os.listdir(DIR)
+                              if f.endswith('.idx')]), 2)
+
+        output = os.path.join(DIR, 'extract.pcap')
+        self.assertEqual(extract(files, output, dport=39, build=False), 1)
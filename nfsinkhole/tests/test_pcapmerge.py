@@ -0,0 +1,89 @@
+import logging
+import os
+import shutil
+from nfsinkhole.pcap import (LINKTYPE_NFLOG, PcapWriter, compress_file,
+                             iter_packets)
+from nfsinkhole.pcapindex import build_index, get_flow
+from nfsinkhole.pcapmerge import PcapMerger, merge_files
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_pcapindex import BASE, get_packet
+from nfsinkhole.utils import int_to_ip
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+DIR = '/tmp/test_nfsinkhole-pcapmerge'
+
+
+def write_file(name=None, timestamps=None, src='192.0.2.1'):
+
+    path = os.path.join(DIR, name)
+    writer = PcapWriter(path)
+    for timestamp in timestamps:
+
+        writer.write(timestamp, get_packet(src))
+
+    writer.close()
+
+    return path
+
+
+class TestPcapMerge(TestCommon):
+
+    def setUp(self):
+
+        shutil.rmtree(DIR, ignore_errors=True)
+        os.makedirs(DIR)
+
+    def test_merge(self):
+
+        # Overlapping (per group), and a later (rotated, compressed) file.
+        paths = [
+            write_file('a.pcap', [BASE + i for i in range(0, 100, 2)]),
+            write_file('b.pcap', [BASE + i for i in range(1, 100, 2)],
+                       src='198.51.100.1'),
+            write_file('c.pcap', [BASE + i for i in range(100, 150)]),
+            write_file('d.pcap', [])
+        ]
+        compress_file(paths[2])
+        paths[2] += '.gz'
+
+        output = os.path.join(DIR, 'merged.pcap')
+        self.assertEqual(merge_files(paths, output), 150)
+        self.assertEqual([p[0] for p in iter_packets(output)],
+                         [BASE + i for i in range(150)])
+
+        # Files are opened as the merge reaches them.
+        merger = PcapMerger(paths)
+        self.assertEqual(len(merger.files), 3)
+        packets = merger.iter_packets()
+        next(packets)
+        self.assertEqual(merger.packets, 1)
+        packets.close()
+
+        # Time window and CIDR filters
+        merger = PcapMerger(paths, start=BASE + 50, end=BASE + 120,
+                            src='192.0.2.0/24')
+        timestamps = []
+        for timestamp, data, orig_len in merger.iter_packets():
+
+            timestamps.append(timestamp)
+            self.assertEqual(int_to_ip(get_flow(data)[0]), '192.0.2.1')
+
+        self.assertEqual(timestamps, [BASE + i for i in range(50, 100, 2)] +
+                         [BASE + i for i in range(100, 120)])
+        self.assertEqual(merger.filtered, 75)
+
+        self.assertEqual(merge_files(paths, output, dst='203.0.113.0/24'), 0)
+        self.assertEqual(merge_files(paths, output, start=BASE + 150), 0)
+
+        # Indexed files outside the window are not read.
+        build_index(paths[0])
+        merger = PcapMerger(paths, start=BASE + 100)
+        self.assertEqual([f[1] for f in merger.files], paths[1:3])
+
+        nflog = os.path.join(DIR, 'nflog.pcap')
+        PcapWriter(nflog, LINKTYPE_NFLOG).close()
+        self.assertRaises(ValueError, PcapMerger, paths + [nflog])
@@ -0,0 +1,120 @@
+import gzip
+import logging
+import os
+import shutil
+from nfsinkhole.pcap import LINKTYPE_NFLOG, LINKTYPE_RAW, iter_packets
+from nfsinkhole.pcaptext import (TextCaptureParser, convert_files,
+                                 get_linktype, get_output_path)
+from nfsinkhole.tests import TestCommon
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+DIRECTORY = '/tmp/test_nfsinkhole-pcaptext'
+
+# NFLOG header (AF_INET, v0, group 0) + TLVs, then an IPv4/TCP SYN.
+PACKET = bytearray(
+    b'\x02\x00\x00\x00\x08\x00\x01\x00\x08\x00\x00\x00'
+    b'\x3c\x00\x09\x00'
+    b'\x45\x00\x00\x3c\x12\x34\x40\x00\x34\x06\x00\x00\xc0\x00\x02\x01'
+    b'\x0a\x00\x00\x01\xa1\x12\x00\x16\x00\x00\x00\x01\x00\x00\x00\x00'
+    b'\xa0\x02\x72\x10\x00\x00\x00\x00\x02\x04\x05\xb4\x04\x02\x08\x0a'
+    b'\x00\x00\x00\x01\x00\x00\x00\x00\x01\x03\x03\x07\x00'
+)
+
+
+def get_dump(data=b''):
+    """
+    Format a packet like tcpdump -XX.
+    """
+
+    data = bytearray(data)
+    lines = []
+    for offset in range(0, len(data), 16):
+
+        chunk = data[offset:offset + 16]
+        hexstuff = ''
+        for i in range(0, len(chunk), 2):
+
+            hexstuff += ' ' + ''.join(['{0:02x}'.format(b)
+                                       for b in chunk[i:i + 2]])
+
+        ascii = ''.join([chr(b) if 32 <= b < 127 else '.' for b in chunk])
+        lines.append('\t0x{0:04x}: {1:<40}  {2}\n'.format(
+            offset, hexstuff, ascii))
+
+    return ''.join(lines)
+
+
+TEXT = (
+    'tcpdump: listening on nflog:0, link-type NFLOG, capture size 262144\n'
+    '2016-10-17 00:28:51.250000 IP (tos 0x0, ttl 52, id 4660, offset 0, '
+    'flags [DF], proto TCP (6), length 60)\n'
+    '    192.0.2.1.41234 > 10.0.0.1.22: Flags [S], seq 1, win 29200, '
+    'length 0\n' + get_dump(PACKET) +
+    '2016-10-17 00:28:52.000001 IP truncated\n' +
+    get_dump(PACKET).replace('0x0010:', '0x0020:') +
+    '2016-10-17 00:28:53 IP no dump\n'
+    '2016-10-17 00:28:54.5 IP\n' + get_dump(PACKET[16:])
+)
+
+
+class TestPcapText(TestCommon):
+
+    def setUp(self):
+
+        shutil.rmtree(DIRECTORY, ignore_errors=True)
+        os.makedirs(DIRECTORY)
+
+    def test_parser(self):
+
+        parser = TextCaptureParser()
+        packets = list(parser.iter_packets(
+            TEXT.encode('ascii').splitlines(True)))
+
+        self.assertEqual(packets, [
+            (1476664131.25, bytes(PACKET)),
+            (1476664134.5, bytes(PACKET[16:]))
+        ])
+        self.assertEqual(parser.skipped, 2)
+
+        self.assertEqual(get_linktype(packets[0][1]), LINKTYPE_NFLOG)
+        self.assertEqual(get_linktype(packets[1][1]), LINKTYPE_RAW)
+
+    def test_convert_files(self):
+
+        paths = []
+        for i in range(3):
+
+            path = os.path.join(DIRECTORY, 'nfsinkhole-pcap.log.{0}'.format(i))
+            data = TEXT.encode('ascii') * (i + 1)
+
+            if i == 2:
+
+                path += '.gz'
+                with gzip.open(path, 'wb') as f:
+
+                    f.write(data)
+
+            else:
+
+                with open(path, 'wb') as f:
+
+                    f.write(data)
+
+            paths.append(path)
+
+        self.assertEqual(get_output_path('/var/log/nfsinkhole-pcap.log'),
+                         '/var/log/nfsinkhole-pcap.pcap')
+
+        results = convert_files(paths, processes=2)
+        self.assertEqual([r[2:] for r in results], [(2, 2), (4, 4), (6, 6)])
+        self.assertEqual(results[2][1], os.path.join(
+            DIRECTORY, 'nfsinkhole-pcap.log.2.pcap'))
+
+        packets = list(iter_packets(results[1][1]))
+        self.assertEqual(len(packets), 4)
+        self.assertEqual(packets[0], (1476664131.25, bytes(PACKET),
+                                      len(PACKET)))
@@ -0,0 +1,254 @@
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+from nfsinkhole.follow import Follower
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_events import LINES
+from nfsinkhole.utils import write_state_file
+
+try:
+
+    from nfsinkhole.shipper import Shipper, Spool
+
+except (ImportError, SyntaxError):  # pragma: no cover
+
+    Shipper = None
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PATH = '/tmp/test_nfsinkhole-shipper.log'
+CHECKPOINT_PATH = '/tmp/test_nfsinkhole-shipper.checkpoint'
+SPOOL_PATH = '/tmp/test_nfsinkhole-shipper-spool'
+
+
+class Collector:
+    """
+    A stand-in TCP collector, receiving in a thread.
+    """
+
+    def __init__(self, port=0):
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', port))
+        self.server.listen(5)
+        self.server.settimeout(0.1)
+        self.port = self.server.getsockname()[1]
+        self.received = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+
+        while self.running:
+
+            try:
+
+                conn, addr = self.server.accept()
+
+            except socket.timeout:
+
+                continue
+
+            conn.settimeout(0.1)
+            while self.running:
+
+                try:
+
+                    data = conn.recv(65536)
+
+                except socket.timeout:
+
+                    continue
+
+                if not data:
+
+                    break
+
+                self.received.append(data)
+
+            conn.close()
+
+    def get_lines(self):
+
+        return b''.join(self.received).splitlines()
+
+    def close(self):
+
+        self.running = False
+        self.thread.join(5)
+        self.server.close()
+
+
+def wait_for(condition=None, timeout=10):
+
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+
+        time.sleep(0.05)
+
+
+class TestShipper(TestCommon):
+
+    def setUp(self):
+
+        if Shipper is None:  # pragma: no cover
+
+            self.skipTest('nfsinkhole.shipper requires Python 3.5+')
+
+        for path in (PATH, CHECKPOINT_PATH):
+
+            if os.path.exists(path):
+
+                os.remove(path)
+
+        shutil.rmtree(SPOOL_PATH, ignore_errors=True)
+
+        with open(PATH, 'wb') as f:
+
+            f.writelines(LINES)
+
+        # Start at the beginning of the log.
+        write_state_file(CHECKPOINT_PATH, {
+            'path': PATH, 'inode': os.stat(PATH).st_ino, 'offset': 0
+        })
+
+    def get_shipper(self, port=0, **kwargs):
+
+        follower = Follower(PATH, checkpoint_path=CHECKPOINT_PATH,
+                            timeout=0.05)
+        shipper = Shipper(follower, '127.0.0.1', port, batch_timeout=0.05,
+                          metrics_interval=None, **kwargs)
+        thread = threading.Thread(target=shipper.ship)
+        thread.start()
+
+        return shipper, thread
+
+    def test_spool(self):
+
+        spool = Spool(SPOOL_PATH, segment_size=10)
+        self.assertEqual(spool.peek(), (None, None))
+
+        for data in (b'one', b'two', b'three'):
+
+            spool.append(data)
+
+        self.assertEqual(len(spool), 23)
+        self.assertEqual(len(spool.segments), 2)
+
+        data, position = spool.peek()
+        self.assertEqual(data, b'one')
+        spool.commit(position)
+        spool.close()
+
+        # A partial record, e.g., a crash while writing.
+        with open(spool.get_segment_path(1), 'ab') as f:
+
+            f.write(b'\x10\x00')
+
+        # Reopen; a new segment is started, the read position is kept.
+        spool = Spool(SPOOL_PATH, segment_size=10)
+        self.assertEqual(len(spool), 18)
+        spool.append(b'four')
+
+        results = []
+        while True:
+
+            data, position = spool.peek()
+            if data is None:
+
+                break
+
+            results.append(data)
+            spool.commit(position)
+
+        self.assertEqual(results, [b'two', b'three', b'four'])
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(spool.segments, [2])
+        spool.close()
+
+        # Over max_size, the oldest segments are dropped.
+        spool = Spool(SPOOL_PATH, segment_size=10, max_size=20)
+        for data in (b'one', b'two', b'three', b'four'):
+
+            spool.append(data)
+
+        self.assertEqual(spool.dropped, 14)
+        self.assertEqual(spool.peek()[0], b'three')
+        spool.close()
+
+    def test_ship(self):
+
+        collector = Collector()
+        shipper, thread = self.get_shipper(collector.port)
+
+        wait_for(lambda: len(collector.get_lines()) >= 4)
+
+        with open(PATH, 'ab') as f:
+
+            f.writelines(LINES[:1])
+
+        wait_for(lambda: len(collector.get_lines()) >= 5)
+        shipper.stop()
+        thread.join(10)
+        collector.close()
+
+        lines = collector.get_lines()
+        self.assertEqual(len(lines), 5)
+        self.assertIn(b'"src":"192.0.2.9"', lines[1])
+
+        metrics = shipper.get_metrics()
+        self.assertEqual(metrics['events'], 5)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertGreaterEqual(metrics['sent_batches'], 2)
+        self.assertTrue(metrics['send_latency_max'] >= 0)
+
+    def test_spool_replay(self):
+
+        # Reserve a port with no collector.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        shipper, thread = self.get_shipper(
+            port, spool=Spool(SPOOL_PATH), queue_size=1, retry_interval=0.05,
+            max_retry_interval=0.1, drain_timeout=0.1)
+
+        # Unavailable; one line at a time, to get a batch per line.
+        for i in range(10):
+
+            with open(PATH, 'ab') as f:
+
+                f.write(LINES[i % 3])
+
+            time.sleep(0.1)
+
+        wait_for(lambda: shipper.get_metrics()['spool_bytes'] > 0)
+        self.assertGreater(shipper.get_metrics()['send_errors'], 0)
+
+        collector = Collector(port)
+        wait_for(lambda: len(collector.get_lines()) >= 14)
+        shipper.stop()
+        thread.join(10)
+        collector.close()
+
+        metrics = shipper.get_metrics()
+        self.assertEqual(metrics['spool_bytes'], 0)
+        self.assertGreater(metrics['spilled_batches'], 0)
+
+        # In order, no loss.
+        expected = [b'192.0.2.1', b'192.0.2.9', b'198.51.100.7',
+                    b'198.51.100.7']
+        expected += [[b'192.0.2.1', b'192.0.2.9', b'198.51.100.7'][i % 3]
+                     for i in range(10)]
+        self.assertEqual(len(collector.get_lines()), 14)
+        self.assertEqual([line.split(b'"src":"')[1].split(b'"')[0]
+                          for line in collector.get_lines()], expected)
@@ -0,0 +1,111 @@
+import json
+import logging
+from nfsinkhole.events import EventParser
+from nfsinkhole.sketch import (HyperLogLog, CountMinSketch, TopK,
+                               SinkholeStats, hash64, hll_from_dict,
+                               cms_from_dict, topk_from_dict,
+                               stats_from_snapshot)
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_events import LINES
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+
+class TestSketch(TestCommon):
+
+    def test_hash64(self):
+
+        self.assertEqual(hash64(1), hash64(1))
+        self.assertNotEqual(hash64(1), hash64(2))
+        self.assertEqual(hash64('a'), hash64(b'a'))
+        self.assertTrue(0 <= hash64(2 ** 40) < 2 ** 64)
+
+    def test_hyperloglog(self):
+
+        hll = HyperLogLog(precision=12)
+        self.assertEqual(hll.count(), 0)
+
+        for i in range(50000):
+
+            hll.add(i)
+            hll.add(i)
+
+        # 1.04 / sqrt(4096) = 1.6% standard error; allow 5%
+        self.assertTrue(abs(hll.count() - 50000) < 2500)
+
+        other = HyperLogLog(precision=12)
+        for i in range(25000, 75000):
+
+            other.add(i)
+
+        hll.merge(other)
+        self.assertTrue(abs(hll.count() - 75000) < 3750)
+
+        copy = hll_from_dict(json.loads(json.dumps(hll.to_dict())))
+        self.assertEqual(copy.count(), hll.count())
+
+        self.assertRaises(ValueError, HyperLogLog, 3)
+        self.assertRaises(ValueError, hll.merge, HyperLogLog(precision=10))
+
+    def test_count_min_sketch(self):
+
+        cms = CountMinSketch(width=256, depth=4)
+        for i in range(1000):
+
+            cms.add(i % 100)
+
+        self.assertEqual(cms.add('x', 50), 50)
+        self.assertTrue(cms.estimate(5) >= 10)
+        self.assertTrue(cms.estimate('x') >= 50)
+        self.assertEqual(cms.total, 1050)
+
+        copy = cms_from_dict(json.loads(json.dumps(cms.to_dict())))
+        self.assertEqual(copy.estimate(5), cms.estimate(5))
+
+        copy.merge(cms)
+        self.assertEqual(copy.estimate('x'), 2 * cms.estimate('x'))
+
+    def test_topk(self):
+
+        topk = TopK(k=3, width=1024)
+        for value, count in ((22, 100), (23, 50), (80, 10), (443, 75),
+                             (445, 1)):
+
+            for i in range(count):
+
+                topk.add(value)
+
+        self.assertEqual(topk.top(), [(22, 100), (443, 75), (23, 50)])
+        self.assertEqual(topk.top(1), [(22, 100)])
+
+        other = TopK(k=3, width=1024)
+        other.add(80, 200)
+        topk.merge(other)
+        self.assertEqual(topk.top(2), [(80, 210), (22, 100)])
+
+        copy = topk_from_dict(json.loads(json.dumps(topk.to_dict())))
+        self.assertEqual(copy.top(), topk.top())
+
+    def test_sinkhole_stats(self):
+
+        events = list(EventParser(year=2016).iter_events(LINES))
+
+        stats = SinkholeStats(precision=10, k=10, width=256)
+        self.assertEqual(stats.update(events), 4)
+        stats.add(events[0].to_tuple())
+
+        summary = stats.summary()
+        self.assertEqual(summary['events'], 5)
+        self.assertEqual(summary['sources'], 3)
+        self.assertEqual(summary['top_networks'][0], ('192.0.2.0/24', 3))
+        self.assertEqual(summary['top_dports'][0], (22, 2))
+        self.assertEqual(summary['start'],
+                         min([e.timestamp for e in events]))
+
+        copy = stats_from_snapshot(json.loads(json.dumps(stats.snapshot())))
+        copy.merge(stats)
+        self.assertEqual(copy.summary()['events'], 10)
+        self.assertEqual(copy.summary()['sources'], 3)
@@ -0,0 +1,86 @@
+import logging
+import shutil
+from nfsinkhole.events import EventParser
+from nfsinkhole.store import EventTable, load_table, np
+from nfsinkhole.tests import TestCommon
+from nfsinkhole.tests.test_events import LINES
+from nfsinkhole.utils import get_cidr_range, int_to_ip, ip_to_int
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PATH = '/tmp/test_nfsinkhole-store'
+
+
+class TestEventTable(TestCommon):
+
+    def setUp(self):
+
+        if np is None:
+
+            self.skipTest('numpy is not installed')
+
+        self.events = list(EventParser(year=2016).iter_events(LINES))
+
+    def test_ip(self):
+
+        self.assertEqual(int_to_ip(ip_to_int('192.0.2.1')), '192.0.2.1')
+        self.assertEqual(get_cidr_range('192.0.2.77/24'),
+                         (ip_to_int('192.0.2.0'), 0xFFFFFF00))
+
+    def test_extend(self):
+
+        table = EventTable(chunk_size=3)
+        self.assertEqual(table.extend(self.events * 2), 8)
+        self.assertEqual(len(table), 8)
+        self.assertEqual(len(table.columns['src']), 9)
+        self.assertEqual(table['dpt'].dtype, np.uint16)
+
+        event = table.get_event(0)
+        self.assertEqual((event.src, event.dpt, event.flags),
+                         ('192.0.2.1', 22, 0x12))
+        self.assertEqual(event.timestamp, self.events[0].timestamp)
+
+        # Tuples (bulk.iter_events(as_tuples=True))
+        table.extend([e.to_tuple() for e in self.events])
+        self.assertEqual(len(table), 12)
+
+    def test_filters(self):
+
+        table = EventTable()
+        table.extend(self.events)
+
+        self.assertEqual(table.cidr('192.0.2.0/24').tolist(),
+                         [True, True, False, False])
+        self.assertEqual(table.cidr('10.0.0.1', column='dst').sum(), 4)
+        self.assertEqual(table.port_range(50, 60).tolist(),
+                         [False, False, True, False])
+
+        start = self.events[2].timestamp
+        self.assertEqual(table.time_window(start).sum(), 2)
+        self.assertEqual(table.time_window(end=start).sum(), 2)
+
+        selected = table.select(table.cidr('198.51.100.0/24') &
+                                table.time_window(start, start + 1))
+        self.assertEqual(len(selected), 2)
+        self.assertEqual(selected['proto'].tolist(), [17, 47])
+
+    def test_save(self):
+
+        table = EventTable()
+        table.extend(self.events)
+        table.save(PATH)
+
+        for mmap in (False, True):
+
+            loaded = load_table(PATH, mmap=mmap)
+            self.assertEqual(len(loaded), 4)
+            self.assertEqual(loaded['src'].tolist(), table['src'].tolist())
+
+        # Appending to a memory-mapped table copies it
+        loaded.extend(self.events)
+        self.assertEqual(len(loaded), 8)
+
+        shutil.rmtree(PATH)
@@ -0,0 +1,105 @@
+import logging
+import os
+from nfsinkhole.events import EventParser
+from nfsinkhole.follow import Follower
+from nfsinkhole.timeindex import TimeIndex
+from nfsinkhole.tests import TestCommon
+
+LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
+              '[%(funcName)s()] %(message)s')
+logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+log = logging.getLogger(__name__)
+
+PATH = '/tmp/test_nfsinkhole-timeindex.log'
+LINE = ('2016-10-17T00:{0:02d}:{1:02d}Z sinkhole kernel: [nfsinkhole] '
+        'IN=eth1 OUT= MAC= SRC=192.0.2.{2} DST=10.0.0.1 LEN=40 TOS=0x00 '
+        'PREC=0x00 TTL=64 ID=0 PROTO=TCP SPT=1024 DPT=22 WINDOW=1024 '
+        'RES=0x00 SYN URGP=0 \n')
+
+# 2016-10-17T00:00:00Z
+BASE = 1476662400
+
+
+def get_lines(start=0, count=0):
+
+    return [LINE.format(i // 60, i % 60, i % 256).encode('ascii')
+            for i in range(start, start + count)]
+
+
+class TestTimeIndex(TestCommon):
+
+    def setUp(self):
+
+        for path in (PATH, PATH + '.idx'):
+
+            if os.path.exists(path):
+
+                os.remove(path)
+
+    def test_query(self):
+
+        with open(PATH, 'wb') as f:
+
+            f.writelines(get_lines(0, 1800))
+
+        index = TimeIndex(PATH, interval=60)
+        self.assertEqual(index.update(), 30)
+        self.assertEqual(index.update(), 0)
+
+        lines = list(index.iter_lines(BASE + 125, BASE + 185))
+        self.assertEqual(lines, get_lines(125, 60))
+
+        # The scanned range is bounded by the index
+        first, last = index.get_range(BASE + 125, BASE + 185)
+        self.assertEqual(last - first, len(b''.join(get_lines(120, 120))))
+
+        events = list(index.iter_events(BASE + 1799))
+        self.assertEqual(len(events), 1)
+
+        # Incremental, with a partial line
+        with open(PATH, 'ab') as f:
+
+            f.writelines(get_lines(1800, 120))
+            f.write(get_lines(1920, 1)[0][:10])
+
+        self.assertEqual(index.update(), 2)
+        self.assertEqual(len(list(index.iter_lines(BASE + 1800))), 120)
+
+        # Reloaded from disk
+        index = TimeIndex(PATH, interval=60)
+        self.assertEqual(len(list(index.iter_lines(BASE + 1860,
+                                                   update=False))), 60)
+
+    def test_rotation(self):
+
+        with open(PATH, 'wb') as f:
+
+            f.writelines(get_lines(0, 600))
+
+        index = TimeIndex(PATH)
+        index.update()
+
+        os.rename(PATH, PATH + '.1')
+        with open(PATH, 'wb') as f:
+
+            f.writelines(get_lines(600, 60))
+
+        self.assertEqual(len(list(index.iter_lines())), 60)
+        self.assertEqual(index.timestamps, [BASE + 600])
+        os.remove(PATH + '.1')
+
+    def test_follow(self):
+
+        with open(PATH, 'wb') as f:
+
+            f.writelines(get_lines(0, 300))
+
+        index = TimeIndex(PATH)
+        follower = Follower(PATH, checkpoint_path=None, batch_size=100,
+                            parser=EventParser(prefix=None), index=index)
+        follower.open_file(PATH, 0)
+        count = sum([len(b) for b in follower.iter_batches(follow=False)])
+
+        self.assertEqual(count, 300)
+        self.assertEqual(len(index.timestamps), 5)
+        self.assertEqual(index.offset, os.path.getsize(PATH))
@@ -2,7 +2,10 @@ import logging
 from nfsinkhole.exceptions import SubprocessError
 from nfsinkhole.tests import TestCommon
 from nfsinkhole.utils import (popen_wrapper, get_default_interface,
-                              get_interface_addr, set_system_timezone)
+                              get_interface_addr, set_system_timezone,
+                              read_state_file, write_state_file,
+                              delete_state_file, get_config_hash,
+                              read_address_file)
 
 LOG_FORMAT = ('[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] '
               '[%(funcName)s()] %(message)s')
@@ -35,3 +38,34 @@ class TestIPTablesSinkhole(TestCommon):
 
         set_system_timezone('UTC')
         set_system_timezone('UTC', skip_timedatectl=True)
+
+    def test_state_file(self):
+
+        path = '/tmp/test_nfsinkhole.state'
+        delete_state_file(path)
+        self.assertEqual(read_state_file(path), None)
+
+        config = {'interface': 'eth1', 'dport': '0:65535'}
+        state = {'hash': get_config_hash(config), 'config': config}
+        self.assertTrue(write_state_file(path, state))
+        self.assertEqual(read_state_file(path), state)
+
+        # Key order does not change the hash
+        self.assertEqual(get_config_hash(config), get_config_hash(
+            {'dport': '0:65535', 'interface': 'eth1'}))
+
+        delete_state_file(path)
+        self.assertEqual(read_state_file(path), None)
+
+    def test_read_address_file(self):
+
+        path = '/tmp/test_nfsinkhole.exclude'
+        with open(path, 'w') as f:
+
+            f.write('# feed\n10.0.0.0/8, 192.0.2.1\n\n192.0.2.1 # dup\n'
+                    '198.51.100.0/24\n')
+
+        self.assertEqual(read_address_file(path), [
+            '10.0.0.0/8', '192.0.2.1', '198.51.100.0/24'])
+
+        self.assertRaises(IOError, read_address_file, '/tmp/asdasd/asdasd')
@@ -0,0 +1,329 @@
+# Copyright (c) 2016-2017 Philip Hane
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+from .events import EventParser
+
+log = logging.getLogger(__name__)
+
+# Index file header; magic, log inode, interval (seconds), and the log
+# offset indexed up to.
+INDEX_MAGIC = b'NFSKIDX1'
+INDEX_HEADER = struct.Struct('<8sQQQ')
+
+# Index entry; timestamp (UNIX epoch seconds), log offset of the line.
+INDEX_ENTRY = struct.Struct('<dQ')
+
+# Bytes of the log read per index update read.
+READ_SIZE = 1048576
+
+
+class TimeIndex:
+    """
+    The class for a sparse time index over an events log. A sidecar file
+    (by default {log}.idx) maps a timestamp to the byte offset of the first
+    line at or after it, every interval seconds. Queries binary search the
+    index and only read the part of the (memory-mapped) log in the time
+    window. The index is updated incrementally, and rebuilt if the log was
+    rotated (inode change) or truncated.
+
+    Args:
+        path: The events log path.
+        index_path: The index path. Defaults to {path}.idx.
+        interval: The number of seconds between index entries.
+        parser: The EventParser used for timestamps and query events.
+            Defaults to EventParser().
+    """
+
+    def __init__(self, path='/var/log/nfsinkhole-events.log',
+                 index_path=None, interval=60, parser=None):
+
+        self.path = path
+        self.index_path = index_path or '{0}.idx'.format(path)
+        self.interval = interval
+        self.parser = parser or EventParser()
+        self.inode = None
+        self.offset = 0
+        self.timestamps = []
+        self.offsets = []
+
+    def load(self):
+        """
+        The function for loading the index file.
+
+        Returns:
+            Boolean: True if the index was loaded, False if it is missing or
+                invalid.
+        """
+
+        try:
+
+            with open(self.index_path, 'rb') as f:
+
+                data = f.read()
+
+        except (IOError, OSError):
+
+            return False
+
+        if len(data) < INDEX_HEADER.size:
+
+            return False
+
+        magic, inode, interval, offset = INDEX_HEADER.unpack_from(data, 0)
+        if magic != INDEX_MAGIC or interval != self.interval:
+
+            return False
+
+        self.inode = inode
+        self.offset = offset
+        self.timestamps = []
+        self.offsets = []
+
+        count = (len(data) - INDEX_HEADER.size) // INDEX_ENTRY.size
+        for i in range(count):
+
+            timestamp, line_offset = INDEX_ENTRY.unpack_from(
+                data, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+            self.timestamps.append(timestamp)
+            self.offsets.append(line_offset)
+
+        return True
+
+    def reset(self, inode=None):
+        """
+        The function for starting a new (empty) index.
+
+        Args:
+            inode: The log inode.
+        """
+
+        self.inode = inode
+        self.offset = 0
+        self.timestamps = []
+        self.offsets = []
+
+        with open(self.index_path, 'wb') as f:
+
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, inode, self.interval, 0))
+
+    def add_lines(self, lines=None, offset=0):
+        """
+        The function for indexing lines read from the log, e.g., by
+        follow.Follower. Lines before the indexed offset are ignored.
+
+        Args:
+            lines: The complete lines (bytes, with newlines).
+            offset: The log offset of the first line.
+
+        Returns:
+            Integer: The number of index entries added.
+        """
+
+        entries = []
+        last = self.timestamps[-1] if self.timestamps else None
+        get_line_timestamp = self.parser.get_line_timestamp
+
+        for line in lines:
+
+            if offset >= self.offset:
+
+                timestamp = get_line_timestamp(line)
+                if timestamp is not None and (
+                        last is None or timestamp >= last + self.interval):
+
+                    entries.append((timestamp, offset))
+                    last = timestamp
+
+            offset += len(line)
+
+        if offset <= self.offset:
+
+            return 0
+
+        with open(self.index_path, 'r+b') as f:
+
+            f.seek(0, os.SEEK_END)
+            for timestamp, line_offset in entries:
+
+                f.write(INDEX_ENTRY.pack(timestamp, line_offset))
+                self.timestamps.append(timestamp)
+                self.offsets.append(line_offset)
+
+            # The header is written last; an interrupted update is
+            # re-indexed from the previous offset.
+            f.seek(0)
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.inode, self.interval,
+                                      offset))
+
+        self.offset = offset
+
+        return len(entries)
+
+    def update(self):
+        """
+        The function for indexing the lines written since the last update.
+        The index is rebuilt if the log was rotated or truncated.
+
+        Returns:
+            Integer: The number of index entries added.
+        """
+
+        try:
+
+            stat = os.stat(self.path)
+
+        except OSError:
+
+            return 0
+
+        if not self.load() or self.inode != stat.st_ino or (
+                stat.st_size < self.offset):
+
+            log.info('Building time index {0}'.format(self.index_path))
+            self.reset(stat.st_ino)
+
+        added = 0
+        with open(self.path, 'rb') as f:
+
+            f.seek(self.offset)
+            buf = b''
+            while True:
+
+                data = f.read(READ_SIZE)
+                if not data:
+
+                    break
+
+                data = buf + data
+                end = data.rfind(b'\n') + 1
+                buf = data[end:]
+
+                added += self.add_lines(data[:end].splitlines(True),
+                                        self.offset)
+
+        return added
+
+    def get_range(self, start=None, end=None):
+        """
+        The function for finding the log byte range that contains a time
+        window.
+
+        Args:
+            start: The start, UNIX epoch seconds, or None.
+            end: The end, UNIX epoch seconds, or None.
+
+        Returns:
+            Tuple: (start offset, end offset); end is exclusive.
+        """
+
+        first = 0
+        if start is not None:
+
+            # The entry before start; lines after it may be before start.
+            i = bisect.bisect_right(self.timestamps, start) - 1
+            first = self.offsets[i] if i >= 0 else 0
+
+        last = self.offset
+        if end is not None:
+
+            i = bisect.bisect_right(self.timestamps, end)
+            if i < len(self.offsets):
+
+                last = self.offsets[i]
+
+        return first, last
+
+    def iter_lines(self, start=None, end=None, update=True):
+        """
+        The generator for reading the log lines in a time window.
+
+        Args:
+            start: The start, UNIX epoch seconds (inclusive), or None.
+            end: The end, UNIX epoch seconds (exclusive), or None.
+            update: If True, update the index first.
+
+        Yields:
+            Bytes: The log lines (with newlines).
+        """
+
+        if update:
+
+            self.update()
+
+        elif not self.timestamps:
+
+            self.load()
+
+        first, last = self.get_range(start, end)
+        if last <= first:
+
+            return
+
+        get_line_timestamp = self.parser.get_line_timestamp
+        with open(self.path, 'rb') as f:
+
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+
+                pos = first
+                while pos < last:
+
+                    newline = mm.find(b'\n', pos, last)
+                    line_end = last if newline < 0 else newline + 1
+                    line = mm[pos:line_end]
+                    pos = line_end
+
+                    timestamp = get_line_timestamp(line)
+                    if timestamp is None or (
+                            start is not None and timestamp < start) or (
+                            end is not None and timestamp >= end):
+
+                        continue
+
+                    yield line
+
+            finally:
+
+                mm.close()
+
+    def iter_events(self, start=None, end=None, update=True):
+        """
+        The generator for reading the events in a time window.
+
+        Args:
+            start: The start, UNIX epoch seconds (inclusive), or None.
+            end: The end, UNIX epoch seconds (exclusive), or None.
+            update: If True, update the index first.
+
+        Yields:
+            Event: The parsed events.
+        """
+
+        return self.parser.iter_events(self.iter_lines(start, end, update))
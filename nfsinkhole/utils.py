@@ -23,12 +23,16 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 from .exceptions import SubprocessError
+import calendar
 import fcntl  # Linux req; autodoc_mock_imports for Sphinx cross platform
+import hashlib
+import json
 import logging
 import os
 import socket
 import struct
 import subprocess
+import time
 
 log = logging.getLogger(__name__)
 uid = os.geteuid()  # Linux req; autodoc_mock_imports for Sphinx cross platform
@@ -44,9 +48,12 @@ ANSI = {
     'cyan': '\033[36m'
 }
 
+# IPv4 address <-> integer (network byte order)
+IPV4 = struct.Struct('!I')
+
 
 def popen_wrapper(cmd_arr=None, raise_err=False, log_stdout_line=True,
-                  sudo=False):
+                  sudo=False, stdin=None):
     """
     The function for subprocess with custom logging output.
 
@@ -57,6 +64,8 @@ def popen_wrapper(cmd_arr=None, raise_err=False, log_stdout_line=True,
             entry. If False, logs all of stdout in a single log entry.
         sudo: If True, prepends /usr/bin/sudo to cmd_arr. If False, cmd_arr
             is run as-is.
+        stdin: Optional string/bytes to write to the subprocess stdin (e.g.,
+            a ruleset payload for iptables-restore).
 
     Returns:
         Tuple: stdout, stderr of the completed subprocess.
@@ -85,12 +94,17 @@ def popen_wrapper(cmd_arr=None, raise_err=False, log_stdout_line=True,
     try:
         proc = subprocess.Popen(
             cmd_arr,
+            stdin=subprocess.PIPE if stdin is not None else None,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT
         )
 
+        # py3 requires bytes for stdin, py2 str is already bytes
+        if stdin is not None and not isinstance(stdin, bytes):
+            stdin = stdin.encode('utf-8')
+
         # Command is done, get the stdout.
-        out, err = proc.communicate()
+        out, err = proc.communicate(stdin)
     except OSError as e:
         out = None
         err = 'subprocess OSError: {0}'.format(e)
@@ -268,3 +282,201 @@ def set_system_timezone(timezone='UTC', skip_timedatectl=False):
             '/etc/localtime'
         ]
         popen_wrapper(cmd, raise_err=True, sudo=True)
+
+
+def read_state_file(path=None):
+    """
+    The function for reading a JSON state file.
+
+    Args:
+        path: The state file path.
+
+    Returns:
+        Dictionary: The state, or None if the file is missing or invalid.
+    """
+
+    try:
+
+        with open(path, 'r') as f:
+
+            return json.load(f)
+
+    except (IOError, OSError, ValueError):
+
+        return None
+
+
+def write_state_file(path=None, state=None):
+    """
+    The function for writing a JSON state file. The file is written to a
+    temporary path and renamed, so readers never see a partial file.
+
+    Args:
+        path: The state file path.
+        state: The dictionary to write.
+
+    Returns:
+        Boolean: True if the state was written, or False.
+    """
+
+    tmp_path = '{0}.tmp'.format(path)
+    try:
+
+        with open(tmp_path, 'w') as f:
+
+            json.dump(state, f, sort_keys=True)
+
+        os.rename(tmp_path, path)
+        return True
+
+    except (IOError, OSError) as e:
+
+        log.error('Could not write state file {0}: {1}'.format(path, e))
+        return False
+
+
+def delete_state_file(path=None):
+    """
+    The function for deleting a state file, if it exists.
+
+    Args:
+        path: The state file path.
+    """
+
+    try:
+
+        os.remove(path)
+
+    except OSError:
+
+        pass
+
+
+def get_config_hash(config=None):
+    """
+    The function for hashing a configuration dictionary.
+
+    Args:
+        config: The configuration dictionary (JSON serializable).
+
+    Returns:
+        String: The SHA-256 hex digest of the sorted JSON configuration.
+    """
+
+    data = json.dumps(config, sort_keys=True).encode('utf-8')
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_address_file(path=None):
+    """
+    The function for reading IPs/CIDRs from a file. Entries are separated by
+    newlines, whitespace or commas; # starts a comment.
+
+    Args:
+        path: The file path.
+
+    Returns:
+        List: The unique entries, in file order.
+
+    Raises:
+        IOError: The file could not be read.
+    """
+
+    entries = []
+    seen = set()
+    with open(path, 'r') as f:
+
+        for line in f:
+
+            for entry in line.split('#', 1)[0].replace(',', ' ').split():
+
+                if entry not in seen:
+
+                    seen.add(entry)
+                    entries.append(entry)
+
+    return entries
+
+
+def ip_to_int(addr=None):
+    """
+    The function for converting a dotted IPv4 address to an integer.
+
+    Args:
+        addr: The IPv4 address (str).
+
+    Returns:
+        Integer: The address.
+    """
+
+    return IPV4.unpack(socket.inet_aton(addr))[0]
+
+
+def int_to_ip(value=0):
+    """
+    The function for converting an integer to a dotted IPv4 address.
+
+    Args:
+        value: The address (int).
+
+    Returns:
+        String: The IPv4 address.
+    """
+
+    return socket.inet_ntoa(IPV4.pack(int(value)))
+
+
+def get_cidr_range(cidr=None):
+    """
+    The function for converting an IPv4 CIDR to a (network, netmask) integer
+    tuple.
+
+    Args:
+        cidr: The IPv4 CIDR (e.g., 192.0.2.0/24) or address.
+
+    Returns:
+        Tuple: (network, netmask) integers.
+    """
+
+    addr, _, bits = cidr.partition('/')
+    bits = int(bits) if bits else 32
+    netmask = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+
+    return ip_to_int(addr) & netmask, netmask
+
+
+def parse_timestamp(value=None):
+    """
+    The function for converting a CLI time argument to UNIX epoch seconds.
+
+    Args:
+        value: The time; UNIX epoch seconds, or UTC YYYY-MM-DDTHH:MM:SS
+            (the time, or seconds, may be omitted).
+
+    Returns:
+        Float: UNIX epoch seconds.
+
+    Raises:
+        ValueError: The value is not a supported time format.
+    """
+
+    try:
+
+        return float(value)
+
+    except ValueError:
+
+        pass
+
+    for time_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+
+        try:
+
+            return float(calendar.timegm(time.strptime(value, time_format)))
+
+        except ValueError:
+
+            pass
+
+    raise ValueError('Invalid time: {0}'.format(value))
@@ -63,6 +63,7 @@ setup(
     packages=PACKAGES,
     package_data=PACKAGE_DATA,
     install_requires=INSTALL_REQUIRES,
-    scripts=['nfsinkhole/scripts/nfsinkhole-service.py',
+    scripts=['nfsinkhole/scripts/nfsinkhole-pcap.py',
+             'nfsinkhole/scripts/nfsinkhole-service.py',
              'nfsinkhole/scripts/nfsinkhole-setup.py']
 )